@@ -3,9 +3,11 @@ General Knowledge Agent for Microsoft Agent Framework
 Handles non-database queries like web searches, general questions, and conversations
 """
 
-from typing import List, Dict, Any
+import copy
+from typing import List, Dict, Any, Optional
 from agent_framework import ChatMessage, Role, ChatAgent
 from agent_framework.azure import AzureOpenAIChatClient
+from metrics import record_llm_call, stage_timer
 import os
 
 
@@ -106,7 +108,13 @@ class GeneralAgent:
         full_context = self.conversation_history + messages
         
         # Run the agent with full conversation context
-        response = await self.agent.run(full_context)
+        with stage_timer('general_agent'):
+            try:
+                response = await self.agent.run(full_context)
+            except Exception:
+                record_llm_call('general_agent', error=True)
+                raise
+        record_llm_call('general_agent', response)
         
         # Store in conversation history (only new messages)
         self.conversation_history.extend(messages)
@@ -148,7 +156,18 @@ class GeneralAgent:
     
     def clear_history(self):
         """Clear the agent's conversation history."""
-        self.conversation_history = []
+        self.conversation_history.clear()
+    
+    def fork(self, conversation_history: Optional[List[ChatMessage]] = None) -> 'GeneralAgent':
+        """
+        Agent with its own conversation history sharing this agent's chat client.
+        
+        Args:
+            conversation_history: History list the fork reads and appends to (default: a new one)
+        """
+        forked = copy.copy(self)
+        forked.conversation_history = conversation_history if conversation_history is not None else []
+        return forked
     
     def get_conversation_history(self) -> List[ChatMessage]:
         """Get the conversation history."""
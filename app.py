@@ -4,14 +4,31 @@ Provides a chat interface using Microsoft Agent Framework with intelligent autom
 Automatically selects appropriate agents (SQL/General) based on query analysis.
 """
 
-from flask import Flask, render_template, request, jsonify, session
+from flask import Flask, Response, render_template, request, jsonify, session, stream_with_context, url_for
 from dotenv import load_dotenv
+import hashlib
 import os
 import secrets
-import asyncio
-from hybrid_agent_with_memory import create_hybrid_agent_from_env
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from async_runtime import run_async
+from hybrid_agent_with_memory import Conversation, create_hybrid_agent_from_env
 from response_formatter import ResponseFormatter, format_general_agent_response
 from query_router import create_query_processor
+from sql_repair import repair_engine
+from correction_memory import get_correction_memory
+from sql_workload import get_workload_store
+from query_stats import get_slow_query_log
+from result_store import get_result_store
+from batch_runner import BatchRunner, normalize_items, summarize
+from session_store import create_session_store_from_env
+from state_backend import create_session_state_store_from_env
+from warmup import Warmup, WarmupStep
+from jobs import FINISHED, JobQueueFullError, create_job_queue_from_env
+from payload import COMPRESSIBLE_MIMETYPES, FastJSONProvider, create_response_compressor_from_env, parse_fields, select_fields
+from metrics import QUERY_SECONDS, registry as metrics_registry, stage_timer
 from datetime import datetime
 
 # Load environment variables
@@ -19,37 +36,204 @@ load_dotenv()
 
 app = Flask(__name__)
 app.secret_key = os.getenv('FLASK_SECRET_KEY', secrets.token_hex(32))
+# orjson-backed when installed; output types match Flask's default provider
+app.json = FastJSONProvider(app)
+# Static assets are versioned in their URLs (see static_url), so clients may cache them
+app.config['SEND_FILE_MAX_AGE_DEFAULT'] = int(os.getenv('STATIC_MAX_AGE_SECONDS', '86400'))
 
-# Store Hybrid agent instances per session
-hybrid_agents = {}
+# gzip/brotli for JSON, HTML and text responses
+response_compressor = create_response_compressor_from_env()
+
+# One Hybrid Agent (clients, schema, caches) shared by every session; sessions only keep
+# their conversation
+shared_agent = None
+shared_agent_lock = threading.Lock()
+
+# Conversations per session, bounded by idle TTL, session count and memory
+session_store = create_session_store_from_env(Conversation)
+
+
+def persist_evicted_session(session_id, conversation, reason):
+    """Write an evicted session's memory to SESSION_PERSIST_DIR (when set) before it is dropped."""
+    directory = os.getenv('SESSION_PERSIST_DIR')
+    if not directory or not conversation.memory.interactions:
+        return
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"session_{session_id}.json")
+    with open(path, 'w') as f:
+        json.dump({'session_id': session_id, 'evicted': reason, **conversation.memory.to_dict()}, f, indent=2)
+
+
+session_store.add_eviction_callback(persist_evicted_session)
+
+# Conversations and settings are stored in a state backend (STATE_BACKEND) so any worker can
+# serve any session; session_store above is this worker's cache of them
+state_store = create_session_state_store_from_env()
+
+# Per-session settings are small UI preferences, not data
+MAX_SETTINGS_BYTES = 4096
+
+# Gauges sampled from the stores when /metrics is scraped
+metrics_registry.gauge('meddata_active_sessions', 'Sessions cached by this worker',
+                       callback=lambda: len(session_store))
+metrics_registry.gauge('meddata_session_cache_bytes', 'Approximate memory of cached sessions',
+                       callback=lambda: session_store.stats()['bytes'])
+metrics_registry.gauge('meddata_result_store_bytes', 'Result pages held in memory',
+                       callback=lambda: get_result_store().stats().get('memory_bytes'))
 
 # Initialize query processor for intelligent routing
 query_processor = create_query_processor()
 
 
+def get_shared_agent():
+    """Get or create the process-wide Hybrid Agent (built once, used by all sessions)."""
+    global shared_agent
+    with shared_agent_lock:
+        if shared_agent is None:
+            # Create Hybrid Agent with SQL-to-General chaining and memory, on the process
+            # loop its client sessions stay bound to
+            shared_agent = run_async(create_hybrid_agent_from_env())
+            print("✓ Hybrid Agent initialized with SQL→General chaining + Memory")
+        return shared_agent
+
+
 def get_orchestrator_for_session():
-    """Get or create a Hybrid Agent instance for the current session."""
+    """Get the shared Hybrid Agent bound to the current session's conversation."""
     session_id = session.get('session_id')
     
     if not session_id:
         session_id = secrets.token_hex(16)
         session['session_id'] = session_id
     
-    if session_id not in hybrid_agents:
-        try:
-            # Create Hybrid Agent with SQL-to-General chaining and memory
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
+    try:
+        agent = get_shared_agent()
+    except Exception as e:
+        print(f"Error creating hybrid agent: {e}")
+        return None
+    
+    return agent.bind(get_session_conversation(session_id))
+
+
+def get_session_conversation(session_id):
+    """A session's conversation from this worker's cache, brought up to date with the state store."""
+    return state_store.sync(session_id, session_store.get(session_id))
+
+
+def save_session_conversation(session_id, conversation):
+    """Store a conversation after a request changed it and re-measure it against the cache budget."""
+    with stage_timer('memory_write'):
+        state_store.commit(session_id, conversation)
+    session_store.touch(session_id)
+
+
+def build_warmup_steps():
+    """Warm-up steps behind /api/ready: the shared agent and what it loads, connections, caches."""
+    def sql_agent():
+        return get_shared_agent().sql_agent
+    
+    def build_agent():
+        agent = get_shared_agent()
+        return {'backend': agent.sql_agent.backend.name}
+    
+    def aad_token():
+        agent = sql_agent()
+        if not agent.use_azure_ad or agent.backend.is_local:
+            return 'skipped'
+        if agent.token_struct is None:
+            raise RuntimeError("No Azure AD token for the database (see the agent's startup warning)")
+        return {'elapsed_ms': agent.startup_timings.get('aad_token', 0)}
+    
+    def db_connections():
+        # Opened concurrently and closed again: with ODBC driver-manager pooling (pyodbc's
+        # default) they stay pooled for the first questions
+        backend = sql_agent().backend
+        count = max(1, int(os.getenv('WARMUP_DB_CONNECTIONS', '4')))
+        
+        def open_one(_):
+            conn = backend.checkout()
             try:
-                hybrid_agents[session_id] = loop.run_until_complete(create_hybrid_agent_from_env())
-                print("✓ Hybrid Agent initialized with SQL→General chaining + Memory")
+                cursor = conn.cursor()
+                cursor.execute("SELECT 1")
+                cursor.fetchall()
             finally:
-                loop.close()
-        except Exception as e:
-            print(f"Error creating hybrid agent: {e}")
-            return None
+                conn.close()
+        
+        with ThreadPoolExecutor(max_workers=count) as pool:
+            list(pool.map(open_one, range(count)))
+        return {'connections': count}
+    
+    def schema_catalog():
+        agent = sql_agent()
+        if not getattr(agent, 'schema_columns', None):
+            raise RuntimeError(agent.schema_info[:200])
+        return {'tables': len(agent.schema_columns), 'elapsed_ms': agent.startup_timings.get('schema', 0)}
+    
+    def ontology_indexes():
+        agent = sql_agent()
+        if not agent.use_name_index:
+            return 'skipped'
+        if agent.ontology is None:
+            raise RuntimeError("Ontology cache did not load (see the agent's startup warning)")
+        stats = agent.ontology.stats()
+        return {'names_indexed': stats['names_indexed'], 'external_codes': stats['external_codes'],
+                'elapsed_ms': agent.startup_timings.get('ontology_cache', 0)}
+    
+    def warmup_questions():
+        path = os.getenv('WARMUP_QUESTIONS_FILE')
+        if not path:
+            return 'skipped'
+        from batch_query import read_questions
+        questions = read_questions(path)[:int(os.getenv('WARMUP_MAX_QUESTIONS', '5'))]
+        started = time.perf_counter()
+        # Forks of the shared agent: caches are primed, no session sees these questions
+        records = list(BatchRunner(get_shared_agent(), parallelism=2).run(questions))
+        summary = summarize(records, time.perf_counter() - started)
+        return {'questions': summary['questions'], 'succeeded': summary['succeeded'], 'p50_ms': summary['p50_ms']}
     
-    return hybrid_agents[session_id]
+    return [
+        WarmupStep('agent', build_agent),
+        WarmupStep('aad_token', aad_token),
+        WarmupStep('schema_catalog', schema_catalog),
+        WarmupStep('ontology_indexes', ontology_indexes),
+        WarmupStep('db_connections', db_connections),
+        WarmupStep('warmup_questions', warmup_questions, required=False)
+    ]
+
+
+# Readiness for /api/ready: started by the server entry points, or by the first readiness probe
+warmup = Warmup(build_warmup_steps, retry_seconds=float(os.getenv('WARMUP_RETRY_SECONDS', '30')))
+
+
+@app.after_request
+def compress_response(response):
+    """Compress JSON, HTML and text bodies for clients that accept it (not streams or files)."""
+    if (response.direct_passthrough or response.is_streamed or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+    response.vary.add('Accept-Encoding')
+    body, encoding = response_compressor.encode(response.get_data(), request.headers.get('Accept-Encoding', ''))
+    if encoding:
+        response.set_data(body)
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+
+# filename -> content hash for static_url
+_static_versions = {}
+
+
+def static_url(filename):
+    """URL of a static file with a content hash, so a changed file is fetched again despite caching."""
+    version = _static_versions.get(filename)
+    if version is None:
+        with open(os.path.join(app.static_folder, filename), 'rb') as f:
+            version = _static_versions[filename] = hashlib.sha256(f.read()).hexdigest()[:12]
+    return url_for('static', filename=filename, v=version)
+
+
+@app.context_processor
+def static_url_processor():
+    return {'static_url': static_url}
 
 
 @app.route('/')
@@ -58,12 +242,112 @@ def index():
     return render_template('index.html')
 
 
+def analyze_query(user_question):
+    """Determine the routing strategy for a question and log it."""
+    with stage_timer('routing'):
+        routing_strategy = query_processor.get_processing_strategy(user_question)
+    print(f"\n[Query Analysis] Route: {routing_strategy['routing']}")
+    print(f"  - Agents: {routing_strategy['agents']['primary']}", end="")
+    if routing_strategy['agents']['secondary']:
+        print(f" + {routing_strategy['agents']['secondary']}")
+    else:
+        print()
+    print(f"  - Strategy: {routing_strategy['strategy']}")
+    print(f"  - Complexity: {routing_strategy['analysis']['complexity']}")
+    print(f"  - Confidence: {routing_strategy['analysis']['confidence']}")
+    return routing_strategy
+
+
+def build_query_response(agent, user_question, routing_strategy, result, session_id):
+    """
+    Format a hybrid agent result for the frontend (shared by the Flask and ASGI query routes).
+
+    Args:
+        agent: The session-bound Hybrid Agent that produced the result
+        user_question: The question as asked
+        routing_strategy: Result of analyze_query()
+        result: Result of agent.query()
+        session_id: Owner of any stored result pages
+
+    Returns:
+        JSON-serializable response dict
+    """
+    with stage_timer('formatting'):
+        return _build_query_response(agent, user_question, routing_strategy, result, session_id)
+
+
+def _build_query_response(agent, user_question, routing_strategy, result, session_id):
+    response = {
+        'success': result.get('success', False),
+        'question': result.get('question', user_question),
+        'response': result.get('final_response', ''),
+        'agent_used': 'Intelligent Hybrid Agent',
+        'agent_type': 'auto_routed',
+        'routing_strategy': routing_strategy['routing'],
+        'agents_involved': routing_strategy['agents'],
+        'agent_chain': result.get('agent_chain', 'Hybrid Agent → Memory'),
+        'timestamp': result.get('timestamp', datetime.now().isoformat()),
+        'memory_size': result.get('memory_size', 0),
+        # Add routing details for transparency
+        'auto_routing': True,
+        'query_complexity': routing_strategy['analysis']['complexity'],
+        'routing_confidence': routing_strategy['analysis']['confidence']
+    }
+    
+    # Format the general agent response with proper HTML structure
+    if result.get('final_response'):
+        query_data = result.get('results', None)
+        ontology = agent.sql_agent.ontology
+        formatted = format_general_agent_response(
+            result['final_response'],
+            query_data,
+            code_lookup=ontology.describe if ontology else None,
+            include_styles=False  # the page links static/formatted_response.css
+        )
+        response['response_html'] = formatted['html']
+        response['response_formatted'] = True
+    
+    # Add SQL-specific fields if SQL was used
+    if 'sql_query' in result:
+        response['sql'] = result['sql_query']
+        response['sql_response'] = result.get('sql_response', '')
+        response['results'] = result.get('results', None)
+        response['row_count'] = result.get('row_count', 0)
+        response['columns'] = result.get('columns', [])
+        response['sql_used'] = True
+        response['db_elapsed_ms'] = result.get('db_elapsed_ms')
+        if result.get('statistics'):
+            response['statistics'] = result['statistics']
+        
+        # Only the first page goes inline; the rest is served by /api/results/<id>
+        rows = result.get('results') or []
+        if rows:
+            store = get_result_store()
+            columns = response['columns'] or list(rows[0].keys())
+            result_id = store.put(columns, rows, owner=session_id)
+            first_page = store.page(result_id, owner=session_id)
+            response['results'] = first_page['rows']
+            response['columns'] = columns
+            response['row_count'] = first_page['row_count']
+            response['result_id'] = result_id
+            response['next_cursor'] = first_page['next_cursor']
+    else:
+        response['sql_used'] = False
+    
+    if not result.get('success', False):
+        response['error'] = result.get('error', 'Unknown error occurred')
+    
+    return response
+
+
 @app.route('/api/query', methods=['POST'])
 def query():
     """Handle natural language queries from the frontend with automatic agent routing."""
+    started = time.perf_counter()
     try:
         data = request.get_json()
         user_question = data.get('question', '').strip()
+        fields = parse_fields(request.args.get('fields') or data.get('fields'))
         
         if not user_question:
             return jsonify({
@@ -72,16 +356,7 @@ def query():
             }), 400
         
         # Step 1: Analyze query and determine optimal routing
-        routing_strategy = query_processor.get_processing_strategy(user_question)
-        print(f"\n[Query Analysis] Route: {routing_strategy['routing']}")
-        print(f"  - Agents: {routing_strategy['agents']['primary']}", end="")
-        if routing_strategy['agents']['secondary']:
-            print(f" + {routing_strategy['agents']['secondary']}")
-        else:
-            print()
-        print(f"  - Strategy: {routing_strategy['strategy']}")
-        print(f"  - Complexity: {routing_strategy['analysis']['complexity']}")
-        print(f"  - Confidence: {routing_strategy['analysis']['confidence']}")
+        routing_strategy = analyze_query(user_question)
         
         # Get Hybrid agent for this session
         agent = get_orchestrator_for_session()
@@ -92,56 +367,19 @@ def query():
             }), 500
         
         # Step 2: Process the query through the optimal agent chain
-        # The hybrid agent will internally determine whether to use SQL or General agent
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        try:
-            result = loop.run_until_complete(agent.query(user_question))
-        finally:
-            loop.close()
+        # The hybrid agent will internally determine whether to use SQL or General agent.
+        # It runs on the process-wide loop, so client connections are reused across requests.
+        result = run_async(agent.query(user_question))
+        # Store the session (its memory now holds this result) for whichever worker serves it next
+        save_session_conversation(session['session_id'], agent.conversation)
         
         # Step 3: Format response with routing metadata
-        response = {
-            'success': result.get('success', False),
-            'question': result.get('question', user_question),
-            'response': result.get('final_response', ''),
-            'agent_used': 'Intelligent Hybrid Agent',
-            'agent_type': 'auto_routed',
-            'routing_strategy': routing_strategy['routing'],
-            'agents_involved': routing_strategy['agents'],
-            'agent_chain': result.get('agent_chain', 'Hybrid Agent → Memory'),
-            'timestamp': result.get('timestamp', datetime.now().isoformat()),
-            'memory_size': result.get('memory_size', 0),
-            # Add routing details for transparency
-            'auto_routing': True,
-            'query_complexity': routing_strategy['analysis']['complexity'],
-            'routing_confidence': routing_strategy['analysis']['confidence']
-        }
-        
-        # Format the general agent response with proper HTML structure
-        if result.get('final_response'):
-            query_data = result.get('results', None)
-            formatted = format_general_agent_response(result['final_response'], query_data)
-            response['response_html'] = formatted['html']
-            response['response_formatted'] = True
-        
-        # Add SQL-specific fields if SQL was used
-        if 'sql_query' in result:
-            response['sql'] = result['sql_query']
-            response['sql_response'] = result.get('sql_response', '')
-            response['results'] = result.get('results', None)
-            response['row_count'] = result.get('row_count', 0)
-            response['columns'] = result.get('columns', [])
-            response['sql_used'] = True
-        else:
-            response['sql_used'] = False
-        
-        if not result.get('success', False):
-            response['error'] = result.get('error', 'Unknown error occurred')
-        
-        return jsonify(response)
+        response = build_query_response(agent, user_question, routing_strategy, result, session['session_id'])
+        QUERY_SECONDS.observe(time.perf_counter() - started, outcome='success' if response['success'] else 'failure')
+        return jsonify(select_fields(response, fields))
     
     except Exception as e:
+        QUERY_SECONDS.observe(time.perf_counter() - started, outcome='error')
         import traceback
         traceback.print_exc()
         return jsonify({
@@ -150,6 +388,135 @@ def query():
         }), 500
 
 
+def run_query_job(job, progress):
+    """Answer a queued question for its session (see jobs.py); returns the /api/query response."""
+    started = time.perf_counter()
+    session_id = job['owner']
+    try:
+        routing_strategy = analyze_query(job['question'])
+        progress('routed', routing=routing_strategy['routing'])
+        
+        agent = get_shared_agent().bind(get_session_conversation(session_id))
+        result = run_async(agent.query(job['question']))
+        progress('answered', success=result.get('success', False), retry_attempts=result.get('retry_attempts'),
+                 row_count=result.get('row_count', 0))
+        
+        save_session_conversation(session_id, agent.conversation)
+        response = build_query_response(agent, job['question'], routing_strategy, result, session_id)
+    except Exception:
+        QUERY_SECONDS.observe(time.perf_counter() - started, outcome='error')
+        raise
+    QUERY_SECONDS.observe(time.perf_counter() - started, outcome='success' if response['success'] else 'failure')
+    return response
+
+
+# Long-running questions run as jobs on their own bounded worker pool
+job_queue = create_job_queue_from_env(run_query_job)
+
+
+def current_session_id():
+    """The current session's id, created on first use."""
+    if not session.get('session_id'):
+        session['session_id'] = secrets.token_hex(16)
+    return session['session_id']
+
+
+@app.route('/api/jobs', methods=['POST'])
+def submit_job():
+    """Queue a question as a job; returns 202 with the job id to poll."""
+    try:
+        data = request.get_json(silent=True) or {}
+        user_question = str(data.get('question', '')).strip()
+        if not user_question:
+            raise ValueError("Please provide a question.")
+        
+        job_id = job_queue.submit(user_question, owner=current_session_id())
+        return jsonify({
+            'success': True,
+            'job_id': job_id,
+            'status': 'queued',
+            'poll_url': f'/api/jobs/{job_id}',
+            'events_url': f'/api/jobs/{job_id}/events'
+        }), 202
+    
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    except JobQueueFullError as e:
+        return jsonify({
+            'success': False,
+            'error': f'Too many jobs in progress, retry later ({e})'
+        }), 429
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f'Error submitting job: {str(e)}'
+        }), 500
+
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Status, progress events and (once finished) the result of a job of this session."""
+    try:
+        job = job_queue.store.get(job_id, owner=session.get('session_id', ''))
+        if job is None:
+            return jsonify({
+                'success': False,
+                'error': 'Job not found or expired'
+            }), 404
+        
+        if 'result' in job:
+            job['result'] = select_fields(job['result'], parse_fields(request.args.get('fields')))
+        return jsonify({'success': True, **job})
+    
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f'Error retrieving job: {str(e)}'
+        }), 500
+
+
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+def stream_job_events(job_id):
+    """Server-sent events: one 'progress' event per job stage, then 'done' with the final job."""
+    owner = session.get('session_id', '')
+    fields = parse_fields(request.args.get('fields'))
+    if job_queue.store.get(job_id, owner=owner, include_result=False) is None:
+        return jsonify({
+            'success': False,
+            'error': 'Job not found or expired'
+        }), 404
+    
+    def generate():
+        sent = 0
+        last_write = time.monotonic()
+        while True:
+            job = job_queue.store.get(job_id, owner=owner, include_result=False)
+            if job is None:
+                yield "event: error\ndata: {\"error\": \"Job not found or expired\"}\n\n"
+                return
+            for event in job['events'][sent:]:
+                yield f"event: progress\ndata: {json.dumps(event, default=str)}\n\n"
+                last_write = time.monotonic()
+            sent = len(job['events'])
+            if job['status'] in FINISHED:
+                job = job_queue.store.get(job_id, owner=owner) or job
+                if 'result' in job:
+                    job['result'] = select_fields(job['result'], fields)
+                yield f"event: done\ndata: {json.dumps(job, default=str)}\n\n"
+                return
+            if time.monotonic() - last_write > 15:
+                # Comment line keeps proxies from closing an idle stream
+                yield ": keepalive\n\n"
+                last_write = time.monotonic()
+            time.sleep(0.5)
+    
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
 @app.route('/api/history', methods=['GET'])
 def get_history():
     """Get conversation history for the current session."""
@@ -184,6 +551,7 @@ def clear_history():
         agent = get_orchestrator_for_session()
         if agent:
             agent.clear_memory()
+            save_session_conversation(session['session_id'], agent.conversation)
         
         return jsonify({
             'success': True,
@@ -197,6 +565,44 @@ def clear_history():
         }), 500
 
 
+@app.route('/api/settings', methods=['GET', 'POST'])
+def session_settings():
+    """Get or update (POST a JSON object, merged) the current session's settings."""
+    try:
+        agent = get_orchestrator_for_session()
+        if not agent:
+            return jsonify({
+                'success': False,
+                'error': 'No active session'
+            }), 404
+        
+        if request.method == 'POST':
+            settings = request.get_json(silent=True)
+            if not isinstance(settings, dict):
+                raise ValueError("Settings must be a JSON object")
+            merged = {**agent.conversation.settings, **settings}
+            if len(json.dumps(merged, default=str)) > MAX_SETTINGS_BYTES:
+                raise ValueError(f"Settings exceed {MAX_SETTINGS_BYTES} bytes")
+            agent.conversation.update_settings(settings)
+            save_session_conversation(session['session_id'], agent.conversation)
+        
+        return jsonify({
+            'success': True,
+            'settings': agent.conversation.settings
+        })
+    
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f'Error updating settings: {str(e)}'
+        }), 500
+
+
 @app.route('/api/memory', methods=['GET'])
 def get_memory():
     """Get detailed memory information."""
@@ -288,6 +694,244 @@ def get_agents():
         }), 500
 
 
+@app.route('/api/repair-stats', methods=['GET'])
+def get_repair_stats():
+    """Get hit rates of the deterministic SQL repair rules and the learned-correction store."""
+    try:
+        correction_memory = get_correction_memory()
+        return jsonify({
+            'success': True,
+            'repair_stats': repair_engine.stats(),
+            'correction_memory': correction_memory.stats() if correction_memory is not None else None
+        })
+    
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f'Error retrieving repair stats: {str(e)}'
+        }), 500
+
+
+@app.route('/api/admin/workload', methods=['GET'])
+def get_workload():
+    """Get per-fingerprint query statistics (counts, latency percentiles, failure rates)."""
+    try:
+        store = get_workload_store()
+        if store is None:
+            return jsonify({
+                'success': False,
+                'error': 'Workload recording is disabled (SQL_WORKLOAD_ENABLED=false)'
+            }), 404
+        
+        since_hours = request.args.get('since_hours', type=float)
+        return jsonify({
+            'success': True,
+            'totals': store.totals(),
+            'fingerprints': store.summary(
+                limit=request.args.get('limit', 20, type=int),
+                order_by=request.args.get('order_by', 'total_time'),
+                since_hours=since_hours
+            )
+        })
+    
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f'Error retrieving workload: {str(e)}'
+        }), 500
+
+
+@app.route('/api/admin/workload/<fingerprint>', methods=['GET'])
+def get_workload_fingerprint(fingerprint):
+    """Get stats, errors and recent executions of one query fingerprint."""
+    try:
+        store = get_workload_store()
+        detail = store.fingerprint_detail(fingerprint) if store is not None else None
+        if detail is None:
+            return jsonify({
+                'success': False,
+                'error': f'Unknown fingerprint: {fingerprint}'
+            }), 404
+        
+        return jsonify({
+            'success': True,
+            'workload': detail
+        })
+    
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f'Error retrieving workload: {str(e)}'
+        }), 500
+
+
+@app.route('/api/admin/sessions', methods=['GET'])
+def get_session_stats():
+    """Get active/evicted session counts, approximate session memory and state store counters."""
+    try:
+        return jsonify({
+            'success': True,
+            'sessions': session_store.stats(),
+            'state': state_store.stats(),
+            'jobs': job_queue.stats()
+        })
+    
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f'Error retrieving session stats: {str(e)}'
+        }), 500
+
+
+@app.route('/api/admin/slow-queries', methods=['GET'])
+def get_slow_queries():
+    """Get logged slow queries (?order_by=recent|elapsed|reads|rows&fingerprint=&since_hours=&limit=) and hotspots."""
+    try:
+        log = get_slow_query_log()
+        if log is None:
+            return jsonify({
+                'success': False,
+                'error': 'Slow-query logging is disabled (SLOW_QUERY_LOG_ENABLED=false)'
+            }), 404
+        
+        since_hours = request.args.get('since_hours', type=float)
+        return jsonify({
+            'success': True,
+            'totals': log.totals(),
+            'hotspots': log.hotspots(limit=request.args.get('hotspots', 10, type=int), since_hours=since_hours),
+            'entries': log.entries(
+                limit=request.args.get('limit', 50, type=int),
+                order_by=request.args.get('order_by', 'recent'),
+                since_hours=since_hours,
+                fp=request.args.get('fingerprint')
+            )
+        })
+    
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f'Error retrieving slow queries: {str(e)}'
+        }), 500
+
+
+@app.route('/api/admin/slow-queries/<int:entry_id>', methods=['GET'])
+def get_slow_query(entry_id):
+    """Get one logged slow query including its captured execution plan."""
+    try:
+        log = get_slow_query_log()
+        entry = log.entry(entry_id) if log is not None else None
+        if entry is None:
+            return jsonify({
+                'success': False,
+                'error': f'Unknown slow query: {entry_id}'
+            }), 404
+        
+        return jsonify({
+            'success': True,
+            'slow_query': entry
+        })
+    
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f'Error retrieving slow query: {str(e)}'
+        }), 500
+
+
+@app.route('/api/results/<result_id>', methods=['GET'])
+def get_result_page(result_id):
+    """Get the next page of a retained query result (?cursor=<next_cursor>&limit=<rows>)."""
+    try:
+        page = get_result_store().page(
+            result_id,
+            cursor=request.args.get('cursor'),
+            limit=request.args.get('limit', type=int),
+            owner=session.get('session_id')
+        )
+        if page is None:
+            return jsonify({
+                'success': False,
+                'error': f'Unknown or expired result: {result_id}'
+            }), 404
+        
+        return jsonify({
+            'success': True,
+            **page
+        })
+    
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f'Error retrieving results: {str(e)}'
+        }), 500
+
+
+@app.route('/api/batch', methods=['POST'])
+def run_batch():
+    """
+    Run many questions and stream one JSON line per question as it completes.
+    
+    Body: {"questions": [str | {"question", "id"}], "parallelism", "llm_concurrency",
+           "db_concurrency", "include_results"}
+    """
+    try:
+        data = request.get_json() or {}
+        items = normalize_items(data.get('questions') or [])
+        if not items:
+            raise ValueError("Please provide at least one question.")
+        
+        max_questions = int(os.getenv('BATCH_MAX_QUESTIONS', '1000'))
+        max_parallelism = int(os.getenv('BATCH_MAX_PARALLELISM', '8'))
+        if len(items) > max_questions:
+            raise ValueError(f"A batch may contain at most {max_questions} questions.")
+        
+        def limit(name, default):
+            value = int(data.get(name, default))
+            if value < 1:
+                raise ValueError(f"{name} must be positive")
+            return min(value, max_parallelism)
+        
+        runner = BatchRunner(
+            get_shared_agent(),
+            parallelism=limit('parallelism', 4),
+            llm_concurrency=limit('llm_concurrency', 4),
+            db_concurrency=limit('db_concurrency', 8),
+            include_results=bool(data.get('include_results', False))
+        )
+        
+        def stream():
+            for record in runner.run(items):
+                yield json.dumps(record, default=str) + "\n"
+        
+        return Response(stream_with_context(stream()), mimetype='application/x-ndjson')
+    
+    except (ValueError, TypeError) as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f'Error starting batch: {str(e)}'
+        }), 500
+
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """Health check endpoint."""
@@ -297,6 +941,20 @@ def health_check():
     })
 
 
+@app.route('/api/ready', methods=['GET'])
+def readiness_check():
+    """Readiness probe: 200 once warm-up has succeeded, 503 (with per-step progress) until then."""
+    warmup.start()
+    report = warmup.report()
+    return jsonify(report), (200 if report['ready'] else 503)
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Pipeline metrics in the Prometheus text format (see metrics.py)."""
+    return Response(metrics_registry.render(), mimetype='text/plain; version=0.0.4')
+
+
 @app.errorhandler(404)
 def not_found(error):
     """Handle 404 errors."""
@@ -356,6 +1014,9 @@ if __name__ == '__main__':
     print(f"Prompt Framework: POML (Prompt Optimization Markup Language)")
     print(f"Agent Architecture: SQL Agent → General Agent → Memory")
     print("=" * 60)
+    # Warm caches and connections while the server starts; /api/ready reports progress
+    warmup.start()
+    
     print("\nStarting Flask application...")
     print("Access the application at: http://localhost:5002")
     print("\nPress CTRL+C to stop the server.")
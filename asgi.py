@@ -0,0 +1,178 @@
+"""
+ASGI Entry Point
+Serves the web app from an ASGI server. /api/query is an async route that awaits the shared
+Hybrid Agent directly on the server's event loop; every other route is the Flask app,
+mounted through a WSGI adapter and submitting its agent work to the same loop
+(see async_runtime.py).
+
+Questions in flight are bounded by the server's concurrency limit and by
+ASYNC_WORKER_THREADS (the blocking SQL generation/execution steps of each question run in
+the loop's executor), not by one thread per request.
+
+Production configuration (one worker holding hundreds of in-flight questions):
+    pip install starlette uvicorn[standard] a2wsgi
+    ASYNC_WORKER_THREADS=256 uvicorn asgi:app --host 0.0.0.0 --port 5002 \\
+        --workers 4 --loop uvloop --http httptools \\
+        --limit-concurrency 512 --backlog 2048 --timeout-keep-alive 30
+
+- Each worker is a process with its own agent and caches; keep FLASK_SECRET_KEY set so
+  session cookies stay valid across workers, and set STATE_BACKEND=sqlite (one host) or
+  redis (several nodes) so conversations follow the session to any worker.
+- --limit-concurrency caps open requests per worker (503 beyond it); size
+  ASYNC_WORKER_THREADS to the SQL steps expected in flight at once, and the database and
+  Azure OpenAI quotas to workers x that number.
+
+Configuration:
+    ASYNC_WORKER_THREADS    Threads for blocking agent work (default: 64)
+    WSGI_WORKER_THREADS     Threads serving the mounted Flask routes (default: 32)
+"""
+
+import asyncio
+import contextlib
+import os
+import secrets
+import time
+
+try:
+    from starlette.applications import Starlette
+    from starlette.requests import Request
+    from starlette.responses import Response
+    from starlette.routing import Mount, Route
+except ImportError as e:
+    raise ImportError("asgi.py requires Starlette: pip install starlette uvicorn[standard] a2wsgi") from e
+
+try:
+    from a2wsgi import WSGIMiddleware
+
+    def _wsgi(flask_app):
+        return WSGIMiddleware(flask_app, workers=int(os.getenv('WSGI_WORKER_THREADS', '32')))
+except ImportError:
+    # Starlette's own adapter (deprecated in favour of a2wsgi, runs on anyio's thread limiter)
+    from starlette.middleware.wsgi import WSGIMiddleware
+
+    def _wsgi(flask_app):
+        return WSGIMiddleware(flask_app)
+
+import app as web
+from async_runtime import get_async_runtime
+from metrics import QUERY_SECONDS
+from payload import parse_fields, select_fields
+
+
+flask_app = web.app
+
+
+def _load_session(request: Request):
+    """
+    Read the Flask session cookie so both servers share one session per browser.
+
+    Returns:
+        (session data, session id, whether the cookie must be (re)written)
+    """
+    serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+    cookie = request.cookies.get(flask_app.config['SESSION_COOKIE_NAME'])
+    data = {}
+    if cookie and serializer is not None:
+        try:
+            data = dict(serializer.loads(cookie, max_age=int(flask_app.permanent_session_lifetime.total_seconds())))
+        except Exception:
+            data = {}
+    if data.get('session_id'):
+        return data, data['session_id'], False
+    data['session_id'] = secrets.token_hex(16)
+    return data, data['session_id'], True
+
+
+def _json(request: Request, payload, status_code: int = 200) -> Response:
+    # Flask's provider and compressor, so the body is encoded as under the Flask route
+    body, encoding = web.response_compressor.encode(
+        flask_app.json.dumps(payload).encode('utf-8'), request.headers.get('accept-encoding', ''))
+    headers = {'Vary': 'Accept-Encoding'}
+    if encoding:
+        headers['Content-Encoding'] = encoding
+    return Response(body, status_code=status_code, media_type='application/json', headers=headers)
+
+
+async def query(request: Request) -> Response:
+    """Async /api/query: same request and response as the Flask route, awaiting the agent directly."""
+    started = time.perf_counter()
+    try:
+        try:
+            data = await request.json()
+        except ValueError:
+            data = {}
+        user_question = str((data or {}).get('question', '')).strip()
+        fields = parse_fields(request.query_params.get('fields') or (data or {}).get('fields'))
+
+        if not user_question:
+            return _json(request, {
+                'success': False,
+                'error': 'Please provide a question.'
+            }, 400)
+
+        # Step 1: Analyze query and determine optimal routing
+        routing_strategy = web.analyze_query(user_question)
+
+        session_data, session_id, new_session = _load_session(request)
+        try:
+            agent = await asyncio.to_thread(web.get_shared_agent)
+        except Exception as e:
+            print(f"Error creating hybrid agent: {e}")
+            return _json(request, {
+                'success': False,
+                'error': 'Failed to initialize hybrid agent system. Check your configuration.'
+            }, 500)
+        # The state store may be a database or Redis: sync off the event loop
+        agent = agent.bind(await asyncio.to_thread(web.get_session_conversation, session_id))
+
+        # Step 2: Awaited on the server loop; other questions proceed meanwhile
+        result = await agent.query(user_question)
+
+        # Step 3: Store the session and format the response (result pages may spill to disk)
+        def finish():
+            web.save_session_conversation(session_id, agent.conversation)
+            return web.build_query_response(agent, user_question, routing_strategy, result, session_id)
+        payload = await asyncio.to_thread(finish)
+        QUERY_SECONDS.observe(time.perf_counter() - started, outcome='success' if payload['success'] else 'failure')
+        response = _json(request, select_fields(payload, fields))
+
+        if new_session:
+            serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+            if serializer is not None:
+                response.set_cookie(
+                    flask_app.config['SESSION_COOKIE_NAME'],
+                    serializer.dumps(session_data),
+                    path=flask_app.config['SESSION_COOKIE_PATH'] or '/',
+                    httponly=flask_app.config['SESSION_COOKIE_HTTPONLY'],
+                    secure=flask_app.config['SESSION_COOKIE_SECURE'],
+                    samesite=flask_app.config['SESSION_COOKIE_SAMESITE']
+                )
+        return response
+
+    except Exception as e:
+        QUERY_SECONDS.observe(time.perf_counter() - started, outcome='error')
+        import traceback
+        traceback.print_exc()
+        return _json(request, {
+            'success': False,
+            'error': f'Server error: {str(e)}'
+        }, 500)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(_app):
+    """Adopt the server loop for all agent work and start warm-up (see /api/ready)."""
+    get_async_runtime().adopt()
+    # Warm-up runs in its own thread; the agent build it starts is submitted to this
+    # (now adopted) loop, so serving starts at once and /api/ready reports progress
+    web.warmup.start()
+    yield
+
+
+app = Starlette(
+    routes=[
+        Route('/api/query', query, methods=['POST']),
+        Mount('/', app=_wsgi(flask_app))
+    ],
+    lifespan=lifespan
+)
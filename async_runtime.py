@@ -0,0 +1,114 @@
+"""
+Process-wide Event Loop
+All agent coroutines in a process run on one long-lived event loop, so HTTP connection
+pools bound to the loop (Azure OpenAI / Agent Framework clients) survive between requests
+and concurrent questions actually overlap.
+
+- Under the Flask (WSGI) server the loop runs in a background thread; request threads
+  submit coroutines with run_async() and wait for the result.
+- Under the ASGI server (asgi.py) the server's own loop is adopted at startup: async routes
+  await the agent directly and the mounted Flask routes submit to the same loop.
+
+Blocking work inside agent coroutines (SQL generation and execution) runs in the loop's
+default executor, sized here because it bounds how many questions are in flight.
+
+Configuration:
+    ASYNC_WORKER_THREADS    Threads for blocking agent work (default: 64)
+"""
+
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Optional
+
+
+class AsyncRuntime:
+    """One event loop per process, either owned (background thread) or adopted (ASGI server)."""
+
+    def __init__(self, worker_threads: int = 64):
+        """
+        Args:
+            worker_threads: Size of the loop's default executor (asyncio.to_thread work)
+        """
+        self.worker_threads = worker_threads
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def _configure(self, loop: asyncio.AbstractEventLoop):
+        loop.set_default_executor(ThreadPoolExecutor(max_workers=self.worker_threads, thread_name_prefix='agent-work'))
+
+    def start(self) -> asyncio.AbstractEventLoop:
+        """Start the background loop thread (no-op when a loop is already running or adopted)."""
+        with self._lock:
+            if self.loop is None or self.loop.is_closed():
+                loop = asyncio.new_event_loop()
+                self._configure(loop)
+                self._thread = threading.Thread(target=loop.run_forever, name='agent-event-loop', daemon=True)
+                self._thread.start()
+                self.loop = loop
+            return self.loop
+
+    def adopt(self, loop: Optional[asyncio.AbstractEventLoop] = None):
+        """
+        Use an already running loop (the ASGI server's) instead of a background thread.
+
+        Args:
+            loop: The loop to adopt (default: the running loop)
+        """
+        loop = loop or asyncio.get_running_loop()
+        with self._lock:
+            self._configure(loop)
+            self.loop = loop
+            self._thread = None
+
+    def run(self, coro: Awaitable[Any], timeout: Optional[float] = None) -> Any:
+        """
+        Run a coroutine on the process loop from a synchronous thread and wait for its result.
+
+        Raises:
+            RuntimeError: Called from the loop's own thread (await the coroutine instead)
+            concurrent.futures.TimeoutError: The coroutine did not finish within timeout
+        """
+        loop = self.start()
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            raise RuntimeError("run_async() called on the event loop thread; await the coroutine instead")
+        future = asyncio.run_coroutine_threadsafe(coro, loop)
+        try:
+            return future.result(timeout)
+        except BaseException:
+            future.cancel()
+            raise
+
+    def stop(self):
+        """Stop and close an owned background loop (an adopted loop is left to its server)."""
+        with self._lock:
+            loop, thread = self.loop, self._thread
+            self.loop, self._thread = None, None
+        if loop is not None and thread is not None:
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join(timeout=5)
+            loop.close()
+
+
+_runtime: Optional[AsyncRuntime] = None
+_runtime_lock = threading.Lock()
+
+
+def get_async_runtime() -> AsyncRuntime:
+    """Process-wide runtime, created from environment variables on first use."""
+    global _runtime
+    with _runtime_lock:
+        if _runtime is None:
+            _runtime = AsyncRuntime(worker_threads=int(os.getenv('ASYNC_WORKER_THREADS', '64')))
+        return _runtime
+
+
+def run_async(coro: Awaitable[Any], timeout: Optional[float] = None) -> Any:
+    """Run a coroutine on the process loop and wait for its result (see AsyncRuntime.run)."""
+    return get_async_runtime().run(coro, timeout)
@@ -0,0 +1,91 @@
+"""
+Run a file of questions through the hybrid agent and write one JSON line per question.
+
+Questions are read from:
+- .txt:   one question per line (blank lines and lines starting with # are skipped)
+- .jsonl: one object per line with a "question" field (and optionally "id")
+- .md:    numbered, quoted questions such as those in SAMPLE_QUESTIONS.md
+
+Records are written in completion order; each carries the question's input index and id.
+A summary (throughput, latency) is printed to stderr at the end.
+
+Usage:
+    python batch_query.py questions.txt [--output results.jsonl] [--parallelism 4]
+                          [--llm-concurrency 4] [--db-concurrency 8] [--include-results]
+"""
+
+import argparse
+import json
+import re
+import sys
+import time
+from dotenv import load_dotenv
+from async_runtime import run_async
+from batch_runner import BatchRunner, summarize
+from hybrid_agent_with_memory import create_hybrid_agent_from_env
+
+load_dotenv()
+
+_MARKDOWN_QUESTION = re.compile(r'^\s*\d+\.\s+"(.+)"\s*$')
+
+
+def read_questions(path: str) -> list:
+    """Questions (strings or {"question", "id"} objects) from a .txt, .jsonl or .md file."""
+    with open(path, encoding='utf-8') as f:
+        lines = f.read().splitlines()
+    if path.endswith('.jsonl'):
+        return [json.loads(line) for line in lines if line.strip()]
+    if path.endswith('.md'):
+        return [match.group(1) for match in map(_MARKDOWN_QUESTION.match, lines) if match]
+    return [line.strip() for line in lines if line.strip() and not line.lstrip().startswith('#')]
+
+
+def run_batch(args):
+    """Run the batch and stream records to the output."""
+    questions = read_questions(args.input)
+    if not questions:
+        print(f"No questions found in {args.input}", file=sys.stderr)
+        return 1
+
+    agent = run_async(create_hybrid_agent_from_env())
+    runner = BatchRunner(
+        agent,
+        parallelism=args.parallelism,
+        llm_concurrency=args.llm_concurrency,
+        db_concurrency=args.db_concurrency,
+        include_results=args.include_results
+    )
+
+    print(f"Running {len(questions)} questions (parallelism {args.parallelism}, "
+          f"LLM {args.llm_concurrency}, DB {args.db_concurrency})", file=sys.stderr)
+    output = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    records = []
+    started = time.perf_counter()
+    try:
+        for record in runner.run(questions):
+            records.append(record)
+            output.write(json.dumps(record, default=str) + "\n")
+            output.flush()
+            status = "✓" if record.get('success') else "✗"
+            print(f"  {status} [{len(records)}/{len(questions)}] {record['question'][:70]} "
+                  f"({record.get('elapsed_ms', 0):.0f} ms)", file=sys.stderr)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+    summary = summarize(records, time.perf_counter() - started)
+    print(json.dumps(summary, indent=2), file=sys.stderr)
+    return 0 if summary['failed'] == 0 else 2
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="Questions file (.txt, .jsonl or .md)")
+    parser.add_argument("--output", help="JSONL output file (default: stdout)")
+    parser.add_argument("--parallelism", type=int, default=4, help="Questions in flight at once")
+    parser.add_argument("--llm-concurrency", type=int, default=4, help="Model calls in flight at once")
+    parser.add_argument("--db-concurrency", type=int, default=8, help="Database connections in use at once")
+    parser.add_argument("--include-results", action="store_true", help="Include result rows in each record")
+    args = parser.parse_args()
+
+    sys.exit(run_batch(args))
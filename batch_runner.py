@@ -0,0 +1,241 @@
+"""
+Batch Question Runner
+Replays many questions (nightly evaluations, reports) through the hybrid pipeline with
+bounded parallelism, and yields one record per question as soon as it completes.
+
+Every item runs on a fork of one hybrid agent (see HybridAgentWithMemory.fork): items
+have independent conversations but share the model clients, schema, ontology cache,
+correction memory and execution backend, so nothing is reloaded per question.
+
+Three limits apply:
+    parallelism       questions in flight at once
+    llm_concurrency   model calls in flight at once (SQL generation, planning, analysis)
+    db_concurrency    database connections checked out at once
+
+Used by /api/batch (JSONL stream) and batch_query.py (CLI).
+"""
+
+import asyncio
+import queue
+import threading
+import time
+from types import SimpleNamespace
+from typing import Any, Dict, Iterable, Iterator, List
+from async_runtime import get_async_runtime
+
+
+class _LimitedCompletions:
+    """chat.completions of an OpenAI client, gated by a semaphore."""
+
+    def __init__(self, completions, slots: threading.BoundedSemaphore):
+        self._completions = completions
+        self._slots = slots
+
+    def create(self, **kwargs):
+        with self._slots:
+            return self._completions.create(**kwargs)
+
+
+class _LimitedClient:
+    """OpenAI client whose chat completions share the batch's model-call slots."""
+
+    def __init__(self, client, slots: threading.BoundedSemaphore):
+        self._client = client
+        self.chat = SimpleNamespace(completions=_LimitedCompletions(client.chat.completions, slots))
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+class _LimitedChatAgent:
+    """Agent Framework ChatAgent whose runs share the batch's model-call slots."""
+
+    def __init__(self, agent, slots: threading.BoundedSemaphore):
+        self._agent = agent
+        self._slots = slots
+
+    async def run(self, *args, **kwargs):
+        await asyncio.to_thread(self._slots.acquire)
+        try:
+            return await self._agent.run(*args, **kwargs)
+        finally:
+            self._slots.release()
+
+    def __getattr__(self, name):
+        return getattr(self._agent, name)
+
+
+class _LimitedConnection:
+    """Connection that frees its batch database slot when closed."""
+
+    def __init__(self, conn, slots: threading.BoundedSemaphore):
+        self._conn = conn
+        self._slots = slots
+        self._released = False
+
+    def close(self):
+        try:
+            self._conn.close()
+        finally:
+            if not self._released:
+                self._released = True
+                self._slots.release()
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+class _LimitedBackend:
+    """Execution backend whose generated-SQL checkouts share the batch's database slots."""
+
+    def __init__(self, backend, slots: threading.BoundedSemaphore):
+        self._backend = backend
+        self._slots = slots
+
+    def checkout(self):
+        self._slots.acquire()
+        try:
+            return _LimitedConnection(self._backend.checkout(), self._slots)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def __getattr__(self, name):
+        return getattr(self._backend, name)
+
+
+def normalize_items(items: Iterable[Any]) -> List[Dict[str, Any]]:
+    """
+    Turn questions into batch items.
+
+    Args:
+        items: Question strings or {"question": ..., "id": ...} objects
+
+    Returns:
+        [{"index", "id", "question"}, ...]
+
+    Raises:
+        ValueError: An item without a question
+    """
+    normalized = []
+    for index, item in enumerate(items):
+        if isinstance(item, str):
+            item = {'question': item}
+        question = str((item or {}).get('question', '')).strip() if isinstance(item, dict) else ''
+        if not question:
+            raise ValueError(f"Item {index} has no question")
+        normalized.append({'index': index, 'id': item.get('id', index), 'question': question})
+    return normalized
+
+
+class BatchRunner:
+    """Runs questions concurrently through forks of one hybrid agent."""
+
+    def __init__(self, agent, parallelism: int = 4, llm_concurrency: int = 4, db_concurrency: int = 8,
+                 include_results: bool = False):
+        """
+        Args:
+            agent: HybridAgentWithMemory whose clients and caches all items share
+            parallelism: Questions in flight at once
+            llm_concurrency: Model calls in flight at once
+            db_concurrency: Database connections checked out at once
+            include_results: Include result rows in each record
+        """
+        self.agent = agent
+        self.parallelism = max(1, parallelism)
+        self.include_results = include_results
+        self._llm_slots = threading.BoundedSemaphore(max(1, llm_concurrency))
+        self._db_slots = threading.BoundedSemaphore(max(1, db_concurrency))
+        self._backend = _LimitedBackend(agent.sql_agent.backend, self._db_slots)
+        self._client = _LimitedClient(agent.sql_agent.client, self._llm_slots)
+
+    def _fork(self):
+        """A per-item agent routed through the batch's model and database limits."""
+        forked = self.agent.fork()
+        forked.sql_agent.client = self._client
+        forked.sql_agent.backend = self._backend
+        forked.general_agent.agent = _LimitedChatAgent(forked.general_agent.agent, self._llm_slots)
+        return forked
+
+    async def _run_item(self, item: Dict[str, Any]) -> Dict[str, Any]:
+        started = time.perf_counter()
+        record = {'index': item['index'], 'id': item['id'], 'question': item['question']}
+        try:
+            result = await self._fork().query(item['question'])
+        except Exception as e:
+            result = {'success': False, 'error': f"{type(e).__name__}: {e}"}
+        record.update({
+            'success': result.get('success', False),
+            'response': result.get('final_response', ''),
+            'sql': result.get('sql_query'),
+            'row_count': result.get('row_count', 0),
+            'columns': result.get('columns', []),
+            'error': result.get('error'),
+            'error_category': result.get('error_category'),
+            'was_corrected': result.get('was_corrected', False),
+            'fast_path': result.get('fast_path', False),
+            'retry_attempts': result.get('retry_attempts'),
+            'elapsed_ms': round((time.perf_counter() - started) * 1000, 2)
+        })
+        if result.get('plan'):
+            record['plan'] = result['plan']
+        if self.include_results:
+            record['results'] = result.get('results', [])
+        return record
+
+    async def _produce(self, items: List[Dict[str, Any]], out: 'queue.Queue', stop: threading.Event):
+        gate = asyncio.Semaphore(self.parallelism)
+
+        async def run(item):
+            async with gate:
+                if stop.is_set():
+                    return
+                out.put(await self._run_item(item))
+
+        await asyncio.gather(*(run(item) for item in items))
+
+    def run(self, items: Iterable[Any]) -> Iterator[Dict[str, Any]]:
+        """
+        Run a batch, yielding each item's record as it completes (completion order).
+
+        Closing the iterator early (e.g. the HTTP client went away) stops items that have
+        not started yet.
+        """
+        normalized = normalize_items(items)
+        out: 'queue.Queue' = queue.Queue()
+        stop = threading.Event()
+        done = object()
+
+        def finished(future):
+            if not future.cancelled() and future.exception() is not None:
+                out.put({'success': False, 'error': f"Batch failed: {future.exception()}"})
+            out.put(done)
+
+        # Items run on the process loop, next to the agent's long-lived client sessions
+        future = asyncio.run_coroutine_threadsafe(
+            self._produce(normalized, out, stop), get_async_runtime().start()
+        )
+        future.add_done_callback(finished)
+        try:
+            while True:
+                record = out.get()
+                if record is done:
+                    return
+                yield record
+        finally:
+            stop.set()
+
+
+def summarize(records: List[Dict[str, Any]], elapsed_s: float) -> Dict[str, Any]:
+    """Counts and latency of a finished batch."""
+    latencies = sorted(record.get('elapsed_ms', 0) for record in records)
+    succeeded = sum(1 for record in records if record.get('success'))
+    return {
+        'questions': len(records),
+        'succeeded': succeeded,
+        'failed': len(records) - succeeded,
+        'elapsed_s': round(elapsed_s, 2),
+        'questions_per_minute': round(len(records) / elapsed_s * 60, 2) if elapsed_s > 0 else None,
+        'p50_ms': latencies[len(latencies) // 2] if latencies else None,
+        'max_ms': latencies[-1] if latencies else None
+    }
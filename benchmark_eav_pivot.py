@@ -0,0 +1,167 @@
+"""
+Benchmark per-attribute self-joins vs. the single-pass pivot rewrite (eav_rewriter.py).
+
+Each query is run in both forms against the MedData database:
+- "before": one LEFT JOIN MED per attribute, collapsed with MAX(CASE ...) and GROUP BY
+- "after":  the rewriter's output - one LEFT JOIN MED ... SLOT_NUMBER IN (...) pass
+
+Logical reads come from SET STATISTICS IO (SQL Server only); results of both forms are
+compared to confirm the rewrite is equivalent.
+
+Usage:
+    python benchmark_eav_pivot.py [--iterations 20] [--loinc 2947-0]
+"""
+
+import argparse
+import re
+import statistics
+import time
+from dotenv import load_dotenv
+from eav_rewriter import EAVRewriter, results_equivalent
+from meddata_sql_agent import create_meddata_agent_from_env
+
+load_dotenv()
+
+
+QUERIES = {
+    "Problems for LOINC + name, SNOMED": """
+        SELECT prob.CODE,
+               MAX(CASE WHEN n.SLOT_NUMBER = 6 THEN n.SLOT_VALUE END) AS Name,
+               MAX(CASE WHEN s.SLOT_NUMBER = 266 THEN s.SLOT_VALUE END) AS SNOMEDCode
+        FROM MED loinc_ref
+        INNER JOIN MED indicates ON loinc_ref.CODE = indicates.CODE AND indicates.SLOT_NUMBER = 150
+        INNER JOIN MED prob ON indicates.REF_CODE = prob.CODE
+        LEFT JOIN MED n ON prob.CODE = n.CODE AND n.SLOT_NUMBER = 6
+        LEFT JOIN MED s ON prob.CODE = s.CODE AND s.SLOT_NUMBER = 266
+        WHERE loinc_ref.SLOT_NUMBER = 212 AND loinc_ref.SLOT_VALUE = ?
+        GROUP BY prob.CODE
+    """,
+    "Tests for LOINC + name, SNOMED, Epic, Millennium": """
+        SELECT t.CODE,
+               MAX(CASE WHEN n.SLOT_NUMBER = 6 THEN n.SLOT_VALUE END) AS Name,
+               MAX(CASE WHEN s.SLOT_NUMBER = 266 THEN s.SLOT_VALUE END) AS SNOMEDCode,
+               MAX(CASE WHEN e.SLOT_NUMBER = 277 THEN e.SLOT_VALUE END) AS EpicCode,
+               MAX(CASE WHEN m.SLOT_NUMBER = 264 THEN m.SLOT_VALUE END) AS MillenniumCode
+        FROM MED t
+        LEFT JOIN MED n ON t.CODE = n.CODE AND n.SLOT_NUMBER = 6
+        LEFT JOIN MED s ON t.CODE = s.CODE AND s.SLOT_NUMBER = 266
+        LEFT JOIN MED e ON t.CODE = e.CODE AND e.SLOT_NUMBER = 277
+        LEFT JOIN MED m ON t.CODE = m.CODE AND m.SLOT_NUMBER = 264
+        WHERE t.SLOT_NUMBER = 212 AND t.SLOT_VALUE = ?
+        GROUP BY t.CODE
+    """,
+    "Named concepts + SNOMED, CPMC (top 100)": """
+        SELECT TOP 100 c.CODE,
+               MAX(n.SLOT_VALUE) AS Name,
+               MAX(s.SLOT_VALUE) AS SNOMEDCode,
+               MAX(p.SLOT_VALUE) AS CPMCCode
+        FROM MED c
+        LEFT JOIN MED n ON n.CODE = c.CODE AND n.SLOT_NUMBER = 6
+        LEFT JOIN MED s ON s.CODE = c.CODE AND s.SLOT_NUMBER = 266
+        LEFT JOIN MED p ON p.CODE = c.CODE AND p.SLOT_NUMBER = 20
+        WHERE c.SLOT_NUMBER = 6 AND c.SLOT_VALUE LIKE ?
+        GROUP BY c.CODE
+        ORDER BY c.CODE
+    """,
+}
+
+_LOGICAL_READS = re.compile(r"logical reads (\d+)")
+
+
+def logical_reads(conn, sql: str, params: tuple):
+    """Total logical reads reported by SET STATISTICS IO (None if unavailable)."""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SET STATISTICS IO ON")
+        cursor.execute(sql, params)
+        cursor.fetchall()
+        messages = list(getattr(cursor, 'messages', None) or [])
+        while cursor.nextset():
+            messages.extend(getattr(cursor, 'messages', None) or [])
+        cursor.execute("SET STATISTICS IO OFF")
+    except Exception:
+        return None
+    finally:
+        cursor.close()
+    reads = [int(match) for _, text in messages for match in _LOGICAL_READS.findall(str(text))]
+    return sum(reads) if reads else None
+
+
+def run_query(conn, sql: str, params: tuple, iterations: int) -> dict:
+    """Run a query repeatedly and return its rows and latency statistics in milliseconds."""
+    cursor = conn.cursor()
+
+    # Warm the plan cache and buffer pool once before measuring
+    cursor.execute(sql, params)
+    columns = [column[0] for column in cursor.description]
+    rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        cursor.execute(sql, params)
+        cursor.fetchall()
+        timings.append((time.perf_counter() - start) * 1000)
+
+    cursor.close()
+    timings.sort()
+    return {
+        "rows": rows,
+        "median_ms": statistics.median(timings),
+        "p95_ms": timings[max(0, int(len(timings) * 0.95) - 1)],
+    }
+
+
+def run_benchmark(iterations: int, loinc_code: str):
+    """Compare self-join and pivot forms and print a summary table."""
+    agent = create_meddata_agent_from_env()
+    conn = agent._get_connection()
+    rewriter = EAVRewriter()
+    local = agent.backend.is_local
+
+    print("=" * 110)
+    print(f"EAV pivot rewrite benchmark (LOINC {loinc_code}, {iterations} iterations, backend {agent.backend.name})")
+    print("=" * 110)
+    print(f"{'Query':<50} {'Form':<10} {'Rows':>6} {'Logical reads':>14} {'Median ms':>11} {'P95 ms':>10}")
+    print("-" * 110)
+
+    for name, sql in QUERIES.items():
+        params = ('%sodium%',) if 'LIKE' in sql else (loinc_code,)
+        rewrite = rewriter.rewrite(sql)
+        if rewrite is None:
+            print(f"{name:<50} (not rewritten)")
+            continue
+
+        forms = {"self-join": sql, "pivot": rewrite.sql}
+        measured = {}
+        for form, form_sql in forms.items():
+            executed = agent.backend.transpile(form_sql)
+            measured[form] = run_query(conn, executed, params, iterations)
+            measured[form]["reads"] = None if local else logical_reads(conn, executed, params)
+
+        for index, (form, stats) in enumerate(measured.items()):
+            reads = stats["reads"] if stats["reads"] is not None else "n/a"
+            label = name if index == 0 else ""
+            print(f"{label:<50} {form:<10} {len(stats['rows']):>6} {reads:>14} {stats['median_ms']:>11.2f} {stats['p95_ms']:>10.2f}")
+
+        before, after = measured["self-join"], measured["pivot"]
+        if not results_equivalent(before["rows"], after["rows"]):
+            print(f"  ⚠️  Results differ between the two forms")
+        else:
+            print(f"  Results identical; {rewrite.joins_removed} self-joins removed (slots {rewrite.slots})")
+            if before["reads"] and after["reads"]:
+                print(f"  Logical reads: {before['reads']} -> {after['reads']} ({before['reads'] / after['reads']:.1f}x fewer)")
+            if after["median_ms"] > 0:
+                print(f"  Speedup: {before['median_ms'] / after['median_ms']:.1f}x")
+        print()
+
+    conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20, help="Timed runs per query")
+    parser.add_argument("--loinc", default="2947-0", help="LOINC code used by the LOINC queries")
+    args = parser.parse_args()
+
+    run_benchmark(args.iterations, args.loinc)
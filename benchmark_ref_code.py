@@ -0,0 +1,107 @@
+"""
+Benchmark multi-hop traversal latency: SLOT_VALUE joins vs. typed REF_CODE joins.
+
+Each traversal is run in both forms against the MedData database:
+- "before": related concepts joined on SLOT_VALUE = CODE (implicit conversion, scan)
+- "after":  related concepts joined on REF_CODE = CODE (typed, IX_MED_REF_CODE seek)
+
+Usage:
+    python benchmark_ref_code.py [--iterations 20] [--loinc 2947-0]
+"""
+
+import argparse
+import statistics
+import time
+from dotenv import load_dotenv
+from meddata_sql_agent import create_meddata_agent_from_env
+
+load_dotenv()
+
+
+# {join} is replaced with the relationship column (SLOT_VALUE or REF_CODE)
+TRAVERSALS = {
+    "1-hop: LOINC -> problems": """
+        SELECT DISTINCT prob.CODE
+        FROM MED loinc_ref
+        INNER JOIN MED indicates ON loinc_ref.CODE = indicates.CODE AND indicates.SLOT_NUMBER = 150
+        INNER JOIN MED prob ON indicates.{join} = prob.CODE AND prob.SLOT_NUMBER = 6
+        WHERE loinc_ref.SLOT_NUMBER = 212 AND loinc_ref.SLOT_VALUE = ?
+    """,
+    "2-hop: LOINC -> problems -> other tests": """
+        SELECT DISTINCT other.CODE
+        FROM MED loinc_ref
+        INNER JOIN MED indicates ON loinc_ref.CODE = indicates.CODE AND indicates.SLOT_NUMBER = 150
+        INNER JOIN MED prob ON indicates.{join} = prob.CODE AND prob.SLOT_NUMBER = 6
+        INNER JOIN MED other ON other.{join} = prob.CODE AND other.SLOT_NUMBER = 150
+        WHERE loinc_ref.SLOT_NUMBER = 212 AND loinc_ref.SLOT_VALUE = ?
+    """,
+    "3-hop: LOINC -> parent class -> siblings -> problems": """
+        SELECT DISTINCT prob.CODE
+        FROM MED loinc_ref
+        INNER JOIN MED parent ON loinc_ref.CODE = parent.CODE AND parent.SLOT_NUMBER = 3
+        INNER JOIN MED sibling ON sibling.{join} = parent.{join} AND sibling.SLOT_NUMBER = 3
+        INNER JOIN MED indicates ON sibling.CODE = indicates.CODE AND indicates.SLOT_NUMBER = 150
+        INNER JOIN MED prob ON indicates.{join} = prob.CODE AND prob.SLOT_NUMBER = 6
+        WHERE loinc_ref.SLOT_NUMBER = 212 AND loinc_ref.SLOT_VALUE = ?
+    """,
+}
+
+
+def time_query(conn, sql: str, params: tuple, iterations: int) -> dict:
+    """Run a query repeatedly and return latency statistics in milliseconds."""
+    cursor = conn.cursor()
+
+    # Warm the plan cache and buffer pool once before measuring
+    cursor.execute(sql, params)
+    row_count = len(cursor.fetchall())
+
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        cursor.execute(sql, params)
+        cursor.fetchall()
+        timings.append((time.perf_counter() - start) * 1000)
+
+    cursor.close()
+    timings.sort()
+    return {
+        "rows": row_count,
+        "median_ms": statistics.median(timings),
+        "p95_ms": timings[max(0, int(len(timings) * 0.95) - 1)],
+    }
+
+
+def run_benchmark(iterations: int, loinc_code: str):
+    """Compare SLOT_VALUE and REF_CODE traversals and print a summary table."""
+    agent = create_meddata_agent_from_env()
+    conn = agent._get_connection()
+
+    print("=" * 100)
+    print(f"Multi-hop traversal benchmark (LOINC {loinc_code}, {iterations} iterations)")
+    print("=" * 100)
+    print(f"{'Traversal':<55} {'Join':<12} {'Rows':>6} {'Median ms':>11} {'P95 ms':>10}")
+    print("-" * 100)
+
+    for name, template in TRAVERSALS.items():
+        before = time_query(conn, template.format(join="SLOT_VALUE"), (loinc_code,), iterations)
+        after = time_query(conn, template.format(join="REF_CODE"), (loinc_code,), iterations)
+
+        print(f"{name:<55} {'SLOT_VALUE':<12} {before['rows']:>6} {before['median_ms']:>11.2f} {before['p95_ms']:>10.2f}")
+        print(f"{'':<55} {'REF_CODE':<12} {after['rows']:>6} {after['median_ms']:>11.2f} {after['p95_ms']:>10.2f}")
+
+        if before["rows"] != after["rows"]:
+            print(f"  ⚠️  Row counts differ - check that REF_CODE has been backfilled")
+        elif after["median_ms"] > 0:
+            print(f"  Speedup: {before['median_ms'] / after['median_ms']:.1f}x")
+        print()
+
+    conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20, help="Timed runs per query")
+    parser.add_argument("--loinc", default="2947-0", help="LOINC code used as the traversal start point")
+    args = parser.parse_args()
+
+    run_benchmark(args.iterations, args.loinc)
@@ -0,0 +1,205 @@
+"""
+External Code System Dictionaries
+Hash-map dictionaries between external code system values (LOINC, SNOMED, CPMC, EPIC, ...)
+and ontology CODEs, built from MED so exact-code lookups need neither an LLM call nor a query.
+"""
+
+import re
+from collections import defaultdict
+from typing import AbstractSet, Dict, Iterable, List, Optional, Set, Tuple
+
+
+# Code system name -> MED slot number holding that system's values
+CODE_SYSTEMS: Dict[str, int] = {
+    'CPMC-LAB-PROC': 9,
+    'CPMC-LAB-TEST': 20,
+    'LOINC': 212,
+    'MILLENNIUM': 264,
+    'SNOMED': 266,
+    'EPIC': 277,
+}
+
+SLOT_TO_SYSTEM: Dict[int, str] = {slot: system for system, slot in CODE_SYSTEMS.items()}
+
+# Words users write for each system, mapped to system names
+SYSTEM_ALIASES: Dict[str, Tuple[str, ...]] = {
+    'loinc': ('LOINC',),
+    'snomed': ('SNOMED',),
+    'epic': ('EPIC',),
+    'millennium': ('MILLENNIUM',),
+    'cerner': ('MILLENNIUM',),
+    'cpmc': ('CPMC-LAB-PROC', 'CPMC-LAB-TEST'),
+}
+
+
+# Value shapes distinctive enough to be taken as a code without naming the system.
+# EPIC and MILLENNIUM ids are plain integers and CPMC values are short mnemonics, so
+# "20" or "K" only count as codes when their system is named in the question.
+CODE_VALUE_PATTERNS: Dict[str, re.Pattern] = {
+    'LOINC': re.compile(r"\d{1,7}-\d"),
+    'SNOMED': re.compile(r"\d{6,18}"),
+}
+
+# Candidate code values in free text (2947-0, 89627008, GLU.B)
+CODE_TOKEN = re.compile(r"[A-Za-z0-9][A-Za-z0-9\-\.]*[A-Za-z0-9]|\d")
+
+
+def normalize_code_value(value: str) -> str:
+    """Canonical dictionary key for an external code value."""
+    return (value or '').strip().upper()
+
+
+class CodeDictionary:
+    """Bidirectional dictionaries: (system, value) -> CODEs and CODE -> system -> values."""
+
+    def __init__(self):
+        self._forward: Dict[str, Dict[str, Set[str]]] = {system: defaultdict(set) for system in CODE_SYSTEMS}
+        self._reverse: Dict[str, Dict[str, Set[str]]] = defaultdict(lambda: defaultdict(set))
+
+    def __len__(self) -> int:
+        return sum(len(values) for values in self._forward.values())
+
+    @classmethod
+    def build(cls, rows: Iterable[Tuple[str, int, str]]) -> 'CodeDictionary':
+        """
+        Build the dictionaries from MED rows.
+
+        Args:
+            rows: Iterable of (code, slot_number, slot_value) tuples
+
+        Returns:
+            Populated CodeDictionary
+        """
+        dictionary = cls()
+        for code, slot, value in rows:
+            dictionary.add(code, slot, value)
+        return dictionary
+
+    def add(self, code: str, slot: int, value: str):
+        """Register one MED row if its slot belongs to a code system and the value is set."""
+        system = SLOT_TO_SYSTEM.get(slot)
+        key = normalize_code_value(value)
+        if not system or not key:
+            return
+        self._forward[system][key].add(str(code))
+        self._reverse[str(code)][system].add(value.strip())
+
+    def lookup(self, system: str, value: str) -> Set[str]:
+        """
+        CODEs carrying a value in one code system.
+
+        Args:
+            system: Code system name (see CODE_SYSTEMS), e.g. 'LOINC'
+            value: External code value, e.g. '2947-0'
+
+        Returns:
+            Set of CODE strings (empty if unknown)
+        """
+        return set(self._forward.get(system.upper(), {}).get(normalize_code_value(value), ()))
+
+    def find(self, value: str, systems: Optional[Iterable[str]] = None) -> Dict[str, Set[str]]:
+        """
+        Look a value up across code systems.
+
+        Args:
+            value: External code value
+            systems: Restrict to these systems (default: all)
+
+        Returns:
+            Mapping of system name -> CODEs, only for systems where the value exists
+        """
+        key = normalize_code_value(value)
+        hits = {}
+        for system in systems or CODE_SYSTEMS:
+            codes = self._forward.get(system, {}).get(key)
+            if codes:
+                hits[system] = set(codes)
+        return hits
+
+    def external_codes(self, code: str) -> Dict[str, List[str]]:
+        """
+        All external code values attached to an ontology CODE.
+
+        Args:
+            code: Ontology CODE
+
+        Returns:
+            Mapping of system name -> sorted values
+        """
+        return {system: sorted(values) for system, values in self._reverse.get(str(code), {}).items() if values}
+
+    def systems_in_text(self, text: str) -> List[str]:
+        """Code systems mentioned by name in free text (e.g. 'loinc' -> LOINC)."""
+        text_lower = text.lower()
+        systems: List[str] = []
+        for alias, names in SYSTEM_ALIASES.items():
+            if alias in text_lower:
+                systems.extend(name for name in names if name not in systems)
+        return systems
+
+
+class LayeredCodeDictionary:
+    """
+    Read-only lookups over a base CodeDictionary plus an overlay holding the current rows
+    of CODEs changed since the base was built (their base entries are ignored).
+    """
+
+    def __init__(self, base: CodeDictionary, overlay: CodeDictionary, replaced: AbstractSet[str]):
+        """
+        Args:
+            base: Dictionaries over the full row set
+            overlay: Dictionaries over the replaced CODEs' current rows
+            replaced: CODEs whose base entries are stale
+        """
+        self.base = base
+        self.overlay = overlay
+        self.replaced = replaced
+
+    def __len__(self) -> int:
+        return len(self.base) + len(self.overlay)
+
+    def lookup(self, system: str, value: str) -> Set[str]:
+        """Same as CodeDictionary.lookup over the combined contents."""
+        return (self.base.lookup(system, value) - self.replaced) | self.overlay.lookup(system, value)
+
+    def find(self, value: str, systems: Optional[Iterable[str]] = None) -> Dict[str, Set[str]]:
+        """Same as CodeDictionary.find over the combined contents."""
+        systems = list(systems) if systems else None
+        hits = {system: codes - self.replaced for system, codes in self.base.find(value, systems).items()}
+        for system, codes in self.overlay.find(value, systems).items():
+            hits[system] = hits.get(system, set()) | codes
+        return {system: codes for system, codes in hits.items() if codes}
+
+    def external_codes(self, code: str) -> Dict[str, List[str]]:
+        """Same as CodeDictionary.external_codes over the combined contents."""
+        source = self.overlay if str(code) in self.replaced else self.base
+        return source.external_codes(code)
+
+    def systems_in_text(self, text: str) -> List[str]:
+        return self.base.systems_in_text(text)
+
+
+def find_code_mentions(dictionary, text: str) -> List[Tuple[str, str, Set[str]]]:
+    """
+    External code values mentioned in free text.
+
+    When a code system is named, every token is looked up in the named systems; otherwise
+    only tokens shaped like a LOINC or SNOMED code (CODE_VALUE_PATTERNS) are, so numbers
+    such as "20 examples" are not mistaken for EPIC or MILLENNIUM ids.
+
+    Args:
+        dictionary: CodeDictionary (or a layered / snapshot one)
+        text: Question text
+
+    Returns:
+        List of (system, value, codes) tuples
+    """
+    systems = dictionary.systems_in_text(text)
+    mentions = []
+    for token in CODE_TOKEN.findall(text):
+        candidates = systems or [system for system, pattern in CODE_VALUE_PATTERNS.items() if pattern.fullmatch(token)]
+        if not candidates:
+            continue
+        for system, codes in dictionary.find(token, candidates).items():
+            mentions.append((system, token, codes))
+    return mentions
@@ -0,0 +1,257 @@
+"""
+SQL Correction Memory
+Persists (failed-SQL fingerprint, error_category) -> corrected SQL pairs learned from
+successful General Agent corrections, so a recurring mistake is fixed from the store
+instead of another LLM round-trip, and past fixes are shown to the SQL generator as
+few-shot hints.
+
+Corrections are stored as parameterized templates: literals of the corrected query that
+came from the failed query are re-bound to the literals of each new failing query with
+the same fingerprint (a fix learned for LOINC 2947-0 applies to 2951-2 as well).
+
+Configuration:
+    MEDDATA_CORRECTION_DB       SQLite file for the store (default: sql_corrections.db)
+    MEDDATA_CORRECTION_MEMORY   Set to 'false' to disable
+"""
+
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from sql_parameters import INLINE_COLUMNS, inline_params, parameterize
+from sql_workload import fingerprint, sqlglot
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sql_corrections (
+    fingerprint         TEXT NOT NULL,
+    error_category      TEXT NOT NULL,
+    failed_sql          TEXT NOT NULL,
+    failed_params       TEXT NOT NULL,
+    corrected_template  TEXT NOT NULL,
+    corrected_params    TEXT NOT NULL,
+    corrected_sql       TEXT NOT NULL,
+    question            TEXT,
+    hits                INTEGER NOT NULL DEFAULT 0,
+    successes           INTEGER NOT NULL DEFAULT 0,
+    failures            INTEGER NOT NULL DEFAULT 0,
+    created_at          REAL NOT NULL,
+    last_used           REAL,
+    PRIMARY KEY (fingerprint, error_category)
+);
+"""
+
+# A stored fix that fails this many more times than it succeeds is dropped
+MAX_NET_FAILURES = 2
+
+_WORD = re.compile(r"[a-z0-9][a-z0-9\-]{2,}")
+
+
+def _correction_key(sql: str) -> str:
+    """Fingerprint that keeps SLOT_NUMBER constants (they decide what a query means)."""
+    return fingerprint(sql, inline_columns=INLINE_COLUMNS)[0]
+
+
+class CorrectionMemory:
+    """SQLite-backed store of learned SQL corrections."""
+
+    def __init__(self, path: str = 'sql_corrections.db'):
+        """
+        Open (or create) the store.
+
+        Args:
+            path: SQLite database file, or ':memory:'
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def record(self, failed_sql: str, error_category: str, corrected_sql: str, question: Optional[str] = None):
+        """
+        Store a correction that executed successfully.
+
+        Args:
+            failed_sql: Query that failed
+            error_category: Its error category
+            corrected_sql: Query that fixed it
+            question: The user's question (used to match few-shot hints)
+        """
+        failed_params = parameterize(failed_sql)[1]
+        template, corrected_values = parameterize(corrected_sql)
+        # Each corrected literal is either re-bound from the failed query or kept constant
+        bindings = []
+        for value in corrected_values:
+            if value in failed_params:
+                bindings.append({'from': failed_params.index(value)})
+            else:
+                bindings.append({'value': value})
+
+        with self._lock:
+            self._conn.execute(
+                """
+                INSERT INTO sql_corrections (fingerprint, error_category, failed_sql, failed_params,
+                    corrected_template, corrected_params, corrected_sql, question, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(fingerprint, error_category) DO UPDATE SET
+                    failed_sql = excluded.failed_sql,
+                    failed_params = excluded.failed_params,
+                    corrected_template = excluded.corrected_template,
+                    corrected_params = excluded.corrected_params,
+                    corrected_sql = excluded.corrected_sql,
+                    question = excluded.question,
+                    failures = 0
+                """,
+                (_correction_key(failed_sql), error_category or 'UNKNOWN_ERROR', failed_sql,
+                 json.dumps(failed_params), template, json.dumps(bindings), corrected_sql,
+                 question, time.time())
+            )
+            self._conn.commit()
+
+    def lookup(self, failed_sql: str, error_category: str) -> Optional[Dict[str, Any]]:
+        """
+        Find a stored fix for a failing query.
+
+        Args:
+            failed_sql: Query that just failed
+            error_category: Its error category
+
+        Returns:
+            {"fingerprint", "error_category", "sql"} with the fix bound to this query's
+            literals, or None
+        """
+        key = _correction_key(failed_sql)
+        category = error_category or 'UNKNOWN_ERROR'
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT failed_sql, corrected_template, corrected_params FROM sql_corrections "
+                "WHERE fingerprint = ? AND error_category = ?",
+                (key, category)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                "UPDATE sql_corrections SET hits = hits + 1, last_used = ? WHERE fingerprint = ? AND error_category = ?",
+                (time.time(), key, category)
+            )
+            self._conn.commit()
+
+        stored_failed_sql, template, bindings = row[0], row[1], json.loads(row[2])
+        if sqlglot is None and failed_sql.strip() != stored_failed_sql.strip():
+            # Without the parser, literals can't be re-bound safely
+            return None
+        params = parameterize(failed_sql)[1]
+        values = []
+        for binding in bindings:
+            if 'from' in binding:
+                if binding['from'] >= len(params):
+                    return None
+                values.append(params[binding['from']])
+            else:
+                values.append(binding['value'])
+        return {'fingerprint': key, 'error_category': category, 'sql': inline_params(template, values)}
+
+    def record_outcome(self, key: str, error_category: str, success: bool):
+        """Record whether a stored fix worked; fixes that keep failing are forgotten."""
+        column = 'successes' if success else 'failures'
+        with self._lock:
+            self._conn.execute(
+                f"UPDATE sql_corrections SET {column} = {column} + 1 WHERE fingerprint = ? AND error_category = ?",
+                (key, error_category)
+            )
+            self._conn.execute(
+                "DELETE FROM sql_corrections WHERE fingerprint = ? AND error_category = ? AND failures - successes >= ?",
+                (key, error_category, MAX_NET_FAILURES)
+            )
+            self._conn.commit()
+
+    def few_shot(self, question: str, limit: int = 3) -> List[Dict[str, Any]]:
+        """
+        Past fixes most relevant to a question: those from similar questions first, then
+        the most recurring ones.
+
+        Returns:
+            Up to `limit` entries with error_category, failed_sql and corrected_sql
+        """
+        words = set(_WORD.findall((question or '').lower()))
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT error_category, failed_sql, corrected_sql, question, hits, successes FROM sql_corrections "
+                "ORDER BY successes + hits DESC LIMIT 200"
+            ).fetchall()
+        scored = []
+        for category, failed_sql, corrected_sql, past_question, hits, successes in rows:
+            overlap = len(words & set(_WORD.findall((past_question or '').lower())))
+            if overlap or hits >= 2:
+                scored.append((overlap, hits + successes, {
+                    'error_category': category,
+                    'failed_sql': failed_sql,
+                    'corrected_sql': corrected_sql
+                }))
+        scored.sort(key=lambda item: (item[0], item[1]), reverse=True)
+        return [entry for _, _, entry in scored[:limit]]
+
+    def stats(self) -> Dict[str, Any]:
+        """Store-wide counts."""
+        with self._lock:
+            corrections, hits, successes, failures = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(hits), 0), COALESCE(SUM(successes), 0), COALESCE(SUM(failures), 0) "
+                "FROM sql_corrections"
+            ).fetchone()
+            by_category = dict(self._conn.execute(
+                "SELECT error_category, COUNT(*) FROM sql_corrections GROUP BY error_category"
+            ).fetchall())
+        return {
+            'path': self.path,
+            'corrections': corrections,
+            'hits': hits,
+            'successes': successes,
+            'failures': failures,
+            'by_category': by_category
+        }
+
+
+def format_few_shot(entries: List[Dict[str, Any]]) -> str:
+    """Render past fixes as a prompt section (empty string when there are none)."""
+    if not entries:
+        return ""
+    lines = ["**PAST MISTAKES AND THEIR FIXES** (avoid repeating these):"]
+    for index, entry in enumerate(entries, 1):
+        lines.append(f"{index}. {entry['error_category']}")
+        lines.append(f"   Failed: {entry['failed_sql']}")
+        lines.append(f"   Fixed:  {entry['corrected_sql']}")
+    return "\n".join(lines)
+
+
+_correction_memory: Optional[CorrectionMemory] = None
+_correction_lock = threading.Lock()
+
+
+def get_correction_memory() -> Optional[CorrectionMemory]:
+    """
+    Process-wide correction memory, created from environment variables on first use.
+
+    Returns:
+        The shared CorrectionMemory, or None when MEDDATA_CORRECTION_MEMORY=false
+    """
+    global _correction_memory
+    if os.getenv('MEDDATA_CORRECTION_MEMORY', 'true').lower() == 'false':
+        return None
+    with _correction_lock:
+        if _correction_memory is None:
+            path = os.getenv('MEDDATA_CORRECTION_DB', 'sql_corrections.db')
+            try:
+                _correction_memory = CorrectionMemory(path)
+            except sqlite3.Error as e:
+                print(f"Warning: Could not open correction memory {path} ({e}); using in-memory store")
+                _correction_memory = CorrectionMemory(':memory:')
+        return _correction_memory
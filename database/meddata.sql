@@ -30,6 +30,9 @@ BEGIN
         CODE INT NOT NULL,
         SLOT_NUMBER INT NOT NULL,
         SLOT_VALUE NVARCHAR(500),
+        -- Typed copy of SLOT_VALUE for reference slots (3, 4, 15, 149, 150) so that
+        -- relationship joins compare INT to INT and can use index seeks
+        REF_CODE INT NULL,
         CONSTRAINT FK_MED_SLOTS FOREIGN KEY (SLOT_NUMBER) REFERENCES MED_SLOTS(SLOT_NUMBER)
     );
     
@@ -45,6 +48,22 @@ BEGIN
 END
 GO
 
+-- Add REF_CODE to MED tables created before the column existed
+IF COL_LENGTH('MED', 'REF_CODE') IS NULL
+BEGIN
+    ALTER TABLE MED ADD REF_CODE INT NULL;
+    PRINT 'REF_CODE column added to MED';
+END
+GO
+
+-- Index for relationship traversal (prob.CODE = indicates.REF_CODE and reverse lookups)
+IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name = 'IX_MED_REF_CODE' AND object_id = OBJECT_ID('MED'))
+BEGIN
+    CREATE INDEX IX_MED_REF_CODE ON MED(REF_CODE, SLOT_NUMBER) INCLUDE (CODE) WHERE REF_CODE IS NOT NULL;
+    PRINT 'IX_MED_REF_CODE index created';
+END
+GO
+
 -- ============================================================================
 -- DATA LOADING - MED_SLOTS
 -- ============================================================================
@@ -232,6 +251,109 @@ INSERT INTO MED (CODE, SLOT_NUMBER, SLOT_VALUE) VALUES
 PRINT 'MED data loaded: ' + CAST(@@ROWCOUNT AS VARCHAR) + ' rows';
 GO
 
+-- Backfill REF_CODE for reference slots
+UPDATE MED
+SET REF_CODE = TRY_CAST(SLOT_VALUE AS INT)
+WHERE SLOT_NUMBER IN (3, 4, 15, 149, 150);
+
+PRINT 'REF_CODE backfilled: ' + CAST(@@ROWCOUNT AS VARCHAR) + ' rows';
+GO
+
+-- ============================================================================
+-- PRINT-NAME TRIGRAM SIDE TABLE (fuzzy name search without LIKE '%term%' scans)
+-- ============================================================================
+-- Each slot-6 name is padded as '  ' + name + ' ' and split into trigrams.
+-- Search by counting matched trigrams per CODE (see name_index.trigram_search_query); agents
+-- use it when the in-process name index is disabled. The recreate_med_*.py loaders refresh
+-- it after reloading MED (name_index.refresh_trigram_table); re-run this block after other
+-- bulk changes to slot-6 names.
+-- A full-text catalog is an alternative on editions that support it:
+--   CREATE FULLTEXT CATALOG MedNameCatalog;
+--   CREATE FULLTEXT INDEX ON MED(SLOT_VALUE) KEY INDEX <MED primary key index> ON MedNameCatalog;
+
+IF NOT EXISTS (SELECT * FROM sys.tables WHERE name = 'MED_NAME_TRIGRAMS')
+BEGIN
+    CREATE TABLE MED_NAME_TRIGRAMS (
+        TRIGRAM NCHAR(3) NOT NULL,
+        CODE INT NOT NULL,
+        CONSTRAINT PK_MED_NAME_TRIGRAMS PRIMARY KEY (TRIGRAM, CODE)
+    );
+    PRINT 'MED_NAME_TRIGRAMS table created';
+END
+GO
+
+DELETE FROM MED_NAME_TRIGRAMS;
+
+WITH names AS (
+    SELECT DISTINCT CODE, N'  ' + LOWER(SLOT_VALUE) + N' ' AS PADDED_NAME
+    FROM MED
+    WHERE SLOT_NUMBER = 6 AND SLOT_VALUE IS NOT NULL AND SLOT_VALUE <> ''
+),
+numbers AS (
+    SELECT TOP (510) ROW_NUMBER() OVER (ORDER BY (SELECT NULL)) AS N
+    FROM sys.all_objects
+)
+INSERT INTO MED_NAME_TRIGRAMS (TRIGRAM, CODE)
+SELECT DISTINCT SUBSTRING(n.PADDED_NAME, num.N, 3), n.CODE
+FROM names n
+INNER JOIN numbers num ON num.N <= DATALENGTH(n.PADDED_NAME) / 2 - 2;
+
+PRINT 'MED_NAME_TRIGRAMS loaded: ' + CAST(@@ROWCOUNT AS VARCHAR) + ' rows';
+GO
+
+-- ============================================================================
+-- CHANGE TRACKING (incremental refresh of in-process ontology caches)
+-- ============================================================================
+-- Agents poll CHANGETABLE(CHANGES MED, @version) and apply row-level deltas
+-- instead of reloading MED (see ontology_sync.py). Enabled after the bulk load
+-- so the initial data does not fill the change history.
+-- Dropping MED (recreate_med_*.py) removes its tracking: re-run this section
+-- afterwards, until then agents fall back to checksum-based reloads.
+
+IF NOT EXISTS (SELECT * FROM sys.change_tracking_databases WHERE database_id = DB_ID())
+BEGIN
+    ALTER DATABASE CURRENT SET CHANGE_TRACKING = ON (CHANGE_RETENTION = 2 DAYS, AUTO_CLEANUP = ON);
+    PRINT 'Change tracking enabled on database';
+END
+GO
+
+IF NOT EXISTS (SELECT * FROM sys.change_tracking_tables WHERE object_id = OBJECT_ID('MED'))
+BEGIN
+    ALTER TABLE MED ENABLE CHANGE_TRACKING WITH (TRACK_COLUMNS_UPDATED = OFF);
+    PRINT 'Change tracking enabled on MED';
+END
+GO
+
+IF NOT EXISTS (SELECT * FROM sys.change_tracking_tables WHERE object_id = OBJECT_ID('MED_SLOTS'))
+BEGIN
+    ALTER TABLE MED_SLOTS ENABLE CHANGE_TRACKING WITH (TRACK_COLUMNS_UPDATED = OFF);
+    PRINT 'Change tracking enabled on MED_SLOTS';
+END
+GO
+
+-- ============================================================================
+-- ROW VERSIONING (generated queries never block the MED loaders)
+-- ============================================================================
+-- Agents run generated SQL under SNAPSHOT isolation (ExecutionProfile in
+-- execution_backend.py), which reads committed row versions instead of taking
+-- shared locks, so recreate_med_*.py loads are not blocked by analytics.
+-- READ_COMMITTED_SNAPSHOT makes READ COMMITTED use row versions as well
+-- (already on by default in Azure SQL Database).
+
+IF EXISTS (SELECT * FROM sys.databases WHERE database_id = DB_ID() AND snapshot_isolation_state = 0)
+BEGIN
+    ALTER DATABASE CURRENT SET ALLOW_SNAPSHOT_ISOLATION ON;
+    PRINT 'Snapshot isolation allowed on database';
+END
+GO
+
+IF EXISTS (SELECT * FROM sys.databases WHERE database_id = DB_ID() AND is_read_committed_snapshot_on = 0)
+BEGIN
+    ALTER DATABASE CURRENT SET READ_COMMITTED_SNAPSHOT ON WITH ROLLBACK IMMEDIATE;
+    PRINT 'Read committed snapshot enabled on database';
+END
+GO
+
 -- ============================================================================
 -- VERIFICATION
 -- ============================================================================
@@ -0,0 +1,295 @@
+"""
+EAV Self-Join Rewriter
+Generated queries often fetch each attribute of a concept with its own self-join,
+
+    LEFT JOIN MED n ON n.CODE = p.CODE AND n.SLOT_NUMBER = 6
+    LEFT JOIN MED s ON s.CODE = p.CODE AND s.SLOT_NUMBER = 266
+    ... MAX(CASE WHEN n.SLOT_NUMBER = 6 THEN n.SLOT_VALUE END), MAX(s.SLOT_VALUE) ... GROUP BY p.CODE
+
+which reads MED once per attribute and multiplies the rows before GROUP BY collapses
+them. The rewriter turns such a group into one filtered pass with conditional aggregation,
+
+    LEFT JOIN MED p_attrs ON p_attrs.CODE = p.CODE AND p_attrs.SLOT_NUMBER IN (6, 266)
+    ... MAX(CASE WHEN p_attrs.SLOT_NUMBER = 6 THEN p_attrs.SLOT_VALUE END), ...
+
+or onto a pivoted view (one row per CODE, one column per slot) when one is configured.
+
+The rewrite is only applied when it cannot change the result: the attribute joins are
+LEFT JOINs on CODE plus a single SLOT_NUMBER constant, their aliases appear only inside
+MAX/MIN in the SELECT list, and every aggregate in the query ignores duplicates (the
+pivot changes row multiplicity within each group). Each rewritten query shape is also
+checked once against the original on live data before the rewrite is trusted.
+"""
+
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import sqlglot
+    from sqlglot import exp
+except ImportError:
+    sqlglot = None
+
+from sql_parameters import INLINE_COLUMNS
+from sql_workload import fingerprint
+
+
+EAV_TABLE = 'MED'
+
+# Verification states of a rewritten query shape
+PENDING, VERIFIED, REJECTED = 'pending', 'verified', 'rejected'
+
+
+@dataclass
+class RewriteResult:
+    """A rewritten query."""
+    sql: str
+    key: str
+    joins_removed: int
+    slots: List[int]
+
+
+@dataclass
+class PivotView:
+    """A view with one row per CODE and one column per slot (column = MAX of the slot's values)."""
+    name: str
+    columns: Dict[int, str]
+
+    @classmethod
+    def parse(cls, spec: Optional[str]) -> Optional['PivotView']:
+        """Parse 'VIEW_NAME:6=PRINT_NAME,266=SNOMED_CODE' (None/empty -> None)."""
+        if not spec:
+            return None
+        name, _, mapping = spec.partition(':')
+        columns = {}
+        for item in mapping.split(','):
+            slot, _, column = item.partition('=')
+            if slot.strip() and column.strip():
+                columns[int(slot)] = column.strip()
+        return cls(name.strip(), columns) if name.strip() and columns else None
+
+
+def _attribute_join(join) -> Optional[Tuple[str, str, int]]:
+    """
+    (alias, anchor alias, slot) for `LEFT JOIN MED a ON a.CODE = b.CODE AND a.SLOT_NUMBER = k`.
+    """
+    table = join.this
+    if (join.side or '').upper() != 'LEFT' or join.kind or not isinstance(table, exp.Table):
+        return None
+    if table.name.upper() != EAV_TABLE or not table.alias:
+        return None
+    alias = table.alias
+    condition = join.args.get('on')
+    if not isinstance(condition, exp.And):
+        return None
+    parts = [condition.left, condition.right]
+    if not all(isinstance(part, exp.EQ) for part in parts):
+        return None
+
+    anchor, slot = None, None
+    for part in parts:
+        left, right = part.left, part.right
+        if isinstance(left, exp.Column) and isinstance(right, exp.Column):
+            if left.name.upper() == 'CODE' and right.name.upper() == 'CODE':
+                if left.table == alias and right.table and right.table != alias:
+                    anchor = right.table
+                elif right.table == alias and left.table and left.table != alias:
+                    anchor = left.table
+        else:
+            column, literal = (left, right) if isinstance(left, exp.Column) else (right, left)
+            if (isinstance(column, exp.Column) and column.table == alias and column.name.upper() == 'SLOT_NUMBER'
+                    and isinstance(literal, exp.Literal) and not literal.is_string):
+                slot = int(literal.this)
+    if anchor is None or slot is None:
+        return None
+    return alias, anchor, slot
+
+
+def _attribute_value(aggregate, alias: str, slot: int) -> bool:
+    """True if a MAX/MIN reads only the slot's value: MAX(a.SLOT_VALUE) or MAX(CASE WHEN a.SLOT_NUMBER = k THEN a.SLOT_VALUE END)."""
+    argument = aggregate.this
+    if isinstance(argument, exp.Column):
+        return argument.table == alias and argument.name.upper() == 'SLOT_VALUE'
+    if not isinstance(argument, exp.Case) or argument.args.get('default') is not None:
+        return False
+    branches = argument.args.get('ifs') or []
+    if len(branches) != 1:
+        return False
+    condition, value = branches[0].this, branches[0].args.get('true')
+    if not (isinstance(value, exp.Column) and value.table == alias and value.name.upper() == 'SLOT_VALUE'):
+        return False
+    if not isinstance(condition, exp.EQ):
+        return False
+    column, literal = (condition.left, condition.right) if isinstance(condition.left, exp.Column) else (condition.right, condition.left)
+    return (isinstance(column, exp.Column) and column.table == alias and column.name.upper() == 'SLOT_NUMBER'
+            and isinstance(literal, exp.Literal) and not literal.is_string and int(literal.this) == slot)
+
+
+def _pivot_case(alias: str, slot: int):
+    return exp.Case(ifs=[exp.If(
+        this=exp.EQ(this=exp.column('SLOT_NUMBER', table=alias), expression=exp.Literal.number(slot)),
+        true=exp.column('SLOT_VALUE', table=alias)
+    )])
+
+
+def rewrite_select(select, pivot_view: Optional[PivotView] = None) -> Tuple[int, List[int]]:
+    """
+    Rewrite attribute self-joins of one SELECT in place.
+
+    Returns:
+        (number of joins removed, slots pivoted)
+    """
+    joins = select.args.get('joins') or []
+    if not joins or not select.args.get('group'):
+        return 0, []
+
+    # Every aggregate must be duplicate-insensitive
+    for aggregate in select.find_all(exp.AggFunc):
+        if aggregate.find_ancestor(exp.Select) is not select:
+            continue
+        if not isinstance(aggregate, (exp.Max, exp.Min)) and not (isinstance(aggregate, exp.Count) and isinstance(aggregate.this, exp.Distinct)):
+            return 0, []
+
+    candidates: Dict[str, List[Tuple[Any, str, int]]] = {}
+    for join in joins:
+        attribute = _attribute_join(join)
+        if attribute:
+            alias, anchor, slot = attribute
+            candidates.setdefault(anchor, []).append((join, alias, slot))
+
+    removed, slots_pivoted = 0, []
+    for anchor, group in candidates.items():
+        usable = []
+        for join, alias, slot in group:
+            # The alias may only appear inside MAX/MIN in the SELECT list (and its own ON clause)
+            uses = [column for column in select.find_all(exp.Column) if column.table == alias and column.find_ancestor(exp.Join) is not join]
+            aggregates = [column.find_ancestor(exp.Max, exp.Min) for column in uses]
+            if any(aggregate is None or aggregate.find_ancestor(exp.Select) is not select for aggregate in aggregates):
+                continue
+            if any(not _attribute_value(aggregate, alias, slot) for aggregate in aggregates):
+                continue
+            if any(column.find_ancestor(exp.Where, exp.Group, exp.Having, exp.Order) for column in uses):
+                continue
+            usable.append((join, alias, slot, aggregates))
+        if len(usable) < 2:
+            continue
+
+        slots = sorted({slot for _, _, slot, _ in usable})
+        use_view = pivot_view is not None and all(slot in pivot_view.columns for slot in slots)
+        pivot_alias = f"{anchor}_pivot" if use_view else f"{anchor}_attrs"
+        taken = {table.alias_or_name.lower() for table in select.find_all(exp.Table)}
+        while pivot_alias.lower() in taken:
+            pivot_alias += '_'
+
+        for _, alias, slot, aggregates in usable:
+            for aggregate in aggregates:
+                if use_view:
+                    aggregate.set('this', exp.column(pivot_view.columns[slot], table=pivot_alias))
+                else:
+                    aggregate.set('this', _pivot_case(pivot_alias, slot))
+
+        if use_view:
+            replacement = exp.Join(
+                this=exp.Table(this=exp.to_identifier(pivot_view.name), alias=exp.TableAlias(this=exp.to_identifier(pivot_alias))),
+                side='LEFT',
+                on=exp.EQ(this=exp.column('CODE', table=pivot_alias), expression=exp.column('CODE', table=anchor))
+            )
+        else:
+            replacement = exp.Join(
+                this=exp.Table(this=exp.to_identifier(EAV_TABLE), alias=exp.TableAlias(this=exp.to_identifier(pivot_alias))),
+                side='LEFT',
+                on=exp.and_(
+                    exp.EQ(this=exp.column('CODE', table=pivot_alias), expression=exp.column('CODE', table=anchor)),
+                    exp.In(this=exp.column('SLOT_NUMBER', table=pivot_alias), expressions=[exp.Literal.number(slot) for slot in slots])
+                )
+            )
+
+        # The combined join takes the place of the first attribute join
+        first = usable[0][0]
+        first.replace(replacement)
+        for join, _, _, _ in usable[1:]:
+            join.pop()
+        removed += len(usable) - 1
+        slots_pivoted.extend(slots)
+    return removed, slots_pivoted
+
+
+class EAVRewriter:
+    """Rewrites per-attribute self-joins and tracks which query shapes were verified."""
+
+    def __init__(self, pivot_view: Optional[PivotView] = None):
+        """
+        Args:
+            pivot_view: Optional pivoted view to join instead of a filtered MED pass
+        """
+        self.pivot_view = pivot_view
+        self._lock = threading.Lock()
+        self._status: Dict[str, str] = {}
+        self.rewrites = 0
+        self.joins_removed = 0
+        self.mismatches = 0
+
+    def rewrite(self, sql: str) -> Optional[RewriteResult]:
+        """
+        Rewrite a query if it contains the self-join anti-pattern.
+
+        Returns:
+            RewriteResult, or None when nothing was rewritten (or the shape was rejected)
+        """
+        if sqlglot is None or not sql or 'SLOT_NUMBER' not in sql.upper():
+            return None
+        key = fingerprint(sql, inline_columns=INLINE_COLUMNS)[0]
+        if self.status(key) == REJECTED:
+            return None
+        try:
+            tree = sqlglot.parse_one(sql, read='tsql')
+        except sqlglot.errors.ParseError:
+            return None
+        if tree is None:
+            return None
+
+        removed, slots = 0, []
+        for select in list(tree.find_all(exp.Select)):
+            select_removed, select_slots = rewrite_select(select, self.pivot_view)
+            removed += select_removed
+            slots.extend(select_slots)
+        if not removed:
+            return None
+        with self._lock:
+            self.rewrites += 1
+            self.joins_removed += removed
+        return RewriteResult(sql=tree.sql(dialect='tsql'), key=key, joins_removed=removed, slots=sorted(set(slots)))
+
+    def status(self, key: str) -> str:
+        """Verification state of a rewritten query shape."""
+        return self._status.get(key, PENDING)
+
+    def record_verification(self, key: str, equivalent: bool):
+        """Trust (or permanently skip) the rewrite of a query shape."""
+        with self._lock:
+            self._status[key] = VERIFIED if equivalent else REJECTED
+            if not equivalent:
+                self.mismatches += 1
+                print(f"Warning: EAV rewrite of query shape {key} changed the results; using the original form")
+
+    def stats(self) -> Dict[str, Any]:
+        """Rewrite counters."""
+        with self._lock:
+            states = list(self._status.values())
+            return {
+                'rewrites': self.rewrites,
+                'joins_removed': self.joins_removed,
+                'verified_shapes': states.count(VERIFIED),
+                'rejected_shapes': states.count(REJECTED),
+                'mismatches': self.mismatches,
+                'pivot_view': self.pivot_view.name if self.pivot_view else None
+            }
+
+
+def results_equivalent(first: List[Dict[str, Any]], second: List[Dict[str, Any]]) -> bool:
+    """Compare two result sets as multisets of rows (column order, not names or row order)."""
+    if len(first) != len(second):
+        return False
+    normalize = lambda rows: sorted(tuple('' if value is None else str(value) for value in row.values()) for row in rows)
+    return normalize(first) == normalize(second)
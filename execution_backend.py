@@ -0,0 +1,658 @@
+"""
+Pluggable Query Execution Backends
+SQL Server (the default, via pyodbc) or an embedded SQLite / DuckDB copy of the same
+tables. Generated T-SQL is transpiled to the local dialect before execution, so dev runs,
+CI benchmarks and edge deployments can work without a live Azure SQL database.
+
+Connections for generated SQL are checked out with an ExecutionProfile (read-only intent,
+snapshot reads, lock timeout, row ceiling, MAXDOP cap), so ad-hoc analytics never take
+shared locks that block the MED loaders or run unbounded.
+
+sqlglot (optional) is used for transpilation when installed; otherwise a regex fallback
+covers the constructs the agents generate (TOP, [bracket] identifiers, N'' literals,
+ISNULL/LEN/GETDATE, NOLOCK hints and OPTION clauses).
+"""
+
+import os
+import re
+import sqlite3
+import uuid
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from name_index import TRIGRAM_TABLE, refresh_trigram_table
+from query_stats import parse_statistics_messages, plan_hash
+
+try:
+    import sqlglot
+except ImportError:
+    sqlglot = None
+
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+
+LOCAL_ENGINES = ('sqlite', 'duckdb')
+
+# ODBC SQL types used to bind parameters with fixed declared types (pyodbc.SQL_WVARCHAR etc.)
+SQL_WVARCHAR = -9
+SQL_INTEGER = 4
+SQL_BIGINT = -5
+SQL_DOUBLE = 8
+
+SQL_SERVER_COLUMNS_QUERY = """
+SELECT
+    c.TABLE_NAME,
+    c.COLUMN_NAME,
+    c.DATA_TYPE,
+    c.CHARACTER_MAXIMUM_LENGTH,
+    c.IS_NULLABLE,
+    CASE WHEN pk.COLUMN_NAME IS NOT NULL THEN 'YES' ELSE 'NO' END AS IS_PRIMARY_KEY
+FROM INFORMATION_SCHEMA.TABLES t
+INNER JOIN INFORMATION_SCHEMA.COLUMNS c ON t.TABLE_NAME = c.TABLE_NAME
+LEFT JOIN (
+    SELECT ku.TABLE_NAME, ku.COLUMN_NAME
+    FROM INFORMATION_SCHEMA.TABLE_CONSTRAINTS tc
+    JOIN INFORMATION_SCHEMA.KEY_COLUMN_USAGE ku
+        ON tc.CONSTRAINT_NAME = ku.CONSTRAINT_NAME
+    WHERE tc.CONSTRAINT_TYPE = 'PRIMARY KEY'
+) pk ON c.TABLE_NAME = pk.TABLE_NAME AND c.COLUMN_NAME = pk.COLUMN_NAME
+WHERE t.TABLE_TYPE = 'BASE TABLE'
+ORDER BY t.TABLE_NAME, c.ORDINAL_POSITION
+"""
+
+# Statements extracted from a T-SQL setup script for hydration (control flow, PRINT,
+# DELETE and ALTER statements are skipped)
+_SCRIPT_STATEMENT = re.compile(
+    r"(CREATE\s+TABLE\s+\w+\s*\(.*?\n\s*\)\s*;"
+    r"|CREATE\s+(?:UNIQUE\s+)?(?:NONCLUSTERED\s+)?INDEX\s+\w+\s+ON\s+\w+\s*\([^;]*;"
+    r"|INSERT\s+INTO\s+\w+\s*\([^)]*\)\s*VALUES.*?\)\s*;"
+    r"|UPDATE\s+\w+\s+SET\s[^;]*;)",
+    re.IGNORECASE | re.DOTALL
+)
+
+
+ISOLATION_LEVELS = ('SNAPSHOT', 'READ COMMITTED', 'READ UNCOMMITTED')
+
+SNAPSHOT_STATE_QUERY = "SELECT snapshot_isolation_state FROM sys.databases WHERE database_id = DB_ID()"
+
+
+@dataclass
+class ExecutionProfile:
+    """
+    Session guardrails applied to every connection that runs generated SQL.
+
+    read_only_intent: Connect with ApplicationIntent=ReadOnly (routes to a readable
+                      secondary when read scale-out is available)
+    isolation: SNAPSHOT (needs ALLOW_SNAPSHOT_ISOLATION, see database/meddata.sql) or
+               READ COMMITTED (row versioning when READ_COMMITTED_SNAPSHOT is on, the
+               Azure SQL default); None keeps the connection default
+    lock_timeout_ms: SET LOCK_TIMEOUT; a blocked query fails instead of waiting
+    row_limit: Maximum rows returned (SET ROWCOUNT on the server, enforced again on fetch)
+    max_dop: OPTION (MAXDOP n) added to every statement
+    query_timeout_s: Client-side query timeout
+    """
+    read_only_intent: bool = True
+    isolation: Optional[str] = 'SNAPSHOT'
+    lock_timeout_ms: Optional[int] = 5000
+    row_limit: Optional[int] = 10000
+    max_dop: Optional[int] = 2
+    query_timeout_s: Optional[int] = 60
+
+    def __post_init__(self):
+        if self.isolation is not None:
+            self.isolation = self.isolation.upper()
+            if self.isolation not in ISOLATION_LEVELS:
+                raise ValueError(f"Unknown isolation level '{self.isolation}' (expected one of {', '.join(ISOLATION_LEVELS)})")
+        # Whether the database allows SNAPSHOT (checked on the first checkout)
+        self._snapshot_allowed: Optional[bool] = None
+
+    @classmethod
+    def from_env(cls, prefix: str) -> 'ExecutionProfile':
+        """
+        Build a profile from <PREFIX>_READ_ONLY_INTENT, <PREFIX>_ISOLATION,
+        <PREFIX>_LOCK_TIMEOUT_MS, <PREFIX>_ROW_LIMIT, <PREFIX>_MAXDOP and
+        <PREFIX>_QUERY_TIMEOUT (0 or 'none' disables a setting).
+        """
+        def number(name: str, default: int) -> Optional[int]:
+            value = os.getenv(f'{prefix}_{name}', str(default)).strip().lower()
+            return None if value in ('', '0', 'none') else int(value)
+
+        isolation = os.getenv(f'{prefix}_ISOLATION', 'SNAPSHOT').strip()
+        return cls(
+            read_only_intent=os.getenv(f'{prefix}_READ_ONLY_INTENT', 'true').lower() == 'true',
+            isolation=None if isolation.lower() in ('', 'none', 'default') else isolation,
+            lock_timeout_ms=number('LOCK_TIMEOUT_MS', 5000),
+            row_limit=number('ROW_LIMIT', 10000),
+            max_dop=number('MAXDOP', 2),
+            query_timeout_s=number('QUERY_TIMEOUT', 60)
+        )
+
+    def session_sql(self, conn) -> str:
+        """SET statements for a freshly opened SQL Server connection."""
+        statements = []
+        isolation = self.isolation
+        if isolation == 'SNAPSHOT':
+            if self._snapshot_allowed is None:
+                cursor = conn.cursor()
+                try:
+                    cursor.execute(SNAPSHOT_STATE_QUERY)
+                    row = cursor.fetchone()
+                    self._snapshot_allowed = bool(row and row[0] == 1)
+                except Exception:
+                    self._snapshot_allowed = False
+                cursor.close()
+                if not self._snapshot_allowed:
+                    print("Warning: ALLOW_SNAPSHOT_ISOLATION is off; generated queries use READ COMMITTED (row versioned when READ_COMMITTED_SNAPSHOT is on)")
+            if not self._snapshot_allowed:
+                isolation = 'READ COMMITTED'
+        if isolation:
+            statements.append(f"SET TRANSACTION ISOLATION LEVEL {isolation};")
+        if self.lock_timeout_ms is not None:
+            statements.append(f"SET LOCK_TIMEOUT {int(self.lock_timeout_ms)};")
+        if self.row_limit is not None:
+            # One extra row tells fetch() that the result was cut off
+            statements.append(f"SET ROWCOUNT {int(self.row_limit) + 1};")
+        return " ".join(statements)
+
+    def apply_hints(self, sql: str) -> str:
+        """Add OPTION (MAXDOP n) to a T-SQL statement (merged into an existing OPTION clause)."""
+        if not self.max_dop or re.search(r"\bMAXDOP\b", sql, re.IGNORECASE):
+            return sql
+        statement = sql.rstrip().rstrip(';').rstrip()
+        option = re.search(r"\bOPTION\s*\(", statement, re.IGNORECASE)
+        if option and statement.endswith(')'):
+            return f"{statement[:option.end()]}MAXDOP {int(self.max_dop)}, {statement[option.end():]}"
+        return f"{statement} OPTION (MAXDOP {int(self.max_dop)})"
+
+    def fetch(self, cursor) -> Tuple[List[Any], bool]:
+        """
+        Fetch a result set within the row ceiling.
+
+        Returns:
+            (rows, truncated)
+        """
+        return fetch_limited(cursor, self.row_limit)
+
+    def describe(self) -> Dict[str, Any]:
+        """Settings for diagnostics."""
+        return {
+            'read_only_intent': self.read_only_intent,
+            'isolation': self.isolation,
+            'snapshot_allowed': self._snapshot_allowed,
+            'lock_timeout_ms': self.lock_timeout_ms,
+            'row_limit': self.row_limit,
+            'max_dop': self.max_dop,
+            'query_timeout_s': self.query_timeout_s
+        }
+
+
+def fetch_limited(cursor, row_limit: Optional[int]) -> Tuple[List[Any], bool]:
+    """
+    Fetch at most row_limit rows (all rows when None).
+
+    Returns:
+        (rows, truncated)
+    """
+    if row_limit is None:
+        return cursor.fetchall(), False
+    rows = cursor.fetchmany(row_limit + 1)
+    if len(rows) > row_limit:
+        return rows[:row_limit], True
+    return rows, False
+
+
+def _regex_transpile(sql: str, dialect: str) -> str:
+    """Best-effort T-SQL -> SQLite/DuckDB rewrite without a parser."""
+    sql = re.sub(r"\[([^\]]+)\]", r'"\1"', sql)
+    sql = re.sub(r"(?<![\w'])N'", "'", sql)
+    sql = re.sub(r"\bWITH\s*\(\s*NOLOCK\s*\)", "", sql, flags=re.IGNORECASE)
+    sql = re.sub(r"\bOPTION\s*\([^)]*\)\s*;?\s*$", "", sql.strip(), flags=re.IGNORECASE)
+    sql = re.sub(r"\bISNULL\s*\(", "COALESCE(", sql, flags=re.IGNORECASE)
+    sql = re.sub(r"\bLEN\s*\(", "LENGTH(", sql, flags=re.IGNORECASE)
+    sql = re.sub(r"\bGETDATE\s*\(\s*\)", "CURRENT_TIMESTAMP", sql, flags=re.IGNORECASE)
+    if dialect == 'sqlite':
+        sql = re.sub(r"\bTRY_CAST\s*\(", "CAST(", sql, flags=re.IGNORECASE)
+
+    # SELECT [DISTINCT] TOP n ... -> SELECT [DISTINCT] ... LIMIT n (outermost query only)
+    top = re.match(r"(\s*SELECT\s+(?:DISTINCT\s+)?)TOP\s*\(?\s*(\d+)\s*\)?\s+", sql, flags=re.IGNORECASE)
+    if top:
+        sql = top.group(1) + sql[top.end():].rstrip().rstrip(';') + f" LIMIT {top.group(2)}"
+    return sql
+
+
+def transpile_tsql(sql: str, dialect: str) -> str:
+    """
+    Transpile a T-SQL statement to a local dialect.
+
+    Args:
+        sql: T-SQL statement
+        dialect: 'sqlite' or 'duckdb' ('tsql' returns the statement unchanged)
+
+    Returns:
+        Statement in the target dialect
+    """
+    if dialect == 'tsql':
+        return sql
+    if sqlglot is not None:
+        try:
+            statements = sqlglot.transpile(sql, read='tsql', write=dialect)
+            # sqlglot keeps N'' literals, which neither engine accepts
+            return re.sub(r"(?<![\w'])N'", "'", ";\n".join(statements))
+        except sqlglot.errors.SqlglotError:
+            pass
+    return _regex_transpile(sql, dialect)
+
+
+class SqlServerBackend:
+    """Executes against SQL Server through the agent's own connection factory."""
+
+    name = 'sqlserver'
+    dialect = 'tsql'
+    is_local = False
+
+    def __init__(self, connect: Callable[..., Any], profile: Optional[ExecutionProfile] = None):
+        """
+        Args:
+            connect: Returns a new pyodbc connection (authentication is the agent's concern);
+                     called with read_only=True for read-only intent checkouts
+            profile: Session guardrails for generated SQL (None = connection defaults)
+        """
+        self._connect = connect
+        self.profile = profile
+
+    def connect(self):
+        """Open a new connection (internal queries: schema, ontology loads, sync)."""
+        return self._connect()
+
+    def checkout(self):
+        """Open a connection for generated SQL with the execution profile applied."""
+        profile = self.profile
+        if profile is None:
+            return self._connect()
+        conn = self._connect(read_only=True) if profile.read_only_intent else self._connect()
+        if profile.query_timeout_s:
+            conn.timeout = int(profile.query_timeout_s)
+        session_sql = profile.session_sql(conn)
+        if session_sql:
+            cursor = conn.cursor()
+            cursor.execute(session_sql)
+            cursor.close()
+        return conn
+
+    def fetch(self, cursor, row_limit: Optional[int] = None) -> Tuple[List[Any], bool]:
+        """
+        Fetch rows within the profile's row ceiling; returns (rows, truncated).
+
+        row_limit replaces the ceiling for this result set (see set_row_limit).
+        """
+        if row_limit is not None:
+            return fetch_limited(cursor, row_limit)
+        if self.profile is None:
+            return cursor.fetchall(), False
+        return self.profile.fetch(cursor)
+
+    def transpile(self, sql: str) -> str:
+        """Generated SQL is already T-SQL."""
+        return sql
+
+    def execute(self, cursor, sql: str, params: Optional[List[Any]] = None):
+        """
+        Execute a statement, binding '?' parameters.
+
+        Strings are declared as NVARCHAR(4000) and integers as INT/BIGINT regardless of the
+        value, so every execution of a template reuses the same cached plan (pyodbc otherwise
+        sizes each string parameter by its length).
+        """
+        if self.profile is not None:
+            sql = self.profile.apply_hints(sql)
+        if not params:
+            cursor.execute(sql)
+            return
+        try:
+            cursor.setinputsizes([self._input_size(value) for value in params])
+        except (AttributeError, TypeError):
+            pass
+        cursor.execute(sql, params)
+
+    def enable_statistics(self, cursor, plan: bool = True):
+        """Turn on STATISTICS IO/TIME (and the actual plan) for the cursor's session."""
+        cursor.execute("SET STATISTICS IO ON; SET STATISTICS TIME ON;" + (" SET STATISTICS XML ON;" if plan else ""))
+
+    def collect_statistics(self, cursor, sql: str, params: Optional[List[Any]] = None, plan: bool = True) -> Dict[str, Any]:
+        """
+        Read the statistics of the statement just fetched from the cursor.
+
+        STATISTICS IO/TIME arrive as informational messages and the actual plan as an extra
+        result set after the statement's rows, so the remaining result sets are drained.
+
+        Returns:
+            parse_statistics_messages() totals plus "plan" (showplan XML) and "plan_hash"
+        """
+        messages = [message[1] for message in (getattr(cursor, 'messages', None) or [])]
+        actual_plan = None
+        while cursor.nextset():
+            messages.extend(message[1] for message in (getattr(cursor, 'messages', None) or []))
+            if plan and cursor.description and 'showplan' in str(cursor.description[0][0]).lower():
+                row = cursor.fetchone()
+                actual_plan = row[0] if row else None
+        statistics = parse_statistics_messages(messages)
+        statistics['plan'] = actual_plan
+        statistics['plan_hash'] = plan_hash(actual_plan)
+        return statistics
+
+    def stage_codes(self, conn, table: str, codes: List[int]):
+        """
+        Load a CODE set into the session temp table #<table> (one INT column CODE), for
+        queries that take an earlier query's result as input.
+        """
+        row_limit = self.profile.row_limit if self.profile is not None else None
+        if row_limit is not None:
+            # SET ROWCOUNT from the execution profile would cap the insert as well
+            self.set_row_limit(conn, None)
+        cursor = conn.cursor()
+        cursor.execute(f"CREATE TABLE #{table} (CODE INT NOT NULL PRIMARY KEY)")
+        if codes:
+            cursor.fast_executemany = True
+            cursor.executemany(f"INSERT INTO #{table} (CODE) VALUES (?)", [(code,) for code in codes])
+        cursor.close()
+        if row_limit is not None:
+            self.set_row_limit(conn, row_limit)
+
+    def set_row_limit(self, conn, row_limit: Optional[int]):
+        """
+        Replace the session's SET ROWCOUNT ceiling (None removes it), e.g. for a planner step
+        whose CODE set feeds other steps; fetch with the same row_limit to detect truncation.
+        """
+        cursor = conn.cursor()
+        cursor.execute(f"SET ROWCOUNT {int(row_limit) + 1 if row_limit is not None else 0}")
+        cursor.close()
+
+    @staticmethod
+    def _input_size(value: Any):
+        if isinstance(value, bool) or value is None:
+            return None
+        if isinstance(value, int):
+            return (SQL_INTEGER, 0, 0) if -2**31 <= value < 2**31 else (SQL_BIGINT, 0, 0)
+        if isinstance(value, float):
+            return (SQL_DOUBLE, 0, 0)
+        return (SQL_WVARCHAR, 4000, 0)
+
+    def describe_tables(self, conn) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        Column metadata of every base table.
+
+        Returns:
+            Mapping of table name -> [{name, type, max_length, nullable, primary_key}, ...]
+        """
+        cursor = conn.cursor()
+        cursor.execute(SQL_SERVER_COLUMNS_QUERY)
+        tables: Dict[str, List[Dict[str, Any]]] = {}
+        for table, column, data_type, max_length, nullable, primary_key in cursor.fetchall():
+            tables.setdefault(table, []).append({
+                'name': column,
+                'type': data_type,
+                'max_length': max_length,
+                'nullable': nullable == 'YES',
+                'primary_key': primary_key == 'YES'
+            })
+        cursor.close()
+        return tables
+
+
+class LocalBackend:
+    """Embedded SQLite or DuckDB copy of the agent's tables."""
+
+    is_local = True
+
+    def __init__(self, engine: str = 'sqlite', path: Optional[str] = None, profile: Optional[ExecutionProfile] = None):
+        """
+        Open (or create) the local database.
+
+        Args:
+            engine: 'sqlite' or 'duckdb'
+            path: Database file; None keeps the copy in memory for the life of the backend
+            profile: Guardrails for generated SQL (read-only and row ceiling apply locally)
+        """
+        if engine not in LOCAL_ENGINES:
+            raise ValueError(f"Unknown local engine '{engine}' (expected one of {', '.join(LOCAL_ENGINES)})")
+        if engine == 'duckdb' and duckdb is None:
+            raise ImportError("The duckdb backend requires the 'duckdb' package (pip install duckdb)")
+
+        self.name = engine
+        self.dialect = engine
+        self.path = path
+        self.profile = profile
+
+        if engine == 'sqlite':
+            # A named shared-cache memory database lives as long as one connection holds it open
+            self._uri = f"file:{path}" if path else f"file:local_{uuid.uuid4().hex}?mode=memory&cache=shared"
+            self._keeper = sqlite3.connect(self._uri, uri=True, check_same_thread=False)
+        else:
+            self._keeper = duckdb.connect(path or ':memory:')
+
+    def connect(self):
+        """Open a new connection to the shared local database."""
+        if self.name == 'sqlite':
+            return sqlite3.connect(self._uri, uri=True, check_same_thread=False)
+        return self._keeper.cursor()
+
+    def checkout(self):
+        """Open a connection for generated SQL (read-only when the profile asks for it)."""
+        conn = self.connect()
+        if self.name == 'sqlite' and self.profile is not None and self.profile.read_only_intent:
+            conn.execute("PRAGMA query_only = ON")
+        return conn
+
+    def fetch(self, cursor, row_limit: Optional[int] = None) -> Tuple[List[Any], bool]:
+        """
+        Fetch rows within the profile's row ceiling; returns (rows, truncated).
+
+        row_limit replaces the ceiling for this result set (see set_row_limit).
+        """
+        if row_limit is not None:
+            return fetch_limited(cursor, row_limit)
+        if self.profile is None:
+            return cursor.fetchall(), False
+        return self.profile.fetch(cursor)
+
+    def enable_statistics(self, cursor, plan: bool = True):
+        """Local engines report no I/O or CPU statistics; only the plan is captured."""
+
+    def collect_statistics(self, cursor, sql: str, params: Optional[List[Any]] = None, plan: bool = True) -> Dict[str, Any]:
+        """
+        The query plan of the statement just fetched (EXPLAIN QUERY PLAN / EXPLAIN).
+
+        Returns:
+            {"plan", "plan_hash"} (I/O and CPU figures are None locally)
+        """
+        statistics: Dict[str, Any] = {'logical_reads': None, 'physical_reads': None, 'cpu_ms': None,
+                                      'server_ms': None, 'compile_ms': None, 'tables': {},
+                                      'plan': None, 'plan_hash': None}
+        if not plan:
+            return statistics
+        explain = "EXPLAIN QUERY PLAN" if self.name == 'sqlite' else "EXPLAIN"
+        self.execute(cursor, f"{explain} {sql}", params)
+        text = "\n".join(str(row[-1]) for row in cursor.fetchall())
+        statistics['plan'] = text
+        statistics['plan_hash'] = plan_hash(text)
+        return statistics
+
+    def stage_codes(self, conn, table: str, codes: List[int]):
+        """
+        Load a CODE set into a connection-local temp table (T-SQL #<table> transpiles to
+        <table>), for queries that take an earlier query's result as input.
+        """
+        read_only = self.name == 'sqlite' and self.profile is not None and self.profile.read_only_intent
+        if read_only:
+            # query_only also blocks the temp schema; MED itself stays read-only
+            conn.execute("PRAGMA query_only = OFF")
+        try:
+            conn.execute(f"CREATE TEMP TABLE {table} (CODE INTEGER NOT NULL PRIMARY KEY)")
+            if codes:
+                conn.executemany(f"INSERT INTO {table} (CODE) VALUES (?)", [(code,) for code in codes])
+        finally:
+            if read_only:
+                conn.execute("PRAGMA query_only = ON")
+
+    def set_row_limit(self, conn, row_limit: Optional[int]):
+        """Local engines have no server-side ceiling; fetch(cursor, row_limit) applies it."""
+
+    def close(self):
+        """Close the database (an in-memory copy is discarded)."""
+        self._keeper.close()
+
+    def transpile(self, sql: str) -> str:
+        """Transpile generated T-SQL to the local dialect."""
+        return transpile_tsql(sql, self.dialect)
+
+    def execute(self, cursor, sql: str, params: Optional[List[Any]] = None):
+        """Execute a statement, binding '?' parameters (both engines use qmark style)."""
+        if params:
+            cursor.execute(sql, params)
+        else:
+            cursor.execute(sql)
+
+    def table_names(self, conn) -> List[str]:
+        """Names of the user tables in the local database."""
+        cursor = conn.cursor()
+        if self.name == 'sqlite':
+            cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name")
+        else:
+            cursor.execute("SELECT table_name FROM information_schema.tables WHERE table_schema = 'main' ORDER BY table_name")
+        names = [row[0] for row in cursor.fetchall()]
+        cursor.close()
+        return names
+
+    def describe_tables(self, conn) -> Dict[str, List[Dict[str, Any]]]:
+        """Column metadata of every table, in the same shape as SqlServerBackend.describe_tables."""
+        tables: Dict[str, List[Dict[str, Any]]] = {}
+        for table in self.table_names(conn):
+            cursor = conn.cursor()
+            cursor.execute(f"PRAGMA table_info('{table}')")
+            for _, column, declared_type, not_null, _, primary_key in cursor.fetchall():
+                match = re.match(r"\s*([A-Za-z ]+?)\s*(?:\((\d+)\))?\s*$", declared_type or '')
+                tables.setdefault(table, []).append({
+                    'name': column,
+                    'type': (match.group(1) if match else declared_type).lower(),
+                    'max_length': int(match.group(2)) if match and match.group(2) else None,
+                    'nullable': not not_null,
+                    'primary_key': bool(primary_key)
+                })
+            cursor.close()
+        return tables
+
+    def _local_statement(self, statement: str) -> List[str]:
+        """Transpile one setup-script statement, dropping features the local engine lacks."""
+        local = self.transpile(statement)
+        local = re.sub(r"\s+INCLUDE\s*\([^)]*\)", "", local, flags=re.IGNORECASE)
+        prefix: List[str] = []
+
+        if self.name == 'sqlite':
+            local = re.sub(r"\bINT\s+IDENTITY\s*\(\s*\d+\s*,\s*\d+\s*\)\s+PRIMARY\s+KEY", "INTEGER PRIMARY KEY AUTOINCREMENT",
+                           local, flags=re.IGNORECASE)
+        else:
+            # DuckDB has no identity columns; back them with a sequence
+            table = re.match(r"\s*CREATE\s+TABLE\s+(\w+)", local, flags=re.IGNORECASE)
+            identity = re.compile(r"(\w+)\s+INT\w*\s+(?:GENERATED\s+BY\s+DEFAULT\s+AS\s+IDENTITY\s*\([^)]*\)|IDENTITY\s*\([^)]*\))",
+                                  flags=re.IGNORECASE)
+            for column in identity.findall(local) if table else []:
+                sequence = f"seq_{table.group(1)}_{column}"
+                prefix.append(f"CREATE SEQUENCE IF NOT EXISTS {sequence}")
+                local = identity.sub(f"\\1 INTEGER DEFAULT nextval('{sequence}')", local, count=1)
+            # Filtered indexes are not supported
+            if re.match(r"\s*CREATE\s+(?:UNIQUE\s+)?INDEX", local, flags=re.IGNORECASE):
+                local = re.sub(r"\s+WHERE\s+.*$", "", local, flags=re.IGNORECASE | re.DOTALL)
+        return prefix + [local]
+
+    def hydrate_from_script(self, script_path: str) -> Dict[str, int]:
+        """
+        Create and load the local tables from a T-SQL setup script (e.g. database/meddata.sql).
+
+        CREATE TABLE, INSERT ... VALUES and UPDATE statements are transpiled and executed in
+        script order; indexes are created after the data is loaded. Statements the local engine
+        cannot run (e.g. ones relying on SQL Server catalog views) are skipped with a warning.
+
+        Args:
+            script_path: Path to the setup script
+
+        Returns:
+            Row count per loaded table
+        """
+        with open(script_path, 'r', encoding='utf-8') as f:
+            script = f.read()
+
+        statements, indexes = [], []
+        for batch in re.split(r"^\s*GO\s*$", script, flags=re.MULTILINE | re.IGNORECASE):
+            for match in _SCRIPT_STATEMENT.finditer(batch):
+                statement = match.group(1).rstrip().rstrip(';')
+                if re.match(r"CREATE\s+(?:UNIQUE\s+)?(?:NONCLUSTERED\s+)?INDEX", statement, flags=re.IGNORECASE):
+                    indexes.append(statement)
+                else:
+                    statements.append(statement)
+
+        conn = self.connect()
+        cursor = conn.cursor()
+        for statement in statements + indexes:
+            for local in self._local_statement(statement):
+                try:
+                    cursor.execute(local)
+                except Exception as e:
+                    print(f"Warning: Skipped setup statement ({statement.split(chr(10))[0][:60]}...): {e}")
+        conn.commit()
+
+        counts = {}
+        for table in self.table_names(conn):
+            cursor.execute(f'SELECT COUNT(*) FROM "{table}"')
+            counts[table] = cursor.fetchone()[0]
+        cursor.close()
+        conn.close()
+        return counts
+
+
+def create_backend_from_env(prefix: str, default_script: str,
+                            profile: Optional[ExecutionProfile] = None) -> Optional[LocalBackend]:
+    """
+    Create the local execution backend selected by environment variables.
+
+    Variables (with e.g. prefix 'MEDDATA'):
+        <PREFIX>_BACKEND        sqlserver (default), sqlite or duckdb
+        <PREFIX>_LOCAL_PATH     local database file (default: in memory)
+        <PREFIX>_LOCAL_SCRIPT   T-SQL setup script used to hydrate an empty local copy
+
+    Args:
+        prefix: Environment variable prefix
+        default_script: Setup script used when <PREFIX>_LOCAL_SCRIPT is not set
+        profile: Execution profile for generated SQL on the local copy
+
+    Returns:
+        LocalBackend, or None for SQL Server (agents then build a SqlServerBackend themselves)
+    """
+    engine = os.getenv(f'{prefix}_BACKEND', 'sqlserver').lower()
+    if engine not in LOCAL_ENGINES:
+        return None
+
+    backend = LocalBackend(engine, path=os.getenv(f'{prefix}_LOCAL_PATH') or None, profile=profile)
+    conn = backend.connect()
+    try:
+        has_tables = bool(backend.table_names(conn))
+    finally:
+        conn.close()
+
+    if not has_tables:
+        script = os.getenv(f'{prefix}_LOCAL_SCRIPT', default_script)
+        if os.path.exists(script):
+            counts = backend.hydrate_from_script(script)
+            if TRIGRAM_TABLE in counts:
+                # The script fills the side table with T-SQL the local engine cannot run
+                conn = backend.connect()
+                try:
+                    counts[TRIGRAM_TABLE] = refresh_trigram_table(conn)
+                finally:
+                    conn.close()
+            print(f"✓ Local {engine} copy hydrated from {script}: {counts}")
+        else:
+            print(f"Warning: Local {engine} backend is empty and setup script {script} was not found")
+    return backend
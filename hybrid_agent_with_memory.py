@@ -9,6 +9,11 @@ from typing import Dict, Any, List, Optional
 from datetime import datetime
 import json
 from meddata_sql_agent import MedDataSQLAgent, create_meddata_agent_from_env
+from sql_repair import repair_engine
+from correction_memory import get_correction_memory
+from query_stats import summarize_statistics
+from session_store import approximate_size
+from metrics import QUERY_ERRORS, RETRIES, record_cache
 from agents.general_agent import GeneralAgent
 from agent_framework import ChatMessage, Role
 
@@ -73,7 +78,7 @@ class InteractionMemory:
                     'timestamp': interaction['timestamp'].isoformat(),
                     'question': interaction['question'],
                     'sql_query': interaction['sql_query'],
-                    'row_count': len(interaction.get('sql_results', [])),
+                    'row_count': interaction.get('row_count', len(interaction.get('sql_results') or [])),
                     'final_response': interaction['final_response']
                 }
                 for interaction in self.interactions
@@ -81,6 +86,159 @@ class InteractionMemory:
         }
 
 
+class Conversation:
+    """
+    Per-session state of a hybrid agent: interaction memory, the SQL and general agents'
+    conversation histories and the session's settings. Everything else (clients, schema,
+    caches, backend) is shared, so a session costs only what it has said.
+    
+    to_state()/load_state() move a conversation through a state backend (state_backend.py);
+    result rows are not part of the stored state, only their count.
+    """
+    
+    def __init__(
+        self,
+        memory: Optional[InteractionMemory] = None,
+        sql_history: Optional[List[Dict[str, str]]] = None,
+        general_history: Optional[List[ChatMessage]] = None
+    ):
+        self.memory = memory or InteractionMemory()
+        self.sql_history: List[Dict[str, str]] = sql_history if sql_history is not None else []
+        self.general_history: List[ChatMessage] = general_history if general_history is not None else []
+        self.settings: Dict[str, Any] = {}
+        self.created_at = datetime.now()
+        # Sizes of already measured (append-only) list prefixes: name -> (items, bytes)
+        self._measured: Dict[str, tuple] = {}
+        # Stored version and what it contained, to re-apply local changes after a conflict
+        self.state_version = 0
+        self._saved_lengths = (0, 0, 0)
+        self._cleared = False
+        self._changed_settings: set = set()
+    
+    def clear(self):
+        """Clear memory and both agents' histories."""
+        self.memory.clear()
+        self.sql_history.clear()
+        self.general_history.clear()
+        self._cleared = True
+    
+    def update_settings(self, settings: Dict[str, Any]):
+        """Merge settings into the session's settings."""
+        self.settings.update(settings)
+        self._changed_settings.update(settings)
+    
+    def _lengths(self) -> tuple:
+        return len(self.memory.interactions), len(self.sql_history), len(self.general_history)
+    
+    def to_state(self) -> Dict[str, Any]:
+        """Compact, JSON-serializable state of the conversation."""
+        return {
+            'created_at': self.created_at.isoformat(),
+            'interactions': [
+                [
+                    interaction['timestamp'].isoformat(),
+                    interaction['question'],
+                    interaction['sql_query'],
+                    interaction.get('row_count', len(interaction.get('sql_results') or [])),
+                    interaction['sql_response'],
+                    interaction['final_response']
+                ]
+                for interaction in self.memory.interactions
+            ],
+            'sql_history': [[message['role'], message['content']] for message in self.sql_history],
+            # The general agent has no tools, so role and text are the whole message
+            'general_history': [
+                [getattr(message.role, 'value', str(message.role)), message.text]
+                for message in self.general_history
+            ],
+            'settings': self.settings
+        }
+    
+    def load_state(self, state: Optional[Dict[str, Any]], version: int):
+        """
+        Replace the conversation's contents with a stored state (None: empty).
+        
+        Lists are replaced in place, since agents bound to this conversation share them.
+        """
+        state = state or {}
+        self.memory.interactions[:] = [
+            {
+                'timestamp': datetime.fromisoformat(timestamp),
+                'question': question,
+                'sql_query': sql_query,
+                'sql_results': [],
+                'row_count': row_count,
+                'sql_response': sql_response,
+                'final_response': final_response
+            }
+            for timestamp, question, sql_query, row_count, sql_response, final_response
+            in state.get('interactions', [])
+        ]
+        self.sql_history[:] = [{'role': role, 'content': content} for role, content in state.get('sql_history', [])]
+        self.general_history[:] = [ChatMessage(role=role, text=text) for role, text in state.get('general_history', [])]
+        self.settings = dict(state.get('settings', {}))
+        if state.get('created_at'):
+            self.created_at = datetime.fromisoformat(state['created_at'])
+        self._measured = {}
+        self.mark_saved(version)
+    
+    def rebase(self, state: Optional[Dict[str, Any]], version: int):
+        """
+        Re-apply this conversation's unsaved changes on top of a newer stored state.
+        
+        Appended interactions and messages follow the stored ones; a clear since the last
+        save wins over the stored history; changed settings override stored ones.
+        """
+        if self._cleared:
+            settings = dict((state or {}).get('settings', {}))
+            settings.update({key: self.settings[key] for key in self._changed_settings if key in self.settings})
+            self.settings = settings
+            self.state_version = version
+            return
+        saved_memory, saved_sql, saved_general = self._saved_lengths
+        added = (
+            self.memory.interactions[saved_memory:],
+            self.sql_history[saved_sql:],
+            self.general_history[saved_general:]
+        )
+        changed = {key: self.settings[key] for key in self._changed_settings if key in self.settings}
+        self.load_state(state, version)
+        self.memory.interactions.extend(added[0])
+        self.sql_history.extend(added[1])
+        self.general_history.extend(added[2])
+        self.update_settings(changed)
+        # Still unsaved: the next write must carry them
+        self._saved_lengths = (
+            len(self.memory.interactions) - len(added[0]),
+            len(self.sql_history) - len(added[1]),
+            len(self.general_history) - len(added[2])
+        )
+    
+    def mark_saved(self, version: int):
+        """Record that the current contents are stored at version."""
+        self.state_version = version
+        self._saved_lengths = self._lengths()
+        self._cleared = False
+        self._changed_settings = set()
+    
+    def approximate_size(self) -> int:
+        """
+        Approximate memory held by the conversation (stored result rows dominate).
+        
+        The lists only grow between clears, so only items added since the last call are measured.
+        """
+        total = 0
+        for name, items in (('memory', self.memory.interactions), ('sql', self.sql_history),
+                            ('general', self.general_history)):
+            count, size = self._measured.get(name, (0, 0))
+            if len(items) < count:
+                count, size = 0, 0
+            size += sum(approximate_size(item) for item in items[count:])
+            self._measured[name] = (len(items), size)
+            total += size
+        return total
+
+
 class HybridAgentWithMemory:
     """
     Hybrid agent that chains SQL agent output through general agent for verification.
@@ -90,7 +248,8 @@ class HybridAgentWithMemory:
     def __init__(
         self,
         sql_agent: MedDataSQLAgent,
-        general_agent: GeneralAgent
+        general_agent: GeneralAgent,
+        conversation: Optional[Conversation] = None
     ):
         """
         Initialize the hybrid agent system.
@@ -98,30 +257,42 @@ class HybridAgentWithMemory:
         Args:
             sql_agent: MedData SQL agent for database queries
             general_agent: General agent for response verification and refinement
+            conversation: Session state to use (default: the agents' own histories); see bind()
         """
         self.sql_agent = sql_agent
         self.general_agent = general_agent
-        self.memory = InteractionMemory()
+        self.conversation = conversation or Conversation(
+            sql_history=sql_agent.conversation_history,
+            general_history=general_agent.conversation_history
+        )
+        self.memory = self.conversation.memory
+        self.correction_memory = get_correction_memory()
         self.name = "Hybrid Medical Query Agent"
     
-    async def query(self, question: str) -> Dict[str, Any]:
+    async def query(self, question: str, conversation: Optional[Conversation] = None) -> Dict[str, Any]:
         """
         Process a query through SQL agent, then verify and refine with general agent.
         Includes error recovery with up to 2 retry attempts via General Agent suggestions.
         
         Flow:
         1. SQL Agent generates SQL and executes it
-        2. If error: General Agent analyzes error and suggests fixes
+        2. If error: a fix learned from an earlier correction (correction_memory.py), then
+           deterministic repair rules (sql_repair.py) are tried; only if neither works does
+           the General Agent suggest a fix, which is stored for next time
         3. Retry with corrections (up to 2 attempts)
         4. If success: General Agent analyzes ACTUAL DATA RESULTS
         5. Memory stores the complete interaction
         
         Args:
             question: User's natural language question
+            conversation: Session state to read and update (default: this agent's own)
             
         Returns:
             Dictionary with complete interaction details and final response
         """
+        if conversation is not None and conversation is not self.conversation:
+            return await self.bind(conversation).query(question)
+        
         timestamp = datetime.now()
         max_retries = 2
         attempt = 0
@@ -131,7 +302,8 @@ class HybridAgentWithMemory:
         while attempt < max_retries:
             attempt += 1
             print(f"[{timestamp.strftime('%H:%M:%S')}] Attempt {attempt}: SQL Agent processing query...")
-            sql_result = self.sql_agent.query(question)
+            # SQL generation and execution block, so they run off the event loop
+            sql_result = await asyncio.to_thread(self.sql_agent.query, question)
             
             if sql_result.get('success'):
                 print(f"[{timestamp.strftime('%H:%M:%S')}] Attempt {attempt}: Success! Retrieved {sql_result.get('row_count', 0)} rows")
@@ -142,13 +314,23 @@ class HybridAgentWithMemory:
                 print(f"[{timestamp.strftime('%H:%M:%S')}] Attempt {attempt}: Failed. Max retries reached.")
                 break
             
-            # Try error recovery with General Agent
-            print(f"[{timestamp.strftime('%H:%M:%S')}] Attempt {attempt}: Error detected. Routing to General Agent for SQL correction suggestion...")
-            
             error_str = sql_result.get('error', 'Unknown error')
             error_category = sql_result.get('error_category', 'UNKNOWN_ERROR')
             error_hint = sql_result.get('error_hint', '')
             sql_query = sql_result.get('sql', 'No query generated')
+            RETRIES.inc(error_category=error_category)
+            
+            # Recurring mistakes are fixed from earlier corrections, mechanical ones by
+            # local rewrite rules - both without an LLM round-trip
+            repaired = await asyncio.to_thread(self._try_local_recovery, sql_result)
+            if repaired:
+                sql_result = repaired
+                print(f"[{timestamp.strftime('%H:%M:%S')}] {repaired['correction_applied']} successful. Retrieved {sql_result.get('row_count', 0)} rows")
+                break
+            repair_engine.record_fallback()
+            
+            # Try error recovery with General Agent
+            print(f"[{timestamp.strftime('%H:%M:%S')}] Attempt {attempt}: Error detected. Routing to General Agent for SQL correction suggestion...")
             
             # Ask General Agent to suggest SQL correction
             correction_prompt = f"""The user asked this medical database question: "{question}"
@@ -190,8 +372,10 @@ Important: The FIX must be valid T-SQL for Microsoft SQL Server with these rules
             
             if corrected_sql:
                 print(f"[{timestamp.strftime('%H:%M:%S')}] Retrying with corrected SQL...")
-                # Execute the corrected SQL directly
-                retry_result = self.sql_agent._execute_query(corrected_sql)
+                # Validate locally, then execute the corrected SQL directly
+                retry_result = self.sql_agent._validate_sql(corrected_sql)
+                if retry_result.get('success'):
+                    retry_result = await asyncio.to_thread(self.sql_agent._execute_query, corrected_sql, question=question)
                 
                 if retry_result.get('success'):
                     # Create a modified result that tracks the retry
@@ -204,9 +388,13 @@ Important: The FIX must be valid T-SQL for Microsoft SQL Server with these rules
                         'response': f"Query corrected and executed successfully after error recovery.",
                         'was_corrected': True,
                         'original_error': error_str,
-                        'correction_applied': general_suggestion
+                        'correction_applied': general_suggestion,
+                        'db_elapsed_ms': retry_result.get('elapsed_ms'),
+                        'statistics': summarize_statistics(retry_result.get('statistics'))
                     }
                     print(f"[{timestamp.strftime('%H:%M:%S')}] Retry successful! Retrieved {sql_result.get('row_count', 0)} rows")
+                    if self.correction_memory is not None:
+                        self.correction_memory.record(sql_query, error_category, corrected_sql, question)
                     break
                 else:
                     print(f"[{timestamp.strftime('%H:%M:%S')}] Corrected query still failed: {retry_result.get('error', 'Unknown error')}")
@@ -219,6 +407,7 @@ Important: The FIX must be valid T-SQL for Microsoft SQL Server with these rules
             error_category = sql_result.get('error_category', 'UNKNOWN_ERROR')
             error_hint = sql_result.get('error_hint', '')
             sql_query = sql_result.get('sql', 'No query generated')
+            QUERY_ERRORS.inc(error_category=error_category)
             
             # Build comprehensive error context for General Agent
             error_analysis = f"""A user asked this medical database question: "{question}"
@@ -316,9 +505,100 @@ Be helpful, friendly, and conversational. Acknowledge that medical database quer
             'memory_size': len(self.memory.interactions),
             'agent_chain': 'SQL (Generate + Execute) -> General Agent (Analyze Data) -> Memory',
             'was_corrected': sql_result.get('was_corrected', False),
+            'fast_path': sql_result.get('fast_path', False),
+            'plan': sql_result.get('plan'),
+            'db_elapsed_ms': sql_result.get('db_elapsed_ms'),
+            'statistics': sql_result.get('statistics'),
             'retry_attempts': attempt
         }
     
+    def _try_local_recovery(self, sql_result: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """A learned correction, else the deterministic repair rules (None if neither worked)."""
+        return self._try_learned_correction(sql_result) or self._try_local_repair(sql_result)
+    
+    def _try_learned_correction(self, sql_result: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Re-apply a correction the General Agent made earlier for the same query shape and error.
+        
+        Args:
+            sql_result: Failed result from the SQL agent
+            
+        Returns:
+            Successful corrected result, or None if no stored fix exists or it failed
+        """
+        if self.correction_memory is None:
+            return None
+        error_category = sql_result.get('error_category', 'UNKNOWN_ERROR')
+        learned = self.correction_memory.lookup(sql_result.get('sql', ''), error_category)
+        record_cache('learned_correction', learned is not None)
+        if learned is None:
+            return None
+        
+        retry_result = self.sql_agent._validate_sql(learned['sql'])
+        if retry_result.get('success'):
+            retry_result = self.sql_agent._execute_query(learned['sql'], question=sql_result.get('question'))
+        self.correction_memory.record_outcome(learned['fingerprint'], learned['error_category'], retry_result.get('success', False))
+        
+        if not retry_result.get('success'):
+            print(f"Stored correction still failed: {retry_result.get('error', 'Unknown error')}")
+            return None
+        
+        return {
+            'success': True,
+            'sql': learned['sql'],
+            'results': retry_result.get('results', []),
+            'row_count': retry_result.get('row_count', 0),
+            'columns': retry_result.get('columns', []),
+            'response': "Query corrected from a previously learned fix and executed successfully.",
+            'was_corrected': True,
+            'original_error': sql_result.get('error', 'Unknown error'),
+            'correction_applied': "Learned correction",
+            'db_elapsed_ms': retry_result.get('elapsed_ms'),
+            'statistics': summarize_statistics(retry_result.get('statistics'))
+        }
+    
+    def _try_local_repair(self, sql_result: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Apply deterministic repair rules to a failed query and re-execute it.
+        
+        Args:
+            sql_result: Failed result from the SQL agent
+            
+        Returns:
+            Successful corrected result, or None if no rule applied or the repair failed
+        """
+        repair = repair_engine.repair(
+            sql_result.get('sql', ''),
+            sql_result,
+            getattr(self.sql_agent, 'schema_columns', None)
+        )
+        if repair is None:
+            return None
+        
+        retry_result = self.sql_agent._validate_sql(repair.sql)
+        if retry_result.get('success'):
+            retry_result = self.sql_agent._execute_query(repair.sql, question=sql_result.get('question'))
+        repair_engine.record_outcome(repair, retry_result.get('success', False))
+        
+        if not retry_result.get('success'):
+            print(f"Auto-repair ({', '.join(repair.rules)}) still failed: {retry_result.get('error', 'Unknown error')}")
+            return None
+        
+        return {
+            'success': True,
+            'sql': repair.sql,
+            'results': retry_result.get('results', []),
+            'row_count': retry_result.get('row_count', 0),
+            'columns': retry_result.get('columns', []),
+            'response': "Query corrected by deterministic repair rules and executed successfully.",
+            'was_corrected': True,
+            'original_error': sql_result.get('error', 'Unknown error'),
+            'correction_applied': f"Auto-repair: {', '.join(repair.rules)}",
+            'repair_rules': repair.rules,
+            'db_elapsed_ms': retry_result.get('elapsed_ms'),
+            'statistics': summarize_statistics(retry_result.get('statistics'))
+        }
+    
     def _format_data_table(self, sql_results: List[Dict]) -> str:
         """Format query results as readable table."""
         if not sql_results:
@@ -499,15 +779,35 @@ Based on the ACTUAL DATA RESULTS shown above, please:
         """Get summary of conversation memory."""
         return self.memory.to_dict()
     
+    def get_repair_stats(self) -> Dict[str, Any]:
+        """Hit and success rates of the deterministic SQL repair rules (shared by all sessions)."""
+        return repair_engine.stats()
+    
     def get_recent_interactions(self, n: int = 5) -> List[Dict[str, Any]]:
         """Get recent interactions."""
         return self.memory.interactions[-n:] if self.memory.interactions else []
     
+    def bind(self, conversation: Conversation) -> 'HybridAgentWithMemory':
+        """
+        Lightweight view of this agent that reads and updates one session's conversation.
+        
+        The view shares the SQL and general agents' clients, schema, caches and backend
+        (see MedDataSQLAgent.fork), so one process-wide agent can serve every session
+        concurrently; binding costs a few shallow copies.
+        """
+        return HybridAgentWithMemory(
+            self.sql_agent.fork(conversation.sql_history),
+            self.general_agent.fork(conversation.general_history),
+            conversation
+        )
+    
+    def fork(self) -> 'HybridAgentWithMemory':
+        """Hybrid agent with a new, empty conversation that shares everything else (see bind)."""
+        return self.bind(Conversation())
+    
     def clear_memory(self):
         """Clear conversation memory."""
-        self.memory.clear()
-        self.sql_agent.clear_history()
-        self.general_agent.clear_history()
+        self.conversation.clear()
         print("✅ Memory cleared for all agents")
     
     def export_memory(self, filepath: str):
@@ -0,0 +1,290 @@
+"""
+Asynchronous Question Jobs
+Long multi-step questions (planning, retries, corrections) run as jobs instead of inside
+an HTTP request: POST /api/jobs queues one and returns its id at once, GET /api/jobs/<id>
+polls it, and GET /api/jobs/<id>/events streams its progress as server-sent events.
+
+Jobs run on a bounded worker pool, so heavy work has its own concurrency cap independent
+of the HTTP server's, and at most JOB_MAX_PENDING jobs wait for a worker. Jobs, their
+progress events and results are kept in a SQLite table (shared by the workers of a host)
+until JOB_TTL_SECONDS after they finish.
+
+Workers heartbeat their jobs; a queued or running job whose heartbeat stops (its process
+died or restarted) is marked failed as interrupted.
+
+Configuration:
+    JOB_WORKERS             Jobs run at once per process (default: 4)
+    JOB_MAX_PENDING         Jobs queued or running per process before new ones are refused (default: 100)
+    JOB_TTL_SECONDS         Finished jobs are kept this long (default: 3600)
+    JOB_DB                  SQLite file for the job table (default: <tmp>/query_jobs.db)
+"""
+
+import json
+import os
+import secrets
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+
+FINISHED = ('succeeded', 'failed')
+
+# Running workers refresh their jobs' heartbeat this often; jobs silent for
+# STALE_AFTER_SECONDS belong to a process that is gone
+HEARTBEAT_SECONDS = 15
+STALE_AFTER_SECONDS = 120
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS query_jobs (
+    job_id        TEXT PRIMARY KEY,
+    owner         TEXT,
+    question      TEXT NOT NULL,
+    status        TEXT NOT NULL,
+    created_at    REAL NOT NULL,
+    started_at    REAL,
+    finished_at   REAL,
+    heartbeat_at  REAL NOT NULL,
+    expires_at    REAL,
+    events        TEXT NOT NULL DEFAULT '[]',
+    result        TEXT,
+    error         TEXT
+);
+CREATE INDEX IF NOT EXISTS ix_query_jobs_expires ON query_jobs (expires_at);
+"""
+
+
+class JobQueueFullError(Exception):
+    """Too many jobs are queued or running."""
+
+
+class JobStore:
+    """Job rows (status, progress events, result) in a SQLite table."""
+
+    def __init__(self, path: str, ttl_seconds: float = 3600):
+        """
+        Args:
+            path: SQLite file (':memory:' for a process-local table)
+            ttl_seconds: Finished jobs are kept this long
+        """
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        if path != ':memory:':
+            self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+
+    def create(self, question: str, owner: Optional[str] = None) -> str:
+        """Add a queued job; returns its id."""
+        job_id = secrets.token_urlsafe(12)
+        now = time.time()
+        event = [{'at': now, 'stage': 'queued'}]
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO query_jobs (job_id, owner, question, status, created_at, heartbeat_at, events) "
+                "VALUES (?, ?, ?, 'queued', ?, ?, ?)",
+                (job_id, owner, question, now, now, json.dumps(event))
+            )
+            self._conn.commit()
+        return job_id
+
+    def _append_event(self, job_id: str, event: Dict[str, Any], sets: str = '', args: tuple = ()):
+        """Append a progress event and apply extra column updates (lock held by caller)."""
+        row = self._conn.execute("SELECT events FROM query_jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None:
+            return
+        events = json.loads(row[0])
+        events.append(event)
+        self._conn.execute(
+            f"UPDATE query_jobs SET events = ?, heartbeat_at = ?{sets} WHERE job_id = ?",
+            (json.dumps(events, default=str), event['at'], *args, job_id)
+        )
+        self._conn.commit()
+
+    def progress(self, job_id: str, stage: str, **detail):
+        """Record a progress event (e.g. routed, answered) for a running job."""
+        with self._lock:
+            self._append_event(job_id, {'at': time.time(), 'stage': stage, **detail})
+
+    def start(self, job_id: str):
+        now = time.time()
+        with self._lock:
+            self._append_event(job_id, {'at': now, 'stage': 'running'}, ", status = 'running', started_at = ?", (now,))
+
+    def finish(self, job_id: str, result: Optional[Dict[str, Any]] = None, error: Optional[str] = None):
+        """Mark a job succeeded (with its result) or failed (with an error) and start its TTL."""
+        now = time.time()
+        status = 'failed' if error else 'succeeded'
+        with self._lock:
+            self._append_event(
+                job_id, {'at': now, 'stage': status},
+                ", status = ?, finished_at = ?, expires_at = ?, result = ?, error = ?",
+                (status, now, now + self.ttl_seconds,
+                 json.dumps(result, default=str) if result is not None else None, error)
+            )
+
+    def heartbeat(self, job_ids: List[str]):
+        if not job_ids:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE query_jobs SET heartbeat_at = ? WHERE job_id = ?", [(time.time(), job_id) for job_id in job_ids]
+            )
+            self._conn.commit()
+
+    def get(self, job_id: str, owner: Optional[str] = None, include_result: bool = True) -> Optional[Dict[str, Any]]:
+        """
+        A job's status, progress events and (when finished) result.
+
+        Args:
+            owner: Only return the job if it belongs to this session (None = any)
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT job_id, owner, question, status, created_at, started_at, finished_at, events, "
+                "result, error, expires_at FROM query_jobs WHERE job_id = ?", (job_id,)
+            ).fetchone()
+        if row is None or (owner is not None and row[1] not in (None, owner)):
+            return None
+        if row[10] is not None and row[10] <= time.time():
+            return None
+        job = {
+            'job_id': row[0],
+            'question': row[2],
+            'status': row[3],
+            'created_at': row[4],
+            'started_at': row[5],
+            'finished_at': row[6],
+            'elapsed_ms': round(((row[6] or time.time()) - (row[5] or row[4])) * 1000, 2),
+            'events': json.loads(row[7])
+        }
+        if include_result and row[8] is not None:
+            job['result'] = json.loads(row[8])
+        if row[9]:
+            job['error'] = row[9]
+        return job
+
+    def sweep(self) -> Dict[str, int]:
+        """Delete expired jobs and fail jobs whose worker stopped heartbeating."""
+        now = time.time()
+        with self._lock:
+            expired = self._conn.execute("DELETE FROM query_jobs WHERE expires_at <= ?", (now,)).rowcount
+            interrupted = self._conn.execute(
+                "UPDATE query_jobs SET status = 'failed', error = 'Interrupted: the worker running this job stopped', "
+                "finished_at = ?, expires_at = ? WHERE status IN ('queued', 'running') AND heartbeat_at < ?",
+                (now, now + self.ttl_seconds, now - STALE_AFTER_SECONDS)
+            ).rowcount
+            self._conn.commit()
+        return {'expired': expired, 'interrupted': interrupted}
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM query_jobs GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
+
+
+class JobQueue:
+    """Runs queued jobs on a bounded worker pool."""
+
+    def __init__(self, store: JobStore, execute: Callable[[Dict[str, Any], Callable[..., None]], Dict[str, Any]],
+                 workers: int = 4, max_pending: int = 100):
+        """
+        Args:
+            store: Where jobs, progress and results are kept
+            execute: execute(job, progress) runs a job and returns its result; progress(stage, **detail)
+                     records a progress event. Raising fails the job.
+            workers: Jobs run at once
+            max_pending: Jobs queued or running before submit() refuses new ones
+        """
+        self.store = store
+        self.execute = execute
+        self.workers = max(1, workers)
+        self.max_pending = max_pending
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='query-job')
+        self._lock = threading.Lock()
+        self._active: Dict[str, str] = {}  # job_id -> 'queued' | 'running'
+        self.submitted = 0
+        self.rejected = 0
+        threading.Thread(target=self._maintain, name='query-job-heartbeat', daemon=True).start()
+
+    def submit(self, question: str, owner: Optional[str] = None) -> str:
+        """
+        Queue a question; returns the job id.
+
+        Raises:
+            JobQueueFullError: max_pending jobs are already queued or running
+        """
+        with self._lock:
+            if len(self._active) >= self.max_pending:
+                self.rejected += 1
+                raise JobQueueFullError(f"{len(self._active)} jobs are already queued or running")
+            job_id = self.store.create(question, owner)
+            self._active[job_id] = 'queued'
+            self.submitted += 1
+        self._pool.submit(self._run, job_id, question, owner)
+        return job_id
+
+    def _run(self, job_id: str, question: str, owner: Optional[str]):
+        with self._lock:
+            self._active[job_id] = 'running'
+        self.store.start(job_id)
+        try:
+            job = {'job_id': job_id, 'question': question, 'owner': owner}
+            result = self.execute(job, lambda stage, **detail: self.store.progress(job_id, stage, **detail))
+            self.store.finish(job_id, result=result)
+        except Exception as e:
+            print(f"Warning: Job {job_id} failed: {e}")
+            self.store.finish(job_id, error=f"{type(e).__name__}: {e}")
+        finally:
+            with self._lock:
+                self._active.pop(job_id, None)
+
+    def _maintain(self):
+        while True:
+            time.sleep(HEARTBEAT_SECONDS)
+            try:
+                with self._lock:
+                    active = list(self._active)
+                self.store.heartbeat(active)
+                self.store.sweep()
+            except Exception as e:
+                print(f"Warning: Job maintenance failed: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            states = list(self._active.values())
+        return {
+            'workers': self.workers,
+            'queued': states.count('queued'),
+            'running': states.count('running'),
+            'max_pending': self.max_pending,
+            'submitted': self.submitted,
+            'rejected': self.rejected,
+            'stored': self.store.counts()
+        }
+
+
+def create_job_queue_from_env(execute: Callable[[Dict[str, Any], Callable[..., None]], Dict[str, Any]]) -> JobQueue:
+    """
+    Create a JobQueue (and its JobStore) from environment variables.
+
+    Args:
+        execute: See JobQueue
+    """
+    path = os.getenv('JOB_DB') or os.path.join(tempfile.gettempdir(), 'query_jobs.db')
+    ttl_seconds = float(os.getenv('JOB_TTL_SECONDS', '3600'))
+    try:
+        store = JobStore(path, ttl_seconds=ttl_seconds)
+    except sqlite3.Error as e:
+        print(f"Warning: Could not open job table {path} ({e}); keeping jobs in memory")
+        store = JobStore(':memory:', ttl_seconds=ttl_seconds)
+    return JobQueue(
+        store,
+        execute,
+        workers=int(os.getenv('JOB_WORKERS', '4')),
+        max_pending=int(os.getenv('JOB_MAX_PENDING', '100'))
+    )
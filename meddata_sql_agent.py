@@ -4,15 +4,51 @@ This agent queries the medical ontology database using slot-based structure.
 Integrates POML (Prompt Optimization Markup Language) for advanced prompt engineering.
 """
 
+import copy
 import os
 import pyodbc
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Set, Tuple
 from openai import AzureOpenAI
 import json
+import re
 import struct
+import threading
+import time
 from azure.identity import DefaultAzureCredential, AzureCliCredential
+from code_dictionary import CODE_SYSTEMS, find_code_mentions
+from execution_backend import ExecutionProfile, SqlServerBackend, create_backend_from_env
+from sql_validator import SQLValidator
+from sql_workload import get_workload_store
+from query_stats import get_slow_query_log, summarize_statistics
+from sql_parameters import count_placeholders, inline_params, parameterize, parse_generated
+from correction_memory import format_few_shot, get_correction_memory
+from eav_rewriter import EAVRewriter, PivotView, VERIFIED, results_equivalent
+from query_planner import QueryPlanner
+from name_index import TRIGRAM_TABLE, NameMatch, name_trigrams, trigram_search_query
+from ontology_cache import OntologyCache
+from ontology_sync import OntologyChangeTracker
+from metrics import DB_CONNECTIONS_IN_USE, STAGE_SECONDS, counted_completion, record_cache, stage_timer
 
 
+# Slots whose SLOT_VALUE holds another CODE (mirrored as a typed REF_CODE column)
+REFERENCE_SLOTS = (3, 4, 15, 149, 150)
+
+# Words that never name a concept; everything between them is treated as a name term
+NAME_TERM_STOPWORDS = {
+    'a', 'about', 'all', 'an', 'and', 'any', 'are', 'as', 'by', 'code', 'codes', 'concept', 'concepts',
+    'do', 'does', 'find', 'for', 'from', 'get', 'give', 'have', 'how', 'in', 'indicate', 'indicated',
+    'indicates', 'is', 'list', 'loinc', 'many', 'me', 'measure', 'measured', 'measures', 'name', 'names',
+    'of', 'on', 'or', 'other', 'problem', 'problems', 'procedure', 'procedures', 'related', 'show',
+    'snomed', 'test', 'tests', 'that', 'the', 'their', 'them', 'these', 'those', 'to', 'what', 'which',
+    'with'
+}
+
+# Questions containing these go through SQL generation even when they mention an exact code
+CODE_FAST_PATH_BLOCKERS = (
+    'indicat', 'problem', 'relat', 'measur', 'parent', 'child', 'descend', 'subclass', 'hierarch',
+    'count', 'how many', 'compare', 'both', 'then', 'those', 'them', 'that', 'these'
+)
+
 # POML System Prompt for Medical Ontology
 MEDICAL_ONTOLOGY_SYSTEM_PROMPT = """
 <system>
@@ -30,7 +66,7 @@ You understand complex multi-step queries that require:
 - **MED Table**: Contains medical concepts (codes) with attributes stored as slot-value pairs
   - CODE (NVARCHAR 50): Unique identifier for medical concepts (e.g., '1302', '3668', '19928')
   - SLOT_NUMBER (INT): References the type of attribute (see MED_SLOTS)
-  - SLOT_VALUE (NVARCHAR 200): The actual value for this attribute or reference to another CODE
+  - SLOT_VALUE (NVARCHAR 200): The actual value for this attribute or reference to another CODE{ref_code_column}
 
 - **MED_SLOTS Table**: Defines the semantic meaning of each slot number
   - SLOT_NUMBER (INT): Unique identifier for the slot type
@@ -67,7 +103,7 @@ The MED table represents a SEMANTIC NETWORK where:
    SELECT DISTINCT m1.CODE, MAX(CASE WHEN m2.SLOT_NUMBER = 6 THEN m2.SLOT_VALUE END) AS [Name], MAX(CASE WHEN m3.SLOT_NUMBER = 266 THEN m3.SLOT_VALUE END) AS [SNOMED Code] FROM MED m1 LEFT JOIN MED m2 ON m1.CODE = m2.CODE AND m2.SLOT_NUMBER = 6 LEFT JOIN MED m3 ON m1.CODE = m3.CODE AND m3.SLOT_NUMBER = 266 WHERE m1.SLOT_NUMBER = 212 AND m1.SLOT_VALUE = '2947-0' GROUP BY m1.CODE
 
 2. **Finding Pt-Problems indicated by a procedure with LOINC code:**
-   SELECT DISTINCT prob.CODE, MAX(CASE WHEN pname.SLOT_NUMBER = 6 THEN pname.SLOT_VALUE END) AS [Problem Name], MAX(CASE WHEN psnomed.SLOT_NUMBER = 266 THEN psnomed.SLOT_VALUE END) AS [Problem SNOMED Code] FROM MED loinc_ref INNER JOIN MED indicates ON loinc_ref.CODE = indicates.CODE AND indicates.SLOT_NUMBER = 150 INNER JOIN MED prob ON indicates.SLOT_VALUE = prob.CODE LEFT JOIN MED pname ON prob.CODE = pname.CODE AND pname.SLOT_NUMBER = 6 LEFT JOIN MED psnomed ON prob.CODE = psnomed.CODE AND psnomed.SLOT_NUMBER = 266 WHERE loinc_ref.SLOT_NUMBER = 212 AND loinc_ref.SLOT_VALUE = '2947-0' GROUP BY prob.CODE
+   SELECT DISTINCT prob.CODE, MAX(CASE WHEN pname.SLOT_NUMBER = 6 THEN pname.SLOT_VALUE END) AS [Problem Name], MAX(CASE WHEN psnomed.SLOT_NUMBER = 266 THEN psnomed.SLOT_VALUE END) AS [Problem SNOMED Code] FROM MED loinc_ref INNER JOIN MED indicates ON loinc_ref.CODE = indicates.CODE AND indicates.SLOT_NUMBER = 150 INNER JOIN MED prob ON indicates.{related} = prob.CODE LEFT JOIN MED pname ON prob.CODE = pname.CODE AND pname.SLOT_NUMBER = 6 LEFT JOIN MED psnomed ON prob.CODE = psnomed.CODE AND psnomed.SLOT_NUMBER = 266 WHERE loinc_ref.SLOT_NUMBER = 212 AND loinc_ref.SLOT_VALUE = '2947-0' GROUP BY prob.CODE
 
 3. **Finding tests by name (fuzzy search):**
    SELECT DISTINCT m1.CODE, m1.SLOT_VALUE AS [Test Name] FROM MED m1 WHERE m1.SLOT_NUMBER = 6 AND m1.SLOT_VALUE LIKE '%glucose%' ORDER BY m1.SLOT_VALUE
@@ -112,7 +148,7 @@ The MED table represents a SEMANTIC NETWORK where:
 
 5. **Alias**: Always alias joined tables (m1, m2, m3, etc.) and use descriptive column aliases
 
-6. **Fuzzy Matching**: Use LIKE '%search%' for partial text matches in SLOT_VALUE
+6. **Fuzzy Matching**: If RESOLVED ENTITIES are provided, filter with CODE IN (...); otherwise use LIKE '%search%' for partial text matches in SLOT_VALUE
 
 7. **NULL Handling**: Results with NULL slot values are valid - they represent missing attributes
 
@@ -124,8 +160,8 @@ The MED table represents a SEMANTIC NETWORK where:
     - For slot 150 (PROCEDURE-(INDICATES)->PT-PROBLEM):
       * Join to find procedures: table1.CODE in a query where table1.SLOT_NUMBER=212
       * Join to find indicated problems: table2.CODE = table1.CODE AND table2.SLOT_NUMBER=150
-      * Get problem codes: table3.CODE = table2.SLOT_VALUE (SLOT_VALUE contains the related CODE)
-    - For other relationship slots: SLOT_VALUE points to the related CODE
+      * Get problem codes: table3.CODE = table2.{related} ({related_note})
+    - For other relationship slots (3, 4, 15, 149): {related} points to the related CODE
 
 11. **Multi-Step Queries**: 
     - Break complex queries into logical steps
@@ -143,7 +179,7 @@ The MED table represents a SEMANTIC NETWORK where:
 - DON'T use column names directly in WHERE clauses after aggregation (would cause error)
 - DON'T use string literals for slot values without proper quoting
 - DON'T forget to GROUP BY when using aggregate functions
-- DON'T confuse SLOT_VALUE with CODE - SLOT_VALUE contains the actual data or reference to another CODE
+- DON'T confuse SLOT_VALUE with CODE - SLOT_VALUE contains the actual data or reference to another CODE{ref_code_rule}
 - DON'T use ### symbols or comments in the SQL - return clean SQL only
 - DON'T use undefined aliases or columns
 - DON'T forget DISTINCT when doing multiple joins to avoid duplicates
@@ -170,12 +206,40 @@ For complex multi-step queries:
 - Names (slot 6) are human-readable and help interpret the meaning of codes
 - Each medical concept can have multiple attributes - always use DISTINCT and GROUP BY
 - Relationships flow through SLOT_NUMBER/SLOT_VALUE pairs in the MED table
-- When joining relationships, remember: CODE connects to next table's CODE, SLOT_VALUE points to the related CODE
+- When joining relationships, remember: CODE connects to next table's CODE, {related} points to the related CODE
 </data_insights>
 </context>
 </system>
 """
 
+# Relationship join guidance for MED tables with the REF_CODE column (database/meddata.sql)
+# and for tables created before it, which only carry the related CODE in SLOT_VALUE
+RELATIONSHIP_GUIDANCE = {
+    True: {
+        'related': 'REF_CODE',
+        'related_note': 'REF_CODE is the typed copy of the related CODE',
+        'ref_code_column': (
+            "\n  - REF_CODE (same type as CODE): Typed copy of SLOT_VALUE for reference slots (3, 4, 15, 149, 150), NULL for all other slots."
+            "\n    ALWAYS join related concepts on REF_CODE = CODE (never SLOT_VALUE = CODE) so the join can use an index seek"
+        ),
+        'ref_code_rule': (
+            "\n- DON'T join SLOT_VALUE = CODE for relationships - use REF_CODE = CODE "
+            "(SLOT_VALUE forces an implicit conversion and a scan)"
+        ),
+    },
+    False: {
+        'related': 'SLOT_VALUE',
+        'related_note': 'SLOT_VALUE contains the related CODE',
+        'ref_code_column': '',
+        'ref_code_rule': '',
+    },
+}
+
+
+def ontology_system_prompt(has_ref_code: bool) -> str:
+    """The POML system prompt, with relationship joins on REF_CODE only when MED has that column."""
+    return MEDICAL_ONTOLOGY_SYSTEM_PROMPT.format(**RELATIONSHIP_GUIDANCE[bool(has_ref_code)])
+
 
 class MedDataSQLAgent:
     """Agent that translates natural language to SQL queries for medical ontology database."""
@@ -191,15 +255,43 @@ class MedDataSQLAgent:
         azure_openai_deployment: str = None,
         azure_openai_api_version: str = "2024-08-01-preview",
         use_azure_ad: bool = True,
-        use_poml: bool = True
+        use_poml: bool = True,
+        use_name_index: bool = True,
+        cache_check_interval: int = 300,
+        snapshot_path: Optional[str] = None,
+        change_poll_interval: float = 30,
+        backend=None,
+        parameterize_queries: bool = True,
+        eav_rewriter: Optional[EAVRewriter] = None,
+        execution_profile: Optional[ExecutionProfile] = None,
+        use_query_planner: bool = True,
+        plan_workers: int = 4
     ):
-        """Initialize the MedData SQL Agent with database and Azure OpenAI credentials."""
+        """
+        Initialize the MedData SQL Agent with database and Azure OpenAI credentials.
+        
+        backend: Execution backend (see execution_backend.py); defaults to SQL Server.
+        A local SQLite/DuckDB backend runs transpiled queries against an embedded copy of MED.
+        parameterize_queries: Generate and execute '?' templates with typed parameters
+        (see sql_parameters.py) so query shapes share cached plans.
+        eav_rewriter: Rewrites per-attribute MED self-joins into one pivot pass before
+        execution (see eav_rewriter.py); None disables the rewrite.
+        execution_profile: Session guardrails for generated queries (read-only intent,
+        snapshot reads, lock timeout, row ceiling, MAXDOP); None uses connection defaults.
+        use_query_planner: Answer multi-hop questions with a DAG of small sub-queries run in
+        parallel (see query_planner.py) instead of one large join.
+        plan_workers: Plan steps run concurrently at most.
+        """
         self.sql_server = sql_server
         self.sql_database = sql_database
         self.sql_username = sql_username
         self.sql_password = sql_password
         self.use_azure_ad = use_azure_ad or (sql_username is None and sql_password is None)
         self.use_poml = use_poml
+        self.parameterize_queries = parameterize_queries
+        self.eav_rewriter = eav_rewriter
+        # Milliseconds spent in each startup step (token, ontology indexes, schema) for /api/ready
+        self.startup_timings: Dict[str, float] = {}
         
         # Initialize Azure OpenAI client
         self.client = AzureOpenAI(
@@ -220,15 +312,18 @@ class MedDataSQLAgent:
                 f"TrustServerCertificate=no;"
                 f"Connection Timeout=30;"
             )
-            # Get Azure AD token
-            try:
-                credential = AzureCliCredential()
-                token = credential.get_token("https://database.windows.net/.default")
-                self.token_bytes = token.token.encode("utf-16-le")
-                self.token_struct = struct.pack(f'<I{len(self.token_bytes)}s', len(self.token_bytes), self.token_bytes)
-            except Exception as e:
-                print(f"Warning: Could not get Azure AD token: {e}")
-                self.token_struct = None
+            # Get Azure AD token (not needed when queries run against a local copy)
+            self.token_struct = None
+            if backend is None or not backend.is_local:
+                started = time.perf_counter()
+                try:
+                    credential = AzureCliCredential()
+                    token = credential.get_token("https://database.windows.net/.default")
+                    self.token_bytes = token.token.encode("utf-16-le")
+                    self.token_struct = struct.pack(f'<I{len(self.token_bytes)}s', len(self.token_bytes), self.token_bytes)
+                except Exception as e:
+                    print(f"Warning: Could not get Azure AD token: {e}")
+                self.startup_timings['aad_token'] = (time.perf_counter() - started) * 1000
         else:
             # SQL authentication
             self.connection_string = (
@@ -243,19 +338,346 @@ class MedDataSQLAgent:
             )
             self.token_struct = None
         
-        # Get database schema on initialization
+        # Where generated queries run (SQL Server unless a local backend was supplied)
+        self.backend = backend or SqlServerBackend(self._connect_sql_server, execution_profile)
+        if execution_profile is not None and self.backend.profile is None:
+            self.backend.profile = execution_profile
+        self.execution_profile = self.backend.profile
+        self.workload_store = get_workload_store()
+        self.slow_query_log = get_slow_query_log()
+        self.correction_memory = get_correction_memory()
+        
+        # In-memory ontology cache (PRINT-NAME index, code dictionaries) for lookups without the database.
+        # With a snapshot path the rows and indexes come from a memory-mapped file shared by all worker processes.
+        self.snapshot_path = snapshot_path
+        self.use_name_index = use_name_index
+        started = time.perf_counter()
+        self.ontology: Optional[OntologyCache] = self._load_ontology_cache() if use_name_index else None
+        self.startup_timings['ontology_cache'] = (time.perf_counter() - started) * 1000
+        self.cache_check_interval = cache_check_interval
+        self._cache_checked_at = time.monotonic()
+        self._refresh_lock = threading.Lock()
+        
+        # Row-level delta sync when change tracking is enabled on MED
+        self.change_tracker: Optional[OntologyChangeTracker] = None
+        if self.ontology and self.ontology.sync_version is not None and change_poll_interval > 0:
+            self.change_tracker = OntologyChangeTracker(
+                connection_factory=self._get_connection,
+                get_cache=lambda: self.ontology,
+                poll_interval=change_poll_interval,
+                # The snapshot may be older than the tracker can catch up from
+                on_reload=lambda: self._reload_ontology(from_database=True),
+                on_slots_changed=self._refresh_schema
+            )
+            self.change_tracker.start()
+            print(f"✓ Ontology change tracking enabled (version {self.ontology.sync_version}, every {change_poll_interval}s)")
+        
+        # Get database schema on initialization (statistics come from the cache when loaded)
+        started = time.perf_counter()
         self.schema_info = self._get_database_schema()
+        self.startup_timings['schema'] = (time.perf_counter() - started) * 1000
+        
+        # Multi-hop questions run as a DAG of small sub-queries
+        self.query_planner: Optional[QueryPlanner] = QueryPlanner(self, max_workers=plan_workers) if use_query_planner else None
         
         # Conversation history
         self.conversation_history: List[Dict[str, str]] = []
+        # The agent this one was forked from (forks share its caches, see fork())
+        self._fork_of: Optional['MedDataSQLAgent'] = None
+    
+    def _load_ontology_cache(self, from_database: bool = False) -> Optional[OntologyCache]:
+        """Load MED (from the snapshot if present, else the database) and build the name index; None if the load fails."""
+        if self.snapshot_path and os.path.exists(self.snapshot_path) and not from_database:
+            try:
+                cache = OntologyCache.from_snapshot(self.snapshot_path)
+                print(f"✓ Ontology cache mapped from {self.snapshot_path}: {cache.stats()['names_indexed']} names indexed")
+                return cache
+            except Exception as e:
+                print(f"Warning: Could not open ontology snapshot, loading from database: {e}")
+        try:
+            conn = self._get_connection()
+            try:
+                cache = OntologyCache.load(conn)
+            finally:
+                conn.close()
+            print(f"✓ Ontology cache loaded: {cache.stats()['names_indexed']} names indexed")
+            return cache
+        except Exception as e:
+            print(f"Warning: Could not load ontology cache: {e}")
+            return None
+    
+    def refresh_ontology_if_stale(self, force: bool = False) -> bool:
+        """
+        Reload the ontology cache when the MED data version has changed.
+        
+        The version check runs at most once per cache_check_interval seconds unless forced.
+        A snapshot-backed cache is reloaded when the snapshot file has been replaced; the
+        new cache is swapped in atomically and in-flight readers keep the old mapping alive.
+        
+        Returns:
+            True if the cache was reloaded
+        """
+        if self._fork_of is not None:
+            # The cache belongs to the agent this one was forked from
+            reloaded = self._fork_of.refresh_ontology_if_stale(force)
+            self.ontology = self._fork_of.ontology
+            return reloaded
+        if not self.ontology:
+            return False
+        if not force and self.change_tracker and self.change_tracker.running:
+            # Deltas are already applied in the background
+            return False
+        with self._refresh_lock:
+            now = time.monotonic()
+            if not force and now - self._cache_checked_at < self.cache_check_interval:
+                return False
+            self._cache_checked_at = now
+        
+        if self.ontology.snapshot is not None:
+            if self.ontology.snapshot.is_current():
+                return False
+            return self._reload_ontology()
+        
+        try:
+            conn = self._get_connection()
+            try:
+                version = OntologyCache.fetch_version(conn)
+            finally:
+                conn.close()
+        except Exception as e:
+            print(f"Warning: Could not check ontology data version: {e}")
+            return False
+        
+        if version == self.ontology.version:
+            return False
+        
+        return self._reload_ontology()
+    
+    def _reload_ontology(self, from_database: bool = False) -> bool:
+        """
+        Load a fresh ontology cache and swap it in; the old cache stays valid for in-flight
+        readers and its snapshot mapping is closed after a grace period.
+        
+        Args:
+            from_database: Skip the snapshot (used by the change tracker)
+        """
+        refreshed = self._load_ontology_cache(from_database)
+        if refreshed:
+            previous, self.ontology = self.ontology, refreshed
+            if previous is not None and previous is not refreshed:
+                previous.retire()
+            # Change tracking stopped (e.g. MED was recreated) and is available again
+            if (self.change_tracker is not None and not self.change_tracker.running
+                    and refreshed.sync_version is not None):
+                self.change_tracker.start()
+            return True
+        return False
+    
+    def _refresh_schema(self):
+        """Rebuild the schema text (e.g. after MED_SLOTS changed)."""
+        self.schema_info = self._get_database_schema()
+    
+    @property
+    def has_ref_code(self) -> bool:
+        """Whether MED has the REF_CODE column (older databases only have SLOT_VALUE)."""
+        columns = (getattr(self, 'schema_columns', None) or {}).get('MED', [])
+        return any(column.upper() == 'REF_CODE' for column in columns)
+    
+    @property
+    def data_version(self) -> Optional[str]:
+        """Current MED data version (change tracking version when enabled) for cache keys."""
+        return self.ontology.cache_key if self.ontology else None
+    
+    def lookup_code(self, system: str, value: str) -> List[Dict[str, Any]]:
+        """
+        Look up ontology concepts by an external code from the in-memory dictionaries.
+        
+        Args:
+            system: Code system name (LOINC, SNOMED, CPMC-LAB-PROC, CPMC-LAB-TEST, MILLENNIUM, EPIC)
+            value: External code value (e.g., '2947-0')
+            
+        Returns:
+            One dictionary per matching CODE with its name and external codes
+        """
+        if not self.ontology:
+            return []
+        return [
+            {
+                "code": code,
+                "name": self.ontology.name_of(code),
+                "external_codes": self.ontology.code_dictionary.external_codes(code)
+            }
+            for code in sorted(self.ontology.code_dictionary.lookup(system, value))
+        ]
+    
+    def _find_code_mentions(self, question: str) -> List[Tuple[str, str, Set[str]]]:
+        """
+        Find external code values mentioned in a question.
+        
+        Without a named code system only LOINC- and SNOMED-shaped values count, so ordinary
+        words and numbers are not mistaken for CPMC mnemonics or EPIC / MILLENNIUM ids.
+        
+        Returns:
+            List of (system, value, codes) tuples
+        """
+        if not self.ontology:
+            return []
+        return find_code_mentions(self.ontology.code_dictionary, question)
+    
+    def _try_code_fast_path(self, question: str) -> Optional[Dict[str, Any]]:
+        """
+        Answer a plain exact-code lookup (e.g. "tests with LOINC 2947-0") from the
+        in-memory dictionaries, skipping SQL generation and the database round-trip.
+        
+        Returns:
+            Result dictionary shaped like _execute_query output plus "sql", or None
+        """
+        question_lower = question.lower()
+        if any(blocker in question_lower for blocker in CODE_FAST_PATH_BLOCKERS):
+            return None
+        
+        mentions = self._find_code_mentions(question)
+        if len(mentions) != 1:
+            return None
+        system, value, codes = mentions[0]
+        dictionary = self.ontology.code_dictionary
+        
+        value_column = f"{system} Code"
+        include_snomed = system != "SNOMED"
+        columns = ["CODE", "Name", value_column] + (["SNOMED Code"] if include_snomed else [])
+        results = []
+        for code in sorted(codes, key=lambda c: (len(c), c)):
+            row = {
+                "CODE": code,
+                "Name": self.ontology.name_of(code),
+                value_column: value
+            }
+            if include_snomed:
+                row["SNOMED Code"] = (dictionary.external_codes(code).get("SNOMED") or [None])[0]
+            results.append(row)
+        
+        # Equivalent SQL, kept for transparency, memory and follow-up questions
+        slot = CODE_SYSTEMS[system]
+        escaped = value.replace("'", "''")
+        snomed_select = ", MAX(CASE WHEN m3.SLOT_NUMBER = 266 THEN m3.SLOT_VALUE END) AS [SNOMED Code]" if include_snomed else ""
+        snomed_join = " LEFT JOIN MED m3 ON m1.CODE = m3.CODE AND m3.SLOT_NUMBER = 266" if include_snomed else ""
+        sql_query = (
+            f"SELECT m1.CODE, MAX(CASE WHEN m2.SLOT_NUMBER = 6 THEN m2.SLOT_VALUE END) AS [Name], "
+            f"m1.SLOT_VALUE AS [{value_column}]{snomed_select} "
+            f"FROM MED m1 LEFT JOIN MED m2 ON m1.CODE = m2.CODE AND m2.SLOT_NUMBER = 6{snomed_join} "
+            f"WHERE m1.SLOT_NUMBER = {slot} AND m1.SLOT_VALUE = '{escaped}' GROUP BY m1.CODE, m1.SLOT_VALUE"
+        )
+        
+        return {
+            "success": True,
+            "sql": sql_query,
+            "results": results,
+            "row_count": len(results),
+            "columns": columns,
+            "fast_path": True
+        }
+    
+    def resolve_names(self, term: str, top_k: int = 10, min_score: float = 0.5) -> List[NameMatch]:
+        """
+        Resolve a free-text name term to ranked concepts using the in-memory PRINT-NAME index,
+        or the MED_NAME_TRIGRAMS side table when the index is disabled or failed to load.
+        
+        Args:
+            term: Name term (typos and prefixes are tolerated)
+            top_k: Maximum number of matches
+            min_score: Minimum match score (0-1)
+            
+        Returns:
+            Ranked matches, empty if neither the index nor the side table is available
+        """
+        if not self.ontology:
+            return self._search_name_table(term, top_k, min_score)
+        return self.ontology.name_index.search(term, top_k=top_k, min_score=min_score)
+    
+    def _search_name_table(self, term: str, top_k: int, min_score: float) -> List[NameMatch]:
+        """Ranked name matches from the server-side trigram table (score: share of the term's trigrams matched)."""
+        if TRIGRAM_TABLE not in (getattr(self, 'schema_columns', None) or {}) or not term.strip():
+            return []
+        sql, params = trigram_search_query(term, top_k=top_k, min_overlap=min_score)
+        gram_count = len(name_trigrams(term))
+        try:
+            conn = self._get_connection()
+            try:
+                cursor = conn.cursor()
+                self.backend.execute(cursor, self.backend.transpile(sql), params)
+                rows = cursor.fetchall()
+                cursor.close()
+            finally:
+                conn.close()
+        except Exception as e:
+            print(f"Warning: Name search on {TRIGRAM_TABLE} failed: {e}")
+            return []
+        return [NameMatch(str(code), name or '', round(matched / gram_count, 3)) for code, matched, name in rows]
+    
+    def _extract_name_terms(self, question: str) -> List[str]:
+        """Split a question into candidate name phrases (runs of non-stopword words)."""
+        terms = []
+        current: List[str] = []
+        for word in re.findall(r"[A-Za-z][A-Za-z0-9\-]*", question):
+            if word.lower() in NAME_TERM_STOPWORDS or len(word) < 3:
+                if current:
+                    terms.append(" ".join(current))
+                current = []
+            else:
+                current.append(word)
+        if current:
+            terms.append(" ".join(current))
+        return terms
+    
+    def _build_entity_hints(self, question: str, min_score: float = 0.75, max_codes: int = 50) -> str:
+        """
+        Link entities in the question to CODE sets - exact external codes via the code
+        dictionaries and name terms via the PRINT-NAME index (or its side table) - so the SQL
+        can filter by CODE instead of scanning SLOT_VALUE.
+        """
+        hints = []
+        for system, value, codes in self._find_code_mentions(question):
+            if len(codes) <= max_codes:
+                code_list = ", ".join(f"'{code}'" for code in sorted(codes))
+                hints.append(f"- {system} '{value}' (slot {CODE_SYSTEMS[system]}) -> CODE IN ({code_list})")
+        
+        for term in self._extract_name_terms(question):
+            # Try the whole phrase first, then fall back to its individual words
+            candidates = [term] if " " not in term else [term] + term.split()
+            for candidate in candidates:
+                matches = self.resolve_names(candidate, top_k=max_codes + 1, min_score=min_score)
+                if not matches or len(matches) > max_codes:
+                    continue
+                codes = ", ".join(f"'{m.code}'" for m in matches)
+                examples = "; ".join(m.name for m in matches[:3])
+                hints.append(f"- '{candidate}' -> CODE IN ({codes})  (e.g. {examples})")
+                break
+        
+        if not hints:
+            return ""
+        return (
+            "**RESOLVED ENTITIES (from the code dictionaries and PRINT-NAME index):**\n"
+            + "\n".join(hints)
+            + "\nFilter these concepts with CODE IN (...) instead of SLOT_VALUE LIKE '%term%'."
+        )
     
     def _get_connection(self):
-        """Get a database connection with appropriate authentication."""
+        """Get a connection from the execution backend."""
+        return self.backend.connect()
+    
+    def _connect_sql_server(self, read_only: bool = False):
+        """
+        Get a SQL Server connection with appropriate authentication.
+        
+        Args:
+            read_only: Connect with ApplicationIntent=ReadOnly (generated queries)
+        """
+        connection_string = self.connection_string + ("ApplicationIntent=ReadOnly;" if read_only else "")
         if self.use_azure_ad and self.token_struct:
             SQL_COPT_SS_ACCESS_TOKEN = 1256
-            conn = pyodbc.connect(self.connection_string, attrs_before={SQL_COPT_SS_ACCESS_TOKEN: self.token_struct})
+            conn = pyodbc.connect(connection_string, attrs_before={SQL_COPT_SS_ACCESS_TOKEN: self.token_struct})
         else:
-            conn = pyodbc.connect(self.connection_string)
+            conn = pyodbc.connect(connection_string)
         return conn
     
     def _get_database_schema(self) -> str:
@@ -269,46 +691,52 @@ class MedDataSQLAgent:
             # Get table information
             schema_parts.append("=== MEDICAL ONTOLOGY DATABASE SCHEMA ===\n")
             
+            tables = self.backend.describe_tables(conn)
+            self.schema_columns = {
+                table: [column['name'] for column in columns] for table, columns in tables.items()
+            }
+            self.sql_validator = SQLValidator(self.schema_columns)
+            
             # MED table
             schema_parts.append("\n--- Table: MED (Medical Concepts & Attributes) ---")
-            cursor.execute("""
-                SELECT COLUMN_NAME, DATA_TYPE, CHARACTER_MAXIMUM_LENGTH, IS_NULLABLE
-                FROM INFORMATION_SCHEMA.COLUMNS
-                WHERE TABLE_NAME = 'MED'
-                ORDER BY ORDINAL_POSITION
-            """)
             schema_parts.append("Columns:")
-            for row in cursor.fetchall():
-                col_name, data_type, max_len, nullable = row
-                length_info = f"({max_len})" if max_len else ""
-                null_info = "NULL" if nullable == "YES" else "NOT NULL"
-                schema_parts.append(f"  - {col_name}: {data_type}{length_info} {null_info}")
-            
-            # Get sample slot distribution
-            cursor.execute("""
-                SELECT TOP 5 SLOT_NUMBER, COUNT(*) as count
-                FROM MED
-                GROUP BY SLOT_NUMBER
-                ORDER BY count DESC
-            """)
+            med_columns = []
+            for column in tables.get('MED', []):
+                med_columns.append(column['name'])
+                length_info = f"({column['max_length']})" if column['max_length'] else ""
+                null_info = "NULL" if column['nullable'] else "NOT NULL"
+                schema_parts.append(f"  - {column['name']}: {column['type']}{length_info} {null_info}")
+            
+            if "REF_CODE" in med_columns:
+                slot_list = ", ".join(str(slot) for slot in REFERENCE_SLOTS)
+                schema_parts.append(
+                    f"\nREF_CODE holds the related CODE for reference slots ({slot_list}) and is indexed."
+                )
+                schema_parts.append("Traverse relationships with: related.CODE = rel.REF_CODE (not rel.SLOT_VALUE)")
+            
+            # Get sample slot distribution (from the in-memory cache when loaded, to avoid scanning MED)
+            cached_stats = self.ontology.statistics() if getattr(self, 'ontology', None) else None
+            if cached_stats:
+                top_slots = cached_stats['top_slots']
+            else:
+                cursor.execute(self.backend.transpile("""
+                    SELECT TOP 5 SLOT_NUMBER, COUNT(*) as count
+                    FROM MED
+                    GROUP BY SLOT_NUMBER
+                    ORDER BY count DESC
+                """))
+                top_slots = cursor.fetchall()
             schema_parts.append("\nTop Slot Usage:")
-            for row in cursor.fetchall():
+            for row in top_slots:
                 schema_parts.append(f"  - Slot {row[0]}: {row[1]} entries")
             
             # MED_SLOTS table
             schema_parts.append("\n--- Table: MED_SLOTS (Slot Definitions) ---")
-            cursor.execute("""
-                SELECT COLUMN_NAME, DATA_TYPE, CHARACTER_MAXIMUM_LENGTH, IS_NULLABLE
-                FROM INFORMATION_SCHEMA.COLUMNS
-                WHERE TABLE_NAME = 'MED_SLOTS'
-                ORDER BY ORDINAL_POSITION
-            """)
             schema_parts.append("Columns:")
-            for row in cursor.fetchall():
-                col_name, data_type, max_len, nullable = row
-                length_info = f"({max_len})" if max_len else ""
-                null_info = "NULL" if nullable == "YES" else "NOT NULL"
-                schema_parts.append(f"  - {col_name}: {data_type}{length_info} {null_info}")
+            for column in tables.get('MED_SLOTS', []):
+                length_info = f"({column['max_length']})" if column['max_length'] else ""
+                null_info = "NULL" if column['nullable'] else "NOT NULL"
+                schema_parts.append(f"  - {column['name']}: {column['type']}{length_info} {null_info}")
             
             # Get all slot definitions
             cursor.execute("SELECT SLOT_NUMBER, SLOT_NAME FROM MED_SLOTS ORDER BY SLOT_NUMBER")
@@ -317,10 +745,14 @@ class MedDataSQLAgent:
                 schema_parts.append(f"  - Slot {row[0]}: {row[1]}")
             
             # Get total counts
-            cursor.execute("SELECT COUNT(DISTINCT CODE) FROM MED")
-            unique_codes = cursor.fetchone()[0]
-            cursor.execute("SELECT COUNT(*) FROM MED")
-            total_entries = cursor.fetchone()[0]
+            if cached_stats:
+                unique_codes = cached_stats['unique_codes']
+                total_entries = cached_stats['total_rows']
+            else:
+                cursor.execute("SELECT COUNT(DISTINCT CODE) FROM MED")
+                unique_codes = cursor.fetchone()[0]
+                cursor.execute("SELECT COUNT(*) FROM MED")
+                total_entries = cursor.fetchone()[0]
             
             schema_parts.append(f"\n=== DATABASE STATISTICS ===")
             schema_parts.append(f"Total unique medical codes: {unique_codes}")
@@ -338,11 +770,12 @@ class MedDataSQLAgent:
         
         # Build messages with POML system prompt if enabled
         messages = []
+        related = RELATIONSHIP_GUIDANCE[self.has_ref_code]['related']
         
         if self.use_poml:
             messages.append({
                 "role": "system",
-                "content": MEDICAL_ONTOLOGY_SYSTEM_PROMPT
+                "content": ontology_system_prompt(self.has_ref_code)
             })
         
         # Add schema context (AFTER the POML system prompt for proper instruction order)
@@ -356,21 +789,39 @@ Database Schema:
 **YOUR TASK**: Generate a T-SQL query to answer the user's question.
 
 **CRITICAL REQUIREMENTS:**
-1. Return ONLY valid T-SQL - no markdown, no code fences, no explanations
+1. Return ONLY valid T-SQL - no markdown, no code fences, no explanations{self._parameter_instructions()}
 2. Use MAX(CASE WHEN slot = X THEN value END) for multiple attributes per row
 3. Always GROUP BY when using aggregate functions
 4. Use DISTINCT when joining multiple times to avoid duplicates
 5. Use LEFT JOIN for optional attributes, INNER JOIN for required relationships
 6. For Pt-Problems queries: Use slot 150 (PROCEDURE-(INDICATES)->PT-PROBLEM) to link procedures to problems
+   and join the problem on {related} = CODE
 7. Always include slot 6 (PRINT-NAME) for human-readable names
 8. Always try to include slot 266 (SNOMED-CODE) for standard terminology
 9. Use TOP 100 to limit results for performance
 
 **EXAMPLE - Pt-Problems for LOINC code:**
-SELECT DISTINCT prob.CODE, MAX(CASE WHEN n.SLOT_NUMBER=6 THEN n.SLOT_VALUE END) AS Name, MAX(CASE WHEN s.SLOT_NUMBER=266 THEN s.SLOT_VALUE END) AS SNOMEDCode FROM MED loinc_ref INNER JOIN MED indicates ON loinc_ref.CODE = indicates.CODE AND indicates.SLOT_NUMBER = 150 INNER JOIN MED prob ON indicates.SLOT_VALUE = prob.CODE LEFT JOIN MED n ON prob.CODE = n.CODE AND n.SLOT_NUMBER = 6 LEFT JOIN MED s ON prob.CODE = s.CODE AND s.SLOT_NUMBER = 266 WHERE loinc_ref.SLOT_NUMBER = 212 AND loinc_ref.SLOT_VALUE = '2947-0' GROUP BY prob.CODE
+SELECT DISTINCT prob.CODE, MAX(CASE WHEN n.SLOT_NUMBER=6 THEN n.SLOT_VALUE END) AS Name, MAX(CASE WHEN s.SLOT_NUMBER=266 THEN s.SLOT_VALUE END) AS SNOMEDCode FROM MED loinc_ref INNER JOIN MED indicates ON loinc_ref.CODE = indicates.CODE AND indicates.SLOT_NUMBER = 150 INNER JOIN MED prob ON indicates.{related} = prob.CODE LEFT JOIN MED n ON prob.CODE = n.CODE AND n.SLOT_NUMBER = 6 LEFT JOIN MED s ON prob.CODE = s.CODE AND s.SLOT_NUMBER = 266 WHERE loinc_ref.SLOT_NUMBER = 212 AND loinc_ref.SLOT_VALUE = '2947-0' GROUP BY prob.CODE
 """
         })
         
+        # Add entity resolution hints (in-memory lookups, no database round-trip)
+        entity_hints = self._build_entity_hints(question)
+        if entity_hints:
+            messages.append({
+                "role": "system",
+                "content": entity_hints
+            })
+        
+        # Past corrections of similar queries (learned by the hybrid agent's error recovery)
+        if self.correction_memory is not None:
+            past_fixes = format_few_shot(self.correction_memory.few_shot(question))
+            if past_fixes:
+                messages.append({
+                    "role": "system",
+                    "content": past_fixes
+                })
+        
         # Add conversation history
         for msg in self.conversation_history[-6:]:  # Last 3 exchanges
             messages.append(msg)
@@ -382,21 +833,33 @@ SELECT DISTINCT prob.CODE, MAX(CASE WHEN n.SLOT_NUMBER=6 THEN n.SLOT_VALUE END)
         })
         
         try:
-            response = self.client.chat.completions.create(
-                model=self.deployment,
-                messages=messages,
-                temperature=0.1,
-                max_tokens=1000
-            )
+            request = {
+                "model": self.deployment,
+                "messages": messages,
+                "temperature": 0.1,
+                "max_tokens": 1000
+            }
+            if self.parameterize_queries:
+                request["response_format"] = {"type": "json_object"}
+            response = counted_completion(self.client, 'sql_generation', **request)
             
-            sql_query = response.choices[0].message.content.strip()
+            content = response.choices[0].message.content.strip()
             
-            # Clean up the SQL query
-            sql_query = sql_query.replace("```sql", "").replace("```", "").strip()
+            if self.parameterize_queries:
+                sql_query, params = parse_generated(content)
+                if params is not None and count_placeholders(sql_query) != len(params):
+                    # A template that doesn't match its parameters can't be bound safely
+                    print(f"Warning: Generated template has {count_placeholders(sql_query)} placeholders "
+                          f"but {len(params)} parameters; using literal SQL")
+                    sql_query, params = inline_params(sql_query, params), None
+            else:
+                # Clean up the SQL query
+                sql_query, params = content.replace("```sql", "").replace("```", "").strip(), None
             
             return {
                 "success": True,
                 "sql": sql_query,
+                "params": params,
                 "question": question
             }
             
@@ -407,19 +870,140 @@ SELECT DISTINCT prob.CODE, MAX(CASE WHEN n.SLOT_NUMBER=6 THEN n.SLOT_VALUE END)
                 "question": question
             }
     
-    def _execute_query(self, sql_query: str) -> Dict[str, Any]:
-        """Execute SQL query and return results with detailed error information."""
+    def _parameter_instructions(self) -> str:
+        """Output-format override for parameterized generation (empty when disabled)."""
+        if not self.parameterize_queries:
+            return ""
+        return """
+   OUTPUT FORMAT OVERRIDE: respond with a JSON object {"sql": "<T-SQL template>", "params": [{"value": ..., "type": "string"|"int"|"float"}, ...]}.
+   Put a ? placeholder in the SQL for every code, name, LIKE pattern or other value in WHERE/ON/HAVING
+   and list the values in placeholder order (no quoting or escaping needed).
+   Keep SLOT_NUMBER comparisons (e.g. SLOT_NUMBER = 212) and TOP counts as inline numbers.
+   Example: {"sql": "SELECT CODE FROM MED WHERE SLOT_NUMBER = 212 AND SLOT_VALUE = ?", "params": [{"value": "2947-0", "type": "string"}]}"""
+    
+    def _validate_sql(self, sql_query: str) -> Dict[str, Any]:
+        """
+        Parse and check the SQL against the cached schema (see sql_validator.py).
+        
+        Returns:
+            {"success": True, ...} or an error dict shaped like _execute_query's
+        """
+        validator = getattr(self, 'sql_validator', None)
+        if validator is None:
+            return {"success": True, "validated": False}
+        return validator.validate(sql_query)
+    
+    def _execute_query(self, sql_query: str, params: Optional[List[Any]] = None,
+                       question: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Execute SQL query and return results with detailed error information.
+        
+        Args:
+            sql_query: T-SQL, either a '?' template or SQL with inlined literals
+            params: Values for the template's placeholders. When omitted, predicate
+                    literals are parameterized automatically (if enabled).
+            question: Question the SQL answers (for the slow-query log)
+        """
+        if params is None and self.parameterize_queries:
+            sql_query, params = parameterize(sql_query)
+        started = time.perf_counter()
+        result, sql_query = self._run_rewritten(sql_query, params)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        result["elapsed_ms"] = round(elapsed_ms, 2)
+        STAGE_SECONDS.observe(elapsed_ms / 1000, stage='db_execution')
+        if self.workload_store is not None:
+            try:
+                self.workload_store.record(
+                    sql_query,
+                    elapsed_ms,
+                    row_count=result.get("row_count", 0),
+                    success=result.get("success", False),
+                    error_category=result.get("error_category"),
+                    source="meddata"
+                )
+            except Exception as e:
+                print(f"Warning: Could not record query workload: {e}")
+        self._log_slow_query(question, inline_params(sql_query, params), elapsed_ms, result, "meddata")
+        return result
+    
+    def _log_slow_query(self, question: Optional[str], sql_query: str, elapsed_ms: float,
+                        result: Dict[str, Any], source: str):
+        """Add an execution to the slow-query log (the log applies its threshold)."""
+        if self.slow_query_log is None:
+            return
         try:
-            conn = self._get_connection()
+            self.slow_query_log.record(
+                sql_query,
+                elapsed_ms,
+                question=question,
+                row_count=result.get("row_count", 0),
+                success=result.get("success", False),
+                error_category=result.get("error_category"),
+                statistics=result.get("statistics"),
+                source=source
+            )
+        except Exception as e:
+            print(f"Warning: Could not record slow query: {e}")
+    
+    def _enable_statistics(self, cursor) -> bool:
+        """Turn on execution statistics capture for a cursor when configured; returns whether it is on."""
+        if self.slow_query_log is None or not self.slow_query_log.capture_statistics:
+            return False
+        try:
+            self.backend.enable_statistics(cursor, self.slow_query_log.capture_plan)
+            return True
+        except Exception as e:
+            # e.g. SHOWPLAN permission missing: run the query without statistics
+            print(f"Warning: Could not enable execution statistics: {e}")
+            return False
+    
+    def _run_rewritten(self, sql_query: str, params: Optional[List[Any]]) -> Tuple[Dict[str, Any], str]:
+        """
+        Run the single-pass pivot form of a query with per-attribute self-joins.
+        
+        The first time a query shape is rewritten, the original runs too and the results
+        are compared; a shape whose results differ keeps its original form from then on.
+        
+        Returns:
+            (result, SQL that produced it)
+        """
+        rewrite = self.eav_rewriter.rewrite(sql_query) if self.eav_rewriter is not None else None
+        if rewrite is None:
+            return self._run_query(sql_query, params), sql_query
+        
+        result = self._run_query(rewrite.sql, params)
+        if self.eav_rewriter.status(rewrite.key) != VERIFIED:
+            original = self._run_query(sql_query, params)
+            if original.get("success"):
+                equivalent = result.get("success") and results_equivalent(result["results"], original["results"])
+                self.eav_rewriter.record_verification(rewrite.key, equivalent)
+                if not equivalent:
+                    return original, sql_query
+            elif not result.get("success"):
+                # Both failed: report the error of the query that was actually generated
+                return original, sql_query
+        result["rewritten"] = True
+        return result, rewrite.sql
+    
+    def _run_query(self, sql_query: str, params: Optional[List[Any]] = None) -> Dict[str, Any]:
+        """Run SQL on the execution backend and map errors to categories and hints."""
+        conn = None
+        try:
+            # Checked out with the execution profile (read-only, lock timeout, row ceiling)
+            conn = self.backend.checkout()
+            DB_CONNECTIONS_IN_USE.inc()
             cursor = conn.cursor()
+            capture = self._enable_statistics(cursor)
             
-            cursor.execute(sql_query)
+            executed = self.backend.transpile(sql_query)
+            self.backend.execute(cursor, executed, params)
             
             # Get column names
             columns = [desc[0] for desc in cursor.description] if cursor.description else []
             
-            # Fetch results
-            rows = cursor.fetchall()
+            # Fetch results (at most the profile's row limit)
+            rows, truncated = self.backend.fetch(cursor) if cursor.description else ([], False)
+            statistics = self._collect_statistics(cursor, executed, params) if capture else None
             
             # Convert to list of dictionaries
             results = []
@@ -427,58 +1011,84 @@ SELECT DISTINCT prob.CODE, MAX(CASE WHEN n.SLOT_NUMBER=6 THEN n.SLOT_VALUE END)
                 results.append({columns[i]: str(row[i]) if row[i] is not None else None 
                                for i in range(len(columns))})
             
-            conn.close()
-            
-            return {
+            result = {
                 "success": True,
                 "results": results,
                 "row_count": len(results),
                 "columns": columns
             }
+            if truncated:
+                result["truncated"] = True
+                result["row_limit"] = self.execution_profile.row_limit
+            if statistics:
+                result["statistics"] = statistics
+            return result
             
         except Exception as e:
-            # Extract detailed error information for better debugging
-            error_str = str(e)
-            error_details = {
-                "success": False,
-                "error": error_str,
-                "sql_query": sql_query,
-                "error_type": type(e).__name__
-            }
-            
-            # Parse common SQL Server errors to provide helpful context
-            if "Incorrect syntax" in error_str:
-                error_details["error_category"] = "SYNTAX_ERROR"
-                # Provide specific hints for common syntax errors
-                if "LIMIT" in error_str:
-                    error_details["hint"] = "T-SQL doesn't support LIMIT. Use TOP instead (e.g., SELECT TOP 10 instead of LIMIT 10)"
-                elif "The" in error_str and "keyword" in error_str:
-                    error_details["hint"] = "A SQL keyword is missing or incorrect. Check the query syntax carefully."
-                else:
-                    error_details["hint"] = "The generated SQL has a syntax error. Check for missing keywords, unmatched parentheses, or incorrect table/column names."
-            elif "Invalid column name" in error_str or "Column name" in error_str:
-                error_details["error_category"] = "COLUMN_ERROR"
-                error_details["hint"] = "The SQL references a column that doesn't exist. Verify slot numbers and column names match the schema."
-            elif "Invalid table name" in error_str or "Table name" in error_str:
-                error_details["error_category"] = "TABLE_ERROR"
-                error_details["hint"] = "The SQL references a table that doesn't exist. Valid tables are: MED, MED_SLOTS"
-            elif "Ambiguous column" in error_str:
-                error_details["error_category"] = "AMBIGUOUS_REFERENCE"
-                error_details["hint"] = "Multiple tables have a column with this name. Use aliases (e.g., m1.CODE vs m2.CODE)"
-            elif "Conversion failed" in error_str or "Cannot convert" in error_str:
-                error_details["error_category"] = "TYPE_ERROR"
-                error_details["hint"] = "There's a data type mismatch. Verify that JOIN conditions compare compatible types."
-            elif "An expression of non-boolean" in error_str or "specified in a context where a condition" in error_str:
-                error_details["error_category"] = "BOOLEAN_ERROR"
-                error_details["hint"] = "A WHERE or JOIN condition is invalid. Make sure comparisons return true/false values."
-            elif "GROUP BY" in error_str or "aggregate" in error_str:
-                error_details["error_category"] = "AGGREGATE_ERROR"
-                error_details["hint"] = "Check that all non-aggregated columns in SELECT are in the GROUP BY clause."
+            return self._error_details(e, sql_query)
+        finally:
+            if conn is not None:
+                DB_CONNECTIONS_IN_USE.dec()
+                conn.close()
+    
+    def _collect_statistics(self, cursor, sql_query: str, params: Optional[List[Any]]) -> Optional[Dict[str, Any]]:
+        """Execution statistics of the statement just fetched (None if they could not be read)."""
+        try:
+            return self.backend.collect_statistics(cursor, sql_query, params, self.slow_query_log.capture_plan)
+        except Exception as e:
+            print(f"Warning: Could not capture execution statistics: {e}")
+            return None
+    
+    def _error_details(self, e: Exception, sql_query: str) -> Dict[str, Any]:
+        """Map a database error to a failure dict with error_category and hint."""
+        # Extract detailed error information for better debugging
+        error_str = str(e)
+        error_details = {
+            "success": False,
+            "error": error_str,
+            "sql_query": sql_query,
+            "error_type": type(e).__name__
+        }
+        
+        # Parse common SQL Server (and local SQLite/DuckDB) errors to provide helpful context
+        error_lower = error_str.lower()
+        if "Incorrect syntax" in error_str or "syntax error" in error_lower:
+            error_details["error_category"] = "SYNTAX_ERROR"
+            # Provide specific hints for common syntax errors
+            if "LIMIT" in error_str:
+                error_details["hint"] = "T-SQL doesn't support LIMIT. Use TOP instead (e.g., SELECT TOP 10 instead of LIMIT 10)"
+            elif "The" in error_str and "keyword" in error_str:
+                error_details["hint"] = "A SQL keyword is missing or incorrect. Check the query syntax carefully."
             else:
-                error_details["error_category"] = "UNKNOWN_ERROR"
-                error_details["hint"] = "An unexpected database error occurred. Check the SQL syntax and database connectivity."
-            
-            return error_details
+                error_details["hint"] = "The generated SQL has a syntax error. Check for missing keywords, unmatched parentheses, or incorrect table/column names."
+        elif ("Invalid column name" in error_str or "Column name" in error_str
+              or "no such column" in error_lower or "referenced column" in error_lower):
+            error_details["error_category"] = "COLUMN_ERROR"
+            error_details["hint"] = "The SQL references a column that doesn't exist. Verify slot numbers and column names match the schema."
+        elif ("Invalid table name" in error_str or "Table name" in error_str
+              or "no such table" in error_lower or "table with name" in error_lower):
+            error_details["error_category"] = "TABLE_ERROR"
+            error_details["hint"] = "The SQL references a table that doesn't exist. Valid tables are: MED, MED_SLOTS"
+        elif "Ambiguous column" in error_str or "ambiguous" in error_lower:
+            error_details["error_category"] = "AMBIGUOUS_REFERENCE"
+            error_details["hint"] = "Multiple tables have a column with this name. Use aliases (e.g., m1.CODE vs m2.CODE)"
+        elif "Conversion failed" in error_str or "Cannot convert" in error_str:
+            error_details["error_category"] = "TYPE_ERROR"
+            error_details["hint"] = "There's a data type mismatch. Verify that JOIN conditions compare compatible types."
+        elif "An expression of non-boolean" in error_str or "specified in a context where a condition" in error_str:
+            error_details["error_category"] = "BOOLEAN_ERROR"
+            error_details["hint"] = "A WHERE or JOIN condition is invalid. Make sure comparisons return true/false values."
+        elif "Lock request time out" in error_str or "database is locked" in error_lower:
+            error_details["error_category"] = "LOCK_TIMEOUT"
+            error_details["hint"] = "The query waited too long for locks held by a data refresh. Retry later or narrow the query."
+        elif "GROUP BY" in error_str or "aggregate" in error_str:
+            error_details["error_category"] = "AGGREGATE_ERROR"
+            error_details["hint"] = "Check that all non-aggregated columns in SELECT are in the GROUP BY clause."
+        else:
+            error_details["error_category"] = "UNKNOWN_ERROR"
+            error_details["hint"] = "An unexpected database error occurred. Check the SQL syntax and database connectivity."
+        
+        return error_details
     
     def _format_response(self, question: str, sql_query: str, query_results: Dict[str, Any]) -> str:
         """Format the query results into a natural language response using POML-enhanced prompting."""
@@ -498,7 +1108,7 @@ SELECT DISTINCT prob.CODE, MAX(CASE WHEN n.SLOT_NUMBER=6 THEN n.SLOT_VALUE END)
         if self.use_poml:
             messages.append({
                 "role": "system",
-                "content": MEDICAL_ONTOLOGY_SYSTEM_PROMPT
+                "content": ontology_system_prompt(self.has_ref_code)
             })
         
         messages.append({
@@ -527,7 +1137,9 @@ Please provide a clear, informative answer about these medical concepts."""
         })
         
         try:
-            response = self.client.chat.completions.create(
+            response = counted_completion(
+                self.client,
+                'sql_response',
                 model=self.deployment,
                 messages=messages,
                 temperature=0.3,
@@ -550,16 +1162,37 @@ Please provide a clear, informative answer about these medical concepts."""
         Returns:
             Dictionary with success status, response, SQL query, and results
         """
-        # Generate SQL query
-        sql_result = self._generate_sql_query(question)
+        self.refresh_ontology_if_stale()
         
-        if not sql_result.get("success"):
-            return sql_result
+        # Exact-code lookups are answered from the in-memory dictionaries
+        query_results = self._try_code_fast_path(question)
+        record_cache('code_fast_path', query_results is not None)
         
-        sql_query = sql_result["sql"]
+        # Multi-hop questions are planned as sub-queries (falls back to one query)
+        if not query_results and self.query_planner is not None:
+            with stage_timer('planning'):
+                query_results = self.query_planner.run(question)
         
-        # Execute query
-        query_results = self._execute_query(sql_query)
+        if query_results:
+            sql_query = query_results["sql"]
+        else:
+            # Generate SQL query
+            with stage_timer('sql_generation'):
+                sql_result = self._generate_sql_query(question)
+            
+            if not sql_result.get("success"):
+                return sql_result
+            
+            sql_query = sql_result["sql"]
+            params = sql_result.get("params")
+            
+            # Catch invalid SQL locally before the database round-trip
+            query_results = self._validate_sql(sql_query)
+            if query_results.get("success"):
+                query_results = self._execute_query(sql_query, params, question=question)
+            
+            # Callers, memory and correction prompts see the SQL with values inlined
+            sql_query = inline_params(sql_query, params)
         
         if not query_results.get("success"):
             # Return error with helpful information for General Agent to interpret
@@ -574,7 +1207,8 @@ Please provide a clear, informative answer about these medical concepts."""
             }
         
         # Format response
-        response_text = self._format_response(question, sql_query, query_results)
+        with stage_timer('sql_response'):
+            response_text = self._format_response(question, sql_query, query_results)
         
         # Update conversation history
         self.conversation_history.append({
@@ -593,12 +1227,34 @@ Please provide a clear, informative answer about these medical concepts."""
             "response": response_text,
             "results": query_results["results"],
             "row_count": query_results["row_count"],
-            "columns": query_results.get("columns", [])
+            "columns": query_results.get("columns", []),
+            "truncated": query_results.get("truncated", False),
+            "fast_path": query_results.get("fast_path", False),
+            "plan": query_results.get("plan"),
+            "db_elapsed_ms": query_results.get("elapsed_ms"),
+            "statistics": summarize_statistics(query_results.get("statistics"))
         }
     
     def clear_history(self):
         """Clear conversation history."""
-        self.conversation_history = []
+        self.conversation_history.clear()
+    
+    def fork(self, conversation_history: Optional[List[Dict[str, str]]] = None) -> 'MedDataSQLAgent':
+        """
+        Agent with its own conversation history that shares this agent's model client,
+        backend, schema, ontology cache and query stores - for sessions and batch questions
+        answered concurrently without reloading anything.
+        
+        Args:
+            conversation_history: History list the fork reads and appends to (default: a new one)
+        """
+        forked = copy.copy(self)
+        forked.conversation_history = conversation_history if conversation_history is not None else []
+        forked._fork_of = self._fork_of or self
+        if self.query_planner is not None:
+            forked.query_planner = copy.copy(self.query_planner)
+            forked.query_planner.agent = forked
+        return forked
     
     def get_schema(self) -> str:
         """Get the database schema information."""
@@ -614,6 +1270,7 @@ def create_meddata_agent_from_env() -> MedDataSQLAgent:
     """
     import os
     
+    execution_profile = ExecutionProfile.from_env('MEDDATA')
     return MedDataSQLAgent(
         sql_server=os.getenv('MEDDATA_SQL_SERVER'),
         sql_database=os.getenv('MEDDATA_SQL_DATABASE', 'MedData'),
@@ -623,5 +1280,16 @@ def create_meddata_agent_from_env() -> MedDataSQLAgent:
         azure_openai_api_key=os.getenv('AZURE_OPENAI_API_KEY'),
         azure_openai_deployment=os.getenv('AZURE_OPENAI_DEPLOYMENT'),
         use_azure_ad=os.getenv('MEDDATA_USE_AZURE_AD', 'true').lower() == 'true',
-        use_poml=True  # Enable POML by default
+        use_poml=True,  # Enable POML by default
+        use_name_index=os.getenv('MEDDATA_NAME_INDEX', 'true').lower() == 'true',
+        cache_check_interval=int(os.getenv('MEDDATA_CACHE_CHECK_SECONDS', '300')),
+        snapshot_path=os.getenv('MEDDATA_SNAPSHOT_PATH'),
+        change_poll_interval=float(os.getenv('MEDDATA_CHANGE_POLL_SECONDS', '30')),
+        backend=create_backend_from_env('MEDDATA', default_script=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'database', 'meddata.sql'), profile=execution_profile),
+        parameterize_queries=os.getenv('MEDDATA_PARAMETERIZE', 'true').lower() == 'true',
+        eav_rewriter=EAVRewriter(PivotView.parse(os.getenv('MEDDATA_PIVOT_VIEW')))
+        if os.getenv('MEDDATA_EAV_REWRITE', 'true').lower() == 'true' else None,
+        execution_profile=execution_profile,
+        use_query_planner=os.getenv('MEDDATA_QUERY_PLANNER', 'true').lower() == 'true',
+        plan_workers=int(os.getenv('MEDDATA_PLAN_WORKERS', '4'))
     )
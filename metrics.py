@@ -0,0 +1,308 @@
+"""
+Pipeline Metrics
+Counters, gauges and histograms for the query pipeline, served in the Prometheus text
+format at /metrics.
+
+Recording a value is a dictionary lookup and a few additions under a per-metric lock, so
+instrumentation stays on in production. Gauges that describe other components (sessions,
+caches) are sampled by callbacks only when /metrics is scraped.
+
+Metrics are per process: with several server workers, scrape each worker (or run one worker
+per container) and aggregate in Prometheus.
+
+Pipeline metrics (module globals below):
+    meddata_query_seconds{outcome}                  End-to-end /api/query latency
+    meddata_stage_seconds{stage}                    routing, planning, sql_generation, db_execution,
+                                                    sql_response, general_agent, formatting, memory_write
+    meddata_llm_calls_total{component,outcome}      Model calls
+    meddata_llm_tokens_total{component,kind}        Prompt and completion tokens
+    meddata_retries_total{error_category}           Correction retries of failed SQL
+    meddata_query_errors_total{error_category}      Failed questions
+    meddata_cache_requests_total{cache,result}      Cache hits and misses
+    meddata_db_connections_in_use                   Connections checked out for generated SQL
+"""
+
+import bisect
+import contextlib
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+
+# Latency buckets in seconds: sub-millisecond cache lookups up to minute-long retried questions
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"] + self._samples()
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """Monotonically increasing count per label set."""
+
+    kind = 'counter'
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, help_text, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def values(self) -> Dict[Tuple[str, ...], float]:
+        with self._lock:
+            return dict(self._values)
+
+    def _samples(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                for key, value in sorted(self.values().items())]
+
+
+class Gauge(_Metric):
+    """Current value per label set, set directly or sampled from a callback at scrape time."""
+
+    kind = 'gauge'
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = (),
+                 callback: Optional[Callable[[], object]] = None):
+        """
+        Args:
+            callback: Returns a number, or {label value tuple: number} for labelled gauges
+        """
+        super().__init__(name, help_text, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self.callback = callback
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def _samples(self) -> List[str]:
+        if self.callback is not None:
+            try:
+                sampled = self.callback()
+            except Exception as e:
+                print(f"Warning: Metric {self.name} could not be sampled: {e}")
+                return []
+            values = sampled if isinstance(sampled, dict) else {(): sampled}
+        else:
+            with self._lock:
+                values = dict(self._values)
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                for key, value in sorted(values.items()) if value is not None]
+
+
+class Histogram(_Metric):
+    """Bucketed distribution (cumulative buckets, sum and count) per label set."""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [per-bucket counts (last is +Inf), sum]
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        """Observe the duration of a with-block (also when it raises)."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels) -> int:
+        with self._lock:
+            series = self._series.get(self._key(labels))
+            return sum(series[0]) if series else 0
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            snapshot = {key: (list(series[0]), series[1]) for key, series in self._series.items()}
+        lines = []
+        for key, (counts, total) in sorted(snapshot.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, ('le', _format_value(bound)))} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """Named metrics rendered together in the Prometheus text format."""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, help_text, labelnames))
+
+    def gauge(self, name: str, help_text: str, labelnames: Tuple[str, ...] = (),
+              callback: Optional[Callable[[], object]] = None) -> Gauge:
+        """A gauge; registering an existing name again replaces its callback (app reloads)."""
+        gauge = self._register(Gauge(name, help_text, labelnames, callback))
+        if callback is not None:
+            gauge.callback = callback
+        return gauge
+
+    def histogram(self, name: str, help_text: str, labelnames: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help_text, labelnames, buckets))
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# Process-wide registry and the pipeline's metrics
+registry = MetricsRegistry()
+
+QUERY_SECONDS = registry.histogram(
+    'meddata_query_seconds', 'End-to-end latency of answered questions', ('outcome',))
+STAGE_SECONDS = registry.histogram(
+    'meddata_stage_seconds', 'Latency of each query pipeline stage', ('stage',))
+LLM_CALLS = registry.counter(
+    'meddata_llm_calls_total', 'Model calls by pipeline component', ('component', 'outcome'))
+LLM_TOKENS = registry.counter(
+    'meddata_llm_tokens_total', 'Model tokens by pipeline component', ('component', 'kind'))
+RETRIES = registry.counter(
+    'meddata_retries_total', 'Correction retries of failed SQL', ('error_category',))
+QUERY_ERRORS = registry.counter(
+    'meddata_query_errors_total', 'Questions that failed', ('error_category',))
+CACHE_REQUESTS = registry.counter(
+    'meddata_cache_requests_total', 'Cache lookups by cache and result (hit/miss)', ('cache', 'result'))
+DB_CONNECTIONS_IN_USE = registry.gauge(
+    'meddata_db_connections_in_use', 'Database connections checked out for generated SQL')
+
+
+def stage_timer(stage: str):
+    """Context manager timing one pipeline stage."""
+    return STAGE_SECONDS.time(stage=stage)
+
+
+def record_llm_call(component: str, response=None, error: bool = False):
+    """
+    Count a model call and its tokens.
+
+    Args:
+        component: Pipeline component (sql_generation, sql_response, planner, general_agent)
+        response: OpenAI chat completion (usage) or Agent Framework run response (usage_details)
+        error: The call failed
+    """
+    LLM_CALLS.inc(component=component, outcome='error' if error else 'ok')
+    if response is None:
+        return
+    usage = getattr(response, 'usage', None)
+    if usage is not None:
+        prompt, completion = getattr(usage, 'prompt_tokens', None), getattr(usage, 'completion_tokens', None)
+    else:
+        usage = getattr(response, 'usage_details', None)
+        prompt = getattr(usage, 'input_token_count', None) if usage is not None else None
+        completion = getattr(usage, 'output_token_count', None) if usage is not None else None
+    if prompt:
+        LLM_TOKENS.inc(prompt, component=component, kind='prompt')
+    if completion:
+        LLM_TOKENS.inc(completion, component=component, kind='completion')
+
+
+def counted_completion(client, component: str, **request):
+    """client.chat.completions.create(**request), counted (and its tokens) under component."""
+    try:
+        response = client.chat.completions.create(**request)
+    except Exception:
+        record_llm_call(component, error=True)
+        raise
+    record_llm_call(component, response)
+    return response
+
+
+def record_cache(cache: str, hit: bool):
+    """Count a cache lookup."""
+    CACHE_REQUESTS.inc(cache=cache, result='hit' if hit else 'miss')
+
+
+def cache_hit_ratios() -> Dict[Tuple[str], float]:
+    """Hit ratio per cache from meddata_cache_requests_total (for the ratio gauge)."""
+    totals: Dict[str, List[float]] = {}
+    for (cache, result), value in CACHE_REQUESTS.values().items():
+        counts = totals.setdefault(cache, [0, 0])
+        counts[0 if result == 'hit' else 1] += value
+    return {(cache,): hits / (hits + misses) for cache, (hits, misses) in totals.items() if hits + misses}
+
+
+registry.gauge('meddata_cache_hit_ratio', 'Hit ratio per cache since start', ('cache',), callback=cache_hit_ratios)
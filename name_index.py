@@ -0,0 +1,297 @@
+"""
+N-gram Name Index for PRINT-NAME Fuzzy Search
+In-process trigram inverted index over medical concept names (slot 6).
+Resolves free-text name terms to CODE sets with ranking, typo tolerance and prefix support,
+so the SQL agent does not have to scan MED with SLOT_VALUE LIKE '%term%'.
+
+The server-side MED_NAME_TRIGRAMS side table (database/meddata.sql, refreshed by the
+recreate_med_*.py loaders with refresh_trigram_table) serves the same lookups when the
+in-process index is disabled or could not be loaded.
+"""
+
+import re
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import AbstractSet, Any, Dict, List, Optional, Set, Tuple
+
+
+NGRAM_SIZE = 3
+
+# Server-side equivalent: MED_NAME_TRIGRAMS side table (see database/meddata.sql)
+TRIGRAM_TABLE = 'MED_NAME_TRIGRAMS'
+
+TRIGRAM_TABLE_SEARCH_SQL = """
+SELECT TOP {top_k} h.CODE, h.MATCHED_TRIGRAMS,
+       (SELECT MIN(n.SLOT_VALUE) FROM MED n WHERE n.CODE = h.CODE AND n.SLOT_NUMBER = 6) AS NAME
+FROM (
+    SELECT t.CODE, COUNT(*) AS MATCHED_TRIGRAMS
+    FROM MED_NAME_TRIGRAMS t
+    WHERE t.TRIGRAM IN ({placeholders})
+    GROUP BY t.CODE
+    HAVING COUNT(*) >= ?
+) h
+ORDER BY h.MATCHED_TRIGRAMS DESC, h.CODE
+"""
+
+
+@dataclass
+class NameMatch:
+    """A ranked name search hit."""
+    code: str
+    name: str
+    score: float
+
+
+def normalize_name(text: str) -> str:
+    """Lowercase and collapse punctuation/whitespace so names compare token by token."""
+    return re.sub(r'[^a-z0-9]+', ' ', (text or '').lower()).strip()
+
+
+def _token_ngrams(token: str, prefix: bool = False) -> List[str]:
+    """Padded n-grams of a single token; prefix mode leaves the end open."""
+    padded = '$' * (NGRAM_SIZE - 1) + token + ('' if prefix else '$')
+    return [padded[i:i + NGRAM_SIZE] for i in range(len(padded) - NGRAM_SIZE + 1)]
+
+
+class NameIndex:
+    """
+    Trigram inverted index over concept names.
+
+    Names are split into tokens; each distinct token is indexed by its padded trigrams.
+    A query token is matched against the token vocabulary (exact, prefix, or trigram
+    similarity for typos), and documents are ranked by the mean best-token similarity
+    across all query tokens.
+    """
+
+    def __init__(self, min_token_similarity: float = 0.5):
+        """
+        Initialize an empty index.
+
+        Args:
+            min_token_similarity: Minimum trigram (Dice) similarity for a fuzzy token match
+        """
+        self.min_token_similarity = min_token_similarity
+
+        # Documents: one per (code, name) pair
+        self._docs: List[Tuple[str, str]] = []
+        self._doc_ids: Dict[Tuple[str, str], int] = {}
+
+        # Token vocabulary and postings
+        self._token_ids: Dict[str, int] = {}
+        self._tokens: List[str] = []
+        self._token_grams: List[Set[str]] = []
+        self._gram_postings: Dict[str, Set[int]] = defaultdict(set)
+        self._token_docs: Dict[int, Set[int]] = defaultdict(set)
+
+    def __len__(self) -> int:
+        return len(self._doc_ids)
+
+    @classmethod
+    def build(cls, names, **kwargs) -> 'NameIndex':
+        """
+        Build an index from (code, name) pairs.
+
+        Args:
+            names: Iterable of (code, name) tuples
+
+        Returns:
+            Populated NameIndex
+        """
+        index = cls(**kwargs)
+        for code, name in names:
+            index.add(code, name)
+        return index
+
+    def _token_id(self, token: str) -> int:
+        """Get or create the vocabulary id for a token."""
+        token_id = self._token_ids.get(token)
+        if token_id is None:
+            token_id = len(self._tokens)
+            self._token_ids[token] = token_id
+            self._tokens.append(token)
+            grams = set(_token_ngrams(token))
+            self._token_grams.append(grams)
+            for gram in grams:
+                self._gram_postings[gram].add(token_id)
+        return token_id
+
+    def add(self, code: str, name: str):
+        """Index a single (code, name) pair."""
+        key = (str(code), name)
+        if not name or key in self._doc_ids:
+            return
+        doc_id = len(self._docs)
+        self._docs.append(key)
+        self._doc_ids[key] = doc_id
+        for token in set(normalize_name(name).split()):
+            self._token_docs[self._token_id(token)].add(doc_id)
+
+    def _match_token(self, query_token: str, prefix: bool) -> Dict[int, float]:
+        """Find vocabulary tokens similar to a query token, with their similarity."""
+        matches: Dict[int, float] = {}
+
+        exact_id = self._token_ids.get(query_token)
+        if exact_id is not None:
+            matches[exact_id] = 1.0
+
+        # Candidate tokens share at least one trigram with the query token
+        candidates: Set[int] = set()
+        for gram in set(_token_ngrams(query_token, prefix=prefix)):
+            candidates.update(self._gram_postings.get(gram, ()))
+
+        full_grams = set(_token_ngrams(query_token))
+        for token_id in candidates:
+            if token_id in matches:
+                continue
+            token = self._tokens[token_id]
+            if prefix and token.startswith(query_token):
+                matches[token_id] = 0.9
+                continue
+            dice = 2 * len(full_grams & self._token_grams[token_id]) / (len(full_grams) + len(self._token_grams[token_id]))
+            if dice >= self.min_token_similarity:
+                matches[token_id] = dice
+
+        return matches
+
+    def search(self, term: str, top_k: int = 10, min_score: float = 0.5, prefix: bool = True,
+               exclude: Optional[AbstractSet[str]] = None) -> List[NameMatch]:
+        """
+        Ranked fuzzy search over indexed names.
+
+        Args:
+            term: Free-text name term (e.g., "glucose", "serum sod")
+            top_k: Maximum number of matches to return
+            min_score: Minimum document score (0-1) to include
+            prefix: Treat the last query token as a prefix
+            exclude: CODEs to leave out (before top_k is applied)
+
+        Returns:
+            Matches ordered by descending score, then shorter names first
+        """
+        query_tokens = normalize_name(term).split()
+        if not query_tokens:
+            return []
+
+        doc_scores: Dict[int, float] = defaultdict(float)
+        for position, query_token in enumerate(query_tokens):
+            is_prefix = prefix and position == len(query_tokens) - 1
+            best_for_doc: Dict[int, float] = {}
+            for token_id, similarity in self._match_token(query_token, is_prefix).items():
+                for doc_id in self._token_docs.get(token_id, ()):
+                    if similarity > best_for_doc.get(doc_id, 0.0):
+                        best_for_doc[doc_id] = similarity
+            for doc_id, similarity in best_for_doc.items():
+                doc_scores[doc_id] += similarity
+
+        ranked = []
+        for doc_id, total in doc_scores.items():
+            score = total / len(query_tokens)
+            if score >= min_score:
+                code, name = self._docs[doc_id]
+                if exclude and code in exclude:
+                    continue
+                ranked.append(NameMatch(code=code, name=name, score=round(score, 3)))
+
+        ranked.sort(key=lambda match: (-match.score, len(match.name), match.code))
+        return ranked[:top_k]
+
+    def resolve(self, term: str, min_score: float = 0.8, limit: int = 50) -> Set[str]:
+        """
+        Resolve a name term to the set of matching CODEs.
+
+        Args:
+            term: Free-text name term
+            min_score: Minimum match score to accept
+            limit: Maximum number of candidate matches considered
+
+        Returns:
+            Set of CODE strings
+        """
+        return {match.code for match in self.search(term, top_k=limit, min_score=min_score)}
+
+
+class LayeredNameIndex:
+    """
+    Read-only search over a base NameIndex plus an overlay index holding the current names
+    of CODEs changed since the base was built (their base entries are ignored).
+    """
+
+    def __init__(self, base: NameIndex, overlay: NameIndex, replaced: AbstractSet[str]):
+        """
+        Args:
+            base: Index over the full row set
+            overlay: Index over the replaced CODEs' current names
+            replaced: CODEs whose base entries are stale
+        """
+        self.base = base
+        self.overlay = overlay
+        self.replaced = replaced
+
+    def __len__(self) -> int:
+        return len(self.base) + len(self.overlay)
+
+    def search(self, term: str, top_k: int = 10, min_score: float = 0.5, prefix: bool = True) -> List[NameMatch]:
+        """Same as NameIndex.search over the combined contents."""
+        ranked = self.base.search(term, top_k=top_k, min_score=min_score, prefix=prefix, exclude=self.replaced)
+        ranked += self.overlay.search(term, top_k=top_k, min_score=min_score, prefix=prefix)
+        ranked.sort(key=lambda match: (-match.score, len(match.name), match.code))
+        return ranked[:top_k]
+
+    def resolve(self, term: str, min_score: float = 0.8, limit: int = 50) -> Set[str]:
+        """Same as NameIndex.resolve over the combined contents."""
+        return {match.code for match in self.search(term, top_k=limit, min_score=min_score)}
+
+
+def name_trigrams(name: str) -> List[str]:
+    """
+    Distinct trigrams of a name as stored in MED_NAME_TRIGRAMS: lowercased and padded
+    as '  ' + name + ' ' (the same padding database/meddata.sql uses).
+    """
+    padded = '  ' + (name or '').lower() + ' '
+    return sorted({padded[i:i + NGRAM_SIZE] for i in range(len(padded) - NGRAM_SIZE + 1)})
+
+
+def trigram_search_query(term: str, top_k: int = 20, min_overlap: float = 0.6) -> Tuple[str, List[Any]]:
+    """
+    Build a parameterized query against the server-side MED_NAME_TRIGRAMS table.
+
+    Used when the in-process index is not loaded. Each row is (CODE, MATCHED_TRIGRAMS, NAME);
+    MATCHED_TRIGRAMS / len(name_trigrams(term)) is the match score.
+
+    Args:
+        term: Free-text name term
+        top_k: Maximum number of CODEs to return
+        min_overlap: Fraction of the term's trigrams a CODE must contain
+
+    Returns:
+        Tuple of (sql, params)
+    """
+    grams = name_trigrams(term)
+    placeholders = ', '.join('?' for _ in grams)
+    sql = TRIGRAM_TABLE_SEARCH_SQL.format(top_k=int(top_k), placeholders=placeholders)
+    min_hits = max(1, int(len(grams) * min_overlap))
+    return sql, list(grams) + [min_hits]
+
+
+def refresh_trigram_table(conn) -> int:
+    """
+    Rebuild MED_NAME_TRIGRAMS from the current slot-6 names (the table must exist).
+
+    Called by the MED loaders after they reload MED, so the side table does not go stale;
+    database/meddata.sql does the same with one set-based statement.
+
+    Args:
+        conn: DB-API connection (SQL Server or a local copy)
+
+    Returns:
+        Number of trigram rows written
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT DISTINCT CODE, SLOT_VALUE FROM MED WHERE SLOT_NUMBER = 6 AND SLOT_VALUE IS NOT NULL AND SLOT_VALUE <> ''")
+    pairs = sorted({(gram, code) for code, name in cursor.fetchall() for gram in name_trigrams(name)})
+    cursor.execute(f"DELETE FROM {TRIGRAM_TABLE}")
+    if pairs:
+        cursor.executemany(f"INSERT INTO {TRIGRAM_TABLE} (TRIGRAM, CODE) VALUES (?, ?)", pairs)
+    conn.commit()
+    cursor.close()
+    return len(pairs)
@@ -0,0 +1,420 @@
+"""
+In-Process Ontology Cache
+Holds a read-only copy of the MED table and the lookup structures derived from it,
+so hot lookups (name resolution, code lookups) never need a database round-trip.
+"""
+
+import threading
+from collections import Counter, defaultdict
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+from code_dictionary import CodeDictionary, LayeredCodeDictionary
+from name_index import LayeredNameIndex, NameIndex
+from ontology_snapshot import PRINT_NAME_SLOT, REFERENCE_SLOTS, OntologySnapshot
+from ontology_sync import current_sync_version, med_key_columns
+
+# (CODE, SLOT_NUMBER, SLOT_VALUE)
+MedRow = Tuple[str, int, str]
+
+# Deltas are folded into a new base once this many CODEs (and this share of all CODEs) changed
+COMPACT_MIN_CODES = 2000
+COMPACT_FRACTION = 0.05
+
+# A swapped-out cache is closed this long after the swap, when in-flight readers are done
+RETIRE_GRACE_SECONDS = 60
+
+# Cheap fingerprint of MED contents used to detect data changes
+DATA_VERSION_QUERY = """
+SELECT COUNT_BIG(*), CHECKSUM_AGG(BINARY_CHECKSUM(CODE, SLOT_NUMBER, SLOT_VALUE))
+FROM MED
+"""
+
+
+class _Base:
+    """Structures derived from one full row set; never modified after construction."""
+
+    def __init__(self, rows: Sequence[MedRow], snapshot: Optional[OntologySnapshot] = None):
+        self.rows = rows
+        self.snapshot = snapshot
+        # Built on first use (racing builders compute the same value)
+        self._codes: Optional[Set[str]] = None
+        self._adjacency: Optional[Dict[str, List[Tuple[int, str]]]] = None
+        if snapshot is not None:
+            # Persisted in the snapshot and read from the shared mapping
+            self.print_names: Optional[Dict[str, List[str]]] = None
+            self.name_index = snapshot.name_index()
+            self.code_dictionary = snapshot.code_dictionary()
+            return
+        print_names: Dict[str, List[str]] = defaultdict(list)
+        for code, slot, value in rows:
+            if slot == PRINT_NAME_SLOT and value:
+                print_names[code].append(value)
+        self.print_names = dict(print_names)
+        self.name_index = NameIndex.build(
+            (code, name) for code, names in self.print_names.items() for name in names
+        )
+        self.code_dictionary = CodeDictionary.build(rows)
+
+    def _code_set(self) -> Set[str]:
+        if self._codes is None:
+            self._codes = {row[0] for row in self.rows}
+        return self._codes
+
+    @property
+    def code_count(self) -> int:
+        if self.snapshot is not None:
+            return self.snapshot.node_count
+        return len(self._code_set())
+
+    def has_code(self, code: str) -> bool:
+        if self.snapshot is not None:
+            return self.snapshot.node_index(code) is not None
+        return code in self._code_set()
+
+    def names(self, code: str) -> List[str]:
+        """PRINT-NAMEs of a CODE."""
+        if self.snapshot is not None:
+            return self.snapshot.print_names(code)
+        return self.print_names.get(code, [])
+
+    def edges(self, code: str) -> List[Tuple[int, str]]:
+        """Reference-slot edges of a CODE (targets are not checked for existence)."""
+        if self.snapshot is not None:
+            return self.snapshot.related(code)
+        if self._adjacency is None:
+            self._adjacency = _adjacency(self.rows)
+        return self._adjacency.get(code, [])
+
+
+class _Overlay:
+    """Current rows of the CODEs changed since the base was built, with their own small indexes."""
+
+    def __init__(self, rows_by_code: Dict[str, List[MedRow]]):
+        self.rows_by_code = rows_by_code
+        self.codes = frozenset(rows_by_code)
+        self.print_names = {
+            code: [value for _, slot, value in rows if slot == PRINT_NAME_SLOT and value]
+            for code, rows in rows_by_code.items()
+        }
+        self.name_index = NameIndex.build(
+            (code, name) for code, names in self.print_names.items() for name in names
+        )
+        self.code_dictionary = CodeDictionary.build(row for rows in rows_by_code.values() for row in rows)
+        self.adjacency = _adjacency(row for rows in rows_by_code.values() for row in rows)
+
+
+class _State:
+    """One consistent generation of the cache; replaced as a whole, never modified."""
+
+    def __init__(self, base: _Base, overlay: _Overlay, sync_version: Optional[int]):
+        self.base = base
+        self.overlay = overlay
+        self.sync_version = sync_version
+        if overlay.codes:
+            self.name_index = LayeredNameIndex(base.name_index, overlay.name_index, overlay.codes)
+            self.code_dictionary = LayeredCodeDictionary(base.code_dictionary, overlay.code_dictionary, overlay.codes)
+        else:
+            self.name_index = base.name_index
+            self.code_dictionary = base.code_dictionary
+        self._statistics: Optional[Dict[str, Any]] = None
+
+    def rows(self) -> Iterator[MedRow]:
+        """Base rows of unchanged CODEs followed by the changed CODEs' current rows."""
+        replaced = self.overlay.codes
+        for row in self.base.rows:
+            if row[0] not in replaced:
+                yield row
+        for rows in self.overlay.rows_by_code.values():
+            yield from rows
+
+    def has_code(self, code: str) -> bool:
+        if code in self.overlay.codes:
+            return bool(self.overlay.rows_by_code[code])
+        return self.base.has_code(code)
+
+
+def _adjacency(rows: Iterable[MedRow]) -> Dict[str, List[Tuple[int, str]]]:
+    """CODE -> reference-slot edges, sorted by (target, slot)."""
+    adjacency: Dict[str, List[Tuple[int, str]]] = defaultdict(list)
+    for source, slot, value in rows:
+        if slot in REFERENCE_SLOTS and value:
+            adjacency[source].append((slot, value))
+    for edges in adjacency.values():
+        edges.sort(key=lambda edge: (edge[1], edge[0]))
+    return dict(adjacency)
+
+
+class OntologyCache:
+    """
+    In-memory copy of MED with derived indexes.
+
+    The contents live in one immutable _State: a base built from a full row set plus an
+    overlay with the current rows of CODEs changed since (change tracking deltas). Applying
+    a delta builds a new overlay from the changed CODEs only and swaps the state reference,
+    so readers never block and never see a structure being modified. Once the overlay grows
+    past COMPACT_MIN_CODES (and COMPACT_FRACTION of all CODEs) it is folded into a new base.
+    """
+
+    def __init__(self, rows: Sequence[MedRow], version: Optional[str] = None,
+                 snapshot: Optional[OntologySnapshot] = None, sync_version: Optional[int] = None):
+        """
+        Build the cache and its derived structures from MED rows.
+
+        Args:
+            rows: Sequence of (code, slot_number, slot_value) tuples
+            version: Data version the rows were read at (see fetch_version)
+            snapshot: Memory-mapped snapshot the rows come from, if any
+            sync_version: Change tracking version the rows are current to (see ontology_sync)
+        """
+        self.version = version
+        self.loaded_at = datetime.now()
+        self._state = _State(_Base(rows, snapshot), _Overlay({}), sync_version)
+        # MED key columns and key -> CODE map read with the rows, handed to the change tracker
+        self.key_columns: Optional[List[str]] = None
+        self.key_codes: Optional[Dict[tuple, str]] = None
+        # Serializes writers (delta application); readers take self._state once and never lock
+        self._lock = threading.Lock()
+        # Snapshots replaced by compaction, closed by close()
+        self._retired: List[OntologySnapshot] = []
+
+    @property
+    def rows(self) -> Sequence[MedRow]:
+        """All current MED rows (materialized when deltas have been applied)."""
+        state = self._state
+        return list(state.rows()) if state.overlay.codes else state.base.rows
+
+    @property
+    def snapshot(self) -> Optional[OntologySnapshot]:
+        return self._state.base.snapshot
+
+    @property
+    def sync_version(self) -> Optional[int]:
+        return self._state.sync_version
+
+    @property
+    def name_index(self):
+        """PRINT-NAME index (NameIndex, or LayeredNameIndex once deltas have been applied)."""
+        return self._state.name_index
+
+    @property
+    def code_dictionary(self):
+        """External code dictionaries (CodeDictionary, or LayeredCodeDictionary after deltas)."""
+        return self._state.code_dictionary
+
+    @staticmethod
+    def fetch_version(conn) -> str:
+        """
+        Read the current MED data version.
+
+        Args:
+            conn: Database connection
+
+        Returns:
+            Opaque version string that changes whenever MED rows change
+        """
+        cursor = conn.cursor()
+        try:
+            cursor.execute(DATA_VERSION_QUERY)
+            row_count, checksum = cursor.fetchone()
+        except Exception:
+            # Local SQLite/DuckDB copies have no CHECKSUM_AGG; they only change on re-hydration
+            cursor.execute("SELECT COUNT(*) FROM MED")
+            row_count, checksum = cursor.fetchone()[0], 'local'
+        cursor.close()
+        return f"{row_count}:{checksum}"
+
+    @classmethod
+    def load(cls, conn) -> 'OntologyCache':
+        """
+        Load MED into memory over an open DB-API connection.
+
+        When MED is change tracked under a key without CODE (the surrogate ID), the key ->
+        CODE map the change tracker needs for deleted rows is read in the same scan, so it
+        matches the cached rows exactly.
+
+        Args:
+            conn: Database connection (pyodbc or compatible)
+
+        Returns:
+            Populated OntologyCache
+        """
+        # Read the change tracking version first so no change after it can be missed
+        sync_version = current_sync_version(conn)
+        version = cls.fetch_version(conn)
+        cursor = conn.cursor()
+        key_columns = med_key_columns(cursor) if sync_version is not None else []
+        key_codes = None
+        if key_columns and 'CODE' not in key_columns:
+            width = len(key_columns)
+            key_list = ', '.join(f'[{column}]' for column in key_columns)
+            cursor.execute(f"SELECT {key_list}, CODE, SLOT_NUMBER, SLOT_VALUE FROM MED")
+            rows, key_codes = [], {}
+            for row in cursor.fetchall():
+                code = str(row[width])
+                key_codes[tuple(row[:width])] = code
+                rows.append((code, int(row[width + 1]), str(row[width + 2]) if row[width + 2] is not None else ''))
+        else:
+            cursor.execute("SELECT CODE, SLOT_NUMBER, SLOT_VALUE FROM MED")
+            rows = [
+                (str(code), int(slot), str(value) if value is not None else '')
+                for code, slot, value in cursor.fetchall()
+            ]
+        cursor.close()
+        cache = cls(rows, version=version, sync_version=sync_version)
+        cache.key_columns = key_columns or None
+        cache.key_codes = key_codes
+        return cache
+
+    @classmethod
+    def from_snapshot(cls, path: str) -> 'OntologyCache':
+        """
+        Build the cache from a memory-mapped snapshot instead of the database.
+
+        Rows, relationships, the name index and the code dictionaries are read straight
+        from the shared mapping; nothing is rebuilt in process memory. The change tracking
+        version stored at build time lets the tracker replay changes made since then.
+
+        Args:
+            path: Snapshot file written by ontology_snapshot.py
+
+        Returns:
+            Populated OntologyCache backed by the snapshot
+        """
+        snapshot = OntologySnapshot(path)
+        return cls(snapshot.rows(), version=snapshot.data_version or None, snapshot=snapshot,
+                   sync_version=snapshot.sync_version)
+
+    def close(self):
+        """Release the snapshot mapping(s), if the cache is backed by one; no reads afterwards."""
+        for snapshot in self._retired + [self._state.base.snapshot]:
+            if snapshot is not None:
+                snapshot.close()
+        self._retired = []
+
+    def retire(self, grace_seconds: float = RETIRE_GRACE_SECONDS):
+        """Close the cache once in-flight readers are done with it (after it has been swapped out)."""
+        if self.snapshot is None and not self._retired:
+            return
+        timer = threading.Timer(grace_seconds, self.close)
+        timer.daemon = True
+        timer.start()
+
+    def related(self, code: str, slot: Optional[int] = None) -> List[Tuple[int, str]]:
+        """
+        Outgoing relationships of a CODE over the reference slots.
+
+        Args:
+            code: Source CODE
+            slot: Restrict to one reference slot (e.g. 150)
+
+        Returns:
+            List of (slot_number, target_code)
+        """
+        state = self._state
+        code = str(code)
+        if code in state.overlay.codes:
+            edges = state.overlay.adjacency.get(code, [])
+        else:
+            edges = state.base.edges(code)
+        return [edge for edge in edges
+                if (slot is None or edge[0] == slot) and state.has_code(edge[1])]
+
+    @property
+    def cache_key(self) -> Optional[str]:
+        """Version string for keying caches derived from MED data."""
+        if self.sync_version is not None:
+            return f"ct:{self.sync_version}"
+        return self.version
+
+    def apply_changes(self, rows_by_code: Dict[str, List[MedRow]], sync_version: Optional[int] = None):
+        """
+        Replace all rows of the given CODEs.
+
+        The work is proportional to the CODEs changed since the base was built; the new
+        state is swapped in with one assignment.
+
+        Args:
+            rows_by_code: CODE -> its current rows (empty list if the CODE was deleted)
+            sync_version: Change tracking version the new rows are current to
+        """
+        with self._lock:
+            state = self._state
+            base, overlay = state.base, state.overlay
+            if rows_by_code:
+                changed = dict(overlay.rows_by_code)
+                changed.update(rows_by_code)
+                overlay = _Overlay(changed)
+                if len(changed) >= max(COMPACT_MIN_CODES, COMPACT_FRACTION * base.code_count):
+                    # Fold the overlay into a new base (the old snapshot stays open for readers)
+                    if base.snapshot is not None:
+                        self._retired.append(base.snapshot)
+                    base = _Base(list(_State(base, overlay, None).rows()))
+                    overlay = _Overlay({})
+            self._state = _State(base, overlay, sync_version if sync_version is not None else state.sync_version)
+
+    def statistics(self, top_slots: int = 5) -> Dict[str, Any]:
+        """
+        Row, CODE and slot usage counts computed from the cached rows (no table scans).
+
+        Args:
+            top_slots: Number of most used slots to report
+
+        Returns:
+            Dict with unique_codes, total_rows and top_slots [(slot_number, count), ...]
+        """
+        state = self._state
+        if state._statistics is None:
+            codes, total, slot_counts = set(), 0, Counter()
+            for code, slot, _ in state.rows():
+                codes.add(code)
+                total += 1
+                slot_counts[slot] += 1
+            state._statistics = {'unique_codes': len(codes), 'total_rows': total, 'slot_counts': slot_counts}
+        return {
+            'unique_codes': state._statistics['unique_codes'],
+            'total_rows': state._statistics['total_rows'],
+            'top_slots': state._statistics['slot_counts'].most_common(top_slots),
+        }
+
+    def name_of(self, code: str) -> Optional[str]:
+        """PRINT-NAME of a CODE, if it has one."""
+        state, code = self._state, str(code)
+        names = state.overlay.print_names.get(code) if code in state.overlay.codes else state.base.names(code)
+        return names[0] if names else None
+
+    def describe(self, value: str) -> Optional[str]:
+        """
+        Human-readable description of a CODE or an external code value.
+
+        Args:
+            value: Ontology CODE or external code (LOINC, SNOMED, ...)
+
+        Returns:
+            Description string, or None if the value is unknown
+        """
+        name = self.name_of(value)
+        if name:
+            return name
+
+        hits = self.code_dictionary.find(value)
+        if not hits:
+            return None
+        parts = []
+        for system, codes in hits.items():
+            names = sorted({self.name_of(code) or code for code in codes})
+            parts.append(f"{system}: {', '.join(names[:3])}" + (f" (+{len(names) - 3} more)" if len(names) > 3 else ""))
+        return "; ".join(parts)
+
+    def stats(self) -> Dict[str, Any]:
+        """Summary of what is cached."""
+        state = self._state
+        return {
+            'rows': len(state.base.rows),
+            'changed_codes': len(state.overlay.codes),
+            'names_indexed': len(self.name_index),
+            'external_codes': len(self.code_dictionary),
+            'version': self.version,
+            'sync_version': state.sync_version,
+            'snapshot': state.base.snapshot.path if state.base.snapshot is not None else None,
+            'loaded_at': self.loaded_at.isoformat()
+        }
@@ -0,0 +1,562 @@
+"""
+Memory-Mapped Ontology Snapshot
+Binary snapshot of MED (interned strings, int32 row arrays, CSR relationship adjacency and
+the derived name index and code dictionaries) written once by a builder command and opened
+read-only via mmap by every worker process, so all workers share one physical copy and
+start without querying the database or rebuilding indexes.
+
+File layout (little-endian, every section 8-byte aligned):
+    header      MAGIC, format version, counts, change tracking version (-1 if untracked),
+                section offsets
+    strings     int32 offsets[n_strings + 1] + UTF-8 blob (interned CODEs, slot values,
+                name tokens and trigrams)
+    rows        int32 code_id[n_rows], int32 slot[n_rows], int32 value_id[n_rows]
+    nodes       int32 node_code_id[n_nodes] (sorted by CODE string)
+    adjacency   int32 indptr[n_nodes + 1], int32 target_node[n_edges], int32 edge_slot[n_edges]
+    node rows   int32 indptr[n_nodes + 1], int32 row[n_rows] (each CODE's rows)
+    names       PRINT-NAME index: int32 doc_code_id[n_docs], int32 doc_name_id[n_docs],
+                int32 token_id[n_tokens] (sorted), CSR token -> docs,
+                int32 gram_id[n_grams] (sorted), CSR gram -> tokens
+    dictionary  int32 key_id[n_entries], int32 slot[n_entries], int32 node[n_entries]
+                (external code values, sorted by normalized value)
+    version     UTF-8 data version of the rows
+
+Usage:
+    python ontology_snapshot.py build --output ontology.snap
+    python ontology_snapshot.py info ontology.snap
+"""
+
+import argparse
+import mmap
+import os
+import struct
+import sys
+from array import array
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+
+from code_dictionary import CODE_SYSTEMS, SLOT_TO_SYSTEM, CodeDictionary, normalize_code_value
+from name_index import NameIndex, _token_ngrams
+
+
+MAGIC = b'MEDSNAP1'
+FORMAT_VERSION = 3
+
+PRINT_NAME_SLOT = 6
+
+# Slots whose SLOT_VALUE references another CODE (edges in the adjacency arrays)
+REFERENCE_SLOTS = (3, 4, 15, 149, 150)
+
+SECTIONS = (
+    'string_offsets', 'string_blob', 'row_code', 'row_slot', 'row_value',
+    'node_code', 'indptr', 'edge_target', 'edge_slot',
+    'node_row_indptr', 'node_row',
+    'doc_code', 'doc_name', 'token', 'token_indptr', 'token_doc', 'gram', 'gram_indptr', 'gram_token',
+    'dict_key', 'dict_slot', 'dict_node',
+    'version'
+)
+# Counts: strings, rows, nodes, edges, name docs, tokens, grams, dictionary entries, external codes
+COUNTS = 9
+HEADER_FORMAT = '<8sI' + 'I' * COUNTS + 'q' + 'Q' * len(SECTIONS) * 2
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+MedRow = Tuple[str, int, str]
+
+
+def _int32_bytes(values) -> bytes:
+    """Pack integers as little-endian int32."""
+    packed = array('i', values)
+    if sys.byteorder != 'little':
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def _csr(lists: Sequence[Iterable[int]]) -> Tuple[List[int], List[int]]:
+    """Flatten per-item lists into (indptr, values) arrays."""
+    indptr, values = [0], []
+    for items in lists:
+        values.extend(items)
+        indptr.append(len(values))
+    return indptr, values
+
+
+def write_snapshot(rows: Sequence[MedRow], path: str, data_version: str = '',
+                   sync_version: Optional[int] = None) -> Dict[str, int]:
+    """
+    Write a snapshot file atomically (temp file + os.replace).
+
+    Readers holding the previous file keep their mapping until they reopen, so a swap
+    never exposes a half-written snapshot.
+
+    Args:
+        rows: MED rows as (code, slot_number, slot_value)
+        path: Destination file path
+        data_version: Data version the rows were read at
+        sync_version: Change tracking version the rows are current to (see ontology_sync)
+
+    Returns:
+        Counts of strings, rows, nodes, edges, names and external codes written
+    """
+    # Intern every CODE and slot value
+    string_ids: Dict[str, int] = {}
+    strings: List[str] = []
+
+    def intern(text: str) -> int:
+        string_id = string_ids.get(text)
+        if string_id is None:
+            string_id = len(strings)
+            string_ids[text] = string_id
+            strings.append(text)
+        return string_id
+
+    row_code, row_slot, row_value = [], [], []
+    for code, slot, value in rows:
+        row_code.append(intern(str(code)))
+        row_slot.append(int(slot))
+        row_value.append(intern(value or ''))
+
+    # Nodes are the distinct CODEs, sorted so readers can binary-search them
+    node_codes = sorted({strings[code_id] for code_id in row_code})
+    node_ids = {code: index for index, code in enumerate(node_codes)}
+
+    # CSR adjacency over reference slots (edges only to CODEs present in MED), and each CODE's rows
+    edges: List[List[Tuple[int, int]]] = [[] for _ in node_codes]
+    code_rows: List[List[int]] = [[] for _ in node_codes]
+    for index, (code_id, slot, value_id) in enumerate(zip(row_code, row_slot, row_value)):
+        node = node_ids[strings[code_id]]
+        code_rows[node].append(index)
+        if slot in REFERENCE_SLOTS:
+            target = node_ids.get(strings[value_id])
+            if target is not None:
+                edges[node].append((target, slot))
+    indptr = [0]
+    edge_target, edge_slot = [], []
+    for node_edges in edges:
+        for target, slot in sorted(node_edges):
+            edge_target.append(target)
+            edge_slot.append(slot)
+        indptr.append(len(edge_target))
+    node_row_indptr, node_row = _csr(code_rows)
+
+    # PRINT-NAME index, built the same way as in process; tokens and trigrams sorted for binary search
+    print_names: Dict[str, List[str]] = {}
+    for code_id, slot, value_id in zip(row_code, row_slot, row_value):
+        if slot == PRINT_NAME_SLOT and strings[value_id]:
+            print_names.setdefault(strings[code_id], []).append(strings[value_id])
+    names = NameIndex.build((code, name) for code, values in print_names.items() for name in values)
+    token_order = sorted(range(len(names._tokens)), key=names._tokens.__getitem__)
+    token_position = {token_id: position for position, token_id in enumerate(token_order)}
+    token_indptr, token_doc = _csr(sorted(names._token_docs.get(token_id, ())) for token_id in token_order)
+    grams = sorted(names._gram_postings)
+    gram_indptr, gram_token = _csr(sorted(token_position[token_id] for token_id in names._gram_postings[gram])
+                                   for gram in grams)
+
+    # External code dictionary entries, sorted by normalized value
+    dictionary = CodeDictionary.build(
+        (strings[code_id], slot, strings[value_id]) for code_id, slot, value_id in zip(row_code, row_slot, row_value)
+    )
+    entries = sorted(
+        (key, CODE_SYSTEMS[system], node_ids[code])
+        for system, values in dictionary._forward.items()
+        for key, codes in values.items()
+        for code in codes
+    )
+
+    payloads = {
+        'row_code': _int32_bytes(row_code),
+        'row_slot': _int32_bytes(row_slot),
+        'row_value': _int32_bytes(row_value),
+        'node_code': _int32_bytes(string_ids[code] for code in node_codes),
+        'indptr': _int32_bytes(indptr),
+        'edge_target': _int32_bytes(edge_target),
+        'edge_slot': _int32_bytes(edge_slot),
+        'node_row_indptr': _int32_bytes(node_row_indptr),
+        'node_row': _int32_bytes(node_row),
+        'doc_code': _int32_bytes(intern(code) for code, _ in names._docs),
+        'doc_name': _int32_bytes(intern(name) for _, name in names._docs),
+        'token': _int32_bytes(intern(names._tokens[token_id]) for token_id in token_order),
+        'token_indptr': _int32_bytes(token_indptr),
+        'token_doc': _int32_bytes(token_doc),
+        'gram': _int32_bytes(intern(gram) for gram in grams),
+        'gram_indptr': _int32_bytes(gram_indptr),
+        'gram_token': _int32_bytes(gram_token),
+        'dict_key': _int32_bytes(intern(key) for key, _, _ in entries),
+        'dict_slot': _int32_bytes(slot for _, slot, _ in entries),
+        'dict_node': _int32_bytes(node for _, _, node in entries),
+        'version': data_version.encode('utf-8'),
+    }
+
+    # The string table last: names and dictionary keys above intern strings of their own
+    encoded = [text.encode('utf-8') for text in strings]
+    string_offsets = [0]
+    for blob in encoded:
+        string_offsets.append(string_offsets[-1] + len(blob))
+    payloads['string_offsets'] = _int32_bytes(string_offsets)
+    payloads['string_blob'] = b''.join(encoded)
+
+    # Lay sections out after the header, each 8-byte aligned
+    offsets, cursor = [], HEADER_SIZE
+    for name in SECTIONS:
+        cursor += (-cursor) % 8
+        offsets.extend((cursor, len(payloads[name])))
+        cursor += len(payloads[name])
+
+    counts = {
+        'strings': len(strings),
+        'rows': len(row_code),
+        'nodes': len(node_codes),
+        'edges': len(edge_target),
+        'names': len(names),
+        'tokens': len(token_order),
+        'grams': len(grams),
+        'dictionary_entries': len(entries),
+        'external_codes': len(dictionary),
+    }
+    header = struct.pack(HEADER_FORMAT, MAGIC, FORMAT_VERSION, *counts.values(),
+                         -1 if sync_version is None else sync_version, *offsets)
+
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    with open(tmp_path, 'wb') as f:
+        f.write(header)
+        for index, name in enumerate(SECTIONS):
+            f.seek(offsets[index * 2])
+            f.write(payloads[name])
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+    return counts
+
+
+class SnapshotRows:
+    """Read-only sequence view of the snapshot's MED rows (no copy)."""
+
+    def __init__(self, snapshot: 'OntologySnapshot'):
+        self._snapshot = snapshot
+
+    def __len__(self) -> int:
+        return self._snapshot.row_count
+
+    def __getitem__(self, index: int) -> MedRow:
+        snap = self._snapshot
+        return (snap.string(snap._row_code[index]), snap._row_slot[index], snap.string(snap._row_value[index]))
+
+    def __iter__(self) -> Iterator[MedRow]:
+        snap = self._snapshot
+        for index in range(snap.row_count):
+            yield (snap.string(snap._row_code[index]), snap._row_slot[index], snap.string(snap._row_value[index]))
+
+
+class _StringColumn:
+    """Sequence view of an int32 array of string ids; position lookups when the strings are sorted."""
+
+    def __init__(self, snapshot: 'OntologySnapshot', ids):
+        self._snapshot = snapshot
+        self._ids = ids
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __getitem__(self, index: int) -> str:
+        return self._snapshot.string(self._ids[index])
+
+    def span(self, text: str) -> Tuple[int, int]:
+        """Range of positions holding text (binary search over a sorted column)."""
+        low, high = 0, len(self._ids)
+        while low < high:
+            mid = (low + high) // 2
+            if self[mid] < text:
+                low = mid + 1
+            else:
+                high = mid
+        end = low
+        while end < len(self._ids) and self[end] == text:
+            end += 1
+        return low, end
+
+    def get(self, text: str, default: Optional[int] = None) -> Optional[int]:
+        """Position of text in a sorted column (a dict-like lookup)."""
+        start, end = self.span(text)
+        return start if end > start else default
+
+
+class _Postings:
+    """CSR lists as a read-only mapping: position (or sorted key) -> list of int32 values."""
+
+    def __init__(self, indptr, values, keys: Optional[_StringColumn] = None):
+        self._indptr = indptr
+        self._values = values
+        self._keys = keys
+
+    def get(self, key, default=()):
+        index = self._keys.get(key) if self._keys is not None else key
+        if index is None or not 0 <= index < len(self._indptr) - 1:
+            return default
+        return self._values[self._indptr[index]:self._indptr[index + 1]].tolist()
+
+
+class _NameDocs:
+    """(code, name) documents of the snapshot name index."""
+
+    def __init__(self, codes: _StringColumn, names: _StringColumn):
+        self._codes = codes
+        self._names = names
+
+    def __len__(self) -> int:
+        return len(self._codes)
+
+    def __getitem__(self, doc_id: int) -> Tuple[str, str]:
+        return self._codes[doc_id], self._names[doc_id]
+
+
+class _TokenGrams:
+    """Trigram sets of the vocabulary tokens, derived on access."""
+
+    def __init__(self, tokens: _StringColumn):
+        self._tokens = tokens
+
+    def __getitem__(self, token_id: int) -> Set[str]:
+        return set(_token_ngrams(self._tokens[token_id]))
+
+
+class SnapshotNameIndex(NameIndex):
+    """NameIndex over the postings persisted in a snapshot (read-only, nothing is built)."""
+
+    def __init__(self, snapshot: 'OntologySnapshot', min_token_similarity: float = 0.5):
+        self.min_token_similarity = min_token_similarity
+        tokens = _StringColumn(snapshot, snapshot._token)
+        self._docs = _NameDocs(_StringColumn(snapshot, snapshot._doc_code), _StringColumn(snapshot, snapshot._doc_name))
+        self._doc_ids = self._docs
+        self._token_ids = tokens
+        self._tokens = tokens
+        self._token_grams = _TokenGrams(tokens)
+        self._gram_postings = _Postings(snapshot._gram_indptr, snapshot._gram_token,
+                                        keys=_StringColumn(snapshot, snapshot._gram))
+        self._token_docs = _Postings(snapshot._token_indptr, snapshot._token_doc)
+
+    def add(self, code: str, name: str):
+        raise TypeError("A snapshot name index is read-only")
+
+
+class SnapshotCodeDictionary(CodeDictionary):
+    """CodeDictionary over the entries persisted in a snapshot (read-only, nothing is built)."""
+
+    def __init__(self, snapshot: 'OntologySnapshot'):
+        self._snapshot = snapshot
+        self._keys = _StringColumn(snapshot, snapshot._dict_key)
+
+    def __len__(self) -> int:
+        return self._snapshot.external_code_count
+
+    def add(self, code: str, slot: int, value: str):
+        raise TypeError("A snapshot code dictionary is read-only")
+
+    def _entries(self, value: str) -> Iterator[Tuple[int, str]]:
+        """(slot, CODE) of every entry for a value."""
+        snap = self._snapshot
+        start, end = self._keys.span(normalize_code_value(value))
+        for entry in range(start, end):
+            yield snap._dict_slot[entry], snap.string(snap._node_code[snap._dict_node[entry]])
+
+    def lookup(self, system: str, value: str) -> Set[str]:
+        slot = CODE_SYSTEMS.get(system.upper())
+        return {code for entry_slot, code in self._entries(value) if entry_slot == slot}
+
+    def find(self, value: str, systems: Optional[Iterable[str]] = None) -> Dict[str, Set[str]]:
+        wanted = set(systems or CODE_SYSTEMS)
+        hits: Dict[str, Set[str]] = {}
+        for slot, code in self._entries(value):
+            system = SLOT_TO_SYSTEM[slot]
+            if system in wanted:
+                hits.setdefault(system, set()).add(code)
+        return hits
+
+    def external_codes(self, code: str) -> Dict[str, List[str]]:
+        values: Dict[str, Set[str]] = {}
+        for slot, value in self._snapshot.code_rows(str(code)):
+            system = SLOT_TO_SYSTEM.get(slot)
+            if system and normalize_code_value(value):
+                values.setdefault(system, set()).add(value.strip())
+        return {system: sorted(system_values) for system, system_values in values.items()}
+
+
+class OntologySnapshot:
+    """Read-only, memory-mapped view of a snapshot file."""
+
+    def __init__(self, path: str):
+        """
+        Open and map a snapshot file.
+
+        Args:
+            path: Snapshot file written by write_snapshot
+        """
+        if sys.byteorder != 'little':
+            raise RuntimeError("Ontology snapshots are mapped as little-endian int32 arrays")
+        self.path = path
+        self._file = open(path, 'rb')
+        stat = os.fstat(self._file.fileno())
+        self.file_identity = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, format_version = struct.unpack_from('<8sI', self._mmap, 0)
+        if magic != MAGIC or format_version != FORMAT_VERSION:
+            self.close()
+            raise ValueError(f"{path} is not a v{FORMAT_VERSION} ontology snapshot (rebuild it with ontology_snapshot.py build)")
+        fields = struct.unpack_from(HEADER_FORMAT, self._mmap, 0)
+        (self.string_count, self.row_count, self.node_count, self.edge_count, self.name_count,
+         self.token_count, self.gram_count, self.entry_count, self.external_code_count) = fields[2:2 + COUNTS]
+        sync_version = fields[2 + COUNTS]
+        self.sync_version = sync_version if sync_version >= 0 else None
+        offsets = fields[3 + COUNTS:]
+
+        self._view = memoryview(self._mmap)
+        self._sections = {}
+        for index, name in enumerate(SECTIONS):
+            start, length = offsets[index * 2], offsets[index * 2 + 1]
+            self._sections[name] = self._view[start:start + length]
+
+        # Every section except the string blob and version is an int32 array (self._<section>)
+        self._arrays = {name: self._sections[name].cast('i') for name in SECTIONS
+                        if name not in ('string_blob', 'version')}
+        for name, values in self._arrays.items():
+            setattr(self, f'_{name}', values)
+        self._string_blob = self._sections['string_blob']
+        self._nodes = _StringColumn(self, self._node_code)
+        self.data_version = bytes(self._sections['version']).decode('utf-8')
+
+    def close(self):
+        """Release the mapping (rows, indexes and views must not be used afterwards)."""
+        # Derived views first, then their parents, then the mapping itself
+        for view in getattr(self, '_arrays', {}).values():
+            view.release()
+        self._arrays = {}
+        for section in getattr(self, '_sections', {}).values():
+            section.release()
+        self._sections = {}
+        if getattr(self, '_view', None) is not None:
+            self._view.release()
+        if getattr(self, '_mmap', None) is not None:
+            self._mmap.close()
+        self._file.close()
+
+    def is_current(self) -> bool:
+        """False once the file at self.path has been replaced by a newer snapshot."""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return True
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size) == self.file_identity
+
+    def string(self, string_id: int) -> str:
+        """Decode an interned string."""
+        start, end = self._string_offsets[string_id], self._string_offsets[string_id + 1]
+        return str(self._string_blob[start:end], 'utf-8')
+
+    def rows(self) -> SnapshotRows:
+        """Zero-copy sequence of (code, slot_number, slot_value) rows."""
+        return SnapshotRows(self)
+
+    def node_index(self, code: str) -> Optional[int]:
+        """Binary-search the sorted node table for a CODE."""
+        return self._nodes.get(code)
+
+    def code_rows(self, code: str) -> List[Tuple[int, str]]:
+        """(slot_number, slot_value) of a CODE's rows, in row order."""
+        node = self.node_index(str(code))
+        if node is None:
+            return []
+        return [(self._row_slot[row], self.string(self._row_value[row]))
+                for row in self._node_row[self._node_row_indptr[node]:self._node_row_indptr[node + 1]].tolist()]
+
+    def print_names(self, code: str) -> List[str]:
+        """PRINT-NAMEs (slot 6) of a CODE."""
+        return [value for slot, value in self.code_rows(code) if slot == PRINT_NAME_SLOT and value]
+
+    def name_index(self) -> SnapshotNameIndex:
+        """The persisted PRINT-NAME index."""
+        return SnapshotNameIndex(self)
+
+    def code_dictionary(self) -> SnapshotCodeDictionary:
+        """The persisted external code dictionaries."""
+        return SnapshotCodeDictionary(self)
+
+    def related(self, code: str, slot: Optional[int] = None) -> List[Tuple[int, str]]:
+        """
+        Outgoing relationships of a CODE from the CSR adjacency arrays.
+
+        Args:
+            code: Source CODE
+            slot: Restrict to one reference slot (e.g. 150)
+
+        Returns:
+            List of (slot_number, target_code)
+        """
+        node = self.node_index(str(code))
+        if node is None:
+            return []
+        related = []
+        for edge in range(self._indptr[node], self._indptr[node + 1]):
+            edge_slot = self._edge_slot[edge]
+            if slot is None or edge_slot == slot:
+                related.append((edge_slot, self.string(self._node_code[self._edge_target[edge]])))
+        return related
+
+    def info(self) -> Dict[str, object]:
+        """Summary of the snapshot contents."""
+        return {
+            'path': self.path,
+            'strings': self.string_count,
+            'rows': self.row_count,
+            'nodes': self.node_count,
+            'edges': self.edge_count,
+            'names': self.name_count,
+            'tokens': self.token_count,
+            'grams': self.gram_count,
+            'external_codes': self.external_code_count,
+            'data_version': self.data_version,
+            'sync_version': self.sync_version,
+            'bytes': self.file_identity[2],
+        }
+
+
+def main():
+    """Command line entry point: build or inspect a snapshot."""
+    parser = argparse.ArgumentParser(description="Build or inspect a memory-mapped ontology snapshot")
+    subcommands = parser.add_subparsers(dest='command', required=True)
+
+    build = subcommands.add_parser('build', help='Read MED from the database and write a snapshot')
+    build.add_argument('--output', default=os.getenv('MEDDATA_SNAPSHOT_PATH', 'ontology.snap'))
+
+    info = subcommands.add_parser('info', help='Print snapshot statistics')
+    info.add_argument('path')
+
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        from dotenv import load_dotenv
+        from meddata_sql_agent import create_meddata_agent_from_env
+        from ontology_cache import OntologyCache
+
+        load_dotenv()
+        # Never read the snapshot we are about to replace
+        os.environ.pop('MEDDATA_SNAPSHOT_PATH', None)
+        os.environ['MEDDATA_NAME_INDEX'] = 'false'
+        agent = create_meddata_agent_from_env()
+        conn = agent._get_connection()
+        try:
+            cache = OntologyCache.load(conn)
+        finally:
+            conn.close()
+
+        # cache.load reads the tracking version before the rows, so the tracker replays anything newer
+        counts = write_snapshot(cache.rows, args.output, data_version=cache.version or '',
+                                sync_version=cache.sync_version)
+        print(f"✅ Snapshot written to {args.output}: {counts}")
+    else:
+        snapshot = OntologySnapshot(args.path)
+        for key, value in snapshot.info().items():
+            print(f"{key}: {value}")
+        snapshot.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,343 @@
+"""
+Ontology Change Tracking Sync
+Polls SQL Server change tracking (CHANGETABLE) for MED / MED_SLOTS and applies row-level
+deltas to the in-process ontology cache, so it stays current without full reloads or
+checksum scans. Change tracking must be enabled on the database and both tables
+(see database/meddata.sql).
+"""
+
+import threading
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+
+CURRENT_VERSION_QUERY = "SELECT CHANGE_TRACKING_CURRENT_VERSION()"
+TRACKED_TABLE_QUERY = "SELECT COUNT(*) FROM sys.change_tracking_tables WHERE object_id = OBJECT_ID(?)"
+MIN_VALID_VERSION_QUERY = "SELECT CHANGE_TRACKING_MIN_VALID_VERSION(OBJECT_ID(?))"
+
+PRIMARY_KEY_QUERY = """
+SELECT c.name
+FROM sys.indexes i
+INNER JOIN sys.index_columns ic ON ic.object_id = i.object_id AND ic.index_id = i.index_id
+INNER JOIN sys.columns c ON c.object_id = ic.object_id AND c.column_id = ic.column_id
+WHERE i.object_id = OBJECT_ID('MED') AND i.is_primary_key = 1
+ORDER BY ic.key_ordinal
+"""
+
+# Changed CODEs are re-read in batches of this many parameters
+CODE_BATCH_SIZE = 500
+
+# Consecutive failed polls after which the tracker stops and data version checks take over
+MAX_FAILED_POLLS = 3
+
+
+def med_key_columns(cursor) -> List[str]:
+    """MED's primary key columns, in key order (empty if MED has no primary key)."""
+    cursor.execute(PRIMARY_KEY_QUERY)
+    return [row[0] for row in cursor.fetchall()]
+
+
+def current_sync_version(conn, table: str = 'MED') -> Optional[int]:
+    """
+    Current change tracking version of the database, if a table is tracked.
+
+    Change tracking is enabled per table, and dropping a table (e.g. recreate_med_*.py)
+    removes it, so the database-level version alone does not mean MED can be synced.
+
+    Args:
+        conn: Database connection
+        table: Table that must have change tracking enabled
+
+    Returns:
+        Version number, or None if the table is not tracked (or change tracking is not supported)
+    """
+    try:
+        cursor = conn.cursor()
+        cursor.execute(TRACKED_TABLE_QUERY, table)
+        tracked = cursor.fetchone()[0] > 0
+        row = None
+        if tracked:
+            cursor.execute(CURRENT_VERSION_QUERY)
+            row = cursor.fetchone()
+        cursor.close()
+    except Exception:
+        return None
+    return int(row[0]) if row and row[0] is not None else None
+
+
+class OntologyChangeTracker:
+    """
+    Background poller that keeps an OntologyCache in sync with MED.
+
+    Each poll reads the CODEs touched since the cache's sync_version and replaces all of
+    their rows in the cache. Replacing whole CODEs makes a delta idempotent, so rows
+    changed while a poll runs are simply applied again by the next one.
+
+    When MED's key does not include CODE (the surrogate ID), a deleted row only reports its
+    key, so the tracker keeps a key -> CODE map. OntologyCache.load reads it in the same scan
+    as the cached rows; for caches without one (snapshots) it is read on the first poll, and
+    a deleted key missing from that map forces a full reload from the database.
+
+    The tracker stops itself when MED is no longer tracked or after MAX_FAILED_POLLS failed
+    polls in a row; the agent then falls back to data version checks (and restarts the
+    tracker after a reload that finds MED tracked again).
+    """
+
+    def __init__(
+        self,
+        connection_factory: Callable[[], Any],
+        get_cache: Callable[[], Any],
+        poll_interval: float = 30.0,
+        on_reload: Optional[Callable[[], bool]] = None,
+        on_slots_changed: Optional[Callable[[], None]] = None
+    ):
+        """
+        Initialize the tracker.
+
+        Args:
+            connection_factory: Returns a new DB-API connection
+            get_cache: Returns the current OntologyCache (may change after full reloads)
+            poll_interval: Seconds between polls
+            on_reload: Called when the change history no longer covers the cache version (or
+                       a deleted row cannot be matched to its CODE); reloads the cache from
+                       the database and returns True if it was reloaded
+            on_slots_changed: Called when MED_SLOTS rows changed
+        """
+        self.connection_factory = connection_factory
+        self.get_cache = get_cache
+        self.poll_interval = poll_interval
+        self.on_reload = on_reload
+        self.on_slots_changed = on_slots_changed
+
+        # MED primary key columns, and a key -> CODE map when CODE is not part of the key
+        # (deleted rows only report their key, so the map tells us which CODE lost a row).
+        # Both belong to _keyed_cache; the map is exact when it was read with the cache's rows.
+        self._key_columns: Optional[List[str]] = None
+        self._key_codes: Optional[Dict[tuple, str]] = None
+        self._keyed_cache: Any = None
+        self._key_codes_exact = False
+
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+        self.polls = 0
+        self.codes_applied = 0
+        self.last_poll: Optional[datetime] = None
+        self.last_error: Optional[str] = None
+        self.failed_polls = 0
+        self.stopped_reason: Optional[str] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Start polling in a daemon thread."""
+        if self.running:
+            return
+        self._stop.clear()
+        self.failed_polls = 0
+        self.stopped_reason = None
+        self._thread = threading.Thread(target=self._run, name='ontology-change-tracker', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        """Stop the polling thread."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self.poll_once()
+                self.last_error = None
+                self.failed_polls = 0
+            except Exception as e:
+                self.last_error = str(e)
+                self.failed_polls += 1
+                print(f"Warning: Ontology change tracking poll failed: {e}")
+                if self.failed_polls >= MAX_FAILED_POLLS:
+                    self._give_up(f"{self.failed_polls} polls in a row failed")
+
+    def _give_up(self, reason: str):
+        """Stop polling (from the polling thread) so the agent's data version checks take over."""
+        self.stopped_reason = reason
+        self._stop.set()
+        print(f"Warning: Ontology change tracking stopped ({reason}); falling back to data version checks")
+
+    def poll_once(self) -> Dict[str, Any]:
+        """
+        Apply all MED changes since the cache's sync version.
+
+        Returns:
+            Summary with from/to versions and the number of CODEs applied
+        """
+        cache = self.get_cache()
+        if cache is None or cache.sync_version is None:
+            # e.g. reloaded while MED was not tracked: only data version checks can see changes
+            self._give_up("the ontology cache has no change tracking version")
+            return {'applied': 0, 'stopped': True}
+        since = cache.sync_version
+
+        conn = self.connection_factory()
+        try:
+            cursor = conn.cursor()
+            version = current_sync_version(conn)
+            self.polls += 1
+            self.last_poll = datetime.now()
+            if version is None:
+                self._give_up("MED is no longer change tracked")
+                return {'from_version': since, 'to_version': since, 'applied': 0, 'stopped': True}
+            if version <= since:
+                return {'from_version': since, 'to_version': since, 'applied': 0}
+
+            # History older than the retention period is gone - only a full reload is safe
+            if any(min_valid is not None and since < min_valid
+                   for min_valid in (self._min_valid_version(cursor, table) for table in ('MED', 'MED_SLOTS'))):
+                # The table may have been recreated: re-read its key with the reloaded cache
+                return self._reload(since, version, f"change history no longer covers version {since}")
+
+            if self._keyed_cache is not cache:
+                self._initialize(cursor, cache)
+
+            changed_codes, key_updates, unmatched = self._changed_codes(cursor, since)
+            if unmatched:
+                # Rows deleted before the key map was read: the CODEs that lost them are unknown
+                return self._reload(since, version, "a deleted MED row could not be matched to its CODE")
+            rows_by_code = self._fetch_code_rows(cursor, changed_codes)
+            slots_changed = self._slots_changed(cursor, since)
+            cursor.close()
+        finally:
+            conn.close()
+
+        cache.apply_changes(rows_by_code, sync_version=version)
+        # Advance the key map only with the cache, so a failed poll is simply repeated
+        for key, code in key_updates.items():
+            if code is None:
+                self._key_codes.pop(key, None)
+            else:
+                self._key_codes[key] = code
+        self.codes_applied += len(rows_by_code)
+        if slots_changed and self.on_slots_changed:
+            self.on_slots_changed()
+
+        return {
+            'from_version': since,
+            'to_version': version,
+            'applied': len(rows_by_code),
+            'slots_changed': slots_changed
+        }
+
+    def _reload(self, since: int, version: int, reason: str) -> Dict[str, Any]:
+        """Replace the cache through on_reload; stop polling if that is not possible."""
+        self._keyed_cache = None
+        reloaded = bool(self.on_reload and self.on_reload())
+        if not reloaded:
+            self._give_up(reason)
+        return {'from_version': since, 'to_version': version, 'applied': 0, 'reloaded': reloaded}
+
+    def stats(self) -> Dict[str, Any]:
+        """Tracker status for diagnostics."""
+        cache = self.get_cache()
+        return {
+            'running': self.running,
+            'poll_interval': self.poll_interval,
+            'sync_version': cache.sync_version if cache is not None else None,
+            'polls': self.polls,
+            'codes_applied': self.codes_applied,
+            'last_poll': self.last_poll.isoformat() if self.last_poll else None,
+            'last_error': self.last_error,
+            'stopped_reason': self.stopped_reason
+        }
+
+    @staticmethod
+    def _min_valid_version(cursor, table: str) -> Optional[int]:
+        cursor.execute(MIN_VALID_VERSION_QUERY, table)
+        row = cursor.fetchone()
+        return int(row[0]) if row and row[0] is not None else None
+
+    def _initialize(self, cursor, cache):
+        """Take MED's primary key and, for surrogate keys, the key -> CODE map for a cache."""
+        self._keyed_cache = cache
+        if getattr(cache, 'key_columns', None):
+            # Read by OntologyCache.load in the same scan as the cached rows
+            self._key_columns = list(cache.key_columns)
+            self._key_codes, cache.key_codes = cache.key_codes, None
+            self._key_codes_exact = self._key_codes is not None
+            return
+
+        self._key_columns = med_key_columns(cursor)
+        if not self._key_columns:
+            raise RuntimeError("MED has no primary key; change tracking requires one")
+        self._key_codes = None
+        self._key_codes_exact = False
+        if 'CODE' not in self._key_columns:
+            # Newer than the cache: rows deleted in between are missing (see _changed_codes)
+            key_list = ', '.join(f'[{column}]' for column in self._key_columns)
+            cursor.execute(f"SELECT {key_list}, CODE FROM MED")
+            self._key_codes = {tuple(row[:-1]): str(row[-1]) for row in cursor.fetchall()}
+
+    def _changed_codes(self, cursor, since: int) -> Tuple[Set[str], Dict[tuple, Optional[str]], bool]:
+        """
+        CODEs with at least one inserted, updated or deleted row since a version.
+
+        Returns:
+            (codes, key map updates (None = key deleted), unmatched). unmatched is True when
+            a deleted key is missing from a key map read after the cache, so the CODE that
+            lost the row is unknown. With a map read alongside the cache such a key was
+            inserted after the cache was loaded, so no cached CODE has the row.
+        """
+        if self._key_codes is None:
+            # CODE is part of the primary key, so CHANGETABLE reports it even for deletes
+            cursor.execute("SELECT DISTINCT ct.CODE FROM CHANGETABLE(CHANGES MED, ?) AS ct", since)
+            return {str(row[0]) for row in cursor.fetchall()}, {}, False
+
+        key_select = ', '.join(f'ct.[{column}]' for column in self._key_columns)
+        key_join = ' AND '.join(f'm.[{column}] = ct.[{column}]' for column in self._key_columns)
+        cursor.execute(
+            f"SELECT {key_select}, m.CODE FROM CHANGETABLE(CHANGES MED, ?) AS ct "
+            f"LEFT JOIN MED m ON {key_join}",
+            since
+        )
+        codes: Set[str] = set()
+        updates: Dict[tuple, Optional[str]] = {}
+        unmatched = False
+        for row in cursor.fetchall():
+            key, current_code = tuple(row[:-1]), row[-1]
+            previous_code = self._key_codes.get(key)
+            if previous_code is not None:
+                codes.add(previous_code)
+            if current_code is None:
+                updates[key] = None
+                if previous_code is None and not self._key_codes_exact:
+                    unmatched = True
+            else:
+                codes.add(str(current_code))
+                updates[key] = str(current_code)
+        return codes, updates, unmatched
+
+    @staticmethod
+    def _fetch_code_rows(cursor, codes: Iterable[str]) -> Dict[str, List[tuple]]:
+        """Current MED rows of each CODE (an empty list for CODEs that were deleted)."""
+        codes = sorted(codes)
+        rows_by_code: Dict[str, List[tuple]] = {code: [] for code in codes}
+        for start in range(0, len(codes), CODE_BATCH_SIZE):
+            batch = codes[start:start + CODE_BATCH_SIZE]
+            placeholders = ', '.join('?' for _ in batch)
+            cursor.execute(f"SELECT CODE, SLOT_NUMBER, SLOT_VALUE FROM MED WHERE CODE IN ({placeholders})", *batch)
+            for code, slot, value in cursor.fetchall():
+                rows_by_code.setdefault(str(code), []).append(
+                    (str(code), int(slot), str(value) if value is not None else '')
+                )
+        return rows_by_code
+
+    @staticmethod
+    def _slots_changed(cursor, since: int) -> bool:
+        """True if MED_SLOTS has changes since a version (False if it is not tracked)."""
+        try:
+            cursor.execute("SELECT COUNT(*) FROM CHANGETABLE(CHANGES MED_SLOTS, ?) AS ct", since)
+            return cursor.fetchone()[0] > 0
+        except Exception:
+            return False
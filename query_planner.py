@@ -0,0 +1,513 @@
+"""
+Multi-step Query Planner
+Multi-hop questions ("problems indicated by LOINC 2947-0 tests, then other tests for
+those problems") otherwise become one large self-join, which is slow and the most common
+source of generation errors. The planner asks the model for a DAG of small sub-queries
+instead:
+
+    s1: tests with LOINC 2947-0                 SELECT DISTINCT CODE FROM MED WHERE ...
+    s2: problems those tests indicate (s1)      ... INNER JOIN #s1 t ON t.CODE = m.CODE ...
+    s3: other tests for those problems (s1, s2) ... INNER JOIN #s2 p ON p.CODE = m.REF_CODE ...
+
+A step that depends on another reads the other step's CODE set from the temp table
+#<step id>, loaded into its own session before it runs. Steps whose dependencies are
+satisfied run concurrently, each on its own connection, with its own timing and retries.
+The answer is assembled locally from the output steps (merged on CODE, names added from
+the in-memory ontology cache).
+"""
+
+import json
+import re
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from sql_parameters import coerce_params, count_placeholders, inline_params
+from sql_repair import repair_engine
+from query_stats import summarize_statistics
+from metrics import DB_CONNECTIONS_IN_USE, STAGE_SECONDS, counted_completion
+from sql_validator import SQLValidator
+
+
+STEP_ID = re.compile(r"^[A-Za-z][A-Za-z0-9_]{0,29}$")
+
+# Questions that chain lookups ("..., then ...", "for each problem"). Bare "then", "those"
+# and "these" are left out: on their own they mostly refer back to an earlier answer.
+MULTI_HOP = re.compile(
+    r"(?:,|;|\band)\s*then\b|\b(?:for each|each of|in turn|and also|followed by)\b",
+    re.IGNORECASE
+)
+
+# Follow-up questions about an earlier answer ("which of those are active?"); the single
+# query path sees the conversation history, so these are not planned
+REFERS_BACK = re.compile(
+    r"\b(those|these|them|that list|the same|the previous|the above|from before|earlier)\b",
+    re.IGNORECASE
+)
+
+# Conversation messages sent with a planning request (the last 3 exchanges)
+HISTORY_MESSAGES = 6
+
+# Failures worth re-running unchanged
+TRANSIENT_ERRORS = {'LOCK_TIMEOUT', 'UNKNOWN_ERROR'}
+
+PLANNER_INSTRUCTIONS = """**QUERY PLANNING INSTRUCTIONS:**
+
+Database Schema:
+{schema}
+
+**YOUR TASK**: Decide whether the question needs several chained lookups. If it does,
+break it into small T-SQL steps instead of one large join.
+
+Respond with a JSON object:
+{{"steps": [{{"id": "s1", "description": "...", "sql": "<T-SQL>", "params": [{{"value": ..., "type": "string"|"int"|"float"}}], "depends_on": []}}, ...],
+  "output": ["<step id>", ...], "names": true|false}}
+
+Rules:
+1. Each step is ONE simple SELECT (one or two MED joins at most). Put a ? placeholder in the SQL
+   for every code, name or LIKE pattern and list the values in "params"; keep SLOT_NUMBER
+   constants inline.
+2. A step that uses the result of an earlier step lists it in "depends_on" and reads its codes
+   from the temp table #<id> (one INT column CODE), e.g. INNER JOIN #s1 t ON t.CODE = m.CODE.
+3. Every step that another step depends on must return its concept codes as a column named CODE.
+4. Steps that do not depend on each other run in parallel - do not chain them needlessly.
+5. "output" lists the steps whose rows answer the question; several outputs are merged on CODE.
+6. Set "names" to true to add the PRINT-NAME of each output CODE (no need to join slot 6).
+7. At most {max_steps} steps. If a single simple query answers the question, return {{"steps": []}}.
+
+**EXAMPLE** - "problems indicated by LOINC 2947-0 tests, then other tests for those problems":
+{{"steps": [
+  {{"id": "s1", "description": "Tests with LOINC 2947-0", "sql": "SELECT DISTINCT CODE FROM MED WHERE SLOT_NUMBER = 212 AND SLOT_VALUE = ?", "params": [{{"value": "2947-0", "type": "string"}}], "depends_on": []}},
+  {{"id": "s2", "description": "Problems those tests indicate", "sql": "SELECT DISTINCT m.{related} AS CODE FROM MED m INNER JOIN #s1 t ON t.CODE = m.CODE WHERE m.SLOT_NUMBER = 150", "params": [], "depends_on": ["s1"]}},
+  {{"id": "s3", "description": "Other tests indicating those problems", "sql": "SELECT DISTINCT m.CODE, m.{related} AS ProblemCode FROM MED m INNER JOIN #s2 p ON p.CODE = m.{related} WHERE m.SLOT_NUMBER = 150 AND m.CODE NOT IN (SELECT t.CODE FROM #s1 t)", "params": [], "depends_on": ["s1", "s2"]}}
+ ], "output": ["s3"], "names": true}}
+"""
+
+
+@dataclass
+class PlanStep:
+    """One sub-query of a plan."""
+    id: str
+    description: str
+    sql: str
+    params: List[Any] = field(default_factory=list)
+    depends_on: List[str] = field(default_factory=list)
+
+
+@dataclass
+class QueryPlan:
+    """A DAG of sub-queries and the steps whose rows form the answer."""
+    question: str
+    steps: List[PlanStep]
+    output: List[str]
+    names: bool = False
+
+    @classmethod
+    def from_payload(cls, question: str, payload: Dict[str, Any], max_steps: int = 6) -> 'QueryPlan':
+        """
+        Build and check a plan from the model's JSON.
+
+        Raises:
+            ValueError: Malformed plan (bad ids, unknown dependencies, cycles, parameter mismatch)
+        """
+        steps = []
+        for item in payload.get('steps') or []:
+            step = PlanStep(
+                id=str(item.get('id', '')),
+                description=str(item.get('description', '')),
+                sql=str(item.get('sql', '')).strip().rstrip(';'),
+                params=coerce_params(item.get('params') or []),
+                depends_on=[str(dependency) for dependency in item.get('depends_on') or []]
+            )
+            if not STEP_ID.match(step.id):
+                raise ValueError(f"Invalid step id '{step.id}'")
+            if count_placeholders(step.sql) != len(step.params):
+                raise ValueError(f"Step {step.id} has {count_placeholders(step.sql)} placeholders but {len(step.params)} parameters")
+            steps.append(step)
+        if len(steps) > max_steps:
+            raise ValueError(f"Plan has {len(steps)} steps (at most {max_steps} allowed)")
+
+        ids = [step.id for step in steps]
+        if len(set(ids)) != len(ids):
+            raise ValueError("Duplicate step ids")
+        output = payload.get('output') or (ids[-1:] if ids else [])
+        output = [output] if isinstance(output, str) else [str(step_id) for step_id in output]
+        plan = cls(question=question, steps=steps, output=output, names=bool(payload.get('names')))
+        for step in steps:
+            unknown = [dependency for dependency in step.depends_on if dependency not in ids]
+            if unknown:
+                raise ValueError(f"Step {step.id} depends on unknown step(s) {', '.join(unknown)}")
+        if any(step_id not in ids for step_id in output):
+            raise ValueError("Plan output refers to an unknown step")
+        plan.order()
+        return plan
+
+    def order(self) -> List[PlanStep]:
+        """
+        Steps in dependency order.
+
+        Raises:
+            ValueError: The dependencies contain a cycle
+        """
+        ordered, placed = [], set()
+        remaining = list(self.steps)
+        while remaining:
+            ready = [step for step in remaining if all(dependency in placed for dependency in step.depends_on)]
+            if not ready:
+                raise ValueError(f"Plan has a dependency cycle among {', '.join(step.id for step in remaining)}")
+            for step in ready:
+                ordered.append(step)
+                placed.add(step.id)
+                remaining.remove(step)
+        return ordered
+
+    def required(self) -> List[PlanStep]:
+        """Steps the outputs depend on (directly or transitively), in dependency order."""
+        steps = {step.id: step for step in self.steps}
+        needed, stack = set(), list(self.output)
+        while stack:
+            step_id = stack.pop()
+            if step_id not in needed:
+                needed.add(step_id)
+                stack.extend(steps[step_id].depends_on)
+        return [step for step in self.order() if step.id in needed]
+
+    def describe_sql(self) -> str:
+        """All steps as one commented script (values inlined), for display and memory."""
+        parts = []
+        for step in self.required():
+            header = f"-- Step {step.id}: {step.description}"
+            if step.depends_on:
+                header += f" (uses {', '.join('#' + dependency for dependency in step.depends_on)})"
+            parts.append(f"{header}\n{inline_params(step.sql, step.params)};")
+        return "\n\n".join(parts)
+
+
+@dataclass
+class StepResult:
+    """Outcome of one executed step."""
+    step_id: str
+    success: bool
+    sql: str
+    columns: List[str] = field(default_factory=list)
+    rows: List[Dict[str, Any]] = field(default_factory=list)
+    duration_ms: float = 0.0
+    attempts: int = 0
+    truncated: bool = False
+    error: Optional[Dict[str, Any]] = None
+    repaired_by: List[str] = field(default_factory=list)
+    statistics: Optional[Dict[str, Any]] = None
+
+    def codes(self) -> List[int]:
+        """The step's CODE column as integers (input for dependent steps)."""
+        column = next((name for name in self.columns if name.upper() == 'CODE'), None)
+        if column is None:
+            raise ValueError(f"Step {self.step_id} feeds another step but returns no CODE column")
+        codes = []
+        for row in self.rows:
+            value = row.get(column)
+            if value is not None:
+                codes.append(int(float(value)))
+        return list(dict.fromkeys(codes))
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            'id': self.step_id,
+            'success': self.success,
+            'row_count': len(self.rows),
+            'duration_ms': round(self.duration_ms, 2),
+            'attempts': self.attempts,
+            'truncated': self.truncated,
+            'repaired_by': self.repaired_by,
+            'error': self.error.get('error') if self.error else None,
+            'statistics': summarize_statistics(self.statistics)
+        }
+
+
+class QueryPlanner:
+    """Plans multi-hop questions as sub-query DAGs and runs them on an agent's backend."""
+
+    def __init__(self, agent, max_workers: int = 4, step_retries: int = 1, max_steps: int = 6,
+                 max_staged_codes: int = 100000):
+        """
+        Args:
+            agent: MedDataSQLAgent (its model client, schema, backend and ontology cache are used)
+            max_workers: Steps run concurrently at most
+            step_retries: Extra attempts per failing step (after a repair rule or a short backoff)
+            max_steps: Largest plan accepted from the model
+            max_staged_codes: Row ceiling for steps that feed other steps (instead of the
+                              execution profile's); a larger CODE set fails the plan, so the
+                              question falls back to a single query
+        """
+        self.agent = agent
+        self.max_workers = max_workers
+        self.step_retries = step_retries
+        self.max_steps = max_steps
+        self.max_staged_codes = max_staged_codes
+
+    def should_plan(self, question: str) -> bool:
+        """Cheap check for chained lookups, before spending a model call on planning."""
+        question = question or ''
+        if not MULTI_HOP.search(question):
+            return False
+        # "For each of those, ..." after an earlier answer needs that answer, not a plan
+        return not (self.agent.conversation_history and REFERS_BACK.search(question))
+
+    def plan(self, question: str) -> Optional[QueryPlan]:
+        """
+        Ask the model for a plan.
+
+        Returns:
+            QueryPlan with at least two steps, or None when one query is enough (or planning failed)
+        """
+        messages = [{
+            "role": "system",
+            "content": PLANNER_INSTRUCTIONS.format(
+                schema=self.agent.schema_info,
+                max_steps=self.max_steps,
+                # Older MED tables have no REF_CODE column
+                related='REF_CODE' if self.agent.has_ref_code else 'SLOT_VALUE'
+            )
+        }]
+        entity_hints = self.agent._build_entity_hints(question)
+        if entity_hints:
+            messages.append({"role": "system", "content": entity_hints})
+        for msg in self.agent.conversation_history[-HISTORY_MESSAGES:]:
+            messages.append(msg)
+        messages.append({"role": "user", "content": question})
+
+        try:
+            response = counted_completion(
+                self.agent.client,
+                'planner',
+                model=self.agent.deployment,
+                messages=messages,
+                temperature=0.1,
+                max_tokens=1500,
+                response_format={"type": "json_object"}
+            )
+            payload = json.loads(response.choices[0].message.content)
+            plan = QueryPlan.from_payload(question, payload, self.max_steps)
+        except Exception as e:
+            print(f"Warning: Query planning failed ({e}); using a single query")
+            return None
+        return plan if len(plan.steps) >= 2 else None
+
+    def execute(self, plan: QueryPlan) -> Dict[str, Any]:
+        """
+        Run a plan, independent steps concurrently.
+
+        Returns:
+            Result dict like the agent's _execute_query (success, results, row_count, columns,
+            truncated) plus "sql" (the steps as one script) and "plan" (per-step timings); on
+            failure the failing step's error details
+        """
+        started = time.perf_counter()
+        # Steps no output depends on are not run
+        steps = plan.required()
+        # Steps whose CODE sets are staged for others must be complete, not cut at the row ceiling
+        feeding = {dependency for step in steps for dependency in step.depends_on}
+        pending = {step.id: step for step in steps}
+        done: Dict[str, StepResult] = {}
+        running = {}
+        failure: Optional[StepResult] = None
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='plan-step') as pool:
+            while (pending and failure is None) or running:
+                if failure is None:
+                    for step_id, step in list(pending.items()):
+                        if all(dependency in done for dependency in step.depends_on):
+                            try:
+                                inputs = {dependency: done[dependency].codes() for dependency in step.depends_on}
+                            except ValueError as e:
+                                failure = StepResult(step_id, False, step.sql, error={
+                                    'success': False, 'error': str(e), 'error_category': 'PLAN_ERROR',
+                                    'hint': 'Steps that feed other steps must return a CODE column.'
+                                })
+                                break
+                            row_limit = self.max_staged_codes if step_id in feeding else None
+                            running[pool.submit(self._run_step, step, inputs, plan.question, row_limit)] = step_id
+                            del pending[step_id]
+                if not running:
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    del running[future]
+                    result = future.result()
+                    done[result.step_id] = result
+                    if not result.success and failure is None:
+                        failure = result
+
+        summary = {
+            'steps': [done[step.id].summary() if step.id in done else {'id': step.id, 'success': False, 'skipped': True}
+                      for step in steps],
+            'total_ms': round((time.perf_counter() - started) * 1000, 2),
+            'output': plan.output
+        }
+        if failure is not None:
+            details = dict(failure.error or {})
+            details.update({'success': False, 'sql_query': failure.sql, 'plan': summary})
+            details['error'] = f"Step {failure.step_id} failed: {details.get('error')}"
+            return details
+
+        columns, rows = self._assemble(plan, done)
+        truncated = any(done[step_id].truncated for step_id in plan.output)
+        profile = getattr(self.agent.backend, 'profile', None)
+        row_limit = profile.row_limit if profile is not None else None
+        if row_limit is not None and len(rows) > row_limit:
+            # Merged outputs (or an output that also fed a step) can exceed the ceiling
+            rows, truncated = rows[:row_limit], True
+        return {
+            'success': True,
+            'results': rows,
+            'row_count': len(rows),
+            'columns': columns,
+            'truncated': truncated,
+            'sql': plan.describe_sql(),
+            'plan': summary
+        }
+
+    def run(self, question: str) -> Optional[Dict[str, Any]]:
+        """Plan and execute a question; None when it is not worth planning or the plan failed."""
+        if not self.should_plan(question):
+            return None
+        plan = self.plan(question)
+        if plan is None:
+            return None
+        result = self.execute(plan)
+        if not result.get('success'):
+            print(f"Warning: Query plan failed ({result.get('error')}); using a single query")
+            return None
+        print(f"✓ Query plan: {len(result['plan']['steps'])} steps in {result['plan']['total_ms']:.0f} ms")
+        return result
+
+    def _run_step(self, step: PlanStep, inputs: Dict[str, List[int]], question: Optional[str] = None,
+                  row_limit: Optional[int] = None) -> StepResult:
+        """
+        Run one step with its dependency CODE sets staged as temp tables; retry on failure.
+
+        row_limit replaces the execution profile's row ceiling (steps feeding other steps);
+        a step cut off at that limit fails, since a partial CODE set would feed wrong answers.
+        """
+        agent = self.agent
+        schema = dict(getattr(agent, 'schema_columns', None) or {})
+        schema.update({dependency: ['CODE'] for dependency in inputs})
+        sql = step.sql
+        result = StepResult(step.id, False, sql)
+        started = time.perf_counter()
+
+        for attempt in range(1 + self.step_retries):
+            result.attempts = attempt + 1
+            error = SQLValidator(schema).validate(sql) if schema else {'success': True}
+            if error.get('success'):
+                error = None
+                step_started = time.perf_counter()
+                result.statistics = None
+                try:
+                    conn = agent.backend.checkout()
+                    DB_CONNECTIONS_IN_USE.inc()
+                    try:
+                        for dependency, codes in inputs.items():
+                            agent.backend.stage_codes(conn, dependency, codes)
+                        if row_limit is not None:
+                            agent.backend.set_row_limit(conn, row_limit)
+                        cursor = conn.cursor()
+                        capture = agent._enable_statistics(cursor)
+                        executed = agent.backend.transpile(sql)
+                        agent.backend.execute(cursor, executed, step.params)
+                        columns = [column[0] for column in cursor.description] if cursor.description else []
+                        rows, result.truncated = agent.backend.fetch(cursor, row_limit) if cursor.description else ([], False)
+                        result.statistics = agent._collect_statistics(cursor, executed, step.params) if capture else None
+                    finally:
+                        DB_CONNECTIONS_IN_USE.dec()
+                        conn.close()
+                    result.columns = columns
+                    result.rows = [{columns[i]: str(row[i]) if row[i] is not None else None for i in range(len(columns))}
+                                   for row in rows]
+                    result.success = True
+                    if result.truncated and row_limit is not None:
+                        result.success = False
+                        error = {
+                            'success': False,
+                            'error': f"Step {step.id} returned more than {row_limit} rows; its CODE set would be incomplete",
+                            'error_type': 'PlanError',
+                            'error_category': 'PLAN_ERROR',
+                            'hint': 'The intermediate result is too large to stage; answer the question with a single query.'
+                        }
+                except Exception as e:
+                    error = agent._error_details(e, sql)
+                STAGE_SECONDS.observe(time.perf_counter() - step_started, stage='db_execution')
+                self._record_workload(sql, step_started, result, error)
+                agent._log_slow_query(
+                    question, inline_params(sql, step.params), (time.perf_counter() - step_started) * 1000,
+                    {**(error or {}), 'success': error is None, 'row_count': len(result.rows),
+                     'statistics': result.statistics},
+                    "meddata-plan"
+                )
+            if error is None:
+                break
+
+            result.error = error
+            repaired = repair_engine.repair(sql, error, schema)
+            if repaired is not None:
+                sql = repaired.sql
+                result.repaired_by.extend(repaired.rules)
+            elif error.get('error_category') in TRANSIENT_ERRORS:
+                time.sleep(0.2 * (attempt + 1))
+            else:
+                break
+
+        result.sql = sql
+        if result.success:
+            result.error = None
+        result.duration_ms = (time.perf_counter() - started) * 1000
+        return result
+
+    def _record_workload(self, sql: str, started: float, result: StepResult, error: Optional[Dict[str, Any]]):
+        store = self.agent.workload_store
+        if store is None:
+            return
+        try:
+            store.record(
+                sql,
+                (time.perf_counter() - started) * 1000,
+                row_count=len(result.rows),
+                success=error is None,
+                error_category=error.get('error_category') if error else None,
+                source="meddata-plan"
+            )
+        except Exception as e:
+            print(f"Warning: Could not record query workload: {e}")
+
+    def _assemble(self, plan: QueryPlan, done: Dict[str, StepResult]):
+        """Merge the output steps on CODE (or concatenate them) and add names locally."""
+        outputs = [done[step_id] for step_id in plan.output]
+        code_columns = [next((name for name in output.columns if name.upper() == 'CODE'), None) for output in outputs]
+
+        if len(outputs) == 1 or None in code_columns:
+            columns = list(dict.fromkeys(name for output in outputs for name in output.columns))
+            rows = [dict(row) for output in outputs for row in output.rows]
+            code_column = code_columns[0] if len(outputs) == 1 else None
+        else:
+            # Outer merge on CODE, in order of first appearance
+            code_column = code_columns[0]
+            columns = [code_column]
+            merged: Dict[Any, Dict[str, Any]] = {}
+            for output, own_code in zip(outputs, code_columns):
+                for name in output.columns:
+                    if name != own_code and name not in columns:
+                        columns.append(name)
+                for row in output.rows:
+                    target = merged.setdefault(row.get(own_code), {code_column: row.get(own_code)})
+                    for name, value in row.items():
+                        if name != own_code and target.get(name) is None:
+                            target[name] = value
+            rows = [{name: row.get(name) for name in columns} for row in merged.values()]
+
+        ontology = self.agent.ontology
+        if plan.names and code_column and ontology is not None and 'Name' not in columns:
+            columns.insert(columns.index(code_column) + 1, 'Name')
+            for row in rows:
+                row['Name'] = ontology.name_of(row.get(code_column)) if row.get(code_column) is not None else None
+        return columns, [{name: row.get(name) for name in columns} for row in rows]
@@ -0,0 +1,369 @@
+"""
+Execution Statistics and Slow-Query Log
+Separates database time from model time for generated queries. When capture is enabled,
+each query runs with SET STATISTICS TIME/IO (and SET STATISTICS XML for the actual plan)
+on SQL Server, or has its EXPLAIN QUERY PLAN taken on a local backend. Executions slower
+than a threshold are persisted with their question, SQL, elapsed time, logical reads, row
+count and plan hash, so indexes and prompt fixes can be aimed at real hotspots.
+
+The plan hash is SQL Server's QueryPlanHash when the actual plan carries one, otherwise a
+hash of the plan text: executions of one fingerprint with different plan hashes point to
+plan instability (parameter sniffing, stale statistics).
+
+Configuration:
+    QUERY_STATS_CAPTURE         Set to 'true' to capture STATISTICS TIME/IO per query (default: false)
+    QUERY_STATS_CAPTURE_PLAN    Also capture the actual execution plan (default: true)
+    SLOW_QUERY_THRESHOLD_MS     Executions at or above this are logged (default: 1000)
+    SLOW_QUERY_LOG_DB           SQLite file for the log (default: in-memory, per process)
+    SLOW_QUERY_LOG_MAX_ENTRIES  Oldest entries beyond this are pruned (default: 5000)
+    SLOW_QUERY_LOG_ENABLED      Set to 'false' to disable the log
+"""
+
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+from sql_workload import fingerprint
+
+
+ORDERINGS = {
+    'recent': 'logged_at DESC',
+    'elapsed': 'elapsed_ms DESC',
+    'reads': 'logical_reads IS NULL, logical_reads DESC',
+    'rows': 'row_count DESC',
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS slow_queries (
+    id              INTEGER PRIMARY KEY AUTOINCREMENT,
+    logged_at       REAL NOT NULL,
+    question        TEXT,
+    sql             TEXT NOT NULL,
+    fingerprint     TEXT NOT NULL,
+    elapsed_ms      REAL NOT NULL,
+    cpu_ms          REAL,
+    server_ms       REAL,
+    logical_reads   INTEGER,
+    physical_reads  INTEGER,
+    row_count       INTEGER NOT NULL,
+    success         INTEGER NOT NULL,
+    error_category  TEXT,
+    plan_hash       TEXT,
+    plan            TEXT,
+    source          TEXT
+);
+CREATE INDEX IF NOT EXISTS ix_slow_queries_time ON slow_queries (logged_at);
+CREATE INDEX IF NOT EXISTS ix_slow_queries_fingerprint ON slow_queries (fingerprint, logged_at);
+"""
+
+_TABLE_IO = re.compile(
+    r"Table '([^']+)'\. Scan count (\d+), logical reads (\d+), physical reads (\d+)", re.IGNORECASE
+)
+_EXECUTION_TIME = re.compile(
+    r"SQL Server Execution Times:\s*CPU time = (\d+) ms,\s*elapsed time = (\d+) ms", re.IGNORECASE
+)
+_COMPILE_TIME = re.compile(
+    r"parse and compile time:\s*CPU time = (\d+) ms,\s*elapsed time = (\d+) ms", re.IGNORECASE
+)
+_QUERY_PLAN_HASH = re.compile(r'QueryPlanHash="(0x[0-9A-F]+)"', re.IGNORECASE)
+# Run-time counters in an actual plan that differ between executions of the same plan
+_RUNTIME_ATTRIBUTES = re.compile(
+    r'\s(?:Actual\w*|CompileTime|CompileCPU|CompileMemory|StatementSubTreeCost|EstimatedTotalSubtreeCost|'
+    r'GrantedMemory|MaxUsedMemory|SerialRequiredMemory|SerialDesiredMemory|RequestedMemory|\w*Elapsed\w*|\w*CPU\w*)="[^"]*"',
+    re.IGNORECASE
+)
+
+
+def parse_statistics_messages(messages: Iterable[str]) -> Dict[str, Any]:
+    """
+    Totals from SET STATISTICS IO/TIME informational messages.
+
+    Args:
+        messages: Message texts (pyodbc cursor.messages entries' second element)
+
+    Returns:
+        {"logical_reads", "physical_reads", "cpu_ms", "server_ms", "compile_ms", "tables"}
+        (None for figures no message reported)
+    """
+    tables: Dict[str, Dict[str, int]] = {}
+    cpu = elapsed = compile_ms = None
+    for text in messages:
+        text = str(text)
+        for table, scans, logical, physical in _TABLE_IO.findall(text):
+            totals = tables.setdefault(table, {'scans': 0, 'logical_reads': 0, 'physical_reads': 0})
+            totals['scans'] += int(scans)
+            totals['logical_reads'] += int(logical)
+            totals['physical_reads'] += int(physical)
+        for cpu_ms, elapsed_ms in _EXECUTION_TIME.findall(text):
+            cpu = (cpu or 0) + int(cpu_ms)
+            elapsed = (elapsed or 0) + int(elapsed_ms)
+        for _, elapsed_ms in _COMPILE_TIME.findall(text):
+            compile_ms = (compile_ms or 0) + int(elapsed_ms)
+    return {
+        'logical_reads': sum(t['logical_reads'] for t in tables.values()) if tables else None,
+        'physical_reads': sum(t['physical_reads'] for t in tables.values()) if tables else None,
+        'cpu_ms': cpu,
+        'server_ms': elapsed,
+        'compile_ms': compile_ms,
+        'tables': tables
+    }
+
+
+def plan_hash(plan: Optional[str]) -> Optional[str]:
+    """QueryPlanHash of an actual plan, else a hash of the plan without run-time counters."""
+    if not plan:
+        return None
+    match = _QUERY_PLAN_HASH.search(plan)
+    if match:
+        return '0x' + match.group(1)[2:].upper()
+    shape = re.sub(r"\s+", " ", _RUNTIME_ATTRIBUTES.sub('', plan)).strip()
+    return hashlib.sha1(shape.encode('utf-8')).hexdigest()[:16]
+
+
+def summarize_statistics(statistics: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Captured statistics without the plan body, for API responses."""
+    if not statistics:
+        return None
+    return {key: value for key, value in statistics.items() if key != 'plan'}
+
+
+class SlowQueryLog:
+    """SQLite-backed log of executions above a latency threshold."""
+
+    def __init__(self, path: str = ':memory:', threshold_ms: float = 1000, max_entries: int = 5000,
+                 capture_statistics: bool = False, capture_plan: bool = True):
+        """
+        Open (or create) the log.
+
+        Args:
+            path: SQLite database file, or ':memory:'
+            threshold_ms: Executions at or above this wall-clock time are logged
+            max_entries: Entries kept; the oldest beyond this are pruned
+            capture_statistics: Whether agents capture STATISTICS TIME/IO per query
+            capture_plan: Whether captured statistics include the actual plan
+        """
+        self.path = path
+        self.threshold_ms = threshold_ms
+        self.max_entries = max_entries
+        self.capture_statistics = capture_statistics
+        self.capture_plan = capture_plan
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+        self._inserted = 0
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def record(
+        self,
+        sql: str,
+        elapsed_ms: float,
+        question: Optional[str] = None,
+        row_count: int = 0,
+        success: bool = True,
+        error_category: Optional[str] = None,
+        statistics: Optional[Dict[str, Any]] = None,
+        source: Optional[str] = None
+    ) -> Optional[int]:
+        """
+        Log an execution if it is at or above the threshold.
+
+        Args:
+            sql: Executed SQL
+            elapsed_ms: Wall-clock execution time (checkout, execute and fetch)
+            question: Natural language question the SQL was generated for
+            row_count: Rows returned
+            success: Whether the statement succeeded
+            error_category: Error category for failures
+            statistics: Captured execution statistics (see parse_statistics_messages, plus
+                        "plan" and "plan_hash")
+            source: Which agent executed it
+
+        Returns:
+            The entry id, or None when the execution was under the threshold
+        """
+        if elapsed_ms < self.threshold_ms:
+            return None
+        statistics = statistics or {}
+        fp, _ = fingerprint(sql)
+        with self._lock:
+            entry_id = self._conn.execute(
+                "INSERT INTO slow_queries (logged_at, question, sql, fingerprint, elapsed_ms, cpu_ms, server_ms, "
+                "logical_reads, physical_reads, row_count, success, error_category, plan_hash, plan, source) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (time.time(), question, sql, fp, float(elapsed_ms), statistics.get('cpu_ms'), statistics.get('server_ms'),
+                 statistics.get('logical_reads'), statistics.get('physical_reads'), int(row_count or 0),
+                 1 if success else 0, error_category, statistics.get('plan_hash'), statistics.get('plan'), source)
+            ).lastrowid
+            self._inserted += 1
+            # Prune in batches rather than on every insert
+            if self._inserted % 100 == 0:
+                self._conn.execute(
+                    "DELETE FROM slow_queries WHERE id <= (SELECT MAX(id) FROM slow_queries) - ?", (int(self.max_entries),)
+                )
+            self._conn.commit()
+        return entry_id
+
+    def entries(self, limit: int = 50, order_by: str = 'recent', since_hours: Optional[float] = None,
+                fp: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Logged executions, without plans.
+
+        Args:
+            limit: Number of entries to return
+            order_by: One of ORDERINGS (recent, elapsed, reads, rows)
+            since_hours: Only entries from the last N hours
+            fp: Only entries of this fingerprint
+
+        Returns:
+            List of entries
+        """
+        if order_by not in ORDERINGS:
+            raise ValueError(f"order_by must be one of: {', '.join(ORDERINGS)}")
+        since = time.time() - since_hours * 3600 if since_hours else 0
+        query = (
+            "SELECT id, logged_at, question, sql, fingerprint, elapsed_ms, cpu_ms, server_ms, logical_reads, "
+            "physical_reads, row_count, success, error_category, plan_hash, plan IS NOT NULL, source "
+            "FROM slow_queries WHERE logged_at >= ?"
+        )
+        args: List[Any] = [since]
+        if fp:
+            query += " AND fingerprint = ?"
+            args.append(fp)
+        query += f" ORDER BY {ORDERINGS[order_by]} LIMIT ?"
+        args.append(int(limit))
+        with self._lock:
+            rows = self._conn.execute(query, args).fetchall()
+        return [self._entry(row) for row in rows]
+
+    def entry(self, entry_id: int) -> Optional[Dict[str, Any]]:
+        """One logged execution including its plan (None if unknown)."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, logged_at, question, sql, fingerprint, elapsed_ms, cpu_ms, server_ms, logical_reads, "
+                "physical_reads, row_count, success, error_category, plan_hash, plan IS NOT NULL, source, plan "
+                "FROM slow_queries WHERE id = ?",
+                (int(entry_id),)
+            ).fetchone()
+        if row is None:
+            return None
+        entry = self._entry(row[:16])
+        entry['plan'] = row[16]
+        return entry
+
+    def hotspots(self, limit: int = 20, since_hours: Optional[float] = None) -> List[Dict[str, Any]]:
+        """
+        Slow executions grouped by fingerprint, by total time.
+
+        Returns:
+            [{"fingerprint", "sample_sql", "sample_question", "executions", "total_ms", "avg_ms",
+              "max_ms", "avg_logical_reads", "plan_hashes"}, ...]
+        """
+        since = time.time() - since_hours * 3600 if since_hours else 0
+        with self._lock:
+            rows = self._conn.execute(
+                """
+                SELECT fingerprint, COUNT(*), SUM(elapsed_ms), AVG(elapsed_ms), MAX(elapsed_ms),
+                       AVG(logical_reads), COUNT(DISTINCT plan_hash), MAX(id)
+                FROM slow_queries
+                WHERE logged_at >= ?
+                GROUP BY fingerprint
+                ORDER BY SUM(elapsed_ms) DESC
+                LIMIT ?
+                """,
+                (since, int(limit))
+            ).fetchall()
+            samples = {
+                entry_id: (sql, question) for entry_id, sql, question in self._conn.execute(
+                    f"SELECT id, sql, question FROM slow_queries WHERE id IN ({','.join('?' * len(rows))})",
+                    [row[7] for row in rows]
+                )
+            } if rows else {}
+        return [
+            {
+                'fingerprint': fp,
+                'sample_sql': samples.get(last_id, (None, None))[0],
+                'sample_question': samples.get(last_id, (None, None))[1],
+                'executions': executions,
+                'total_ms': round(total_ms, 2),
+                'avg_ms': round(avg_ms, 2),
+                'max_ms': round(max_ms, 2),
+                'avg_logical_reads': round(avg_reads, 1) if avg_reads is not None else None,
+                'plan_hashes': plan_hashes
+            }
+            for fp, executions, total_ms, avg_ms, max_ms, avg_reads, plan_hashes, last_id in rows
+        ]
+
+    def totals(self) -> Dict[str, Any]:
+        """Log-wide counts and settings."""
+        with self._lock:
+            entries, = self._conn.execute("SELECT COUNT(*) FROM slow_queries").fetchone()
+        return {
+            'path': self.path,
+            'entries': entries,
+            'threshold_ms': self.threshold_ms,
+            'max_entries': self.max_entries,
+            'capture_statistics': self.capture_statistics,
+            'capture_plan': self.capture_plan
+        }
+
+    @staticmethod
+    def _entry(row) -> Dict[str, Any]:
+        (entry_id, logged_at, question, sql, fp, elapsed, cpu, server, logical, physical,
+         row_count, success, category, hashed, has_plan, source) = row
+        return {
+            'id': entry_id,
+            'logged_at': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(logged_at)),
+            'question': question,
+            'sql': sql,
+            'fingerprint': fp,
+            'elapsed_ms': round(elapsed, 2),
+            'cpu_ms': cpu,
+            'server_ms': server,
+            'logical_reads': logical,
+            'physical_reads': physical,
+            'row_count': row_count,
+            'success': bool(success),
+            'error_category': category,
+            'plan_hash': hashed,
+            'has_plan': bool(has_plan),
+            'source': source
+        }
+
+
+_slow_query_log: Optional[SlowQueryLog] = None
+_slow_query_lock = threading.Lock()
+
+
+def get_slow_query_log() -> Optional[SlowQueryLog]:
+    """
+    Process-wide slow-query log, created from environment variables on first use.
+
+    Returns:
+        The shared SlowQueryLog, or None when SLOW_QUERY_LOG_ENABLED=false
+    """
+    global _slow_query_log
+    if os.getenv('SLOW_QUERY_LOG_ENABLED', 'true').lower() == 'false':
+        return None
+    with _slow_query_lock:
+        if _slow_query_log is None:
+            path = os.getenv('SLOW_QUERY_LOG_DB', ':memory:')
+            options = dict(
+                threshold_ms=float(os.getenv('SLOW_QUERY_THRESHOLD_MS', '1000')),
+                max_entries=int(os.getenv('SLOW_QUERY_LOG_MAX_ENTRIES', '5000')),
+                capture_statistics=os.getenv('QUERY_STATS_CAPTURE', 'false').lower() == 'true',
+                capture_plan=os.getenv('QUERY_STATS_CAPTURE_PLAN', 'true').lower() == 'true'
+            )
+            try:
+                _slow_query_log = SlowQueryLog(path, **options)
+            except sqlite3.Error as e:
+                print(f"Warning: Could not open slow-query log {path} ({e}); using in-memory log")
+                _slow_query_log = SlowQueryLog(':memory:', **options)
+        return _slow_query_log
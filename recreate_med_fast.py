@@ -5,6 +5,11 @@ import pyodbc
 import struct
 from azure.identity import AzureCliCredential
 
+from name_index import refresh_trigram_table
+
+# Slots whose SLOT_VALUE holds another CODE; REF_CODE carries the typed copy
+REFERENCE_SLOTS = (3, 4, 15, 149, 150)
+
 def recreate_med_table():
     """Drop and recreate MED table with new data"""
     try:
@@ -43,9 +48,14 @@ def recreate_med_table():
                 CODE NVARCHAR(50) NOT NULL,
                 SLOT_NUMBER INT NOT NULL,
                 SLOT_VALUE NVARCHAR(200) NOT NULL,
+                REF_CODE NVARCHAR(50) NULL,
                 PRIMARY KEY (CODE, SLOT_NUMBER, SLOT_VALUE)
             )
         """)
+        cursor.execute("""
+            CREATE INDEX IX_MED_REF_CODE ON MED(REF_CODE, SLOT_NUMBER)
+            INCLUDE (CODE) WHERE REF_CODE IS NOT NULL
+        """)
         conn.commit()
         print("✅ MED table created")
         
@@ -173,13 +183,33 @@ def recreate_med_table():
             ("228458", 4, "32698"), ("228458", 6, "Quest Result: SODIUM"),
         ]
         
+        # Populate REF_CODE for reference slots alongside the raw value
+        data = [
+            (code, slot_num, slot_val, slot_val if slot_num in REFERENCE_SLOTS and slot_val else None)
+            for code, slot_num, slot_val in data
+        ]
+        
         # Insert using executemany for better performance
-        insert_sql = "INSERT INTO MED (CODE, SLOT_NUMBER, SLOT_VALUE) VALUES (?, ?, ?)"
+        insert_sql = "INSERT INTO MED (CODE, SLOT_NUMBER, SLOT_VALUE, REF_CODE) VALUES (?, ?, ?, ?)"
         cursor.executemany(insert_sql, data)
         conn.commit()
         
         print(f"✅ Successfully inserted {len(data)} rows")
         
+        # The PRINT-NAME trigram side table is derived from MED: rebuild it with the new names
+        print("\n🔤 Refreshing MED_NAME_TRIGRAMS...")
+        cursor.execute("DROP TABLE IF EXISTS MED_NAME_TRIGRAMS")
+        cursor.execute("""
+            CREATE TABLE MED_NAME_TRIGRAMS (
+                TRIGRAM NCHAR(3) NOT NULL,
+                CODE NVARCHAR(50) NOT NULL,
+                PRIMARY KEY (TRIGRAM, CODE)
+            )
+        """)
+        conn.commit()
+        trigram_rows = refresh_trigram_table(conn)
+        print(f"✅ MED_NAME_TRIGRAMS loaded: {trigram_rows} rows")
+        
         # Verify
         cursor.execute("SELECT COUNT(*) FROM MED")
         total = cursor.fetchone()[0]
@@ -4,9 +4,48 @@ Transforms General Agent responses into readable, well-structured HTML/Markdown
 with tables, sections, and proper paragraph styling for end-user consumption.
 """
 
+import html as html_lib
+import os
 import re
-from typing import Dict, List, Any, Optional
+from typing import Callable, Dict, List, Any, Optional
 from dataclasses import dataclass
+from functools import lru_cache
+
+from code_dictionary import CODE_SYSTEMS, SLOT_TO_SYSTEM
+from ontology_snapshot import REFERENCE_SLOTS
+
+
+# The page links this file once; format_for_html(include_styles=True) embeds it for standalone HTML
+STYLES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'formatted_response.css')
+
+
+# Table columns whose cells hold ontology CODEs or external code values (normalized headers,
+# see _column_key); other cells are never looked up, so counts or ids equal to a CODE stay plain
+CODE_COLUMNS = (
+    {'CODE', 'REF_CODE'}
+    | {system.replace('-', '_') for system in CODE_SYSTEMS}
+    | {f"{system.replace('-', '_')}_CODE" for system in CODE_SYSTEMS}
+    | {f'SLOT_{slot}' for slot in (*SLOT_TO_SYSTEM, *REFERENCE_SLOTS)}
+)
+
+# SLOT_VALUE cells are codes when the row's SLOT_NUMBER is a code-system or reference slot
+CODE_SLOTS = {str(slot) for slot in (*SLOT_TO_SYSTEM, *REFERENCE_SLOTS)}
+
+
+def _column_key(header: str) -> str:
+    """Normalized table header: 'Ref Code' and `REF_CODE` both become REF_CODE."""
+    return re.sub(r'[\s\-]+', '_', header.strip('`* ').upper())
+
+
+def _split_row(line: str) -> List[str]:
+    """Cells of a markdown table row, keeping empty cells so columns stay aligned."""
+    return [cell.strip() for cell in line.strip().strip('|').split('|')]
+
+
+@lru_cache(maxsize=1)
+def _read_styles() -> str:
+    with open(STYLES_PATH, encoding='utf-8') as f:
+        return f.read()
 
 
 @dataclass
@@ -24,8 +63,14 @@ class ResponseFormatter:
     with proper tables, sections, and formatting for end users.
     """
 
-    def __init__(self):
+    def __init__(self, code_lookup: Optional[Callable[[str], Optional[str]]] = None):
+        """
+        Args:
+            code_lookup: Optional callable mapping a CODE or external code value to a
+                description (e.g. OntologyCache.describe); used to annotate table cells
+        """
         self.sections = []
+        self.code_lookup = code_lookup
 
     def format_response(self, agent_response: str, query_data: Optional[List[Dict]] = None) -> str:
         """
@@ -116,25 +161,43 @@ class ResponseFormatter:
         
         # Parse header
         header_line = table_lines[0]
-        headers = [h.strip() for h in header_line.split('|') if h.strip()]
+        headers = _split_row(header_line)
         
         for header in headers:
             html += f'<th>{header}</th>'
         html += '</tr>\n</thead>\n<tbody>\n'
         
+        keys = [_column_key(header) for header in headers]
+        code_columns = {index for index, key in enumerate(keys) if key in CODE_COLUMNS}
+        slot_number = keys.index('SLOT_NUMBER') if 'SLOT_NUMBER' in keys else None
+        slot_value = keys.index('SLOT_VALUE') if 'SLOT_VALUE' in keys else None
+        
         # Parse rows (skip separator line)
         for line in table_lines[2:]:
             if line.strip() and '|' in line:
-                cells = [c.strip() for c in line.split('|') if c.strip()]
-                if cells:
+                cells = _split_row(line)
+                if any(cells):
+                    row_code_columns = code_columns
+                    if (slot_number is not None and slot_value is not None and slot_number < len(cells)
+                            and cells[slot_number].strip('`*') in CODE_SLOTS):
+                        row_code_columns = code_columns | {slot_value}
                     html += '<tr>'
-                    for cell in cells:
-                        html += f'<td>{cell}</td>'
+                    for index, cell in enumerate(cells):
+                        html += f'<td>{self._annotate_code(cell) if index in row_code_columns else cell}</td>'
                     html += '</tr>\n'
         
         html += '</tbody>\n</table>\n'
         return html
 
+    def _annotate_code(self, cell: str) -> str:
+        """Wrap a code column's cell holding a known code in a tooltip with its description."""
+        if not self.code_lookup or not cell or ' ' in cell or len(cell) > 30:
+            return cell
+        description = self.code_lookup(cell.strip('`*'))
+        if not description:
+            return cell
+        return f'<span class="code-ref" title="{html_lib.escape(description, quote=True)}">{cell}</span>'
+
     def _format_paragraphs(self, content: str) -> str:
         """Format text content into readable paragraphs with proper styling."""
         html = ''
@@ -210,124 +273,8 @@ class ResponseFormatter:
 
     @staticmethod
     def _get_css_styles() -> str:
-        """Get CSS styles for formatted responses."""
-        return '''
-<style>
-.formatted-response {
-    font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-    color: #333;
-    line-height: 1.8;
-    max-width: 900px;
-    margin: 0 auto;
-}
-
-.response-title {
-    font-size: 24px;
-    font-weight: 700;
-    color: #1a1a1a;
-    margin: 20px 0 15px 0;
-    border-bottom: 3px solid #667eea;
-    padding-bottom: 10px;
-}
-
-.response-heading {
-    font-size: 20px;
-    font-weight: 600;
-    color: #2196f3;
-    margin: 20px 0 12px 0;
-    border-left: 4px solid #2196f3;
-    padding-left: 10px;
-}
-
-.response-subheading {
-    font-size: 16px;
-    font-weight: 600;
-    color: #333;
-    margin: 15px 0 10px 0;
-}
-
-.response-paragraph {
-    font-size: 15px;
-    line-height: 1.8;
-    color: #444;
-    margin: 10px 0;
-    text-align: justify;
-}
-
-.response-list {
-    margin: 10px 0 10px 20px;
-    padding-left: 20px;
-}
-
-.response-list li {
-    margin: 8px 0;
-    color: #444;
-    font-size: 15px;
-    line-height: 1.6;
-}
-
-.data-table {
-    width: 100%;
-    border-collapse: collapse;
-    margin: 15px 0;
-    box-shadow: 0 2px 4px rgba(0,0,0,0.1);
-    border-radius: 8px;
-    overflow: hidden;
-}
-
-.data-table thead {
-    background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-    color: white;
-}
-
-.data-table th {
-    padding: 14px;
-    text-align: left;
-    font-weight: 600;
-    font-size: 14px;
-    text-transform: capitalize;
-}
-
-.data-table td {
-    padding: 12px 14px;
-    border-bottom: 1px solid #e0e0e0;
-    font-size: 14px;
-    color: #555;
-}
-
-.data-table tbody tr:nth-child(odd) {
-    background-color: #f9f9f9;
-}
-
-.data-table tbody tr:hover {
-    background-color: #f0f0f0;
-    transition: background-color 0.2s;
-}
-
-.data-table tbody tr:last-child td {
-    border-bottom: none;
-}
-
-strong {
-    color: #1a1a1a;
-    font-weight: 600;
-}
-
-em {
-    color: #666;
-    font-style: italic;
-}
-
-code {
-    background-color: #f5f5f5;
-    padding: 2px 6px;
-    border-radius: 3px;
-    font-family: 'Courier New', monospace;
-    font-size: 13px;
-    color: #d63384;
-}
-</style>
-'''
+        """Get CSS styles for formatted responses (static/formatted_response.css, read once)."""
+        return f'<style>\n{_read_styles()}</style>\n'
 
     @staticmethod
     def create_data_summary_table(data: List[Dict], title: str = "Query Results") -> str:
@@ -368,19 +315,23 @@ code {
 
 
 def format_general_agent_response(agent_text: str, 
-                                  query_results: Optional[List[Dict]] = None) -> Dict[str, str]:
+                                  query_results: Optional[List[Dict]] = None,
+                                  code_lookup: Optional[Callable[[str], Optional[str]]] = None,
+                                  include_styles: bool = True) -> Dict[str, str]:
     """
     Convenience function to format General Agent response.
     
     Args:
         agent_text: Response text from General Agent
         query_results: Optional query results to include
+        code_lookup: Optional code description lookup used to annotate table cells
+        include_styles: Embed the CSS; pages that link static/formatted_response.css pass False
         
     Returns:
         Dictionary with 'html' and 'markdown' keys
     """
-    formatter = ResponseFormatter()
-    html_response = formatter.format_for_html(agent_text, query_results)
+    formatter = ResponseFormatter(code_lookup=code_lookup)
+    html_response = formatter.format_for_html(agent_text, query_results, include_styles=include_styles)
     
     return {
         'html': html_response,
@@ -0,0 +1,325 @@
+"""
+Server-side Result Retention
+/api/query returns only the first page of a result set plus a result_id; the full result
+is kept here and served page by page from /api/results/<id>. Results live in memory up to
+a byte budget, the least recently used ones spill to a SQLite file, and every result
+expires after a TTL.
+
+By default the SQLite file is shared by the worker processes of a host and every result is
+written to it when stored, so a result_id (also one returned by a job) can be paged from
+any worker; the storing worker still serves it from memory while it fits the budget.
+With RESULT_STORE_SHARED=false each process has its own file, and paging requests must
+reach the worker that ran the query (sticky sessions). Across hosts, requests for a result
+must reach the same host either way.
+
+Pages are keyset-paginated on the row sequence number: the cursor encodes the next
+sequence number, so a page is `seq >= cursor ORDER BY seq LIMIT n` on disk and a slice in
+memory, and its cost does not grow with the page's position.
+
+Configuration:
+    RESULT_STORE_TTL_SECONDS    Lifetime of a retained result (default: 900)
+    RESULT_STORE_MEMORY_MB      In-memory budget before results spill to disk (default: 64)
+    RESULT_STORE_SHARED         Share results between the workers of a host: true or false (default: true)
+    RESULT_STORE_SPILL_DB       SQLite file for results; '{pid}' is replaced by the process id
+                                (default: <tmp>/sql_results.db, or <tmp>/sql_results_{pid}.db when not shared)
+    RESULT_STORE_PAGE_SIZE      Default and first-page size (default: 50)
+"""
+
+import base64
+import json
+import os
+import secrets
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS result_rows (
+    result_id   TEXT NOT NULL,
+    seq         INTEGER NOT NULL,
+    row         TEXT NOT NULL,
+    PRIMARY KEY (result_id, seq)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS results (
+    result_id   TEXT PRIMARY KEY,
+    columns     TEXT NOT NULL,
+    row_count   INTEGER NOT NULL,
+    owner       TEXT,
+    expires_at  REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_results_expires ON results (expires_at);
+"""
+
+# Upper bound for the limit= parameter
+MAX_PAGE_SIZE = 1000
+
+# A shared store deletes every worker's expired results at most this often
+SWEEP_SECONDS = 60
+
+
+def encode_cursor(seq: int) -> str:
+    """Opaque cursor for the row sequence number a page starts at."""
+    return base64.urlsafe_b64encode(f"seq:{seq}".encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: Optional[str]) -> int:
+    """
+    Row sequence number of a cursor (0 when there is none).
+
+    Raises:
+        ValueError: Malformed cursor
+    """
+    if not cursor:
+        return 0
+    try:
+        text = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        prefix, _, seq = text.partition(':')
+        if prefix != 'seq' or int(seq) < 0:
+            raise ValueError
+        return int(seq)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError(f"Invalid cursor '{cursor}'")
+
+
+class ResultStore:
+    """TTL-bounded result sets held in memory, spilling to a SQLite file."""
+
+    def __init__(self, spill_path: str, max_memory_bytes: int = 64 * 1024 * 1024,
+                 ttl_seconds: float = 900, page_size: int = 50, shared: bool = False):
+        """
+        Args:
+            spill_path: SQLite file for spilled results
+            max_memory_bytes: Budget for results kept in memory (JSON-encoded size)
+            ttl_seconds: Lifetime of a result after it was stored
+            page_size: Default page size
+            shared: The file is shared with other processes: every result is written to it
+                    on put() and results stored by other processes are read from it
+        """
+        self.spill_path = spill_path
+        self.max_memory_bytes = max_memory_bytes
+        self.ttl_seconds = ttl_seconds
+        self.page_size = page_size
+        self.shared = shared
+        self._lock = threading.Lock()
+        # result_id -> entry, least recently used first
+        self._entries: 'OrderedDict[str, Dict[str, Any]]' = OrderedDict()
+        self._memory_bytes = 0
+        self._conn = sqlite3.connect(spill_path, timeout=10, check_same_thread=False)
+        if shared:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        if shared:
+            self._next_sweep = 0.0
+            self._sweep(time.time())
+        else:
+            # Results spilled by an earlier process are unreachable (their ids were in memory)
+            self._conn.execute("DELETE FROM result_rows")
+            self._conn.execute("DELETE FROM results")
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def put(self, columns: List[str], rows: List[Dict[str, Any]], owner: Optional[str] = None) -> str:
+        """
+        Retain a result set.
+
+        Args:
+            columns: Column names, in order
+            rows: Result rows as dictionaries
+            owner: Session that may read the result (None = anyone)
+
+        Returns:
+            result_id
+        """
+        values = [[row.get(column) for column in columns] for row in rows]
+        size = sum(len(json.dumps(value, default=str)) for value in values)
+        result_id = secrets.token_urlsafe(12)
+        now = time.time()
+        entry = {
+            'columns': list(columns),
+            'rows': values,
+            'row_count': len(values),
+            'bytes': size,
+            'owner': owner,
+            'expires_at': now + self.ttl_seconds,
+            'spilled': False,
+            'persisted': False
+        }
+        with self._lock:
+            self._expire(now)
+            if self.shared:
+                # Other workers page the result from the file
+                self._persist(result_id, entry)
+                self._sweep(now)
+            self._entries[result_id] = entry
+            self._memory_bytes += size
+            self._spill_to_budget()
+        return result_id
+
+    def page(self, result_id: str, cursor: Optional[str] = None, limit: Optional[int] = None,
+             owner: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        One page of a retained result.
+
+        Args:
+            result_id: Id returned by put()
+            cursor: next_cursor of the previous page (None = first page)
+            limit: Rows per page (default page_size, at most MAX_PAGE_SIZE)
+            owner: Requesting session (must match the owner given to put())
+
+        Returns:
+            {"result_id", "columns", "rows", "row_count", "next_cursor", "expires_at"},
+            or None when the result is unknown, expired or owned by another session
+
+        Raises:
+            ValueError: Malformed cursor or limit
+        """
+        start = decode_cursor(cursor)
+        limit = self.page_size if limit is None else limit
+        if limit < 1:
+            raise ValueError("limit must be positive")
+        limit = min(limit, MAX_PAGE_SIZE)
+
+        with self._lock:
+            now = time.time()
+            self._expire(now)
+            entry = self._entries.get(result_id)
+            if entry is not None:
+                self._entries.move_to_end(result_id)
+            elif self.shared:
+                # Stored by another worker
+                entry = self._load_entry(result_id, now)
+            if entry is None or (entry['owner'] is not None and entry['owner'] != owner):
+                return None
+            columns = entry['columns']
+            if entry['spilled']:
+                values = [json.loads(row) for (row,) in self._conn.execute(
+                    "SELECT row FROM result_rows WHERE result_id = ? AND seq >= ? ORDER BY seq LIMIT ?",
+                    (result_id, start, limit)
+                )]
+            else:
+                values = entry['rows'][start:start + limit]
+            row_count, expires_at = entry['row_count'], entry['expires_at']
+
+        end = start + len(values)
+        return {
+            'result_id': result_id,
+            'columns': columns,
+            'rows': [dict(zip(columns, value)) for value in values],
+            'row_count': row_count,
+            'next_cursor': encode_cursor(end) if end < row_count else None,
+            'expires_at': expires_at
+        }
+
+    def _persist(self, result_id: str, entry: Dict[str, Any]):
+        """Write a result's rows (and, when shared, its metadata) to the file (lock held)."""
+        with self._conn:
+            self._conn.executemany(
+                "INSERT INTO result_rows (result_id, seq, row) VALUES (?, ?, ?)",
+                ((result_id, seq, json.dumps(value, default=str)) for seq, value in enumerate(entry['rows']))
+            )
+            if self.shared:
+                self._conn.execute(
+                    "INSERT INTO results (result_id, columns, row_count, owner, expires_at) VALUES (?, ?, ?, ?, ?)",
+                    (result_id, json.dumps(entry['columns']), entry['row_count'], entry['owner'], entry['expires_at'])
+                )
+        entry['persisted'] = True
+
+    def _load_entry(self, result_id: str, now: float) -> Optional[Dict[str, Any]]:
+        """A result another worker stored in the shared file, as a spilled entry (lock held)."""
+        row = self._conn.execute(
+            "SELECT columns, row_count, owner, expires_at FROM results WHERE result_id = ? AND expires_at > ?",
+            (result_id, now)
+        ).fetchone()
+        if row is None:
+            return None
+        return {'columns': json.loads(row[0]), 'row_count': row[1], 'owner': row[2], 'expires_at': row[3],
+                'rows': None, 'spilled': True, 'persisted': True}
+
+    def _spill_to_budget(self):
+        """Move least recently used results to disk until memory is within budget (lock held)."""
+        for result_id, entry in self._entries.items():
+            if self._memory_bytes <= self.max_memory_bytes:
+                break
+            if entry['spilled']:
+                continue
+            if not entry['persisted']:
+                self._persist(result_id, entry)
+            entry['rows'] = None
+            entry['spilled'] = True
+            self._memory_bytes -= entry['bytes']
+
+    def _expire(self, now: float):
+        """Drop results past their TTL (lock held)."""
+        expired = [result_id for result_id, entry in self._entries.items() if entry['expires_at'] <= now]
+        persisted = []
+        for result_id in expired:
+            entry = self._entries.pop(result_id)
+            if entry['persisted']:
+                persisted.append((result_id,))
+            if not entry['spilled']:
+                self._memory_bytes -= entry['bytes']
+        if persisted:
+            with self._conn:
+                self._conn.executemany("DELETE FROM result_rows WHERE result_id = ?", persisted)
+                self._conn.executemany("DELETE FROM results WHERE result_id = ?", persisted)
+
+    def _sweep(self, now: float):
+        """Delete expired results of every worker from the shared file, at most every SWEEP_SECONDS (lock held)."""
+        if now < self._next_sweep:
+            return
+        self._next_sweep = now + SWEEP_SECONDS
+        with self._conn:
+            self._conn.execute(
+                "DELETE FROM result_rows WHERE result_id IN (SELECT result_id FROM results WHERE expires_at <= ?)",
+                (now,)
+            )
+            self._conn.execute("DELETE FROM results WHERE expires_at <= ?", (now,))
+
+    def stats(self) -> Dict[str, Any]:
+        """Retained results and memory use."""
+        with self._lock:
+            self._expire(time.time())
+            spilled = sum(1 for entry in self._entries.values() if entry['spilled'])
+            return {
+                'results': len(self._entries),
+                'in_memory': len(self._entries) - spilled,
+                'spilled': spilled,
+                'memory_bytes': self._memory_bytes,
+                'max_memory_bytes': self.max_memory_bytes,
+                'ttl_seconds': self.ttl_seconds,
+                'shared': self.shared
+            }
+
+
+_result_store: Optional[ResultStore] = None
+_result_lock = threading.Lock()
+
+
+def get_result_store() -> ResultStore:
+    """Process-wide result store, created from environment variables on first use."""
+    global _result_store
+    with _result_lock:
+        if _result_store is None:
+            shared = os.getenv('RESULT_STORE_SHARED', 'true').lower() == 'true'
+            default_name = 'sql_results.db' if shared else 'sql_results_{pid}.db'
+            path = os.getenv('RESULT_STORE_SPILL_DB') or os.path.join(tempfile.gettempdir(), default_name)
+            path = path.replace('{pid}', str(os.getpid()))
+            options = dict(
+                max_memory_bytes=int(float(os.getenv('RESULT_STORE_MEMORY_MB', '64')) * 1024 * 1024),
+                ttl_seconds=float(os.getenv('RESULT_STORE_TTL_SECONDS', '900')),
+                page_size=int(os.getenv('RESULT_STORE_PAGE_SIZE', '50'))
+            )
+            try:
+                _result_store = ResultStore(path, shared=shared, **options)
+            except sqlite3.Error as e:
+                print(f"Warning: Could not open result spill file {path} ({e}); results are only served by this worker")
+                _result_store = ResultStore(':memory:', **options)
+        return _result_store
@@ -16,6 +16,22 @@ import logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Slots whose SLOT_VALUE holds another CODE; REF_CODE carries the typed copy
+REFERENCE_SLOTS = (3, 4, 15, 149, 150)
+
+
+def ref_code_for(slot_number, slot_value):
+    """
+    REF_CODE for a MED row: the referenced CODE as an INT for reference slots, None for
+    other slots and for values that are not numeric (like TRY_CAST in database/meddata.sql).
+    """
+    if slot_number not in REFERENCE_SLOTS or not slot_value:
+        return None
+    try:
+        return int(str(slot_value).strip())
+    except ValueError:
+        return None
+
 
 class MedDataDatabaseSetup:
     """Setup Azure SQL Database for medical data storage"""
@@ -194,6 +210,7 @@ class MedDataDatabaseSetup:
                         CODE INT NOT NULL,
                         SLOT_NUMBER INT NOT NULL,
                         SLOT_VALUE NVARCHAR(500),
+                        REF_CODE INT NULL,
                         FOREIGN KEY (SLOT_NUMBER) REFERENCES MED_SLOTS(SLOT_NUMBER)
                     );
                     
@@ -202,6 +219,10 @@ class MedDataDatabaseSetup:
                     
                     -- Create index on SLOT_NUMBER for joins
                     CREATE INDEX IX_MED_SLOT_NUMBER ON MED(SLOT_NUMBER);
+                    
+                    -- Create index on REF_CODE for relationship traversal
+                    CREATE INDEX IX_MED_REF_CODE ON MED(REF_CODE, SLOT_NUMBER)
+                        INCLUDE (CODE) WHERE REF_CODE IS NOT NULL;
                 END
             """)
             conn.commit()
@@ -385,9 +406,10 @@ class MedDataDatabaseSetup:
                 while retry_count < max_retries:
                     try:
                         for code, slot_number, slot_value in batch:
+                            ref_code = ref_code_for(slot_number, slot_value)
                             cursor.execute(
-                                "INSERT INTO MED (CODE, SLOT_NUMBER, SLOT_VALUE) VALUES (?, ?, ?)",
-                                code, slot_number, slot_value if slot_value else None
+                                "INSERT INTO MED (CODE, SLOT_NUMBER, SLOT_VALUE, REF_CODE) VALUES (?, ?, ?, ?)",
+                                code, slot_number, slot_value if slot_value else None, ref_code
                             )
                         conn.commit()
                         break
@@ -0,0 +1,209 @@
+"""
+Bounded Session Store
+Holds per-session state (the web app's conversations) with three bounds: an idle TTL, a
+maximum number of sessions (least recently used evicted first) and an approximate memory
+budget across all sessions. Evicted sessions are handed to eviction callbacks, which can
+persist them before they are dropped.
+
+Sizes are estimates (sys.getsizeof over the object graph, strings and result rows
+dominating); values that know their own size expose approximate_size().
+
+Configuration:
+    SESSION_MAX_COUNT           Sessions kept at most (default: 1000)
+    SESSION_IDLE_TTL_SECONDS    Sessions idle longer than this are evicted (default: 3600)
+    SESSION_MAX_MB              Approximate memory budget for all sessions (default: 256)
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List
+
+
+EVICTION_REASONS = ('idle', 'lru', 'memory', 'manual')
+
+# Lazy sweeps for idle sessions run at most this often
+SWEEP_INTERVAL_SECONDS = 30
+
+
+def approximate_size(value: Any, _depth: int = 0) -> int:
+    """
+    Approximate memory footprint of a value in bytes.
+
+    Containers are walked (to a bounded depth); other objects count their 'text' attribute
+    when they have one (chat messages) and their own size otherwise.
+    """
+    size = sys.getsizeof(value)
+    if _depth > 8 or isinstance(value, (str, bytes, int, float, bool)) or value is None:
+        return size
+    if isinstance(value, dict):
+        return size + sum(approximate_size(k, _depth + 1) + approximate_size(v, _depth + 1) for k, v in value.items())
+    if isinstance(value, (list, tuple, set)):
+        return size + sum(approximate_size(item, _depth + 1) for item in value)
+    text = getattr(value, 'text', None)
+    return size + (sys.getsizeof(text) if isinstance(text, str) else 0)
+
+
+class SessionStore:
+    """Session id -> value map with idle TTL, LRU count bound, memory budget and eviction callbacks."""
+
+    def __init__(
+        self,
+        factory: Callable[[], Any],
+        max_sessions: int = 1000,
+        idle_ttl_seconds: float = 3600,
+        max_bytes: int = 256 * 1024 * 1024
+    ):
+        """
+        Args:
+            factory: Creates the value of a new session
+            max_sessions: Sessions kept at most
+            idle_ttl_seconds: Idle time after which a session is evicted
+            max_bytes: Approximate memory budget across all sessions
+        """
+        self.factory = factory
+        self.max_sessions = max_sessions
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # session_id -> {"value", "last_used", "bytes"}, least recently used first
+        self._sessions: 'OrderedDict[str, Dict[str, Any]]' = OrderedDict()
+        self._bytes = 0
+        self._callbacks: List[Callable[[str, Any, str], None]] = []
+        self._swept_at = time.monotonic()
+        self.created = 0
+        self.evicted = {reason: 0 for reason in EVICTION_REASONS}
+
+    def add_eviction_callback(self, callback: Callable[[str, Any, str], None]):
+        """Call callback(session_id, value, reason) for every evicted session."""
+        self._callbacks.append(callback)
+
+    def get(self, session_id: str) -> Any:
+        """The session's value, created on first use; marks the session as used."""
+        now = time.monotonic()
+        evicted = []
+        with self._lock:
+            if now - self._swept_at >= SWEEP_INTERVAL_SECONDS:
+                self._swept_at = now
+                evicted.extend(self._expire(now))
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                entry = {'value': self.factory(), 'last_used': now, 'bytes': 0}
+                self._sessions[session_id] = entry
+                self.created += 1
+                while len(self._sessions) > self.max_sessions:
+                    evicted.append(self._pop_oldest('lru'))
+            else:
+                entry['last_used'] = now
+                self._sessions.move_to_end(session_id)
+            value = entry['value']
+        self._notify(evicted)
+        return value
+
+    def touch(self, session_id: str):
+        """Re-measure a session after a request changed it and enforce the memory budget."""
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return
+            value = entry['value']
+        # Measured outside the lock: sizing a large session must not block other requests
+        size = value.approximate_size() if hasattr(value, 'approximate_size') else approximate_size(value)
+        evicted = []
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None or entry['value'] is not value:
+                return
+            self._bytes += size - entry['bytes']
+            entry['bytes'] = size
+            entry['last_used'] = time.monotonic()
+            self._sessions.move_to_end(session_id)
+            # The session just used is evicted last
+            while self._bytes > self.max_bytes and len(self._sessions) > 1:
+                evicted.append(self._pop_oldest('memory'))
+        self._notify(evicted)
+
+    def evict(self, session_id: str, reason: str = 'manual') -> bool:
+        """Evict one session; returns False if it does not exist."""
+        with self._lock:
+            entry = self._sessions.pop(session_id, None)
+            if entry is None:
+                return False
+            self._bytes -= entry['bytes']
+            self.evicted[reason] = self.evicted.get(reason, 0) + 1
+        self._notify([(session_id, entry['value'], reason)])
+        return True
+
+    def sweep(self) -> int:
+        """Evict idle sessions now; returns how many were evicted."""
+        with self._lock:
+            self._swept_at = time.monotonic()
+            evicted = self._expire(self._swept_at)
+        self._notify(evicted)
+        return len(evicted)
+
+    def _expire(self, now: float) -> list:
+        """Remove sessions idle past the TTL (lock held)."""
+        evicted = []
+        while self._sessions:
+            session_id, entry = next(iter(self._sessions.items()))
+            if now - entry['last_used'] < self.idle_ttl_seconds:
+                break
+            evicted.append(self._pop_oldest('idle'))
+        return evicted
+
+    def _pop_oldest(self, reason: str):
+        """Remove the least recently used session (lock held)."""
+        session_id, entry = self._sessions.popitem(last=False)
+        self._bytes -= entry['bytes']
+        self.evicted[reason] += 1
+        return session_id, entry['value'], reason
+
+    def _notify(self, evicted: list):
+        for session_id, value, reason in evicted:
+            for callback in self._callbacks:
+                try:
+                    callback(session_id, value, reason)
+                except Exception as e:
+                    print(f"Warning: Session eviction callback failed for {session_id}: {e}")
+
+    def __contains__(self, session_id: str) -> bool:
+        with self._lock:
+            return session_id in self._sessions
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._sessions)
+
+    def stats(self) -> Dict[str, Any]:
+        """Active sessions, memory use and eviction counts."""
+        with self._lock:
+            largest = max((entry['bytes'] for entry in self._sessions.values()), default=0)
+            return {
+                'active': len(self._sessions),
+                'created': self.created,
+                'evicted': dict(self.evicted),
+                'evicted_total': sum(self.evicted.values()),
+                'bytes': self._bytes,
+                'largest_session_bytes': largest,
+                'max_sessions': self.max_sessions,
+                'max_bytes': self.max_bytes,
+                'idle_ttl_seconds': self.idle_ttl_seconds
+            }
+
+
+def create_session_store_from_env(factory: Callable[[], Any]) -> SessionStore:
+    """
+    Create a SessionStore from environment variables.
+
+    Args:
+        factory: Creates the value of a new session
+    """
+    return SessionStore(
+        factory,
+        max_sessions=int(os.getenv('SESSION_MAX_COUNT', '1000')),
+        idle_ttl_seconds=float(os.getenv('SESSION_IDLE_TTL_SECONDS', '3600')),
+        max_bytes=int(float(os.getenv('SESSION_MAX_MB', '256')) * 1024 * 1024)
+    )
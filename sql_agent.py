@@ -9,7 +9,12 @@ from typing import List, Dict, Any, Optional
 from openai import AzureOpenAI
 import json
 import struct
+import time
 from azure.identity import DefaultAzureCredential, AzureCliCredential
+from execution_backend import ExecutionProfile, SqlServerBackend, create_backend_from_env
+from sql_validator import SQLValidator
+from sql_workload import get_workload_store
+from query_stats import get_slow_query_log, summarize_statistics
 
 
 class SQLAgent:
@@ -25,9 +30,16 @@ class SQLAgent:
         azure_openai_api_key: str = None,
         azure_openai_deployment: str = None,
         azure_openai_api_version: str = "2024-08-01-preview",
-        use_azure_ad: bool = True
+        use_azure_ad: bool = True,
+        backend=None,
+        execution_profile: Optional[ExecutionProfile] = None
     ):
-        """Initialize the SQL Agent with database and Azure OpenAI credentials."""
+        """
+        Initialize the SQL Agent with database and Azure OpenAI credentials.
+        
+        backend: Execution backend (see execution_backend.py); defaults to SQL Server.
+        execution_profile: Session guardrails for generated queries; None uses connection defaults.
+        """
         self.sql_server = sql_server
         self.sql_database = sql_database
         self.sql_username = sql_username
@@ -53,16 +65,17 @@ class SQLAgent:
                 f"TrustServerCertificate=no;"
                 f"Connection Timeout=30;"
             )
-            # Get Azure AD token
-            try:
-                credential = AzureCliCredential()
-                token = credential.get_token("https://database.windows.net/.default")
-                self.token_bytes = token.token.encode("utf-16-le")
-                self.token_struct = struct.pack(f'<I{len(self.token_bytes)}s', len(self.token_bytes), self.token_bytes)
-            except Exception as e:
-                print(f"Warning: Could not get Azure AD token: {e}")
-                print("Falling back to environment variables if available...")
-                self.token_struct = None
+            # Get Azure AD token (not needed when queries run against a local copy)
+            self.token_struct = None
+            if backend is None or not backend.is_local:
+                try:
+                    credential = AzureCliCredential()
+                    token = credential.get_token("https://database.windows.net/.default")
+                    self.token_bytes = token.token.encode("utf-16-le")
+                    self.token_struct = struct.pack(f'<I{len(self.token_bytes)}s', len(self.token_bytes), self.token_bytes)
+                except Exception as e:
+                    print(f"Warning: Could not get Azure AD token: {e}")
+                    print("Falling back to environment variables if available...")
         else:
             # SQL authentication
             self.connection_string = (
@@ -77,6 +90,14 @@ class SQLAgent:
             )
             self.token_struct = None
         
+        # Where generated queries run (SQL Server unless a local backend was supplied)
+        self.backend = backend or SqlServerBackend(self._connect_sql_server, execution_profile)
+        if execution_profile is not None and self.backend.profile is None:
+            self.backend.profile = execution_profile
+        self.execution_profile = self.backend.profile
+        self.workload_store = get_workload_store()
+        self.slow_query_log = get_slow_query_log()
+        
         # Get database schema on initialization
         self.schema_info = self._get_database_schema()
         
@@ -84,71 +105,41 @@ class SQLAgent:
         self.conversation_history: List[Dict[str, str]] = []
     
     def _get_connection(self):
-        """Get a database connection with appropriate authentication."""
+        """Get a connection from the execution backend."""
+        return self.backend.connect()
+    
+    def _connect_sql_server(self, read_only: bool = False):
+        """Get a SQL Server connection with appropriate authentication (read-only intent for generated queries)."""
+        connection_string = self.connection_string + ("ApplicationIntent=ReadOnly;" if read_only else "")
         if self.use_azure_ad and self.token_struct:
             # Connect with Azure AD token
             SQL_COPT_SS_ACCESS_TOKEN = 1256  # Connection option for access token
-            conn = pyodbc.connect(self.connection_string, attrs_before={SQL_COPT_SS_ACCESS_TOKEN: self.token_struct})
+            conn = pyodbc.connect(connection_string, attrs_before={SQL_COPT_SS_ACCESS_TOKEN: self.token_struct})
         else:
             # Connect with connection string (SQL auth or env vars)
-            conn = pyodbc.connect(self.connection_string)
+            conn = pyodbc.connect(connection_string)
         return conn
     
     def _get_database_schema(self) -> str:
         """Retrieve the database schema to help with query generation."""
         try:
             conn = self._get_connection()
-            cursor = conn.cursor()
             
             # Get tables and columns
-            schema_query = """
-            SELECT 
-                t.TABLE_NAME,
-                c.COLUMN_NAME,
-                c.DATA_TYPE,
-                c.IS_NULLABLE,
-                CASE WHEN pk.COLUMN_NAME IS NOT NULL THEN 'YES' ELSE 'NO' END AS IS_PRIMARY_KEY
-            FROM INFORMATION_SCHEMA.TABLES t
-            LEFT JOIN INFORMATION_SCHEMA.COLUMNS c ON t.TABLE_NAME = c.TABLE_NAME
-            LEFT JOIN (
-                SELECT ku.TABLE_NAME, ku.COLUMN_NAME
-                FROM INFORMATION_SCHEMA.TABLE_CONSTRAINTS tc
-                JOIN INFORMATION_SCHEMA.KEY_COLUMN_USAGE ku
-                    ON tc.CONSTRAINT_NAME = ku.CONSTRAINT_NAME
-                WHERE tc.CONSTRAINT_TYPE = 'PRIMARY KEY'
-            ) pk ON c.TABLE_NAME = pk.TABLE_NAME AND c.COLUMN_NAME = pk.COLUMN_NAME
-            WHERE t.TABLE_TYPE = 'BASE TABLE'
-            ORDER BY t.TABLE_NAME, c.ORDINAL_POSITION
-            """
-            
-            cursor.execute(schema_query)
-            rows = cursor.fetchall()
-            
-            # Build schema description
-            schema_dict = {}
-            for row in rows:
-                table_name = row.TABLE_NAME
-                if table_name not in schema_dict:
-                    schema_dict[table_name] = []
-                
-                column_info = {
-                    'name': row.COLUMN_NAME,
-                    'type': row.DATA_TYPE,
-                    'nullable': row.IS_NULLABLE,
-                    'primary_key': row.IS_PRIMARY_KEY
-                }
-                schema_dict[table_name].append(column_info)
+            schema_dict = self.backend.describe_tables(conn)
+            self.sql_validator = SQLValidator({
+                table_name: [col['name'] for col in columns] for table_name, columns in schema_dict.items()
+            })
             
             # Format schema as text
             schema_text = "Database Schema:\n\n"
             for table_name, columns in schema_dict.items():
                 schema_text += f"Table: {table_name}\n"
                 for col in columns:
-                    pk_marker = " (PRIMARY KEY)" if col['primary_key'] == 'YES' else ""
+                    pk_marker = " (PRIMARY KEY)" if col['primary_key'] else ""
                     schema_text += f"  - {col['name']}: {col['type']}{pk_marker}\n"
                 schema_text += "\n"
             
-            cursor.close()
             conn.close()
             
             return schema_text
@@ -218,20 +209,85 @@ Example response format:
                 'error': f"Error generating SQL: {str(e)}"
             }
     
-    def _execute_query(self, sql_query: str) -> Dict[str, Any]:
+    def _validate_sql(self, sql_query: str) -> Dict[str, Any]:
+        """Check the SQL against the cached schema before executing it (see sql_validator.py)."""
+        validator = getattr(self, 'sql_validator', None)
+        validation = validator.validate(sql_query) if validator else {'success': True, 'validated': False}
+        if validation['success']:
+            return validation
+        return {
+            'success': False,
+            'data': None,
+            'row_count': 0,
+            'columns': None,
+            'error': validation['error'],
+            'error_category': validation['error_category'],
+            'hint': validation['hint']
+        }
+    
+    def _execute_query(self, sql_query: str, question: Optional[str] = None) -> Dict[str, Any]:
         """Execute the SQL query and return results."""
+        started = time.perf_counter()
+        result = self._run_query(sql_query)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        result['elapsed_ms'] = round(elapsed_ms, 2)
+        if self.workload_store is not None:
+            try:
+                self.workload_store.record(
+                    sql_query,
+                    elapsed_ms,
+                    row_count=result.get('row_count', 0),
+                    success=result.get('success', False),
+                    source='sql'
+                )
+            except Exception as e:
+                print(f"Warning: Could not record query workload: {e}")
+        if self.slow_query_log is not None:
+            try:
+                self.slow_query_log.record(
+                    sql_query,
+                    elapsed_ms,
+                    question=question,
+                    row_count=result.get('row_count', 0),
+                    success=result.get('success', False),
+                    statistics=result.get('statistics'),
+                    source='sql'
+                )
+            except Exception as e:
+                print(f"Warning: Could not record slow query: {e}")
+        return result
+    
+    def _run_query(self, sql_query: str) -> Dict[str, Any]:
+        """Run the SQL on the execution backend."""
         try:
-            conn = self._get_connection()
+            # Checked out with the execution profile (read-only, lock timeout, row ceiling)
+            conn = self.backend.checkout()
             cursor = conn.cursor()
+            log = self.slow_query_log
+            capture = log is not None and log.capture_statistics
+            if capture:
+                try:
+                    self.backend.enable_statistics(cursor, log.capture_plan)
+                except Exception as e:
+                    print(f"Warning: Could not enable execution statistics: {e}")
+                    capture = False
             
-            # Execute the query
-            cursor.execute(sql_query)
+            # Execute the query (transpiled when running against a local copy)
+            executed = self.backend.transpile(sql_query)
+            self.backend.execute(cursor, executed)
             
             # Get column names
             columns = [column[0] for column in cursor.description]
             
-            # Fetch results
-            rows = cursor.fetchall()
+            # Fetch results (at most the profile's row limit)
+            rows, truncated = self.backend.fetch(cursor)
+            
+            statistics = None
+            if capture:
+                try:
+                    statistics = self.backend.collect_statistics(cursor, executed, None, log.capture_plan)
+                except Exception as e:
+                    print(f"Warning: Could not capture execution statistics: {e}")
             
             # Convert to list of dictionaries
             results = []
@@ -246,6 +302,8 @@ Example response format:
                 'data': results,
                 'row_count': len(results),
                 'columns': columns,
+                'truncated': truncated,
+                'statistics': statistics,
                 'error': None
             }
             
@@ -349,8 +407,10 @@ Please provide a natural language answer to the user's question based on these r
         sql_query = sql_generation['sql']
         explanation = sql_generation['explanation']
         
-        # Step 2: Execute query
-        query_results = self._execute_query(sql_query)
+        # Step 2: Validate locally, then execute query
+        query_results = self._validate_sql(sql_query)
+        if query_results['success']:
+            query_results = self._execute_query(sql_query, question=user_question)
         
         # Step 3: Generate natural language response
         if query_results['success']:
@@ -377,6 +437,8 @@ Please provide a natural language answer to the user's question based on these r
             'results': query_results['data'] if query_results['success'] else None,
             'row_count': query_results['row_count'],
             'response': nl_response,
+            'db_elapsed_ms': query_results.get('elapsed_ms'),
+            'statistics': summarize_statistics(query_results.get('statistics')),
             'error': query_results.get('error')
         }
     
@@ -391,6 +453,7 @@ Please provide a natural language answer to the user's question based on these r
 
 def create_agent_from_env() -> SQLAgent:
     """Create SQLAgent instance from environment variables."""
+    execution_profile = ExecutionProfile.from_env('SQL')
     return SQLAgent(
         sql_server=os.getenv('SQL_SERVER'),
         sql_database=os.getenv('SQL_DATABASE'),
@@ -399,5 +462,7 @@ def create_agent_from_env() -> SQLAgent:
         azure_openai_endpoint=os.getenv('AZURE_OPENAI_ENDPOINT'),
         azure_openai_api_key=os.getenv('AZURE_OPENAI_API_KEY'),
         azure_openai_deployment=os.getenv('AZURE_OPENAI_DEPLOYMENT'),
-        azure_openai_api_version=os.getenv('AZURE_OPENAI_API_VERSION', '2024-08-01-preview')
+        azure_openai_api_version=os.getenv('AZURE_OPENAI_API_VERSION', '2024-08-01-preview'),
+        backend=create_backend_from_env('SQL', default_script=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'database', 'northwind.sql'), profile=execution_profile),
+        execution_profile=execution_profile
     )
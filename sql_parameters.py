@@ -0,0 +1,169 @@
+"""
+Parameterized SQL
+Generated queries are executed as a '?' template plus a typed parameter list instead of
+inlined literals, so SQL Server caches one plan per query shape (pyodbc sends them as a
+parameterized RPC, like sp_executesql) and string quoting can no longer break a query.
+
+The model returns {"sql": <template>, "params": [{"value": ..., "type": ...}]}. Anything
+else (raw SQL from older prompts, LLM corrections, repair rules) is auto-parameterized.
+
+SLOT_NUMBER constants stay inline: they are a small fixed set, part of the query shape,
+and filtered indexes (WHERE SLOT_NUMBER = 6, ...) only match literal predicates.
+"""
+
+import json
+import re
+from typing import Any, List, Optional, Tuple
+
+try:
+    import sqlglot
+    from sqlglot import exp
+except ImportError:
+    sqlglot = None
+
+
+# Parameter types the model may declare, and how values are coerced
+PARAM_TYPES = {
+    'string': str,
+    'int': int,
+    'integer': int,
+    'float': float,
+    'decimal': float,
+}
+
+# Columns whose literal comparisons are kept inline
+INLINE_COLUMNS = {'SLOT_NUMBER'}
+
+_TOKEN = re.compile(r"N?'(?:[^']|'')*'|--[^\n]*|/\*.*?\*/|\?", re.DOTALL)
+_MARKER = re.compile(r"__param_(\d+)__")
+
+
+def count_placeholders(sql: str) -> int:
+    """Number of '?' placeholders outside string literals and comments."""
+    return sum(1 for token in _TOKEN.findall(sql or '') if token == '?')
+
+
+def coerce_params(params: List[Any]) -> List[Any]:
+    """
+    Convert declared parameters to Python values.
+
+    Args:
+        params: Items like {"value": "2947-0", "type": "string"} or bare values
+
+    Returns:
+        List of str/int/float/None values in placeholder order
+
+    Raises:
+        ValueError: Unknown type or a value that does not match its type
+    """
+    values = []
+    for param in params:
+        if not isinstance(param, dict):
+            values.append(param)
+            continue
+        value = param.get('value')
+        param_type = str(param.get('type', 'string')).lower()
+        if param_type not in PARAM_TYPES:
+            raise ValueError(f"Unknown parameter type '{param_type}'")
+        values.append(None if value is None else PARAM_TYPES[param_type](value))
+    return values
+
+
+def parse_generated(content: str) -> Tuple[str, Optional[List[Any]]]:
+    """
+    Read the model's SQL generation output.
+
+    Args:
+        content: Model response (JSON object, or raw SQL)
+
+    Returns:
+        (sql, params) - params is None when the response was not a parameterized template
+    """
+    text = (content or '').strip()
+    text = re.sub(r"^```(?:json|sql)?\s*|\s*```$", "", text).strip()
+    try:
+        payload = json.loads(text)
+    except ValueError:
+        return text, None
+    if not isinstance(payload, dict) or not isinstance(payload.get('sql'), str):
+        return text, None
+    return payload['sql'].strip(), coerce_params(payload.get('params') or [])
+
+
+def _is_inline(literal) -> bool:
+    """Literals that must stay in the SQL text (TOP/FETCH counts, SLOT_NUMBER constants, SELECT-list values)."""
+    parent = literal.parent
+    if isinstance(parent, (exp.Limit, exp.Fetch)) or literal.find_ancestor(exp.Limit, exp.Fetch, exp.Order, exp.Group, exp.DataType):
+        return True
+    if isinstance(parent, exp.Binary):
+        other = parent.right if parent.left is literal else parent.left
+        if isinstance(other, exp.Column) and other.name.upper() in INLINE_COLUMNS:
+            return True
+    # Only predicates are parameterized (WHERE, JOIN ... ON, HAVING)
+    return literal.find_ancestor(exp.Where, exp.Join, exp.Having) is None
+
+
+def parameterize(sql: str) -> Tuple[str, List[Any]]:
+    """
+    Replace predicate literals with '?' placeholders.
+
+    Args:
+        sql: T-SQL with inlined literals
+
+    Returns:
+        (template, params) - unchanged SQL and [] if nothing could be parameterized
+    """
+    if sqlglot is None or not sql:
+        return sql, []
+    try:
+        tree = sqlglot.parse_one(sql, read='tsql')
+    except sqlglot.errors.ParseError:
+        return sql, []
+    if tree is None:
+        return sql, []
+
+    values: List[Any] = []
+    for literal in list(tree.find_all(exp.Literal, exp.National)):
+        if _is_inline(literal):
+            continue
+        if isinstance(literal, exp.National) or literal.is_string:
+            value: Any = literal.name
+        else:
+            value = float(literal.this) if any(c in literal.this for c in '.eE') else int(literal.this)
+        # Numbered markers, so parameter order follows the generated text
+        literal.replace(exp.column(f"__param_{len(values)}__"))
+        values.append(value)
+    if not values:
+        return sql, []
+
+    generated = tree.sql(dialect='tsql')
+    params = [values[int(match.group(1))] for match in _MARKER.finditer(generated)]
+    return _MARKER.sub('?', generated), params
+
+
+def _literal(value: Any) -> str:
+    if value is None:
+        return 'NULL'
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def inline_params(sql: str, params: Optional[List[Any]]) -> str:
+    """
+    Render a template with its parameters inlined, for display, memory and LLM prompts.
+
+    Returns:
+        SQL with each '?' replaced by a quoted literal
+    """
+    if not params:
+        return sql
+    remaining = iter(params)
+
+    def replace(match):
+        token = match.group(0)
+        if token != '?':
+            return token
+        return _literal(next(remaining, None))
+
+    return _TOKEN.sub(replace, sql)
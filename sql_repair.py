@@ -0,0 +1,300 @@
+"""
+Deterministic SQL Auto-Repair
+Rule-based rewrites for mechanical SQL mistakes (LIMIT instead of TOP, markdown fences,
+stray comments, missing GROUP BY columns, unqualified ambiguous columns, SLOT_VALUE = CODE
+joins). The hybrid agent applies them and re-executes before falling back to an LLM
+correction round-trip. Rule hit rates are recorded for tuning.
+
+AST rules use sqlglot when installed; without it only the text rules run.
+"""
+
+import re
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from sql_validator import in_order_by, in_scope, order_by_aliases
+
+try:
+    import sqlglot
+    from sqlglot import exp
+    from sqlglot.optimizer.scope import traverse_scope
+except ImportError:
+    sqlglot = None
+
+
+Schema = Dict[str, Iterable[str]]
+
+
+@dataclass
+class RepairResult:
+    """A repaired query and the rules that produced it."""
+    sql: str
+    rules: List[str] = field(default_factory=list)
+
+
+@dataclass
+class RepairRule:
+    """A single rewrite rule."""
+    name: str
+    apply: Callable[[str, Schema], Optional[str]]
+    # Error categories the rule is tried for (None = any failure)
+    categories: Optional[Tuple[str, ...]] = None
+    description: str = ''
+
+
+def _parse(sql: str):
+    """Parse one T-SQL statement, or None if sqlglot is missing or cannot parse it."""
+    if sqlglot is None:
+        return None
+    try:
+        return sqlglot.parse_one(sql, read='tsql')
+    except sqlglot.errors.ParseError:
+        return None
+
+
+def _lower_schema(schema: Schema) -> Dict[str, set]:
+    return {table.lower(): {column.lower() for column in columns} for table, columns in (schema or {}).items()}
+
+
+# ---------------------------------------------------------------------------
+# Text rules
+# ---------------------------------------------------------------------------
+
+def strip_markdown(sql: str, schema: Schema) -> Optional[str]:
+    """Remove ``` fences and a leading 'SQL:' label."""
+    cleaned = re.sub(r"```(?:sql|tsql)?", "", sql, flags=re.IGNORECASE)
+    cleaned = re.sub(r"^\s*(?:T-?SQL|SQL)\s*:\s*", "", cleaned, flags=re.IGNORECASE).strip()
+    return cleaned if cleaned != sql.strip() else None
+
+
+def _is_heading_marker(sql: str, i: int) -> bool:
+    """A markdown '#'/'###' heading at the start of a line (not a #temp table name)."""
+    if not sql.startswith('#', i) or sql[sql.rfind('\n', 0, i) + 1:i].strip():
+        return False
+    rest = sql[i:].lstrip('#')
+    return not rest or rest[0].isspace()
+
+
+def strip_comments(sql: str, schema: Schema) -> Optional[str]:
+    """Remove '###' markers, '--' and '/* */' comments outside string literals."""
+    out, i, changed = [], 0, False
+    while i < len(sql):
+        char = sql[i]
+        if char == "'":
+            end = i + 1
+            while end < len(sql):
+                if sql[end] == "'" and not sql.startswith("''", end):
+                    break
+                end += 2 if sql.startswith("''", end) else 1
+            out.append(sql[i:end + 1])
+            i = end + 1
+        elif sql.startswith('--', i) or _is_heading_marker(sql, i):
+            end = sql.find('\n', i)
+            i = len(sql) if end < 0 else end
+            changed = True
+        elif sql.startswith('/*', i):
+            end = sql.find('*/', i + 2)
+            i = len(sql) if end < 0 else end + 2
+            out.append(' ')
+            changed = True
+        else:
+            out.append(char)
+            i += 1
+    if not changed:
+        return None
+    return re.sub(r"[ \t]+\n", "\n", ''.join(out)).strip()
+
+
+def limit_to_top(sql: str, schema: Schema) -> Optional[str]:
+    """Rewrite LIMIT n as SELECT TOP n."""
+    if not re.search(r"\bLIMIT\s+\d+", sql, re.IGNORECASE):
+        return None
+    tree = _parse(sql)
+    if tree is not None:
+        return tree.sql(dialect='tsql')
+    match = re.search(r"\s+LIMIT\s+(\d+)\s*;?\s*$", sql, re.IGNORECASE)
+    if not match:
+        return None
+    body = sql[:match.start()]
+    return re.sub(r"^(\s*SELECT\s+(?:DISTINCT\s+)?)", rf"\g<1>TOP {match.group(1)} ", body, count=1, flags=re.IGNORECASE)
+
+
+# ---------------------------------------------------------------------------
+# AST rules
+# ---------------------------------------------------------------------------
+
+def add_missing_group_by(sql: str, schema: Schema) -> Optional[str]:
+    """Add non-aggregated SELECT expressions to GROUP BY in aggregating queries."""
+    tree = _parse(sql)
+    if tree is None:
+        return None
+    changed = False
+    for select in tree.find_all(exp.Select):
+        if not any(select_expr.find(exp.AggFunc) for select_expr in select.expressions):
+            continue
+        group = select.args.get('group')
+        grouped = {expression.sql('tsql') for expression in group.expressions} if group else set()
+        missing = []
+        for select_expr in select.expressions:
+            expression = select_expr.unalias()
+            if expression.find(exp.AggFunc) or isinstance(expression, (exp.Literal, exp.Star)) or not expression.find(exp.Column):
+                continue
+            if expression.sql('tsql') not in grouped:
+                missing.append(expression.copy())
+                grouped.add(expression.sql('tsql'))
+        if missing:
+            select.group_by(*missing, copy=False)
+            changed = True
+    return tree.sql(dialect='tsql') if changed else None
+
+
+def qualify_ambiguous_columns(sql: str, schema: Schema) -> Optional[str]:
+    """
+    Qualify unqualified columns (SELECT list included) that exist in several tables joined
+    in their own SELECT with the first such alias. Columns of subqueries are only matched
+    against the subquery's tables, and a scope with a source whose columns are unknown
+    (derived table, CTE, unknown table) is left alone.
+    """
+    tree = _parse(sql)
+    columns_by_table = _lower_schema(schema)
+    if tree is None or not columns_by_table:
+        return None
+    changed = False
+    for scope in traverse_scope(tree):
+        if any(not isinstance(source, exp.Table) or source.name.lower() not in columns_by_table
+               for source in scope.sources.values()):
+            continue
+        # SELECT-list columns are qualified too; only ORDER BY may name a SELECT alias
+        order_aliases = order_by_aliases(scope)
+        for column in scope.columns:
+            if column.table or not in_scope(column, scope) or (column.name.lower() in order_aliases and in_order_by(column)):
+                continue
+            owners = [
+                alias for alias, source in scope.sources.items()
+                if column.name.lower() in columns_by_table[source.name.lower()]
+            ]
+            if len(owners) > 1:
+                column.set('table', exp.to_identifier(owners[0]))
+                changed = True
+    return tree.sql(dialect='tsql') if changed else None
+
+
+def ref_code_joins(sql: str, schema: Schema) -> Optional[str]:
+    """Turn x.SLOT_VALUE = y.CODE into x.REF_CODE = y.CODE (or a TRY_CAST when REF_CODE is absent)."""
+    tree = _parse(sql)
+    if tree is None:
+        return None
+    has_ref_code = 'ref_code' in _lower_schema(schema).get('med', set())
+    changed = False
+    for equality in list(tree.find_all(exp.EQ)):
+        left, right = equality.left, equality.right
+        for value_side, code_side in ((left, right), (right, left)):
+            if (isinstance(value_side, exp.Column) and isinstance(code_side, exp.Column)
+                    and value_side.name.upper() == 'SLOT_VALUE' and code_side.name.upper() == 'CODE'):
+                if has_ref_code:
+                    replacement = exp.column('REF_CODE', table=value_side.table or None)
+                else:
+                    replacement = exp.TryCast(this=value_side.copy(), to=exp.DataType.build('INT'))
+                value_side.replace(replacement)
+                changed = True
+                break
+    return tree.sql(dialect='tsql') if changed else None
+
+
+DEFAULT_RULES: List[RepairRule] = [
+    RepairRule('strip_markdown', strip_markdown, description="Remove markdown code fences"),
+    RepairRule('strip_comments', strip_comments, description="Remove ### markers and SQL comments"),
+    RepairRule('limit_to_top', limit_to_top, description="LIMIT n -> SELECT TOP n"),
+    RepairRule('add_missing_group_by', add_missing_group_by, categories=('AGGREGATE_ERROR',),
+               description="Add non-aggregated SELECT columns to GROUP BY"),
+    RepairRule('qualify_ambiguous_columns', qualify_ambiguous_columns, categories=('AMBIGUOUS_REFERENCE',),
+               description="Qualify ambiguous columns with a table alias"),
+    RepairRule('ref_code_joins', ref_code_joins, categories=('TYPE_ERROR',),
+               description="Join relationships on REF_CODE instead of SLOT_VALUE"),
+]
+
+
+class SQLRepairEngine:
+    """Applies repair rules to a failed query and keeps per-rule hit rates."""
+
+    def __init__(self, rules: Optional[List[RepairRule]] = None):
+        self.rules = list(rules if rules is not None else DEFAULT_RULES)
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, int]] = {
+            rule.name: {'eligible': 0, 'applied': 0, 'succeeded': 0} for rule in self.rules
+        }
+        self.repairs_attempted = 0
+        self.repairs_succeeded = 0
+        self.llm_fallbacks = 0
+
+    def repair(self, sql: str, error_result: Dict[str, Any], schema: Optional[Schema] = None) -> Optional[RepairResult]:
+        """
+        Apply every eligible rule in order.
+
+        Args:
+            sql: The failed query
+            error_result: Failure dict (error_category is used to pick rules)
+            schema: Table -> column names, for rules that need it
+
+        Returns:
+            RepairResult if at least one rule changed the query, else None
+        """
+        if not sql:
+            return None
+        category = error_result.get('error_category')
+        current, applied = sql, []
+        for rule in self.rules:
+            if rule.categories and category not in rule.categories:
+                continue
+            try:
+                rewritten = rule.apply(current, schema or {})
+            except Exception as e:
+                print(f"Warning: SQL repair rule {rule.name} failed: {e}")
+                rewritten = None
+            with self._lock:
+                self._stats[rule.name]['eligible'] += 1
+                if rewritten and rewritten.strip() != current.strip():
+                    self._stats[rule.name]['applied'] += 1
+            if rewritten and rewritten.strip() != current.strip():
+                current = rewritten
+                applied.append(rule.name)
+        if not applied:
+            return None
+        with self._lock:
+            self.repairs_attempted += 1
+        return RepairResult(sql=current, rules=applied)
+
+    def record_outcome(self, result: RepairResult, success: bool):
+        """Record whether a repaired query executed successfully."""
+        with self._lock:
+            if success:
+                self.repairs_succeeded += 1
+                for name in result.rules:
+                    self._stats[name]['succeeded'] += 1
+
+    def record_fallback(self):
+        """Record that no rule fixed the query and the LLM correction was used."""
+        with self._lock:
+            self.llm_fallbacks += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Per-rule hit and success rates plus totals."""
+        with self._lock:
+            rules = {}
+            for rule in self.rules:
+                counts = dict(self._stats[rule.name])
+                counts['hit_rate'] = round(counts['applied'] / counts['eligible'], 3) if counts['eligible'] else 0.0
+                counts['success_rate'] = round(counts['succeeded'] / counts['applied'], 3) if counts['applied'] else 0.0
+                counts['description'] = rule.description
+                rules[rule.name] = counts
+            return {
+                'rules': rules,
+                'repairs_attempted': self.repairs_attempted,
+                'repairs_succeeded': self.repairs_succeeded,
+                'llm_fallbacks': self.llm_fallbacks
+            }
+
+
+# Shared by all hybrid agents so hit rates cover every session
+repair_engine = SQLRepairEngine()
@@ -0,0 +1,260 @@
+"""
+Local SQL Validation
+Parses generated T-SQL and checks it against the cached schema before it is sent to the
+database, so errors the retry loop would otherwise learn from a failed round-trip (unknown
+tables, columns or aliases, ambiguous columns, LIMIT, non-SELECT statements) are caught
+locally. Failures use the same error_category / hint structure as the agents' _execute_query.
+
+Uses sqlglot when installed; otherwise only the statement-level checks run.
+"""
+
+import re
+from typing import Any, Dict, Iterable, List, Optional
+
+try:
+    import sqlglot
+    from sqlglot import exp
+    from sqlglot.optimizer.scope import traverse_scope
+except ImportError:
+    sqlglot = None
+
+
+# Keywords that make a statement more than a read-only SELECT
+WRITE_KEYWORDS = re.compile(
+    r"\b(INSERT|UPDATE|DELETE|MERGE|DROP|ALTER|CREATE|TRUNCATE|EXEC|EXECUTE|GRANT|REVOKE|INTO)\b",
+    re.IGNORECASE
+)
+
+# Schemas whose catalog views may be queried without being part of the cached schema
+SYSTEM_SCHEMAS = {'sys', 'information_schema'}
+
+
+# Comments, string literals and delimited identifiers, matched left to right so that e.g.
+# a quote inside [brackets] or '--' inside a string is not mistaken for the other kind
+_LITERAL_PATTERN = re.compile(
+    r"--[^\n]*|/\*.*?\*/|N?'(?:[^']|'')*'|\[(?:[^\]]|\]\])*\]|\"(?:[^\"]|\"\")*\"",
+    re.DOTALL
+)
+
+
+def _strip_literals(sql: str) -> str:
+    """
+    Blank out comments, string literals and delimited identifiers ([Last Update],
+    "Drop Date") so keyword checks only see SQL text.
+    """
+    def blank(match) -> str:
+        token = match.group(0)
+        if token.startswith(('--', '/*')):
+            return ' '
+        if token.startswith('['):
+            return '[_]'
+        if token.startswith('"'):
+            return '"_"'
+        return "''"
+    return _LITERAL_PATTERN.sub(blank, sql)
+
+
+def order_by_aliases(scope) -> set:
+    """
+    SELECT-list aliases an ORDER BY in this scope may refer to (lowercase). An alias that
+    only restates a bare column (CODE AS CODE) is not included, so that column is still checked.
+    """
+    if not isinstance(scope.expression, exp.Select):
+        return set()
+    aliases = set()
+    for select in scope.expression.selects:
+        if not isinstance(select, exp.Alias):
+            continue
+        inner = select.this
+        if isinstance(inner, exp.Column) and not inner.table and inner.name.lower() == select.alias.lower():
+            continue
+        aliases.add(select.alias.lower())
+    return aliases
+
+
+def in_scope(column, scope) -> bool:
+    """
+    True if a column belongs to this scope's own SELECT. scope.columns also lists the
+    unqualified columns of IN / EXISTS / scalar subqueries, which are checked in their own
+    scope, and a UNION's ORDER BY refers to its output columns rather than to a table.
+    """
+    return isinstance(scope.expression, exp.Select) and column.find_ancestor(exp.Select, exp.SetOperation) is scope.expression
+
+
+def in_order_by(column) -> bool:
+    """True if a column sits in the ORDER BY of its own SELECT (not in a nested query)."""
+    return isinstance(column.find_ancestor(exp.Order, exp.Select), exp.Order)
+
+
+class SQLValidator:
+    """Validates generated SQL against a table -> columns schema."""
+
+    def __init__(self, schema: Dict[str, Iterable[str]], strict_syntax: bool = False):
+        """
+        Initialize the validator.
+
+        Args:
+            schema: Mapping of table name -> column names (compared case-insensitively,
+                    like SQL Server's default collation)
+            strict_syntax: Reject queries sqlglot cannot parse. Off by default so T-SQL the
+                           parser does not know is left for the database to judge.
+        """
+        self.strict_syntax = strict_syntax
+        self.tables = {table.lower(): table for table in schema}
+        self.columns = {table.lower(): {column.lower(): column for column in columns} for table, columns in schema.items()}
+
+    def validate(self, sql: str) -> Dict[str, Any]:
+        """
+        Validate a single generated query.
+
+        Args:
+            sql: Generated T-SQL
+
+        Returns:
+            {"success": True, "validated": <parsed with sqlglot>} or an error dict with
+            success, error, sql_query, error_type, error_category and hint
+        """
+        text = _strip_literals(sql or '').strip().rstrip(';').strip()
+        if not text:
+            return self._error(sql, "SYNTAX_ERROR", "Empty SQL query", "The SQL Agent did not produce a query.")
+
+        if ';' in text:
+            return self._error(sql, "NON_SELECT_STATEMENT", "Multiple statements in one query",
+                               "Return exactly one SELECT statement.")
+        if not re.match(r"(SELECT|WITH)\b", text, re.IGNORECASE) or WRITE_KEYWORDS.search(text):
+            return self._error(sql, "NON_SELECT_STATEMENT", "Only read-only SELECT queries are allowed",
+                               "Generate a single SELECT query; INSERT/UPDATE/DELETE/DDL, EXEC and SELECT INTO are rejected.")
+        if re.search(r"\bLIMIT\s+\d+", text, re.IGNORECASE):
+            return self._error(sql, "SYNTAX_ERROR", "Incorrect syntax near 'LIMIT'",
+                               "T-SQL doesn't support LIMIT. Use TOP instead (e.g., SELECT TOP 10 instead of LIMIT 10)")
+
+        if sqlglot is None:
+            return {"success": True, "validated": False}
+
+        try:
+            statements = [statement for statement in sqlglot.parse(sql, read='tsql') if statement is not None]
+        except sqlglot.errors.ParseError as e:
+            message = str(e).split('\n')[0]
+            if not self.strict_syntax:
+                return {"success": True, "validated": False, "warning": message}
+            return self._error(sql, "SYNTAX_ERROR", f"Incorrect syntax: {message}",
+                               "The generated SQL has a syntax error. Check for missing keywords, unmatched parentheses, or incorrect table/column names.")
+        if len(statements) != 1 or not isinstance(statements[0], (exp.Select, exp.SetOperation)):
+            return self._error(sql, "NON_SELECT_STATEMENT", "Only read-only SELECT queries are allowed",
+                               "Generate a single SELECT query.")
+
+        problem = self._check_references(statements[0])
+        if problem:
+            category, message, hint = problem
+            return self._error(sql, category, message, hint)
+        return {"success": True, "validated": True}
+
+    def _check_references(self, statement) -> Optional[tuple]:
+        """Check tables, aliases and columns scope by scope; return (category, message, hint) or None."""
+        for scope in traverse_scope(statement):
+            order_aliases = order_by_aliases(scope)
+
+            # Tables
+            for source in scope.sources.values():
+                if isinstance(source, exp.Table) and source.db.lower() not in SYSTEM_SCHEMAS:
+                    if source.name.lower() not in self.tables:
+                        return (
+                            "TABLE_ERROR",
+                            f"Invalid object name '{source.name}'",
+                            f"The SQL references a table that doesn't exist. Valid tables are: {', '.join(sorted(self.tables.values()))}"
+                        )
+
+            for column in scope.columns:
+                name = column.name.lower()
+                if not name or name == '*' or not in_scope(column, scope):
+                    continue
+
+                if column.table:
+                    source = self._resolve_alias(scope, column.table)
+                    if source is None:
+                        return (
+                            "ALIAS_ERROR",
+                            f"The multi-part identifier \"{column.table}.{column.name}\" could not be bound",
+                            f"Alias '{column.table}' is not defined in the FROM/JOIN clauses of this query. "
+                            f"Define it (e.g. FROM MED {column.table}) or use an alias that exists."
+                        )
+                    outputs = self._source_columns(source)
+                    if outputs is not None and name not in outputs:
+                        return (
+                            "COLUMN_ERROR",
+                            f"Invalid column name '{column.name}'",
+                            f"'{column.table}' has no column '{column.name}'. Available columns: {', '.join(sorted(outputs.values()))}"
+                        )
+                    continue
+
+                # Unqualified: must match exactly one source (or, in ORDER BY, a SELECT alias)
+                if name in order_aliases and in_order_by(column):
+                    continue
+                matches, unknown = self._match_unqualified(scope, name)
+                if unknown:
+                    continue
+                if len(matches) > 1:
+                    return (
+                        "AMBIGUOUS_REFERENCE",
+                        f"Ambiguous column name '{column.name}'",
+                        f"'{column.name}' exists in {', '.join(sorted(matches))}. Qualify it with an alias (e.g., m1.{column.name} vs m2.{column.name})"
+                    )
+                if not matches:
+                    return (
+                        "COLUMN_ERROR",
+                        f"Invalid column name '{column.name}'",
+                        "The SQL references a column that doesn't exist. Verify slot numbers and column names match the schema."
+                    )
+        return None
+
+    @staticmethod
+    def _resolve_alias(scope, alias: str):
+        """Find the source an alias refers to in this scope or an enclosing one (correlated subqueries)."""
+        alias_lower = alias.lower()
+        while scope is not None:
+            for name, source in scope.sources.items():
+                if name.lower() == alias_lower:
+                    return source
+            scope = scope.parent
+        return None
+
+    def _source_columns(self, source) -> Optional[Dict[str, str]]:
+        """Columns exposed by a source (lowercase -> name), or None if they cannot be known."""
+        if isinstance(source, exp.Table):
+            if source.db.lower() in SYSTEM_SCHEMAS:
+                return None
+            return self.columns.get(source.name.lower())
+        expression = getattr(source, 'expression', None)
+        if isinstance(expression, exp.Select):
+            names = expression.named_selects
+            if '*' in names or any(isinstance(select, exp.Star) or select.is_star for select in expression.selects):
+                return None
+            return {name.lower(): name for name in names}
+        return None
+
+    def _match_unqualified(self, scope, name: str):
+        """Sources in scope exposing a column; unknown=True if any source's columns cannot be known."""
+        matches: List[str] = []
+        unknown = False
+        current = scope
+        while current is not None and not matches:
+            for alias, source in current.sources.items():
+                outputs = self._source_columns(source)
+                if outputs is None:
+                    unknown = True
+                elif name in outputs:
+                    matches.append(alias)
+            current = current.parent
+        return matches, unknown
+
+    @staticmethod
+    def _error(sql: str, category: str, message: str, hint: str) -> Dict[str, Any]:
+        return {
+            "success": False,
+            "error": f"SQL validation failed: {message}",
+            "sql_query": sql,
+            "error_type": "ValidationError",
+            "error_category": category,
+            "hint": hint,
+            "validated_locally": True
+        }
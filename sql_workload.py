@@ -0,0 +1,408 @@
+"""
+SQL Workload Analytics
+Normalizes every executed statement to a canonical fingerprint (literals replaced by
+placeholders, table aliases renamed positionally, whitespace and keyword case normalized)
+and aggregates per-fingerprint counts, latency percentiles, row counts and failure rates
+in a SQLite store, for capacity planning and choosing which query shapes to cache.
+
+Configuration:
+    SQL_WORKLOAD_DB             SQLite file for the store (default: in-memory, per process)
+    SQL_WORKLOAD_MAX_EXECUTIONS Oldest executions beyond this are pruned (default: 100000)
+    SQL_WORKLOAD_RETENTION_DAYS Executions older than this are pruned; 0 keeps them (default: 30)
+    SQL_WORKLOAD_ENABLED        Set to 'false' to disable recording
+"""
+
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+try:
+    import sqlglot
+    from sqlglot import exp
+except ImportError:
+    sqlglot = None
+
+
+PLACEHOLDER = '?'
+
+ORDERINGS = {
+    'total_time': 'total_ms DESC',
+    'count': 'executions DESC',
+    'avg_time': 'avg_ms DESC',
+    'failure_rate': 'failure_rate DESC, executions DESC',
+    'rows': 'avg_rows DESC',
+    'recent': 'last_seen DESC',
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS query_fingerprints (
+    fingerprint     TEXT PRIMARY KEY,
+    normalized_sql  TEXT NOT NULL,
+    sample_sql      TEXT NOT NULL,
+    first_seen      REAL NOT NULL,
+    last_seen       REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS query_executions (
+    id              INTEGER PRIMARY KEY AUTOINCREMENT,
+    fingerprint     TEXT NOT NULL REFERENCES query_fingerprints(fingerprint),
+    executed_at     REAL NOT NULL,
+    duration_ms     REAL NOT NULL,
+    row_count       INTEGER NOT NULL,
+    success         INTEGER NOT NULL,
+    error_category  TEXT,
+    source          TEXT
+);
+CREATE INDEX IF NOT EXISTS ix_query_executions_fingerprint ON query_executions (fingerprint, executed_at);
+CREATE INDEX IF NOT EXISTS ix_query_executions_time ON query_executions (executed_at);
+"""
+
+
+def _regex_normalize(sql: str) -> str:
+    """Fallback normalizer when sqlglot is missing or cannot parse the statement."""
+    text = re.sub(r"--[^\n]*", " ", sql)
+    text = re.sub(r"/\*.*?\*/", " ", text, flags=re.DOTALL)
+    text = re.sub(r"N?'(?:[^']|'')*'", PLACEHOLDER, text)
+    text = re.sub(r"(?<![\w.])-?\d+(?:\.\d+)?\b", PLACEHOLDER, text)
+    text = re.sub(r"\(\s*\?(?:\s*,\s*\?)*\s*\)", f"({PLACEHOLDER})", text)
+    text = re.sub(r"\s+", " ", text).strip().rstrip(';').strip()
+    return text.upper()
+
+
+def normalize_sql(sql: str, inline_columns: Iterable[str] = ()) -> str:
+    """
+    Canonical form of a statement.
+
+    Literals become '?', IN lists collapse to a single placeholder, table aliases are
+    renamed t1, t2, ... in order of appearance, and the SQL is regenerated by sqlglot
+    so whitespace and keyword case no longer matter.
+
+    Args:
+        sql: Executed T-SQL
+        inline_columns: Columns whose compared literals are kept (e.g. SLOT_NUMBER, when
+                        the slot is part of what distinguishes two statements)
+
+    Returns:
+        Normalized SQL text
+    """
+    if sqlglot is None:
+        return _regex_normalize(sql)
+    try:
+        tree = sqlglot.parse_one(sql, read='tsql')
+    except sqlglot.errors.ParseError:
+        return _regex_normalize(sql)
+    if tree is None:
+        return _regex_normalize(sql)
+
+    # Literals (including TOP n) -> placeholders; IN lists -> one placeholder
+    keep = {column.upper() for column in inline_columns}
+    for literal in list(tree.find_all(exp.Literal, exp.National)):
+        parent = literal.parent
+        if keep and isinstance(parent, exp.Binary):
+            other = parent.right if parent.left is literal else parent.left
+            if isinstance(other, exp.Column) and other.name.upper() in keep:
+                continue
+        literal.replace(exp.Placeholder())
+    for in_expr in tree.find_all(exp.In):
+        values = in_expr.expressions
+        if values and all(isinstance(value, exp.Placeholder) for value in values):
+            in_expr.set('expressions', [exp.Placeholder()])
+
+    # Positional table aliases, so "m1"/"med"/"a" variants share a fingerprint
+    renamed: Dict[str, str] = {}
+    for table in tree.find_all(exp.Table):
+        alias = table.alias
+        if alias and alias.lower() not in renamed:
+            renamed[alias.lower()] = f"t{len(renamed) + 1}"
+            table.set('alias', exp.TableAlias(this=exp.to_identifier(renamed[alias.lower()])))
+    if renamed:
+        for column in tree.find_all(exp.Column):
+            if column.table and column.table.lower() in renamed:
+                column.set('table', exp.to_identifier(renamed[column.table.lower()]))
+
+    return tree.sql(dialect='tsql', normalize=True, identify=False).upper()
+
+
+def fingerprint(sql: str, inline_columns: Iterable[str] = ()) -> Tuple[str, str]:
+    """
+    Fingerprint a statement.
+
+    Args:
+        sql: T-SQL statement
+        inline_columns: See normalize_sql
+
+    Returns:
+        (fingerprint hash, normalized SQL)
+    """
+    normalized = normalize_sql(sql or '', inline_columns)
+    return hashlib.sha1(normalized.encode('utf-8')).hexdigest()[:16], normalized
+
+
+def _percentile(sorted_values: List[float], fraction: float) -> Optional[float]:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return round(sorted_values[index], 2)
+
+
+class WorkloadStore:
+    """SQLite-backed per-fingerprint execution statistics."""
+
+    def __init__(self, path: str = ':memory:', max_executions: int = 100000, retention_days: float = 30):
+        """
+        Open (or create) the store.
+
+        Args:
+            path: SQLite database file, or ':memory:'
+            max_executions: Executions kept; the oldest beyond this are pruned
+            retention_days: Executions older than this are pruned (0 = no age limit)
+        """
+        self.path = path
+        self.max_executions = max_executions
+        self.retention_days = retention_days
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+        self._inserted = 0
+        # Fingerprints are cached per SQL text: generated queries repeat verbatim often
+        self._fingerprints: Dict[str, Tuple[str, str]] = {}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _fingerprint(self, sql: str) -> Tuple[str, str]:
+        cached = self._fingerprints.get(sql)
+        if cached is None:
+            if len(self._fingerprints) >= 10000:
+                self._fingerprints.clear()
+            cached = self._fingerprints[sql] = fingerprint(sql)
+        return cached
+
+    def record(
+        self,
+        sql: str,
+        duration_ms: float,
+        row_count: int = 0,
+        success: bool = True,
+        error_category: Optional[str] = None,
+        source: Optional[str] = None
+    ) -> str:
+        """
+        Record one execution.
+
+        Args:
+            sql: Executed SQL
+            duration_ms: Wall-clock execution time
+            row_count: Rows returned
+            success: Whether the statement succeeded
+            error_category: Error category for failures
+            source: Which agent executed it
+
+        Returns:
+            The statement's fingerprint
+        """
+        fp, normalized = self._fingerprint(sql)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO query_fingerprints (fingerprint, normalized_sql, sample_sql, first_seen, last_seen) "
+                "VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(fingerprint) DO UPDATE SET last_seen = excluded.last_seen, sample_sql = excluded.sample_sql",
+                (fp, normalized, sql, now, now)
+            )
+            self._conn.execute(
+                "INSERT INTO query_executions (fingerprint, executed_at, duration_ms, row_count, success, error_category, source) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (fp, now, float(duration_ms), int(row_count or 0), 1 if success else 0, error_category, source)
+            )
+            self._inserted += 1
+            # Prune in batches rather than on every insert
+            if self._inserted % 100 == 0:
+                self._conn.execute(
+                    "DELETE FROM query_executions WHERE id <= (SELECT MAX(id) FROM query_executions) - ?",
+                    (int(self.max_executions),)
+                )
+                if self.retention_days:
+                    self._delete_older_than(now - self.retention_days * 86400)
+                self._delete_unused_fingerprints()
+            self._conn.commit()
+        return fp
+
+    def summary(self, limit: int = 20, order_by: str = 'total_time', since_hours: Optional[float] = None) -> List[Dict[str, Any]]:
+        """
+        Per-fingerprint aggregates.
+
+        Args:
+            limit: Number of fingerprints to return
+            order_by: One of ORDERINGS (total_time, count, avg_time, failure_rate, rows, recent)
+            since_hours: Only include executions from the last N hours
+
+        Returns:
+            List of fingerprint stats with p50/p95/p99 latency in milliseconds
+        """
+        if order_by not in ORDERINGS:
+            raise ValueError(f"order_by must be one of: {', '.join(ORDERINGS)}")
+        since = time.time() - since_hours * 3600 if since_hours else 0
+        with self._lock:
+            rows = self._conn.execute(
+                f"""
+                SELECT e.fingerprint, f.normalized_sql, f.sample_sql,
+                       COUNT(*) AS executions,
+                       SUM(1 - e.success) AS failures,
+                       CAST(SUM(1 - e.success) AS REAL) / COUNT(*) AS failure_rate,
+                       SUM(e.duration_ms) AS total_ms,
+                       AVG(e.duration_ms) AS avg_ms,
+                       AVG(e.row_count) AS avg_rows,
+                       MAX(e.row_count) AS max_rows,
+                       MAX(e.executed_at) AS last_seen
+                FROM query_executions e
+                JOIN query_fingerprints f ON f.fingerprint = e.fingerprint
+                WHERE e.executed_at >= ?
+                GROUP BY e.fingerprint
+                ORDER BY {ORDERINGS[order_by]}
+                LIMIT ?
+                """,
+                (since, int(limit))
+            ).fetchall()
+            stats = []
+            for row in rows:
+                durations = [value for (value,) in self._conn.execute(
+                    "SELECT duration_ms FROM query_executions WHERE fingerprint = ? AND executed_at >= ? ORDER BY duration_ms",
+                    (row[0], since)
+                )]
+                stats.append({
+                    'fingerprint': row[0],
+                    'normalized_sql': row[1],
+                    'sample_sql': row[2],
+                    'executions': row[3],
+                    'failures': row[4],
+                    'failure_rate': round(row[5], 3),
+                    'total_ms': round(row[6], 2),
+                    'avg_ms': round(row[7], 2),
+                    'p50_ms': _percentile(durations, 0.50),
+                    'p95_ms': _percentile(durations, 0.95),
+                    'p99_ms': _percentile(durations, 0.99),
+                    'avg_rows': round(row[8], 1),
+                    'max_rows': row[9],
+                    'last_seen': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(row[10])),
+                })
+        return stats
+
+    def fingerprint_detail(self, fp: str, recent: int = 20) -> Optional[Dict[str, Any]]:
+        """
+        Stats, error breakdown and recent executions of one fingerprint.
+
+        Returns:
+            Detail dict, or None for an unknown fingerprint
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT normalized_sql, sample_sql, first_seen, last_seen FROM query_fingerprints WHERE fingerprint = ?",
+                (fp,)
+            ).fetchone()
+            if row is None:
+                return None
+            errors = dict(self._conn.execute(
+                "SELECT COALESCE(error_category, 'UNKNOWN_ERROR'), COUNT(*) FROM query_executions "
+                "WHERE fingerprint = ? AND success = 0 GROUP BY error_category",
+                (fp,)
+            ).fetchall())
+            executions = [
+                {
+                    'executed_at': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(executed_at)),
+                    'duration_ms': round(duration, 2),
+                    'row_count': row_count,
+                    'success': bool(success),
+                    'error_category': category,
+                    'source': source
+                }
+                for executed_at, duration, row_count, success, category, source in self._conn.execute(
+                    "SELECT executed_at, duration_ms, row_count, success, error_category, source FROM query_executions "
+                    "WHERE fingerprint = ? ORDER BY executed_at DESC LIMIT ?",
+                    (fp, int(recent))
+                )
+            ]
+        return {
+            'fingerprint': fp,
+            'normalized_sql': row[0],
+            'sample_sql': row[1],
+            'first_seen': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(row[2])),
+            'last_seen': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(row[3])),
+            'errors': errors,
+            'recent_executions': executions
+        }
+
+    def totals(self) -> Dict[str, Any]:
+        """Store-wide counts."""
+        with self._lock:
+            fingerprints, = self._conn.execute("SELECT COUNT(*) FROM query_fingerprints").fetchone()
+            executions, failures, total_ms = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(1 - success), 0), COALESCE(SUM(duration_ms), 0) FROM query_executions"
+            ).fetchone()
+        return {
+            'path': self.path,
+            'fingerprints': fingerprints,
+            'executions': executions,
+            'failures': failures,
+            'total_ms': round(total_ms, 2),
+            'max_executions': self.max_executions,
+            'retention_days': self.retention_days
+        }
+
+    def prune(self, older_than_days: float) -> int:
+        """
+        Delete executions older than a number of days (and fingerprints left without any).
+
+        Returns:
+            Number of executions deleted
+        """
+        with self._lock:
+            deleted = self._delete_older_than(time.time() - older_than_days * 86400)
+            self._delete_unused_fingerprints()
+            self._conn.commit()
+        return deleted
+
+    def _delete_older_than(self, cutoff: float) -> int:
+        """Delete executions before a timestamp (lock held)."""
+        return self._conn.execute("DELETE FROM query_executions WHERE executed_at < ?", (cutoff,)).rowcount
+
+    def _delete_unused_fingerprints(self):
+        """Delete fingerprints left without executions (lock held)."""
+        self._conn.execute(
+            "DELETE FROM query_fingerprints WHERE fingerprint NOT IN (SELECT DISTINCT fingerprint FROM query_executions)"
+        )
+
+
+_workload_store: Optional[WorkloadStore] = None
+_workload_lock = threading.Lock()
+
+
+def get_workload_store() -> Optional[WorkloadStore]:
+    """
+    Process-wide workload store, created from environment variables on first use.
+
+    Returns:
+        The shared WorkloadStore, or None when SQL_WORKLOAD_ENABLED=false
+    """
+    global _workload_store
+    if os.getenv('SQL_WORKLOAD_ENABLED', 'true').lower() == 'false':
+        return None
+    with _workload_lock:
+        if _workload_store is None:
+            path = os.getenv('SQL_WORKLOAD_DB', ':memory:')
+            options = dict(
+                max_executions=int(os.getenv('SQL_WORKLOAD_MAX_EXECUTIONS', '100000')),
+                retention_days=float(os.getenv('SQL_WORKLOAD_RETENTION_DAYS', '30'))
+            )
+            try:
+                _workload_store = WorkloadStore(path, **options)
+            except sqlite3.Error as e:
+                print(f"Warning: Could not open workload store {path} ({e}); using in-memory store")
+                _workload_store = WorkloadStore(':memory:', **options)
+        return _workload_store
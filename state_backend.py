@@ -0,0 +1,394 @@
+"""
+Session State Backends
+Keeps conversation memory and per-session settings outside the worker process, so any
+worker (or node) can serve any request of a session.
+
+Backends (STATE_BACKEND):
+    memory  In-process (one worker; the default)
+    sqlite  One file shared by the workers of a host
+    redis   Any Redis-protocol server (Redis, Valkey, KeyDB; redis-server runs locally too)
+
+Every record carries a version. A writer passes the version it read and the write fails
+with StateConflictError when another worker wrote in between (optimistic concurrency);
+SessionStateStore then reloads, re-applies its own changes and retries. Versions come from
+one counter per store, so a record that expired and was recreated never reuses a version.
+
+State is compact JSON, zlib-compressed above STATE_COMPRESS_MIN_BYTES.
+
+Configuration:
+    STATE_BACKEND               memory | sqlite | redis (default: memory)
+    STATE_SQLITE_PATH           SQLite file (default: <tmp>/session_state.db)
+    STATE_REDIS_URL             Redis URL (default: redis://localhost:6379/0)
+    STATE_KEY_PREFIX            Key prefix in Redis (default: meddata:session:)
+    STATE_TTL_SECONDS           Records unused for this long expire (default: 86400)
+    STATE_COMPRESS_MIN_BYTES    Compress state larger than this (default: 1024)
+"""
+
+import itertools
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import zlib
+from typing import Any, Dict, Optional, Tuple
+
+try:
+    import redis
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
+
+
+# First byte of an encoded record: raw or zlib-compressed JSON
+_RAW = b'J'
+_ZLIB = b'Z'
+
+
+class StateConflictError(Exception):
+    """The record was written by someone else since it was read."""
+
+
+def encode_state(state: Dict[str, Any], compress_min_bytes: int = 1024) -> bytes:
+    """Compact JSON, zlib-compressed when larger than compress_min_bytes."""
+    data = json.dumps(state, separators=(',', ':'), ensure_ascii=False, default=str).encode('utf-8')
+    if len(data) > compress_min_bytes:
+        return _ZLIB + zlib.compress(data, 6)
+    return _RAW + data
+
+
+def decode_state(data: bytes) -> Dict[str, Any]:
+    """Inverse of encode_state."""
+    marker, body = data[:1], data[1:]
+    if marker == _ZLIB:
+        body = zlib.decompress(body)
+    elif marker != _RAW:
+        raise ValueError(f"Unknown state encoding {marker!r}")
+    return json.loads(body.decode('utf-8'))
+
+
+class MemoryStateBackend:
+    """Versioned records in this process (a single worker)."""
+
+    name = 'memory'
+
+    def __init__(self, ttl_seconds: float = 86400):
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        # key -> (version, data, expires_at)
+        self._records: Dict[str, Tuple[int, bytes, float]] = {}
+        self._versions = itertools.count(1)
+
+    def _live(self, key: str, now: float) -> Optional[Tuple[int, bytes, float]]:
+        record = self._records.get(key)
+        if record is not None and record[2] <= now:
+            del self._records[key]
+            return None
+        return record
+
+    def version(self, key: str) -> int:
+        """Current version of a record (0 = none)."""
+        with self._lock:
+            record = self._live(key, time.time())
+            return record[0] if record else 0
+
+    def load(self, key: str) -> Optional[Tuple[int, bytes]]:
+        """(version, data) of a record, or None."""
+        with self._lock:
+            record = self._live(key, time.time())
+            return (record[0], record[1]) if record else None
+
+    def save(self, key: str, data: bytes, expected_version: int) -> int:
+        """
+        Write a record if it is still at expected_version (0 = must not exist).
+
+        Returns:
+            The new version
+
+        Raises:
+            StateConflictError: The record is at another version
+        """
+        now = time.time()
+        with self._lock:
+            record = self._live(key, now)
+            if (record[0] if record else 0) != expected_version:
+                raise StateConflictError(key)
+            version = next(self._versions)
+            self._records[key] = (version, data, now + self.ttl_seconds)
+            # Opportunistic expiry keeps abandoned sessions from accumulating
+            if version % 256 == 0:
+                for stale in [k for k, r in self._records.items() if r[2] <= now]:
+                    del self._records[stale]
+            return version
+
+    def delete(self, key: str) -> bool:
+        with self._lock:
+            return self._records.pop(key, None) is not None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'records': len(self._records),
+                'bytes': sum(len(record[1]) for record in self._records.values())
+            }
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS session_state (
+    key TEXT PRIMARY KEY,
+    version INTEGER NOT NULL,
+    data BLOB NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS session_state_seq (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO session_state_seq (id, value) VALUES (1, 0);
+"""
+
+
+class SQLiteStateBackend:
+    """Versioned records in a SQLite file shared by the worker processes of one host."""
+
+    name = 'sqlite'
+
+    def __init__(self, path: str, ttl_seconds: float = 86400):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        # Autocommit mode: transactions are explicit (BEGIN IMMEDIATE) where they matter
+        self._conn = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SQLITE_SCHEMA)
+        self._writes = 0
+
+    def version(self, key: str) -> int:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT version FROM session_state WHERE key = ? AND expires_at > ?", (key, time.time())
+            ).fetchone()
+        return row[0] if row else 0
+
+    def load(self, key: str) -> Optional[Tuple[int, bytes]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT version, data FROM session_state WHERE key = ? AND expires_at > ?", (key, time.time())
+            ).fetchone()
+        return (row[0], bytes(row[1])) if row else None
+
+    def save(self, key: str, data: bytes, expected_version: int) -> int:
+        now = time.time()
+        with self._lock:
+            conn = self._conn
+            # Takes the write lock up front, so the version check and the write are atomic
+            # across processes
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT version FROM session_state WHERE key = ? AND expires_at > ?", (key, now)
+                ).fetchone()
+                if (row[0] if row else 0) != expected_version:
+                    raise StateConflictError(key)
+                conn.execute("UPDATE session_state_seq SET value = value + 1 WHERE id = 1")
+                version = conn.execute("SELECT value FROM session_state_seq WHERE id = 1").fetchone()[0]
+                conn.execute(
+                    "INSERT OR REPLACE INTO session_state (key, version, data, expires_at) VALUES (?, ?, ?, ?)",
+                    (key, version, sqlite3.Binary(data), now + self.ttl_seconds)
+                )
+                self._writes += 1
+                if self._writes % 256 == 0:
+                    conn.execute("DELETE FROM session_state WHERE expires_at <= ?", (now,))
+                conn.execute("COMMIT")
+                return version
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    def delete(self, key: str) -> bool:
+        with self._lock:
+            return self._conn.execute("DELETE FROM session_state WHERE key = ?", (key,)).rowcount > 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            records, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(data)), 0) FROM session_state WHERE expires_at > ?",
+                (time.time(),)
+            ).fetchone()
+        return {'records': records, 'bytes': size, 'path': self.path}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+# Compare-and-set in one round trip: KEYS = record, version counter;
+# ARGV = expected version, data, TTL. Returns the new version or -1 on conflict.
+_REDIS_SAVE = """
+local current = redis.call('HGET', KEYS[1], 'v')
+if (current or '0') ~= ARGV[1] then
+    return -1
+end
+local version = redis.call('INCR', KEYS[2])
+redis.call('HSET', KEYS[1], 'v', version, 'd', ARGV[2])
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+return version
+"""
+
+
+class RedisStateBackend:
+    """Versioned records in a Redis-protocol server, shared by every worker and node."""
+
+    name = 'redis'
+
+    def __init__(self, url: str, prefix: str = 'meddata:session:', ttl_seconds: float = 86400):
+        if not REDIS_AVAILABLE:
+            raise ImportError("STATE_BACKEND=redis requires the redis package: pip install redis")
+        self.url = url
+        self.prefix = prefix
+        self.ttl_seconds = int(ttl_seconds)
+        self._client = redis.Redis.from_url(url)
+        self._save = self._client.register_script(_REDIS_SAVE)
+        # The script touches the record and this counter; on Redis Cluster use a hash-tagged
+        # prefix (e.g. "{meddata}:session:") so both land in one slot
+        self._counter = f"{prefix}__version__"
+
+    def version(self, key: str) -> int:
+        value = self._client.hget(self.prefix + key, 'v')
+        return int(value) if value is not None else 0
+
+    def load(self, key: str) -> Optional[Tuple[int, bytes]]:
+        version, data = self._client.hmget(self.prefix + key, 'v', 'd')
+        if version is None or data is None:
+            return None
+        return int(version), data
+
+    def save(self, key: str, data: bytes, expected_version: int) -> int:
+        version = self._save(keys=[self.prefix + key, self._counter],
+                             args=[str(expected_version), data, self.ttl_seconds])
+        if version == -1:
+            raise StateConflictError(key)
+        return int(version)
+
+    def delete(self, key: str) -> bool:
+        return self._client.delete(self.prefix + key) > 0
+
+    def stats(self) -> Dict[str, Any]:
+        kwargs = self._client.connection_pool.connection_kwargs
+        return {'host': kwargs.get('host'), 'port': kwargs.get('port'), 'prefix': self.prefix}
+
+
+class SessionStateStore:
+    """
+    Keeps in-process session values in step with a state backend.
+
+    Values provide:
+        state_version                 version they were loaded or saved at (0 = never)
+        to_state() -> dict            full state
+        load_state(state, version)    replace contents with a stored state (None = empty)
+        rebase(state, version)        re-apply local changes on top of a newer stored state
+        mark_saved(version)           record a successful write
+
+    Backend failures are logged and the process-local value is used, so an unavailable
+    store degrades to per-worker sessions instead of failing requests.
+    """
+
+    def __init__(self, backend, max_retries: int = 5, compress_min_bytes: int = 1024):
+        """
+        Args:
+            backend: MemoryStateBackend, SQLiteStateBackend or RedisStateBackend
+            max_retries: Attempts to write after conflicting writes by other workers
+            compress_min_bytes: Compress state larger than this
+        """
+        self.backend = backend
+        self.max_retries = max_retries
+        self.compress_min_bytes = compress_min_bytes
+        # Striped locks serialize load/save of one session within this process
+        self._locks = [threading.Lock() for _ in range(64)]
+        self.counters = {'reloads': 0, 'writes': 0, 'conflicts': 0, 'errors': 0, 'bytes_written': 0}
+
+    def _lock_for(self, session_id: str) -> threading.Lock:
+        return self._locks[hash(session_id) % len(self._locks)]
+
+    def _decode(self, record: Optional[Tuple[int, bytes]]) -> Tuple[Optional[Dict[str, Any]], int]:
+        return (decode_state(record[1]), record[0]) if record else (None, 0)
+
+    def sync(self, session_id: str, value: Any) -> Any:
+        """Bring a value up to date with the store before a request uses it."""
+        with self._lock_for(session_id):
+            try:
+                if self.backend.version(session_id) != value.state_version:
+                    value.load_state(*self._decode(self.backend.load(session_id)))
+                    self.counters['reloads'] += 1
+            except Exception as e:
+                self.counters['errors'] += 1
+                print(f"Warning: Could not load session state for {session_id}: {e}")
+        return value
+
+    def commit(self, session_id: str, value: Any) -> bool:
+        """Write a value after a request changed it; returns False if the write failed."""
+        with self._lock_for(session_id):
+            try:
+                for _ in range(self.max_retries):
+                    data = encode_state(value.to_state(), self.compress_min_bytes)
+                    try:
+                        version = self.backend.save(session_id, data, value.state_version)
+                    except StateConflictError:
+                        # Another worker wrote this session: apply our changes on top of theirs
+                        self.counters['conflicts'] += 1
+                        value.rebase(*self._decode(self.backend.load(session_id)))
+                        continue
+                    value.mark_saved(version)
+                    self.counters['writes'] += 1
+                    self.counters['bytes_written'] += len(data)
+                    return True
+                print(f"Warning: Session state for {session_id} not saved after {self.max_retries} conflicting writes")
+            except Exception as e:
+                print(f"Warning: Could not save session state for {session_id}: {e}")
+            self.counters['errors'] += 1
+            return False
+
+    def delete(self, session_id: str) -> bool:
+        with self._lock_for(session_id):
+            return self.backend.delete(session_id)
+
+    def stats(self) -> Dict[str, Any]:
+        """Backend, record counts and sync counters."""
+        try:
+            backend_stats = self.backend.stats()
+        except Exception as e:
+            backend_stats = {'error': str(e)}
+        return {'backend': self.backend.name, **backend_stats, **self.counters}
+
+
+def create_state_backend_from_env():
+    """
+    Create the configured state backend.
+
+    Raises:
+        ValueError: Unknown STATE_BACKEND
+    """
+    kind = os.getenv('STATE_BACKEND', 'memory').strip().lower()
+    ttl_seconds = float(os.getenv('STATE_TTL_SECONDS', '86400'))
+    if kind == 'memory':
+        return MemoryStateBackend(ttl_seconds=ttl_seconds)
+    if kind == 'sqlite':
+        path = os.getenv('STATE_SQLITE_PATH') or os.path.join(tempfile.gettempdir(), 'session_state.db')
+        return SQLiteStateBackend(path, ttl_seconds=ttl_seconds)
+    if kind == 'redis':
+        return RedisStateBackend(
+            os.getenv('STATE_REDIS_URL', 'redis://localhost:6379/0'),
+            prefix=os.getenv('STATE_KEY_PREFIX', 'meddata:session:'),
+            ttl_seconds=ttl_seconds
+        )
+    raise ValueError(f"Unknown STATE_BACKEND '{kind}' (expected memory, sqlite or redis)")
+
+
+def create_session_state_store_from_env() -> SessionStateStore:
+    """Create a SessionStateStore over the configured backend."""
+    return SessionStateStore(
+        create_state_backend_from_env(),
+        compress_min_bytes=int(os.getenv('STATE_COMPRESS_MIN_BYTES', '1024'))
+    )
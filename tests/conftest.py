@@ -0,0 +1,53 @@
+"""Shared fixtures for the unit tests (modules live in the repository root)."""
+
+import os
+import sqlite3
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+MED_SCHEMA = {
+    'MED': ['ID', 'CODE', 'SLOT_NUMBER', 'SLOT_VALUE', 'REF_CODE'],
+    'MED_SLOTS': ['SLOT_NUMBER', 'SLOT_NAME', 'SLOT_TYPE'],
+}
+
+
+@pytest.fixture
+def med_schema():
+    """Table -> columns of the MED database, as the agents cache it."""
+    return {table: list(columns) for table, columns in MED_SCHEMA.items()}
+
+
+# (CODE, SLOT_NUMBER, SLOT_VALUE): two glucose tests with LOINC 2947-0 indicating
+# hyperglycemia (30) and hypoglycemia (31), and a third test indicating hypoglycemia
+MED_ROWS = [
+    (10, 6, 'Glucose, Serum'), (10, 212, '2947-0'), (10, 150, '30'), (10, 150, '31'),
+    (11, 6, 'Glucose, Whole Blood'), (11, 212, '2947-0'), (11, 150, '30'),
+    (12, 6, 'Fructosamine'), (12, 212, '15069-8'), (12, 150, '31'),
+    (13, 6, 'Hemoglobin A1c'), (13, 212, '4548-4'),
+    (30, 6, 'Hyperglycemia'), (31, 6, 'Hypoglycemia'),
+]
+
+MED_SLOT_ROWS = [
+    (6, 'PRINT-NAME', 'STRING'), (150, 'INDICATES-PROBLEM', 'REFERENCE'), (212, 'LOINC-CODE', 'STRING'),
+]
+
+
+@pytest.fixture
+def med_connection():
+    """In-memory SQLite MED / MED_SLOTS with a few tests and problems."""
+    conn = sqlite3.connect(':memory:')
+    conn.executescript("""
+        CREATE TABLE MED (ID INTEGER PRIMARY KEY, CODE INT, SLOT_NUMBER INT, SLOT_VALUE TEXT, REF_CODE INT);
+        CREATE TABLE MED_SLOTS (SLOT_NUMBER INT PRIMARY KEY, SLOT_NAME TEXT, SLOT_TYPE TEXT);
+    """)
+    conn.executemany(
+        "INSERT INTO MED (CODE, SLOT_NUMBER, SLOT_VALUE, REF_CODE) VALUES (?, ?, ?, ?)",
+        [(code, slot, value, int(value) if slot == 150 else None) for code, slot, value in MED_ROWS]
+    )
+    conn.executemany("INSERT INTO MED_SLOTS VALUES (?, ?, ?)", MED_SLOT_ROWS)
+    yield conn
+    conn.close()
@@ -0,0 +1,41 @@
+import pytest
+
+from code_dictionary import CodeDictionary, find_code_mentions
+
+
+@pytest.fixture
+def dictionary():
+    return CodeDictionary.build([
+        ('10', 212, '2947-0'), ('10', 266, '89627008'), ('10', 277, '20'),
+        ('11', 212, '2947-0'), ('11', 264, '4521'), ('11', 20, 'GLU'),
+    ])
+
+
+def mentions(dictionary, text):
+    return sorted((system, value, sorted(codes)) for system, value, codes in find_code_mentions(dictionary, text))
+
+
+@pytest.mark.parametrize('text', [
+    "Give me 20 examples",
+    "What does 20 mean?",
+    "Show 4521 rows",
+    "glu levels",
+])
+def test_bare_numbers_and_words_are_not_codes(dictionary, text):
+    assert mentions(dictionary, text) == []
+
+
+def test_loinc_and_snomed_shapes_need_no_system_name(dictionary):
+    assert mentions(dictionary, "tests with 2947-0") == [('LOINC', '2947-0', ['10', '11'])]
+    assert mentions(dictionary, "what is 89627008?") == [('SNOMED', '89627008', ['10'])]
+
+
+def test_named_system_accepts_short_values(dictionary):
+    assert mentions(dictionary, "EPIC code 20") == [('EPIC', '20', ['10'])]
+    assert mentions(dictionary, "Cerner 4521") == [('MILLENNIUM', '4521', ['11'])]
+    assert mentions(dictionary, "CPMC GLU") == [('CPMC-LAB-TEST', 'GLU', ['11'])]
+
+
+def test_reverse_lookup(dictionary):
+    assert dictionary.external_codes('10') == {'EPIC': ['20'], 'LOINC': ['2947-0'], 'SNOMED': ['89627008']}
+    assert dictionary.lookup('LOINC', ' 2947-0 ') == {'10', '11'}
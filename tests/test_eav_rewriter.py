@@ -0,0 +1,77 @@
+import pytest
+
+sqlglot = pytest.importorskip('sqlglot')
+
+from eav_rewriter import EAVRewriter, PivotView, results_equivalent
+
+
+PIVOT_VIEW = "CREATE VIEW MED_PIVOT AS SELECT CODE, MAX(CASE WHEN SLOT_NUMBER = 6 THEN SLOT_VALUE END) AS PRINT_NAME, " \
+             "MAX(CASE WHEN SLOT_NUMBER = 212 THEN SLOT_VALUE END) AS LOINC_CODE FROM MED GROUP BY CODE"
+
+REWRITTEN = [
+    # Two attributes of each test indicating a problem
+    "SELECT p.CODE, MAX(n.SLOT_VALUE) AS NAME, MAX(l.SLOT_VALUE) AS LOINC FROM MED p "
+    "LEFT JOIN MED n ON n.CODE = p.CODE AND n.SLOT_NUMBER = 6 "
+    "LEFT JOIN MED l ON l.CODE = p.CODE AND l.SLOT_NUMBER = 212 "
+    "WHERE p.SLOT_NUMBER = 150 GROUP BY p.CODE",
+    # CASE form, MIN, COUNT(DISTINCT) and an attribute missing for some CODEs
+    "SELECT p.REF_CODE, MIN(CASE WHEN n.SLOT_NUMBER = 6 THEN n.SLOT_VALUE END) AS FIRST_NAME, "
+    "MAX(l.SLOT_VALUE) AS LOINC, COUNT(DISTINCT p.CODE) AS TESTS FROM MED p "
+    "LEFT JOIN MED n ON p.CODE = n.CODE AND n.SLOT_NUMBER = 6 "
+    "LEFT JOIN MED l ON l.CODE = p.CODE AND l.SLOT_NUMBER = 212 "
+    "WHERE p.SLOT_NUMBER = 150 GROUP BY p.REF_CODE",
+    # Inside a subquery
+    "SELECT t.NAME FROM (SELECT p.CODE, MAX(n.SLOT_VALUE) AS NAME, MAX(l.SLOT_VALUE) AS LOINC FROM MED p "
+    "LEFT JOIN MED n ON n.CODE = p.CODE AND n.SLOT_NUMBER = 6 "
+    "LEFT JOIN MED l ON l.CODE = p.CODE AND l.SLOT_NUMBER = 212 "
+    "WHERE p.SLOT_NUMBER = 6 GROUP BY p.CODE) t WHERE t.LOINC = '2947-0'",
+]
+
+UNCHANGED = [
+    # COUNT(*) counts the multiplied rows
+    "SELECT p.CODE, MAX(n.SLOT_VALUE), MAX(l.SLOT_VALUE), COUNT(*) FROM MED p "
+    "LEFT JOIN MED n ON n.CODE = p.CODE AND n.SLOT_NUMBER = 6 "
+    "LEFT JOIN MED l ON l.CODE = p.CODE AND l.SLOT_NUMBER = 212 GROUP BY p.CODE",
+    # An attribute filters rows
+    "SELECT p.CODE, MAX(n.SLOT_VALUE), MAX(l.SLOT_VALUE) FROM MED p "
+    "LEFT JOIN MED n ON n.CODE = p.CODE AND n.SLOT_NUMBER = 6 "
+    "LEFT JOIN MED l ON l.CODE = p.CODE AND l.SLOT_NUMBER = 212 WHERE l.SLOT_VALUE = '2947-0' GROUP BY p.CODE",
+    # Inner joins drop CODEs without the attribute
+    "SELECT p.CODE, MAX(n.SLOT_VALUE), MAX(l.SLOT_VALUE) FROM MED p "
+    "JOIN MED n ON n.CODE = p.CODE AND n.SLOT_NUMBER = 6 "
+    "JOIN MED l ON l.CODE = p.CODE AND l.SLOT_NUMBER = 212 GROUP BY p.CODE",
+]
+
+
+def run(connection, sql):
+    cursor = connection.execute(sqlglot.transpile(sql, read='tsql', write='sqlite')[0])
+    columns = [column[0] for column in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+@pytest.mark.parametrize('pivot_view', [None, PivotView.parse('MED_PIVOT:6=PRINT_NAME,212=LOINC_CODE')])
+@pytest.mark.parametrize('sql', REWRITTEN)
+def test_rewrite_returns_the_same_rows(med_connection, sql, pivot_view):
+    med_connection.execute(PIVOT_VIEW)
+    result = EAVRewriter(pivot_view).rewrite(sql)
+
+    assert result is not None and result.joins_removed == 1 and result.slots == [6, 212]
+    assert ('MED_PIVOT' in result.sql) == (pivot_view is not None)
+    original = run(med_connection, sql)
+    assert original and results_equivalent(run(med_connection, result.sql), original)
+
+
+@pytest.mark.parametrize('sql', UNCHANGED)
+def test_unsafe_self_joins_are_left_alone(sql):
+    assert EAVRewriter().rewrite(sql) is None
+
+
+def test_rejected_shapes_are_not_rewritten_again():
+    rewriter = EAVRewriter()
+    result = rewriter.rewrite(REWRITTEN[2])
+    rewriter.record_verification(result.key, False)
+
+    # Same shape with another parameter value; SLOT_NUMBER constants are part of the shape
+    assert rewriter.rewrite(REWRITTEN[2].replace('2947-0', '15069-8')) is None
+    assert rewriter.rewrite(REWRITTEN[2].replace('p.SLOT_NUMBER = 6', 'p.SLOT_NUMBER = 212')) is not None
+    assert rewriter.stats()['rejected_shapes'] == 1
@@ -0,0 +1,34 @@
+import pytest
+
+from name_index import NameIndex, name_trigrams, refresh_trigram_table, trigram_search_query
+from tests.conftest import MED_ROWS
+
+
+@pytest.fixture
+def index():
+    return NameIndex.build((str(code), value) for code, slot, value in MED_ROWS if slot == 6)
+
+
+def test_search_tolerates_typos_and_prefixes(index):
+    assert [match.code for match in index.search('glucose')][:2] == ['10', '11']
+    assert index.search('glucos serum')[0].code == '10'
+    assert index.search('hypoglycmia')[0].code == '31'
+    assert index.search('fructo', prefix=True)[0].code == '12'
+
+
+def test_trigram_table_fallback(med_connection):
+    sqlglot = pytest.importorskip('sqlglot')
+    med_connection.execute("CREATE TABLE MED_NAME_TRIGRAMS (TRIGRAM TEXT NOT NULL, CODE INT NOT NULL, PRIMARY KEY (TRIGRAM, CODE))")
+    written = refresh_trigram_table(med_connection)
+    assert written == med_connection.execute("SELECT COUNT(*) FROM MED_NAME_TRIGRAMS").fetchone()[0] > 0
+
+    sql, params = trigram_search_query('glucose whole', top_k=5, min_overlap=0.6)
+    rows = med_connection.execute(sqlglot.transpile(sql, read='tsql', write='sqlite')[0], params).fetchall()
+    assert rows[0][0] == 11 and rows[0][2] == 'Glucose, Whole Blood'
+    assert rows[0][1] == len(set(name_trigrams('glucose whole')) & set(name_trigrams('Glucose, Whole Blood')))
+
+    # Refreshing after MED changed replaces the old trigrams
+    med_connection.execute("UPDATE MED SET SLOT_VALUE = 'Sodium, Serum' WHERE CODE = 10 AND SLOT_NUMBER = 6")
+    refresh_trigram_table(med_connection)
+    sql, params = trigram_search_query('sodium', top_k=5, min_overlap=0.8)
+    assert [row[0] for row in med_connection.execute(sqlglot.transpile(sql, read='tsql', write='sqlite')[0], params)] == [10]
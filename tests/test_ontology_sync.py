@@ -0,0 +1,178 @@
+import pytest
+
+from ontology_cache import OntologyCache
+from ontology_snapshot import write_snapshot
+from ontology_sync import OntologyChangeTracker
+
+
+class ChangeTrackedMed:
+    """MED with a surrogate ID key and SQL Server change tracking, answering the tracker's queries."""
+
+    def __init__(self, rows):
+        self.rows = {row_id: row for row_id, row in enumerate(rows, start=1)}
+        self.version = 1
+        self.changed = {}  # ID -> version of its last change
+
+    def insert(self, code, slot, value):
+        row_id = max(self.rows, default=0) + 1
+        self.rows[row_id] = (code, slot, value)
+        self._touch(row_id)
+        return row_id
+
+    def update(self, row_id, code, slot, value):
+        self.rows[row_id] = (code, slot, value)
+        self._touch(row_id)
+
+    def delete(self, row_id):
+        del self.rows[row_id]
+        self._touch(row_id)
+
+    def _touch(self, row_id):
+        self.version += 1
+        self.changed[row_id] = self.version
+
+    def connect(self):
+        return FakeConnection(self)
+
+
+class FakeConnection:
+    def __init__(self, med):
+        self.med = med
+
+    def cursor(self):
+        return FakeCursor(self.med)
+
+    def close(self):
+        pass
+
+
+class FakeCursor:
+    def __init__(self, med):
+        self.med = med
+        self.result = []
+
+    def execute(self, sql, *params):
+        med = self.med
+        rows = sorted(med.rows.items())
+        if 'sys.change_tracking_tables' in sql or 'MIN_VALID_VERSION' in sql:
+            self.result = [(1,)] if 'sys.change_tracking_tables' in sql else [(0,)]
+        elif 'CURRENT_VERSION' in sql:
+            self.result = [(med.version,)]
+        elif 'is_primary_key' in sql:
+            self.result = [('ID',)]
+        elif 'CHECKSUM_AGG' in sql:
+            self.result = [(len(rows), hash(tuple(rows)))]
+        elif 'CHANGES MED_SLOTS' in sql:
+            self.result = [(0,)]
+        elif 'CHANGES MED' in sql:
+            since = params[0]
+            self.result = [(row_id, med.rows[row_id][0] if row_id in med.rows else None)
+                           for row_id, version in sorted(med.changed.items()) if version > since]
+        elif sql.startswith('SELECT [ID], CODE, SLOT_NUMBER, SLOT_VALUE FROM MED'):
+            self.result = [(row_id, *row) for row_id, row in rows]
+        elif sql.startswith('SELECT [ID], CODE FROM MED'):
+            self.result = [(row_id, row[0]) for row_id, row in rows]
+        elif 'WHERE CODE IN' in sql:
+            self.result = [row for _, row in rows if str(row[0]) in params]
+        else:
+            raise AssertionError(f"Unexpected query: {sql}")
+
+    def fetchone(self):
+        return self.result[0] if self.result else None
+
+    def fetchall(self):
+        return list(self.result)
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def med():
+    return ChangeTrackedMed([
+        (10, 6, 'Glucose, Serum'), (10, 212, '2947-0'),
+        (11, 6, 'Glucose, Whole Blood'), (11, 212, '2947-0'),
+    ])
+
+
+def slots_of(cache, code):
+    return sorted((slot, value) for row_code, slot, value in cache.rows if row_code == str(code))
+
+
+def tracker_for(med, cache, reloads=None):
+    def reload():
+        reloads.append(True)
+        return False
+    return OntologyChangeTracker(med.connect, lambda: cache, on_reload=reload if reloads is not None else None)
+
+
+def test_row_deleted_before_first_poll_is_removed(med):
+    cache = OntologyCache.load(med.connect())
+    med.delete(2)  # CODE 10's LOINC row, deleted before the tracker read anything
+    tracker_for(med, cache).poll_once()
+
+    assert slots_of(cache, 10) == [(6, 'Glucose, Serum')]
+    assert cache.sync_version == med.version
+
+
+def test_inserts_updates_and_code_moves(med):
+    cache = OntologyCache.load(med.connect())
+    tracker = tracker_for(med, cache)
+    new_id = med.insert(12, 6, 'Fructosamine')
+    med.update(4, 12, 212, '15069-8')  # a row moves from CODE 11 to CODE 12
+    tracker.poll_once()
+    assert slots_of(cache, 11) == [(6, 'Glucose, Whole Blood')]
+    assert slots_of(cache, 12) == [(6, 'Fructosamine'), (212, '15069-8')]
+
+    med.delete(new_id)
+    med.delete(4)
+    tracker.poll_once()
+    assert slots_of(cache, 12) == []
+
+
+def test_inserted_then_deleted_row_needs_no_reload(med):
+    cache = OntologyCache.load(med.connect())
+    reloads = []
+    tracker = tracker_for(med, cache, reloads)
+    med.delete(med.insert(13, 6, 'Short-lived'))
+    result = tracker.poll_once()
+
+    assert reloads == [] and result['applied'] == 0
+    assert slots_of(cache, 13) == []
+
+
+def test_unmatched_delete_without_key_map_forces_reload(med):
+    # e.g. a snapshot-backed cache: no key map was read with its rows
+    cache = OntologyCache([(str(code), slot, value) for code, slot, value in med.rows.values()],
+                          sync_version=med.version)
+    med.delete(2)
+    reloads = []
+    tracker = tracker_for(med, cache, reloads)
+    result = tracker.poll_once()
+
+    assert reloads == [True]
+    assert result['reloaded'] is False and tracker.stopped_reason
+
+
+def test_snapshot_cache_resumes_from_its_build_version(med, tmp_path):
+    built = OntologyCache.load(med.connect())
+    path = str(tmp_path / 'ontology.snap')
+    write_snapshot(built.rows, path, data_version=built.version or '', sync_version=built.sync_version)
+    med.insert(12, 6, 'Fructosamine')  # changed after the snapshot was built
+
+    cache = OntologyCache.from_snapshot(path)
+    assert cache.sync_version == built.sync_version
+    result = tracker_for(med, cache).poll_once()
+
+    assert not result.get('stopped')
+    assert slots_of(cache, 12) == [(6, 'Fructosamine')]
+    assert cache.sync_version == med.version
+    cache.close()
+
+
+def test_untracked_snapshot_has_no_sync_version(tmp_path):
+    path = str(tmp_path / 'ontology.snap')
+    write_snapshot([('10', 6, 'Glucose, Serum')], path)
+    cache = OntologyCache.from_snapshot(path)
+    assert cache.sync_version is None and cache.snapshot.info()['sync_version'] is None
+    cache.close()
@@ -0,0 +1,61 @@
+import json
+
+import pytest
+
+from execution_backend import LocalBackend
+from query_planner import PLANNER_INSTRUCTIONS, QueryPlan, QueryPlanner
+from tests.conftest import MED_ROWS, MED_SLOT_ROWS
+
+pytest.importorskip('sqlglot')
+
+
+class PlanAgent:
+    """The parts of MedDataSQLAgent a QueryPlanner uses, on a local SQLite MED."""
+
+    def __init__(self, schema):
+        self.backend = LocalBackend('sqlite')
+        conn = self.backend.connect()
+        conn.executescript("""
+            CREATE TABLE MED (ID INTEGER PRIMARY KEY, CODE INT, SLOT_NUMBER INT, SLOT_VALUE TEXT, REF_CODE INT);
+            CREATE TABLE MED_SLOTS (SLOT_NUMBER INT PRIMARY KEY, SLOT_NAME TEXT, SLOT_TYPE TEXT);
+        """)
+        conn.executemany(
+            "INSERT INTO MED (CODE, SLOT_NUMBER, SLOT_VALUE, REF_CODE) VALUES (?, ?, ?, ?)",
+            [(code, slot, value, int(value) if slot == 150 else None) for code, slot, value in MED_ROWS]
+        )
+        conn.executemany("INSERT INTO MED_SLOTS VALUES (?, ?, ?)", MED_SLOT_ROWS)
+        conn.commit()
+        conn.close()
+        self.schema_columns = schema
+        self.ontology = None
+        self.workload_store = None
+        self.conversation_history = []
+
+    def _enable_statistics(self, cursor):
+        return False
+
+    def _error_details(self, error, sql):
+        return {'success': False, 'error': str(error), 'error_category': 'EXECUTION_ERROR', 'sql_query': sql}
+
+    def _log_slow_query(self, *args):
+        pass
+
+
+def example_plan(related: str) -> QueryPlan:
+    """The example plan of the planner instructions, as the model would return it."""
+    instructions = PLANNER_INSTRUCTIONS.format(schema='', max_steps=6, related=related)
+    example = instructions[instructions.rindex('{"steps"'):]
+    return QueryPlan.from_payload("LOINC 2947-0 problems, then other tests", json.loads(example))
+
+
+@pytest.mark.parametrize('related', ['REF_CODE', 'SLOT_VALUE'])
+def test_example_plan_runs_every_step(med_schema, related):
+    planner = QueryPlanner(PlanAgent(med_schema))
+    result = planner.execute(example_plan(related))
+
+    assert result['success'], result.get('error')
+    steps = {step['id']: step for step in result['plan']['steps']}
+    # s1: tests 10 and 11; s2: problems 30 and 31; s3: test 12 (indicates 31)
+    assert {step_id: step['row_count'] for step_id, step in steps.items()} == {'s1': 2, 's2': 2, 's3': 1}
+    assert not any(step['repaired_by'] for step in steps.values())
+    assert [row['CODE'] for row in result['results']] == ['12']
@@ -0,0 +1,80 @@
+import pytest
+
+from result_store import MAX_PAGE_SIZE, ResultStore, decode_cursor, encode_cursor
+
+
+COLUMNS = ['CODE', 'NAME']
+ROWS = [{'CODE': code, 'NAME': f'Test {code}'} for code in range(1, 121)]
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = ResultStore(str(tmp_path / 'results.db'), page_size=50)
+    yield store
+    store.close()
+
+
+def all_pages(store, result_id, limit=None, owner=None):
+    pages, cursor = [], None
+    while True:
+        page = store.page(result_id, cursor, limit=limit, owner=owner)
+        pages.append(page)
+        cursor = page['next_cursor']
+        if cursor is None:
+            return pages
+
+
+def test_cursor_round_trip():
+    assert decode_cursor(None) == 0
+    assert decode_cursor(encode_cursor(1234)) == 1234
+    for cursor in ('not-a-cursor', encode_cursor(5)[:-1] + '!'):
+        with pytest.raises(ValueError):
+            decode_cursor(cursor)
+
+
+def test_pages_walk_the_result_in_order(store):
+    result_id = store.put(COLUMNS, ROWS)
+    pages = all_pages(store, result_id)
+
+    assert [len(page['rows']) for page in pages] == [50, 50, 20]
+    assert [row for page in pages for row in page['rows']] == ROWS
+    assert all(page['row_count'] == len(ROWS) for page in pages)
+
+
+def test_spilled_result_pages_from_disk(tmp_path):
+    store = ResultStore(str(tmp_path / 'results.db'), max_memory_bytes=1)
+    first = store.put(COLUMNS, ROWS)
+    second = store.put(COLUMNS, ROWS[:3])
+    assert store.stats()['spilled'] == 2
+
+    pages = all_pages(store, first, limit=40)
+    assert [len(page['rows']) for page in pages] == [40, 40, 40]
+    assert [row for page in pages for row in page['rows']] == ROWS
+    assert store.page(second)['rows'] == ROWS[:3]
+    store.close()
+
+
+def test_shared_store_serves_other_workers(tmp_path):
+    path = str(tmp_path / 'results.db')
+    writer, reader = ResultStore(path, shared=True), ResultStore(path, shared=True)
+    result_id = writer.put(COLUMNS, ROWS, owner='session-1')
+
+    assert reader.page(result_id, owner='session-2') is None
+    assert [row for page in all_pages(reader, result_id, owner='session-1') for row in page['rows']] == ROWS
+    writer.close()
+    reader.close()
+
+
+def test_limits_and_expiry(tmp_path):
+    store = ResultStore(str(tmp_path / 'results.db'), ttl_seconds=0)
+    with pytest.raises(ValueError):
+        store.page('anything', limit=0)
+    result_id = store.put(COLUMNS, ROWS)
+    assert store.page(result_id) is None
+    store.close()
+
+    store = ResultStore(str(tmp_path / 'results.db'))
+    rows = [{'CODE': code} for code in range(MAX_PAGE_SIZE + 5)]
+    page = store.page(store.put(['CODE'], rows), limit=MAX_PAGE_SIZE * 2)
+    assert len(page['rows']) == MAX_PAGE_SIZE and decode_cursor(page['next_cursor']) == MAX_PAGE_SIZE
+    store.close()
@@ -0,0 +1,55 @@
+import pytest
+
+sqlglot = pytest.importorskip('sqlglot')
+
+from sql_parameters import count_placeholders, inline_params, parameterize, parse_generated
+
+
+QUERIES = [
+    "SELECT TOP 10 m.CODE FROM MED m WHERE m.SLOT_NUMBER = 212 AND m.SLOT_VALUE = '2947-0'",
+    "SELECT m.CODE, 'x' AS tag FROM MED m WHERE m.SLOT_NUMBER = 6 AND m.SLOT_VALUE NOT LIKE '%O''Brien%' AND m.CODE IN (10, 12)",
+    "SELECT m.CODE FROM MED m JOIN MED n ON n.CODE = m.CODE AND n.SLOT_NUMBER = 6 AND n.SLOT_VALUE NOT LIKE '%?%' "
+    "WHERE m.REF_CODE = 31 GROUP BY m.CODE HAVING COUNT(*) >= 1",
+    "SELECT m.CODE FROM MED m WHERE m.SLOT_NUMBER = 150 AND m.CODE NOT IN (SELECT r.CODE FROM MED r WHERE r.REF_CODE = 30)",
+]
+
+
+def normalized(sql):
+    return sqlglot.parse_one(sql, read='tsql').sql(dialect='tsql')
+
+
+@pytest.mark.parametrize('sql', QUERIES)
+def test_inline_params_restores_parameterized_sql(sql):
+    template, params = parameterize(sql)
+    assert params and count_placeholders(template) == len(params)
+    assert inline_params(template, params) == normalized(sql)
+
+
+@pytest.mark.parametrize('sql', QUERIES)
+def test_template_returns_the_same_rows(med_connection, sql):
+    template, params = parameterize(sql)
+    original = med_connection.execute(sqlglot.transpile(sql, read='tsql', write='sqlite')[0]).fetchall()
+    bound = med_connection.execute(sqlglot.transpile(template, read='tsql', write='sqlite')[0], params).fetchall()
+    assert original and sorted(bound) == sorted(original)
+
+
+def test_shape_literals_stay_inline():
+    template, params = parameterize(QUERIES[0])
+    assert 'TOP 10' in template and 'SLOT_NUMBER = 212' in template
+    assert params == ['2947-0']
+    assert parameterize("SELECT 1 AS one FROM MED") == ("SELECT 1 AS one FROM MED", [])
+
+
+def test_placeholders_in_literals_and_comments_are_not_bound():
+    sql = "SELECT CODE FROM MED WHERE SLOT_VALUE = '?' /* ? */ AND CODE = ? -- ?"
+    assert count_placeholders(sql) == 1
+    assert inline_params(sql, [10]) == "SELECT CODE FROM MED WHERE SLOT_VALUE = '?' /* ? */ AND CODE = 10 -- ?"
+
+
+def test_parse_generated_coerces_declared_types():
+    content = '```json\n{"sql": "SELECT CODE FROM MED WHERE CODE = ? AND SLOT_VALUE = ?", ' \
+              '"params": [{"value": "10", "type": "int"}, {"value": 2947, "type": "string"}]}\n```'
+    assert parse_generated(content) == ("SELECT CODE FROM MED WHERE CODE = ? AND SLOT_VALUE = ?", [10, '2947'])
+    assert parse_generated("SELECT 1") == ("SELECT 1", None)
+    with pytest.raises(ValueError):
+        parse_generated('{"sql": "SELECT ?", "params": [{"value": 1, "type": "date"}]}')
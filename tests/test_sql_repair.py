@@ -0,0 +1,57 @@
+import pytest
+
+from sql_repair import SQLRepairEngine, limit_to_top, qualify_ambiguous_columns, strip_markdown
+
+sqlglot = pytest.importorskip('sqlglot')
+
+AMBIGUOUS = {'error_category': 'AMBIGUOUS_REFERENCE'}
+
+
+def run(conn, sql):
+    """Rows of a T-SQL query on the SQLite fixture, order-independent."""
+    return sorted(conn.execute(sqlglot.transpile(sql, read='tsql', write='sqlite')[0]).fetchall())
+
+
+@pytest.mark.parametrize('sql', [
+    "SELECT m1.CODE FROM MED m1 WHERE m1.SLOT_NUMBER = 6 AND m1.CODE IN "
+    "(SELECT CODE FROM MED WHERE SLOT_NUMBER = 212 AND SLOT_VALUE = '2947-0')",
+    "SELECT m1.CODE FROM MED m1 WHERE m1.SLOT_NUMBER = 6 AND m1.CODE NOT IN "
+    "(SELECT CODE FROM MED WHERE SLOT_NUMBER = 212 AND SLOT_VALUE = '2947-0')",
+    "SELECT m.CODE FROM MED m WHERE EXISTS "
+    "(SELECT 1 FROM MED_SLOTS s WHERE s.SLOT_NUMBER = m.SLOT_NUMBER AND SLOT_NAME = 'LOINC-CODE')",
+    "SELECT DISTINCT m.CODE FROM MED m INNER JOIN MED_SLOTS s ON s.SLOT_NUMBER = m.SLOT_NUMBER "
+    "WHERE m.CODE IN (SELECT CODE FROM MED WHERE SLOT_NUMBER = 150)",
+])
+def test_subquery_columns_are_not_attached_to_outer_tables(med_connection, med_schema, sql):
+    repaired = SQLRepairEngine().repair(sql, AMBIGUOUS, med_schema)
+    if repaired is not None:
+        assert run(med_connection, repaired.sql) == run(med_connection, sql)
+    assert qualify_ambiguous_columns(sql, med_schema) is None
+
+
+def test_refuses_when_only_owner_is_in_outer_scope(med_schema):
+    sql = ("SELECT m1.CODE FROM MED m1 INNER JOIN MED_SLOTS s ON s.SLOT_NUMBER = m1.SLOT_NUMBER "
+           "WHERE m1.CODE IN (SELECT CODE FROM #s1 WHERE SLOT_NUMBER = 6)")
+    assert qualify_ambiguous_columns(sql, {**med_schema, 's1': ['CODE']}) is None
+
+
+def test_qualifies_ambiguous_join_columns(med_connection, med_schema):
+    sql = ("SELECT DISTINCT CODE, SLOT_VALUE FROM MED m1 INNER JOIN MED m2 ON m2.CODE = m1.REF_CODE "
+           "WHERE m1.SLOT_NUMBER = 150 AND m2.SLOT_NUMBER = 6")
+    repaired = SQLRepairEngine().repair(sql, AMBIGUOUS, med_schema)
+    assert repaired.rules == ['qualify_ambiguous_columns']
+    expected = sql.replace('DISTINCT CODE, SLOT_VALUE', 'DISTINCT m1.CODE, m1.SLOT_VALUE')
+    assert run(med_connection, repaired.sql) == run(med_connection, expected)
+
+
+def test_qualifies_inside_subquery_with_its_own_join(med_connection, med_schema):
+    sql = ("SELECT m.CODE FROM MED m WHERE m.SLOT_NUMBER = 6 AND m.CODE IN "
+           "(SELECT CODE FROM MED a INNER JOIN MED b ON b.CODE = a.REF_CODE WHERE b.SLOT_VALUE = 'Hypoglycemia')")
+    repaired = qualify_ambiguous_columns(sql, med_schema)
+    assert 'SELECT a.CODE FROM MED AS a' in repaired
+    assert run(med_connection, repaired) == [(10,), (12,)]
+
+
+def test_text_rules():
+    assert limit_to_top("SELECT CODE FROM MED LIMIT 5", {}) == "SELECT TOP 5 CODE FROM MED"
+    assert strip_markdown("```sql\nSELECT 1\n```", {}) == "SELECT 1"
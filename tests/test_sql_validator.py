@@ -0,0 +1,41 @@
+import pytest
+
+from sql_validator import SQLValidator
+
+pytest.importorskip('sqlglot')
+
+
+@pytest.fixture
+def validator(med_schema):
+    return SQLValidator({**med_schema, 's1': ['CODE']})
+
+
+@pytest.mark.parametrize('sql', [
+    "SELECT m.CODE FROM MED m WHERE m.SLOT_NUMBER IN (SELECT SLOT_NUMBER FROM MED_SLOTS WHERE SLOT_TYPE = 'STRING')",
+    "SELECT m.CODE FROM MED m WHERE m.SLOT_NUMBER NOT IN (SELECT SLOT_NUMBER FROM MED_SLOTS WHERE SLOT_TYPE = 'STRING')",
+    "SELECT m.CODE FROM MED m WHERE EXISTS (SELECT 1 FROM MED_SLOTS s WHERE s.SLOT_NUMBER = m.SLOT_NUMBER AND SLOT_NAME = 'LOINC-CODE')",
+    "SELECT m.CODE, (SELECT SLOT_NAME FROM MED_SLOTS s WHERE s.SLOT_NUMBER = m.SLOT_NUMBER) AS SlotName FROM MED m",
+    "SELECT m1.CODE FROM MED m1 WHERE m1.CODE IN (SELECT CODE FROM MED WHERE SLOT_NUMBER = 212 AND SLOT_VALUE = '2947-0')",
+    "SELECT m.CODE FROM MED m WHERE m.CODE NOT IN (SELECT CODE FROM #s1)",
+    "SELECT CODE FROM MED UNION SELECT SLOT_NUMBER FROM MED_SLOTS ORDER BY CODE",
+    "SELECT TOP 10 CODE, SLOT_VALUE AS Name FROM MED WHERE SLOT_NUMBER = 6 ORDER BY Name",
+    "SELECT [CODE] FROM MED WHERE SLOT_VALUE = 'DROP TABLE'",
+])
+def test_valid_queries_pass(validator, sql):
+    assert validator.validate(sql)['success'], sql
+
+
+@pytest.mark.parametrize('sql, category', [
+    ("SELECT m.CODE FROM MED m WHERE m.SLOT_NUMBER IN (SELECT SLOT_NUMBER FROM MED_SLOTS WHERE SLOT_TYPEX = 'STRING')", 'COLUMN_ERROR'),
+    ("SELECT m.CODE FROM MED m WHERE m.CODE IN (SELECT CODE FROM MED WHERE SLOT_TYPE = 'STRING')", 'COLUMN_ERROR'),
+    ("SELECT m.CODE FROM MED m WHERE EXISTS (SELECT 1 FROM MED_SLOTS s WHERE s.SLOT_NUMBER = x.SLOT_NUMBER)", 'ALIAS_ERROR'),
+    ("SELECT CODE FROM MED m1 INNER JOIN MED m2 ON m1.CODE = m2.REF_CODE", 'AMBIGUOUS_REFERENCE'),
+    ("SELECT CODE FROM MEDS", 'TABLE_ERROR'),
+    ("SELECT CODE FROM MED LIMIT 10", 'SYNTAX_ERROR'),
+    ("DELETE FROM MED", 'NON_SELECT_STATEMENT'),
+    ("SELECT CODE INTO #copy FROM MED", 'NON_SELECT_STATEMENT'),
+])
+def test_invalid_queries_fail(validator, sql, category):
+    result = validator.validate(sql)
+    assert not result['success']
+    assert result['error_category'] == category
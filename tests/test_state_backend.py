@@ -0,0 +1,91 @@
+import pytest
+
+from state_backend import (MemoryStateBackend, SessionStateStore, SQLiteStateBackend, StateConflictError,
+                           decode_state, encode_state)
+
+
+class Notes:
+    """A minimal session value: an append-only list of notes, rebased like a conversation."""
+
+    def __init__(self):
+        self.notes = []
+        self.state_version = 0
+        self._saved = 0
+
+    def to_state(self):
+        return {'notes': self.notes}
+
+    def load_state(self, state, version):
+        self.notes = list((state or {}).get('notes', []))
+        self.mark_saved(version)
+
+    def rebase(self, state, version):
+        added = self.notes[self._saved:]
+        self.load_state(state, version)
+        self.notes.extend(added)
+        self._saved = len(self.notes) - len(added)
+
+    def mark_saved(self, version):
+        self.state_version = version
+        self._saved = len(self.notes)
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def backend(request, tmp_path):
+    if request.param == 'memory':
+        yield MemoryStateBackend()
+    else:
+        backend = SQLiteStateBackend(str(tmp_path / 'state.db'))
+        yield backend
+        backend.close()
+
+
+def test_encoding_round_trip():
+    state = {'notes': ['x' * 2000], 'settings': {'limit': 5}}
+    assert encode_state(state)[:1] == b'Z' and encode_state({'notes': []})[:1] == b'J'
+    assert decode_state(encode_state(state)) == state
+
+
+def test_save_checks_the_expected_version(backend):
+    first = backend.save('s1', b'Jone', 0)
+    with pytest.raises(StateConflictError):
+        backend.save('s1', b'Jtwo', 0)
+    second = backend.save('s1', b'Jtwo', first)
+
+    assert second > first and backend.load('s1') == (second, b'Jtwo')
+    with pytest.raises(StateConflictError):
+        backend.save('s1', b'Jthree', first)
+    assert backend.delete('s1') and backend.version('s1') == 0
+    # A recreated record never reuses a version
+    assert backend.save('s1', b'Jfour', 0) > second
+
+
+def test_concurrent_writers_rebase_instead_of_losing_changes(backend):
+    worker_a, worker_b = SessionStateStore(backend), SessionStateStore(backend)
+    notes_a, notes_b = Notes(), Notes()
+    notes_a.notes.append('a1')
+    assert worker_a.commit('s1', notes_a)
+
+    # Worker B has not seen a1 yet
+    notes_b.notes.append('b1')
+    assert worker_b.commit('s1', notes_b)
+    assert notes_b.notes == ['a1', 'b1'] and worker_b.counters['conflicts'] == 1
+
+    worker_a.sync('s1', notes_a)
+    assert notes_a.notes == ['a1', 'b1'] and notes_a.state_version == notes_b.state_version
+    assert decode_state(backend.load('s1')[1]) == {'notes': ['a1', 'b1']}
+
+
+def test_commit_gives_up_after_max_retries(backend):
+    class Racing(Notes):
+        def rebase(self, state, version):
+            super().rebase(state, version)
+            backend.save('s1', encode_state({'notes': ['other']}), version)  # someone writes again
+
+    store = SessionStateStore(backend, max_retries=3)
+    backend.save('s1', encode_state({'notes': []}), 0)
+    value = Racing()
+    value.notes.append('mine')
+
+    assert store.commit('s1', value) is False
+    assert store.counters['conflicts'] == 3 and store.counters['errors'] == 1
@@ -0,0 +1,145 @@
+"""
+Startup Warm-up
+Runs the steps that make the first real questions fast (Azure AD token, database
+connections, schema and slot catalog, ontology indexes, optionally a set of warm-up
+questions) and tracks readiness for /api/ready. /api/health stays a liveness check.
+
+Steps run in order in a background thread. A failed required step leaves the process not
+ready; warm-up is retried on a later readiness check after WARMUP_RETRY_SECONDS. Optional
+steps (warm-up questions) are reported but never block readiness.
+
+Configuration:
+    WARMUP_DB_CONNECTIONS       Connections opened (and returned to the ODBC pool) (default: 4)
+    WARMUP_QUESTIONS_FILE       Questions replayed to prime caches, e.g. SAMPLE_QUESTIONS.md (default: none)
+    WARMUP_MAX_QUESTIONS        Questions replayed at most (default: 5)
+    WARMUP_RETRY_SECONDS        Wait before retrying a failed warm-up (default: 30)
+"""
+
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+
+class WarmupStep:
+    """One named warm-up step and its outcome."""
+
+    def __init__(self, name: str, run: Callable[[], Any], required: bool = True):
+        """
+        Args:
+            name: Step name in the readiness report
+            run: Does the work; returns a detail (dict or string) for the report, or
+                 'skipped' when the step does not apply. Raises on failure. A dict detail
+                 with 'elapsed_ms' reports that duration instead of the call's (work that
+                 already happened, e.g. while the agent was built).
+            required: Readiness waits for this step to succeed
+        """
+        self.name = name
+        self.run = run
+        self.required = required
+        self.status = 'pending'
+        self.elapsed_ms: Optional[float] = None
+        self.detail: Any = None
+        self.error: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        step = {'name': self.name, 'status': self.status, 'elapsed_ms': self.elapsed_ms, 'required': self.required}
+        if self.detail is not None:
+            step['detail'] = self.detail
+        if self.error:
+            step['error'] = self.error
+        return step
+
+
+class Warmup:
+    """Runs warm-up steps once in the background and reports readiness."""
+
+    def __init__(self, steps_factory: Callable[[], List[WarmupStep]], retry_seconds: float = 30):
+        """
+        Args:
+            steps_factory: Creates the steps (fresh for every attempt)
+            retry_seconds: Wait after a failed attempt before the next one may start
+        """
+        self.steps_factory = steps_factory
+        self.retry_seconds = retry_seconds
+        self.steps: List[WarmupStep] = []
+        self.attempts = 0
+        self.started_at: Optional[datetime] = None
+        self.finished_at: Optional[float] = None
+        self.elapsed_ms: Optional[float] = None
+        self.ready = False
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> bool:
+        """
+        Start warm-up in the background unless it is running, succeeded, or failed less
+        than retry_seconds ago.
+
+        Returns:
+            True if an attempt was started
+        """
+        with self._lock:
+            if self.ready or self.running:
+                return False
+            if self.finished_at is not None and time.monotonic() - self.finished_at < self.retry_seconds:
+                return False
+            self.steps = self.steps_factory()
+            self.attempts += 1
+            self.started_at = datetime.now()
+            self.finished_at = None
+            self.elapsed_ms = None
+            self._thread = threading.Thread(target=self.run, name='warmup', daemon=True)
+            self._thread.start()
+            return True
+
+    def run(self):
+        """Run all steps in order (blocking); later steps still run after an optional one fails."""
+        started = time.perf_counter()
+        ready = True
+        for step in self.steps:
+            if not ready:
+                step.status = 'not_run'
+                continue
+            step.status = 'running'
+            step_started = time.perf_counter()
+            try:
+                detail = step.run()
+                step.status = 'skipped' if detail == 'skipped' else 'ok'
+                step.detail = None if detail == 'skipped' else detail
+            except Exception as e:
+                step.status = 'failed'
+                step.error = f"{type(e).__name__}: {e}"
+                print(f"Warning: Warm-up step '{step.name}' failed: {step.error}")
+                if step.required:
+                    ready = False
+            step.elapsed_ms = round((time.perf_counter() - step_started) * 1000, 2)
+            if isinstance(step.detail, dict) and 'elapsed_ms' in step.detail:
+                step.elapsed_ms = round(step.detail.pop('elapsed_ms'), 2)
+        self.elapsed_ms = round((time.perf_counter() - started) * 1000, 2)
+        self.finished_at = time.monotonic()
+        self.ready = ready
+        if ready:
+            print(f"✓ Warm-up complete in {self.elapsed_ms:.0f} ms")
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Wait for a running attempt; returns readiness."""
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+        return self.ready
+
+    def report(self) -> Dict[str, Any]:
+        """Readiness, overall and per-step durations."""
+        return {
+            'ready': self.ready,
+            'status': 'ready' if self.ready else ('warming_up' if self.running or not self.attempts else 'failed'),
+            'attempts': self.attempts,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'elapsed_ms': self.elapsed_ms,
+            'steps': [step.to_dict() for step in self.steps]
+        }